@@ -59,7 +59,7 @@ setup(
         'pandas==0.21.1',
         'boto3==1.5.9',
         'numpy==1.13.3',
-        'ortools',
+        'ortools==9.0.9048',
         # 'dash==0.19.0',
         # 'dash-auth',
         # 'dash-renderer==0.11.1',
@@ -77,11 +77,13 @@ setup(
         'connexion'
     ],
     setup_requires=['pytest-runner'],
-    tests_require=['pytest', 'pytest-cov'],
+    tests_require=['pytest', 'pytest-cov', 'hypothesis'],
     extras_require={
         # eg:
         #   'rst': ['docutils>=0.11'],
         #   ':python_version=="2.6"': ['argparse'],
+        'traffic': ['scikit-learn'],
+        'roads': ['scipy'],
     },
     entry_points={
         'console_scripts': [
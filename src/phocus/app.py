@@ -1,6 +1,11 @@
 import logging
+import math
 import os
-from typing import Sequence
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Sequence
 
 import numpy as np
 import pendulum
@@ -8,19 +13,30 @@ from connexion.resolver import RestyResolver
 import connexion
 
 from phocus.cp.cp_app import run_model
+from phocus.cp.model_cache import CacheStats, model_input_cache
 from phocus.model.appointment import Appointment
 from phocus.model.location import Location
 from phocus.model.work_period import WorkPeriod
 from phocus.utils import bootstrap_project
 from phocus.utils.api_validator import APIValidator, start_location_validator
 from phocus.utils.constants import END_LOCATION, START_LOCATION, LOCATIONS
-from phocus.utils.date_utils import combine_periods, convert_open_times_to_blackout_windows, \
-    convert_date_time_to_epoch_millis, are_periods_overlapping
+from phocus.utils.date_utils import combine_periods, convert_date_time_to_epoch_millis, are_periods_overlapping, \
+    convert_epoch_millis_to_date_time
+from phocus.utils.epoch import Interval, epoch_millis_to_epoch, open_times_to_blackout_intervals, period_to_interval
 from phocus.utils.maps import lat_lon
 
 HOST = os.environ.get('API_HOST', 'localhost:8080')
+DEFAULT_MAX_RUN_MILLIS = 10000
+# Routes allotted less than this are reported as errors rather than solved
+MIN_ALLOTTED_MILLIS = 1000
+"""Size of the process pool of `plan_routes`, which caps its maxWorkers"""
+MAX_WORKERS = os.cpu_count() or 1
 logger = logging.getLogger(__name__)
 
+"""The process pool of `plan_routes`, started by its first call and shared by the calls after it"""
+_route_executor: Optional[ProcessPoolExecutor] = None
+_route_executor_lock = threading.Lock()
+
 
 def recalculate_lat_lon(doctor):
     result = doctor.copy()
@@ -40,11 +56,42 @@ def parse_period(period_dict) -> pendulum.Period:
     return period
 
 
+def parse_interval(period_dict) -> Interval:
+    """Parse an API Period parameter to epoch seconds
+
+    If the end is before the start; raises a RuntimeError"""
+    start, end = period_dict['start'], period_dict['end']
+    if start >= end:
+        raise RuntimeError('Periods should end after start but found %s -> %s' % (
+            convert_epoch_millis_to_date_time(start), convert_epoch_millis_to_date_time(end)))
+    return epoch_millis_to_epoch(start), epoch_millis_to_epoch(end)
+
+
 def parse_and_combine_periods(period_dict_list) -> Sequence[pendulum.Period]:
     return combine_periods([parse_period(x) for x in period_dict_list])
 
 
-def location_from_dict(d, work_periods=None, include_blackout_windows=True):
+def blackout_intervals_from_dict(d, work_intervals: Sequence[Interval], cache_stats: CacheStats = None) -> List[Interval]:
+    """Convert the open times of an API location to blackout intervals
+
+    The conversion is cached by the location's open times and the work intervals"""
+    open_times = d.get('openTimes', [])
+    open_times_key = tuple((x['start'], x['end']) for x in open_times)
+
+    def convert():
+        return open_times_to_blackout_intervals(
+            open_intervals=[parse_interval(x) for x in open_times],
+            work_intervals=work_intervals,
+        )
+
+    return model_input_cache.get(
+        ('blackout_intervals', open_times_key, tuple(work_intervals)),
+        convert,
+        cache_stats,
+    )
+
+
+def location_from_dict(d, work_intervals=None, include_blackout_windows=True, cache_stats: CacheStats = None):
     loc = Location(
         d['name'],
         d.get('address', ''),
@@ -65,27 +112,24 @@ def location_from_dict(d, work_periods=None, include_blackout_windows=True):
         loc.is_required = d['isRequired']
 
     if include_blackout_windows:
-        open_times = parse_and_combine_periods(d.get('openTimes', []))
-        loc.blackout_windows = convert_open_times_to_blackout_windows(
-            open_times=open_times,
-            work_periods=work_periods,
-        )
+        loc.blackout_intervals = blackout_intervals_from_dict(d, work_intervals, cache_stats)
 
     return loc
 
 
 def location_to_dict(location):
-    d = {k: v for k, v in vars(location).items() if v is not None}
+    d = {k: v for k, v in location.to_dict().items() if v is not None}
     d['name'] = location.doctor_name
     del d['doctor_name']
-    if 'blackout_windows' in d:
-        del d['blackout_windows']
+    for key in ('blackout_windows', 'blackout_intervals', 'time_off_period', 'time_off_seconds'):
+        d.pop(key, None)
 
-    d['arrival_time'] = convert_date_time_to_epoch_millis(pendulum.parse(d['arrival_time']))
-    d['end_time'] = convert_date_time_to_epoch_millis(pendulum.parse(d['end_time']))
-
-    if 'time_off_period' in d:
-        del d['time_off_period']
+    if 'arrival_epoch' in d:
+        d['arrival_time'] = d.pop('arrival_epoch') * 1000
+        d['end_time'] = d.pop('end_epoch') * 1000
+    else:
+        d['arrival_time'] = convert_date_time_to_epoch_millis(pendulum.parse(d['arrival_time']))
+        d['end_time'] = convert_date_time_to_epoch_millis(pendulum.parse(d['end_time']))
 
     return d
 
@@ -106,6 +150,11 @@ def plan_route(routeParams: dict) -> dict:
     :param routeParams: The parameters for the route planning. If overrides is a key, those will be passed directly to run_model
     :return:
     """
+    return _plan_route(routeParams)
+
+
+def _plan_route(routeParams: dict, deadline: Optional[float] = None) -> dict:
+    """Plan the route, with the solver stopping by `deadline` in `time.time()` seconds if there is one"""
     logger.info('Plan Route called with %s', routeParams)
 
     app_validator.validate(routeParams)
@@ -121,6 +170,8 @@ def plan_route(routeParams: dict) -> dict:
         'lunch_hour_start': routeParams['lunchStartHour'],
         'lunch_minutes': routeParams['lunchMinutes'],
         'work_periods': work_periods,
+        'persist': routeParams.get('persistSolution', True),
+        'deadline': deadline,
     }
 
     if 'solutionName' in routeParams:
@@ -130,6 +181,7 @@ def plan_route(routeParams: dict) -> dict:
 
     solution = run_model(**args)
     metrics = solution.metrics
+    params.cache_stats.add_to(metrics)
     route_location_ids = {location.id for location in solution.route}
     original_location_ids = {location.id for location in params.locations}
 
@@ -142,6 +194,111 @@ def plan_route(routeParams: dict) -> dict:
     return result
 
 
+def fair_time_allotment_ms(remaining_ms: float, num_remaining: int, num_workers: int) -> int:
+    """The solver time each remaining route gets so that all of them finish within `remaining_ms`
+
+    Routes are solved `num_workers` at a time so each worker still has to solve ceil(num_remaining / num_workers)
+    routes. Routes that finish early leave more time for the ones after them."""
+    rounds = math.ceil(num_remaining / num_workers)
+    return int(remaining_ms / rounds)
+
+
+def _plan_route_in_worker(route_params: dict, deadline: Optional[float]) -> dict:
+    """Plan a route in a worker process, returning the error instead of raising it"""
+    try:
+        return {'result': _plan_route(route_params, deadline)}
+    except Exception as e:
+        logger.exception('Error planning route %s', route_params.get('solutionName'))
+        return {'error': '%s: %s' % (type(e).__name__, e)}
+
+
+# noinspection PyPep8Naming
+def plan_routes(batchParams: dict) -> dict:
+    """
+    Plan many routes at once, for example every rep of a region
+
+    Routes are solved on a process pool that is kept for later calls. The total budget of maxTotalMillis starts with
+    the call, each route gets its fair share of what is left of it when the route starts and has to be prepared and
+    solved within that share, so the batch finishes within the total budget.
+    :param batchParams: routeParams is the list of parameters as taken by `plan_route`
+    :return: A result or error per route in the same order as routeParams
+    """
+    # Wall clock time since the deadlines are compared in the worker processes
+    request_start = time.time()
+    all_route_params = batchParams['routeParams']
+    num_workers = min(batchParams.get('maxWorkers', MAX_WORKERS), MAX_WORKERS, max(1, len(all_route_params)))
+    logger.info('Plan Routes called with %d routes on %d workers', len(all_route_params), num_workers)
+
+    deadline = None
+    if 'maxTotalMillis' in batchParams:
+        deadline = request_start + batchParams['maxTotalMillis'] / 1000
+
+    results = [{k: v for k, v in params.items() if k == 'solutionName'} for params in all_route_params]
+    pending = list(range(len(all_route_params)))
+    running = {}
+    while pending or running:
+        while pending and len(running) < num_workers:
+            idx = pending.pop(0)
+            route_params = dict(all_route_params[idx])
+            max_run_millis = route_params.get('maxRunMillis', DEFAULT_MAX_RUN_MILLIS)
+            route_deadline = None
+            if deadline is not None:
+                remaining_ms = (deadline - time.time()) * 1000
+                allotted = fair_time_allotment_ms(remaining_ms, len(pending) + len(running) + 1, num_workers)
+                if allotted < MIN_ALLOTTED_MILLIS:
+                    results[idx]['error'] = 'Total time budget of %d ms was exhausted' % batchParams['maxTotalMillis']
+                    continue
+                max_run_millis = min(max_run_millis, allotted)
+                route_deadline = time.time() + allotted / 1000
+            route_params['maxRunMillis'] = max_run_millis
+            results[idx]['allottedMillis'] = max_run_millis
+            executor = route_executor()
+            try:
+                running[executor.submit(_plan_route_in_worker, route_params, route_deadline)] = idx, executor
+            except BrokenProcessPool as e:
+                _discard_route_executor(executor)
+                logger.exception('Worker pool failed before planning route %d', idx)
+                results[idx]['error'] = '%s: %s' % (type(e).__name__, e)
+
+        if not running:
+            continue
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            idx, executor = running.pop(future)
+            try:
+                results[idx].update(future.result())
+            except Exception as e:
+                # The worker itself failed, e.g. it was killed, which breaks the pool
+                if isinstance(e, BrokenProcessPool):
+                    _discard_route_executor(executor)
+                logger.exception('Worker failed planning route %d', idx)
+                results[idx]['error'] = '%s: %s' % (type(e).__name__, e)
+
+    return {
+        'results': results,
+        'numSucceeded': sum('result' in r for r in results),
+        'numFailed': sum('error' in r for r in results),
+    }
+
+
+def route_executor() -> ProcessPoolExecutor:
+    """The process pool of `plan_routes`, starting it if there is none"""
+    global _route_executor
+    with _route_executor_lock:
+        if _route_executor is None:
+            _route_executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+        return _route_executor
+
+
+def _discard_route_executor(executor: ProcessPoolExecutor):
+    """Drop a pool broken by a dead worker so that the next route starts a new one"""
+    global _route_executor
+    with _route_executor_lock:
+        if _route_executor is executor:
+            _route_executor = None
+    executor.shutdown(wait=False)
+
+
 class APIParams:
     """Wrapper for API params
 
@@ -149,6 +306,8 @@ class APIParams:
     def __init__(self, api_json):
         self.params = api_json
         self._work_periods = None
+        self._work_intervals = None
+        self.cache_stats = CacheStats()
 
         # Get start and end locations
         self.start_and_end_location_ids = set()
@@ -170,7 +329,8 @@ class APIParams:
             else:
                 loc = location_from_dict(
                     doctor_dict,
-                    work_periods=self.work_periods,
+                    work_intervals=self.work_intervals,
+                    cache_stats=self.cache_stats,
                 )
 
                 # Parse Appointments
@@ -217,6 +377,13 @@ class APIParams:
     def location_from_id(self, id):
         return self.locations[self.id_to_locations_idx[id]]
 
+    @property
+    def work_intervals(self) -> List[Interval]:
+        """The work periods as epoch second intervals"""
+        if self._work_intervals is None:
+            self._work_intervals = [period_to_interval(p) for p in self.work_periods]
+        return self._work_intervals
+
     @property
     def work_periods(self):
         if self._work_periods:
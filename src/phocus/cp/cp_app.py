@@ -2,10 +2,14 @@ import copy
 import itertools
 import logging
 import random
+import time
 import uuid
+from collections import defaultdict
 from datetime import datetime
+from enum import Enum
+from pathlib import Path
 from timeit import default_timer as timer
-from typing import Tuple, Sequence, AbstractSet, Mapping, Optional, Any, Dict, List, Set
+from typing import Tuple, Sequence, AbstractSet, Mapping, Optional, Any, Dict, List
 
 import numpy as np
 import pendulum
@@ -14,29 +18,50 @@ from ortools.constraint_solver import pywrapcp, routing_enums_pb2
 import phocus.errors
 from phocus.config import MIP_CONFIG
 import phocus.cp.solution_validator
+from phocus.cp.insertion_heuristic import InsertionHeuristic
+from phocus.cp.model_cache import CacheStats, ModelInputCache, fingerprint_array, model_input_cache
 from phocus.cp.objective import ObjectiveCostEvaluator
 from phocus.cp.time_dimension_converter import TimeDimensionConverter, Granularity
 from phocus.cp.utils import RouteElement
 from phocus.errors import NoSolutionFoundError
 from phocus.model.appointment import Appointment
 from phocus.model.location import Location
+from phocus.model.problem_instance import DEFAULT_SERVICE_SECONDS, NO_NODE, ProblemInstance, location_repeat_visits
 from phocus.model.solution import Solution
+import phocus.model.solution_sink
+from phocus.model.solution_sink import SolutionSink
 from phocus.solver import Solver
-from phocus.utils import current_isotime_for_filename
-from phocus.utils.date_utils import combine_periods, time_off_periods
+from phocus.utils import LazySequence, current_isotime_for_filename
+from phocus.utils.epoch import Interval, SECONDS_PER_DAY, SECONDS_PER_HOUR, date_to_epoch, from_epoch, \
+    period_to_interval, time_off_intervals
+from phocus.utils.interval_set import IntervalSet
 from phocus.utils.files import real_long_island_data
 from phocus.utils.distance_matrix_loader import load_distance_matrix_data
+from phocus.utils.distance_provider import DistanceProvider
 from phocus.utils.mixins import Base
+from phocus.utils.travel_time_tensor import TravelTimeTensor
 from phocus.utils.ortools_utils import convert_first_solution_strategy_to_name, convert_search_heuristic_to_name
 
-REAL_LONG_ISLAND_DATA = real_long_island_data()
+"""Sample data, loaded on first use so that importing the module does not read it"""
+REAL_LONG_ISLAND_DATA = LazySequence(real_long_island_data)
 
-EXAMPLE_APPOINTMENTS = [Appointment(REAL_LONG_ISLAND_DATA[4], pendulum.datetime(2018, 1, 1, hour=11),
-                                    pendulum.datetime(2018, 1, 1, hour=12))]
+
+def _example_appointments():
+    return [Appointment(REAL_LONG_ISLAND_DATA[4], pendulum.datetime(2018, 1, 1, hour=11),
+                        pendulum.datetime(2018, 1, 1, hour=12))]
+
+
+EXAMPLE_APPOINTMENTS = LazySequence(_example_appointments)
 EXAMPLE_START_DATETIME = pendulum.datetime(2018, 1, 1, hour=9)
 
 SERVICE_TIME_DURATION = pendulum.duration(minutes=20)
+SERVICE_TIME_SECONDS = int(SERVICE_TIME_DURATION.total_seconds())
 TIME = 'Time'
+BASE_SKIP_PENALTY = 100000
+REQUIRED_SKIP_PENALTY = 100000000
+DEFAULT_LUNCH_FLEXIBILITY_MINUTES = 60
+"""The ortools version whose routing dimension can take break intervals, 8.x crashes in SetBreakIntervalsOfVehicle"""
+BREAKS_MIN_ORTOOLS_VERSION = (9, 0)
 
 logger = logging.getLogger(__name__)
 
@@ -48,106 +73,172 @@ class RepeatLocation(Base):
         self.duplicate_indices: Sequence[int] = duplicate_indices if duplicate_indices else []
 
 
+class LunchModel(Enum):
+    """How lunch is added to the routing model"""
+    # A blackout window on every node that forbids arriving during lunch
+    BLACKOUT = 1
+    # A break interval on the vehicle that can start anywhere in a window
+    BREAK = 2
+
+
+def breaks_supported() -> bool:
+    """Whether the installed ortools can model lunch with `LunchModel.BREAK`"""
+    import ortools
+    version = tuple(int(part) for part in ortools.__version__.split('.')[:2])
+    return version >= BREAKS_MIN_ORTOOLS_VERSION
+
+
+class Break(Base):
+    """A rest period of the vehicle that starts between `earliest_start` and `latest_start` epoch seconds"""
+    def __init__(self, earliest_start: int, latest_start: int, duration_seconds: int):
+        self.earliest_start = earliest_start
+        self.latest_start = latest_start
+        self.duration_seconds = duration_seconds
+
+
 class CP(Solver):
     """
     MIP main solver class
 
-    :arg distance_matrix: The distance between points in seconds
+    :arg problem: The compiled locations, appointments, work periods, blackouts, breaks and travel times in seconds
+    :arg locations: The locations of the problem to put in the route, rebuilt from the problem if not given
     """
 
     def __init__(
             self,
-            locations: Sequence[Location],
-            distance_matrix,
-            work_periods,
+            problem: ProblemInstance,
+            locations: Optional[Sequence[Location]] = None,
             time_dimension_granularity=Granularity.SECOND,
-            appointments=None,
             num_vehicles=MIP_CONFIG['num_vehicles'],
-            blackout_intervals: Optional[Sequence[pendulum.Period]] = None,
             time_limit_ms: int = 10 * 1000,
             solution_name: str = 'MIP',
             first_solution_strategy=routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION,
+            use_insertion_heuristic: bool = False,
+            model_cache: Optional[ModelInputCache] = None,
     ):
         self.log.info('Initializing CP')
         super().__init__()
         if num_vehicles != 1:
             raise RuntimeError('Only supports 1 vehicle')
-        self.work_periods: Sequence[pendulum.Period] = combine_periods(work_periods)
-        self.log.info('Work Periods: %s', self.work_periods)
-        self.time_off_periods = time_off_periods(self.work_periods)
-        self.log.info('Time off periods: %s', self.time_off_periods)
+        preprocessing_start = timer()
+        self.model_cache = model_cache if model_cache is not None else model_input_cache
+        self.cache_stats = CacheStats()
+        self.problem = problem
+        # Times are epoch seconds from here on, the timezone is only needed to format the solution
+        self.timezone = problem.tzinfo
+        work_intervals = problem.work_intervals()
+        # Copies of the cached intervals, which are read-only tuples
+        self.work_intervals, self.time_off_intervals = (list(intervals) for intervals in self.model_cache.get(
+            ('territory', tuple(work_intervals)),
+            lambda: _combine_work_intervals(work_intervals),
+            self.cache_stats,
+        ))
+        self.log.info('Work intervals: %s', self.work_intervals)
+        self.log.info('Time off intervals: %s', self.time_off_intervals)
         self.time_granularity = time_dimension_granularity
         self.assignment = None
-        self.locations_no_duplicates = locations[:]
-        start_datetime = self.work_periods[0].start
+        self.locations_no_duplicates = list(locations) if locations is not None else problem.to_locations()
+        if len(self.locations_no_duplicates) != problem.num_locations:
+            raise RuntimeError('Expected the %d locations of the problem but got %d' % (
+                problem.num_locations, len(self.locations_no_duplicates)))
+        start_datetime = from_epoch(self.work_intervals[0][0], self.timezone)
         self.time_dimension_converter: TimeDimensionConverter = TimeDimensionConverter(
             granularity=time_dimension_granularity, start_datetime=start_datetime)
-        self.metrics: Dict['str', Any] = {'num_work_periods': len(self.work_periods)}
-        self.log.info('Number of work periods: %s', len(self.work_periods))
+        self.metrics: Dict['str', Any] = {'num_work_periods': len(self.work_intervals)}
+        self.log.info('Number of work periods: %s', len(self.work_intervals))
         self.log.info('Start datetime %s', start_datetime)
-        self.log.info('End datetime %s', self.work_periods[-1].end)
-        self.locations, self.repeat_locations, self.fake_origin_idx = self._locations_with_duplicates_and_origin(locations, self.time_off_periods)
+        self.log.info('End datetime %s', from_epoch(self.work_intervals[-1][1], self.timezone))
+        self.locations, self.repeat_locations, self.fake_origin_idx = self._locations_with_duplicates_and_origin(
+            self.locations_no_duplicates, self.time_off_intervals, problem)
 
         # map of node index to time-off in the case of duplicate origins at end of work_periods
         self.node_time_off_map = {}
         for i, loc, in enumerate(self.locations):
             if loc.is_duplicate_origin:  # FIXME start locations should have 0 travel time to them and end locations should have 0 travel time from them
-                self.node_time_off_map[i] = self.time_dimension_converter.duration_to_time_dimension(
-                    loc.time_off_period.as_timedelta())
+                self.node_time_off_map[i] = self.time_dimension_converter.seconds_to_time_dimension(
+                    loc.time_off_seconds)
                 loc.visit_time_seconds = self.node_time_off_map[i]
         self.log.info('%d locations with duplicates', len(self.locations))
         self.repeat_to_original_indices = {rep: loc.original_idx for loc in self.repeat_locations for rep in
                                            loc.duplicate_indices}
-        self.appointments = appointments if appointments else []
+        self.node_sources = self._node_sources()
         self.num_vehicles = num_vehicles
-        self.blackout_windows = blackout_intervals if blackout_intervals else []
+        self.blackout_intervals = problem.blackout_intervals()
+        self.breaks = [Break(*window) for window in problem.break_windows()]
+        self.break_intervals = []
         self.time_limit_ms = time_limit_ms
         self.solution_name = solution_name
         # TODO if various granularities are supported this should be divided by the granularity
-        self.distance_matrix = distance_matrix
-        self._travel_time_callback_object = CreateTravelTimeCallback(self.distance_matrix,
-                                                                     self.repeat_to_original_indices)
-        self.travel_time_callback = self._travel_time_callback_object.get_travel_time
+        self.distance_matrix = problem.travel_times
+        self.travel_times = self._travel_time_matrix()
+        self.travel_time_callback = CreateTravelTimeCallback(self.travel_times).get_travel_time
 
-        self.node_appointments = make_node_appointments_map(self.locations, self.appointments)
+        # The repeat visits and origins come after the locations, so the nodes of appointments are their locations
+        self.node_appointments = problem.appointment_intervals()
         self.node_appointment_times = {
-            node: self.time_dimension_converter.duration_to_time_dimension(appointment.duration)
-            for node, appointment in self.node_appointments.items()
+            node: self.time_dimension_converter.seconds_to_time_dimension(end - start)
+            for node, (start, end) in self.node_appointments.items()
         }
 
         location_visit_times = self.calculate_location_visit_times()
 
         service_times = CreateServiceTimeCallback(location_visit_times)
         self.service_time_callback = service_times.get_service_time
-        num_locations = len(self.locations)
-        # FIXME probably have to make this a special node with 0 distance from every other node
-        depot_idx = MIP_CONFIG['depot_idx']
-        self.log.info('Specifying model with %d locations and %d vehicles', len(self.locations), self.num_vehicles)
-        self.routing_model = pywrapcp.RoutingModel(num_locations, self.num_vehicles, depot_idx)
+        self.routing_model = self._create_routing_model()
         self.solver = self.routing_model.solver()
 
         self.first_solution_strategy = first_solution_strategy
         self.metrics['first_solution_strategy'] = convert_first_solution_strategy_to_name(self.first_solution_strategy)
+        self.use_insertion_heuristic = use_insertion_heuristic
+        self._blackout_intervals: Optional[List[Tuple[Sequence[int], Sequence[int]]]] = None
+        self.metrics['preprocessing_time'] = timer() - preprocessing_start
 
-    @staticmethod
-    def _locations_with_duplicates_and_origin(locations, time_off) -> Tuple[Sequence[Location], Sequence[RepeatLocation]]:
-        locations = locations[:]
+    def _create_routing_model(self) -> pywrapcp.RoutingModel:
+        # FIXME probably have to make this a special node with 0 distance from every other node
+        depot_idx = MIP_CONFIG['depot_idx']
+        self.log.info('Specifying model with %d locations and %d vehicles', len(self.locations), self.num_vehicles)
+        self.index_manager = pywrapcp.RoutingIndexManager(len(self.locations), self.num_vehicles, depot_idx)
+        return pywrapcp.RoutingModel(self.index_manager)
+
+    def _register_node_callback(self, node_callback) -> int:
+        """Register a transit callback of two nodes, the routing model calls transit callbacks with indices"""
+        index_nodes = [self.index_manager.IndexToNode(index)
+                       for index in range(self.index_manager.GetNumberOfIndices())]
+        return self.routing_model.RegisterTransitCallback(
+            lambda from_index, to_index: int(node_callback(index_nodes[from_index], index_nodes[to_index])))
+
+    def _travel_time_matrix(self) -> np.ndarray:
+        """The travel time between every pair of nodes including duplicates, cached by distance matrix contents"""
+        num_nodes = len(self.locations)
+        callback = CreateTravelTimeCallback(self.distance_matrix, self.repeat_to_original_indices)
+        return self.model_cache.get(
+            ('transit', fingerprint_array(np.asarray(self.distance_matrix)),
+             tuple(sorted(self.repeat_to_original_indices.items())), num_nodes),
+            lambda: callback.travel_time_matrix(num_nodes),
+            self.cache_stats,
+        )
 
-        # Add repeat visits
-        repeat_idx = len(locations)
-        repeat_locations = []
-        duplicate_locations_to_add_to_locations = []
-        for orig_idx, loc in enumerate(locations):
-            if getattr(loc, 'num_total_visits', 1) > 1:
-                total_visits = loc.num_total_visits
-                min_visit_gap_days = loc.min_visit_gap_days
-                repeat_location = RepeatLocation(orig_idx, min_visit_gap_days)
-                repeat_locations.append(repeat_location)
-                for _ in range(total_visits - 1):
-                    duplicate_locations_to_add_to_locations.append(loc.copy())
-                    repeat_location.duplicate_indices.append(repeat_idx)
-                    repeat_idx += 1
-        locations.extend(duplicate_locations_to_add_to_locations)
+    def _node_sources(self) -> np.ndarray:
+        """The location of the problem that each node is a visit to
+
+        Repeat visits are visits to their original location and duplicate origins to the origin. The fake origin is
+        `NO_NODE`."""
+        num_locations = self.problem.num_locations
+        sources = np.zeros(len(self.locations), dtype=np.int64)
+        sources[:num_locations] = np.arange(num_locations)
+        for repeat_node, original_node in self.repeat_to_original_indices.items():
+            sources[repeat_node] = original_node
+        if self.fake_origin_idx is not None:
+            sources[self.fake_origin_idx] = NO_NODE
+        return sources
+
+    @staticmethod
+    def _locations_with_duplicates_and_origin(
+            locations,
+            time_off,
+            problem: Optional[ProblemInstance] = None,
+    ) -> Tuple[Sequence[Location], Sequence[RepeatLocation]]:
+        locations, repeat_locations = CP._locations_with_repeats(locations, problem)
 
         fake_origin_idx = len(locations)
         locations.append(Location('fake origin', 'fake origin', 'fake origin', 'fake origin', id=str(uuid.uuid1())))
@@ -155,29 +246,61 @@ class CP(Solver):
 
         # Add duplicate origin nodes
         # FIXME change time off for work period nodes
-        for period in time_off:
+        for start, end in time_off:
             duplicate_origin = locations[0].copy()
             duplicate_origin.is_duplicate_origin = True
-            duplicate_origin.time_off_period = period
+            duplicate_origin.time_off_seconds = end - start
             locations.append(duplicate_origin)
 
         # Add final location
         # FIXME
         duplicate_origin = locations[0].copy()
         duplicate_origin.is_duplicate_origin = True
-        duplicate_origin.time_off_period = pendulum.Duration(seconds=0)
+        duplicate_origin.time_off_seconds = 0
         locations.append(duplicate_origin)
 
         return locations, repeat_locations, fake_origin_idx
 
+    @staticmethod
+    def _locations_with_repeats(
+            locations,
+            problem: Optional[ProblemInstance] = None,
+    ) -> Tuple[List[Location], List[RepeatLocation]]:
+        """The locations followed by a copy for each repeat visit
+
+        The number of visits come from the `problem` of the locations if there is one."""
+        locations = list(locations)
+        if problem is not None:
+            num_visits, gap_days = problem.num_visits.tolist(), problem.min_visit_gap_days.tolist()
+        else:
+            num_visits, gap_days = location_repeat_visits(locations)
+
+        # Add repeat visits
+        repeat_idx = len(locations)
+        repeat_locations = []
+        duplicate_locations_to_add_to_locations = []
+        for orig_idx, loc in enumerate(locations):
+            if num_visits[orig_idx] > 1:
+                total_visits = num_visits[orig_idx]
+                min_visit_gap_days = gap_days[orig_idx]
+                repeat_location = RepeatLocation(orig_idx, min_visit_gap_days)
+                repeat_locations.append(repeat_location)
+                for _ in range(total_visits - 1):
+                    duplicate_locations_to_add_to_locations.append(loc.copy())
+                    repeat_location.duplicate_indices.append(repeat_idx)
+                    repeat_idx += 1
+        locations.extend(duplicate_locations_to_add_to_locations)
+        return locations, repeat_locations
+
     def _specify_model(self):
+        model_build_start = timer()
         # grab search parameters
         if MIP_CONFIG['use_default_search_params']:
-            search_parameters = self.routing_model.DefaultSearchParameters()
+            search_parameters = pywrapcp.DefaultRoutingSearchParameters()
         else:
             raise RuntimeError('Only support default routing search params. Please try again.')
 
-        search_parameters.time_limit_ms = self.time_limit_ms
+        search_parameters.time_limit.FromMilliseconds(self.time_limit_ms)
         # PATH_CHEAPEST_ARC doesn't find a solution
         # Apparently best heuristics are PARALLEL_CHEAPEST_INSERTION, SAVINGS, PATH_CHEAPEST_ARC
         # Based on a small test, SAVINGS is faster than PARALLEL_CHEAPEST_INSERTION
@@ -207,136 +330,252 @@ class CP(Solver):
         # search_parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.EVALUATOR_STRATEGY
         # self.routing_model.SetFirstSolutionEvaluator(solution_evaluator.evaluate)
 
+        self._add_time_dimension()
+        self._add_required_constraints()
+        self._add_all_blackouts()
+        self._add_breaks()
+        self._add_duplicate_origin_constraints()
+        self._add_appointments()
+        self._add_repeat_visit_constraints()
+        self._add_disjunction()
+        self.metrics['model_build_time'] = timer() - model_build_start
+        self.log.info('Getting assignment')
+        initial_assignment = None
+        if self.use_insertion_heuristic:
+            initial_routes = self._initial_routes_from_insertion_heuristic()
+            initial_assignment = self.routing_model.ReadAssignmentFromRoutes(
+                [[self.index_manager.NodeToIndex(node) for node in route] for route in initial_routes], True)
+            self.metrics['initial_solution']['accepted'] = initial_assignment is not None
+            if not initial_assignment:
+                self.log.warning('Initial routes were rejected by the routing model, falling back to %s',
+                                 self.metrics['first_solution_strategy'])
+
+        if initial_assignment:
+            self.assignment = self.routing_model.SolveFromAssignmentWithParameters(initial_assignment,
+                                                                                   search_parameters)
+        else:
+            self.assignment = self.routing_model.SolveWithParameters(search_parameters)
+
+    def _add_time_dimension(self):
         # time dimension callbacks
         # for a given node, time is comprised of service time for that node +
         # time to travel to the next node
         total_times = CreateTotalTimeCallback(self.travel_time_callback, self.service_time_callback)
         total_time_callback = total_times.get_total_time
-        self.routing_model.SetArcCostEvaluatorOfAllVehicles(self.travel_time_callback)
+        self.routing_model.SetArcCostEvaluatorOfAllVehicles(self._register_node_callback(self.travel_time_callback))
 
         # add the time dimension
-        max_time_dimension = self.time_dimension_converter.datetime_to_time_dimension(self.work_periods[-1].end)
+        self.max_time_dimension = self.time_dimension_converter.epoch_to_time_dimension(self.work_intervals[-1][1])
         self.routing_model.AddDimension(
-            total_time_callback,
-            max_time_dimension,
-            max_time_dimension,
+            self._register_node_callback(total_time_callback),
+            self.max_time_dimension,
+            self.max_time_dimension,
             MIP_CONFIG['fix_start_cumul_to_zero_time'],
             TIME
         )
         self.time = self.routing_model.GetDimensionOrDie(TIME)
         # This isn't needed since the final and start times are set
         # self.time.SetGlobalSpanCostCoefficient(100)
-        self.routing_model.AddVariableMinimizedByFinalizer(
-            self.routing_model.CumulVar(self.routing_model.End(0), TIME))
+        self.routing_model.AddVariableMinimizedByFinalizer(self.time.CumulVar(self.routing_model.End(0)))
 
         # FIXME
         self.duplicate_origin_indices = [node for node in
-                                         range(len(self.locations) - len(self.work_periods), len(self.locations))]
-        self._add_required_constraints()
-        self._add_all_blackouts()
-        self._add_duplicate_origin_constraints()
-        self._add_appointments()
-        self._add_repeat_visit_constraints()
-        self._add_disjunction()
-        self.log.info('Getting assignment')
-        # initial_route = self._initial_route_from_high_priority_nodes()
-        # initial_assignment = self.routing_model.ReadAssignmentFromRoutes(initial_route, True)
-        self.assignment = self.routing_model.SolveWithParameters(search_parameters)
-        # self.assignment = self.routing_model.SolveFromAssignmentWithParameters(initial_assignment, search_parameters)
+                                         range(len(self.locations) - len(self.work_intervals), len(self.locations))]
 
     def _add_repeat_visit_constraints(self):
         self.log.info('Adding repeat visit constraints')
         time = self.routing_model.GetDimensionOrDie('Time')
+        nodes_without_index = self._nodes_without_index()
         for rep in self.repeat_locations:
             self.log.info('Adding repeat visit constraints for %s', rep)
-            repeat_indices = {self.routing_model.NodeToIndex(rep.original_idx)}.union(
-                {self.routing_model.NodeToIndex(dupe_node) for dupe_node in rep.duplicate_indices})
+            repeat_nodes = [rep.original_idx] + list(rep.duplicate_indices)
+            repeat_indices = {self.index_manager.NodeToIndex(node) for node in repeat_nodes
+                              if node not in nodes_without_index}
+            gap_time = self._repeat_gap_time(rep)
 
             for combo in itertools.combinations(repeat_indices, 2):
                 t0 = time.CumulVar(combo[0])
                 t1 = time.CumulVar(combo[1])
-                gap_time = self.time_dimension_converter.duration_to_time_dimension(
-                    pendulum.duration(days=rep.gap_days))
                 self.solver.Add(abs(t1 - t0) >= gap_time)
 
+    def _repeat_gap_time(self, rep: RepeatLocation) -> int:
+        return self.time_dimension_converter.seconds_to_time_dimension(int(rep.gap_days * SECONDS_PER_DAY))
+
     def _add_all_blackouts(self):
         """Add global and location specific blackout windows. It is important to add both at the same time because
         otherwise no solution is found.
         """
-        global_blackouts = self._global_blackout_windows()
-
         time = self.routing_model.GetDimensionOrDie('Time')
 
-        for node, loc in enumerate(self.locations):
-            node_blackouts: Sequence[pendulum.Period] = getattr(loc, 'blackout_windows', [])
-
-            # We have to subtract service time here otherwise you can arrive less than the amount of time it
-            # takes to service doctor
-            location_service_time = self.service_time_callback(node, node)
-            location_service_duration = self.time_dimension_converter.time_dimension_to_duration(location_service_time)
-            node_blackouts = [b.end - (b.start - location_service_duration) for b in node_blackouts]
-            joined_blackouts = combine_periods(node_blackouts + global_blackouts)
-
-            # Doesn't work if less than 1
-            blackout_starts = [max(0, self.time_dimension_converter.datetime_to_time_dimension(b.start)) for b in
-                               joined_blackouts]
-            blackout_ends = [self.time_dimension_converter.datetime_to_time_dimension(b.end) for b in joined_blackouts]
-
-            # Filter entries where end is less than start
-            blackout_ends_greater_than_start = [end > start for start, end in zip(blackout_starts, blackout_ends)]
-            blackout_starts = [start for start, end_greater in zip(blackout_starts, blackout_ends_greater_than_start) if
-                               end_greater]
-            blackout_ends = [end for end, end_greater in zip(blackout_ends, blackout_ends_greater_than_start) if
-                             end_greater]
-
-            node_time = time.CumulVar(self.routing_model.NodeToIndex(node))
+        num_blackout_intervals = 0
+        nodes_without_index = self._nodes_without_index()
+        for node, (blackout_starts, blackout_ends) in enumerate(self._node_blackout_intervals()):
+            if node in nodes_without_index:
+                continue
+            node_time = time.CumulVar(self.index_manager.NodeToIndex(node))
             self.solver.AddConstraint(
                 self.solver.NotMemberCt(
                     node_time,
-                    blackout_starts, blackout_ends
+                    list(blackout_starts), list(blackout_ends)
                 )
             )
+            num_blackout_intervals += len(blackout_starts)
+        self.metrics['num_blackout_intervals'] = num_blackout_intervals
+
+    def _vehicle_work_intervals(self) -> List[Tuple[int, Interval]]:
+        """The (vehicle, work interval) pairs of every work interval"""
+        return [(0, interval) for interval in self.work_intervals]
+
+    def _break_windows(self) -> List[Tuple[int, int, int, int]]:
+        """The (vehicle, earliest start, latest start, duration) of each break in time dimension units
+
+        Break windows are clipped to the work interval they start in. Breaks that don't fit in any work interval are
+        dropped."""
+        windows = []
+        for brk in self.breaks:
+            for vehicle, (work_start, work_end) in self._vehicle_work_intervals():
+                earliest_start = max(brk.earliest_start, work_start)
+                latest_start = min(brk.latest_start, work_end - brk.duration_seconds)
+                if earliest_start <= latest_start:
+                    windows.append((
+                        vehicle,
+                        self.time_dimension_converter.epoch_to_time_dimension(earliest_start),
+                        self.time_dimension_converter.epoch_to_time_dimension(latest_start),
+                        self.time_dimension_converter.seconds_to_time_dimension(brk.duration_seconds),
+                    ))
+                    break
+            else:
+                self.log.warning('Dropping break %s that is outside of the work periods', brk)
+        return windows
+
+    def _add_breaks(self):
+        """Add the breaks as break intervals of the vehicle
 
-    def _global_blackout_windows(self) -> Sequence[pendulum.Period]:
-        blackout_windows = copy.deepcopy(self.blackout_windows)
-        blackout_windows.extend(self.time_off_periods)
-        self.log.info('Adding global blackouts: %s', blackout_windows)
-        return blackout_windows
+        Unlike blackouts these are a single interval per break instead of one per node, and the time of the break
+        is chosen by the solver."""
+        windows = self._break_windows()
+        self.metrics['num_breaks'] = len(windows)
+        if not windows:
+            return
+
+        if not breaks_supported():
+            raise RuntimeError('Lunch breaks need ortools %s or newer, try `pip install -U ortools` or use %s' % (
+                '.'.join(map(str, BREAKS_MIN_ORTOOLS_VERSION)), LunchModel.BLACKOUT))
+
+        self.log.info('Adding %d breaks', len(windows))
+        breaks_by_vehicle = defaultdict(list)
+        for i, (vehicle, earliest_start, latest_start, duration) in enumerate(windows):
+            break_interval = self.solver.FixedDurationIntervalVar(
+                earliest_start, latest_start, duration, False, 'Break %d' % i)
+            self.break_intervals.append(break_interval)
+            breaks_by_vehicle[vehicle].append(break_interval)
+
+        # Visits can't overlap a break from their arrival until the end of their service time, by routing index
+        node_visit_transits = [
+            self.service_time_callback(node, node)
+            for node in map(self.index_manager.IndexToNode, range(self.routing_model.Size()))
+        ]
+        for vehicle, break_intervals in breaks_by_vehicle.items():
+            self.time.SetBreakIntervalsOfVehicle(break_intervals, vehicle, node_visit_transits)
+
+    def _node_blackout_intervals(self) -> List[Tuple[Sequence[int], Sequence[int]]]:
+        """The (starts, ends) of the time dimension values that each node cannot be started at
+
+        The intervals of a node only depend on its own blackouts, its service time and the global blackouts so they
+        are cached per location."""
+        if self._blackout_intervals is not None:
+            return self._blackout_intervals
+
+        global_blackouts = IntervalSet.from_intervals(self._global_blackout_intervals())
+        global_key = (
+            tuple(global_blackouts),
+            self.time_granularity,
+            self.time_dimension_converter.start_epoch,
+        )
+        intervals = []
+
+        for node, source in enumerate(self.node_sources.tolist()):
+            node_blackouts = self.problem.windows(source) if source != NO_NODE else []
+            location_service_time = self.service_time_callback(node, node)
+            intervals.append(self.model_cache.get(
+                ('node_blackouts', tuple(node_blackouts), location_service_time, global_key),
+                lambda: self._compile_blackout_intervals(node_blackouts, location_service_time, global_blackouts),
+                self.cache_stats,
+            ))
+
+        self._blackout_intervals = intervals
+        return intervals
+
+    def _compile_blackout_intervals(
+            self,
+            node_blackouts: Sequence[Interval],
+            location_service_time: int,
+            global_blackouts: IntervalSet,
+    ) -> Tuple[List[int], List[int]]:
+        # We have to subtract service time here otherwise you can arrive less than the amount of time it
+        # takes to service doctor
+        location_service_seconds = self.time_dimension_converter.time_dimension_to_seconds(location_service_time)
+        joined_blackouts = (IntervalSet.from_intervals(node_blackouts).shift(start_offset=-location_service_seconds)
+                            | global_blackouts)
+
+        # Doesn't work if less than 1
+        blackout_starts = np.maximum(0, self.time_dimension_converter.epochs_to_time_dimension(joined_blackouts.starts))
+        blackout_ends = self.time_dimension_converter.epochs_to_time_dimension(joined_blackouts.ends)
+
+        # Filter entries where end is less than start
+        blackout_ends_greater_than_start = blackout_ends > blackout_starts
+        return (blackout_starts[blackout_ends_greater_than_start].tolist(),
+                blackout_ends[blackout_ends_greater_than_start].tolist())
+
+    def _global_blackout_intervals(self) -> List[Interval]:
+        blackout_intervals = self.blackout_intervals + self.time_off_intervals
+        self.log.info('Adding global blackouts: %s', blackout_intervals)
+        return blackout_intervals
+
+    def _duplicate_origin_times(self) -> Dict[int, int]:
+        """Map of duplicate origin node -> the time dimension value of the end of its work period"""
+        return {
+            node: self.time_dimension_converter.epoch_to_time_dimension(end)
+            for node, (_, end) in zip(self.duplicate_origin_indices, self.work_intervals)
+        }
 
     def _add_duplicate_origin_constraints(self):
         # FIXME
         time = self.routing_model.GetDimensionOrDie('Time')
-        for node, eod_datetime in zip(self.duplicate_origin_indices, [p.end for p in self.work_periods]):
-            node_time = time.CumulVar(self.routing_model.NodeToIndex(node))
-            time_constraint = self.time_dimension_converter.datetime_to_time_dimension(eod_datetime)
+        for node, eod_epoch in zip(self.duplicate_origin_indices, [end for _, end in self.work_intervals]):
+            node_time = time.CumulVar(self.index_manager.NodeToIndex(node))
+            time_constraint = self.time_dimension_converter.epoch_to_time_dimension(eod_epoch)
             self.log.info(
                 'Adding origin constraint: %s offset %s for node %d %s',
-                eod_datetime.isoformat(),
+                eod_epoch,
                 time_constraint,
                 node,
                 self.locations[node],
             )
             self.solver.Add(node_time == time_constraint)
 
-        end_node = self.routing_model.End(0)
-        self.log.info('Adding end node constraint to node: %d', end_node)
+        end_index = self.routing_model.End(0)
+        self.log.info('Adding end node constraint to index: %d', end_index)
         self.solver.Add(
-            self.routing_model.CumulVar(end_node, TIME)
-            == self.time_dimension_converter.datetime_to_time_dimension(eod_datetime))
+            time.CumulVar(end_index) == self.time_dimension_converter.epoch_to_time_dimension(eod_epoch))
 
     def _add_appointments(self):
-        if not self.appointments:
+        if not self.node_appointments:
             self.log.info('No appointments')
             return
 
-        self.log.info('Adding %d appointments', len(self.appointments))
+        self.log.info('Adding %d appointments', len(self.node_appointments))
         time = self.routing_model.GetDimensionOrDie('Time')
 
-        for appointment in self.appointments:
-            node = self.locations.index(appointment.location)
-            node_time = time.CumulVar(self.routing_model.NodeToIndex(node))
-            start = self.time_dimension_converter.datetime_to_time_dimension(appointment.start_time)
-            self.log.info('Adding appointment: %s with offset %s for node %d', appointment, start, node)
+        nodes_without_index = self._nodes_without_index()
+        for node, (start_epoch, end_epoch) in self.node_appointments.items():
+            if node in nodes_without_index:
+                self.log.info('Not adding the appointment of node %d which starts or ends a vehicle', node)
+                continue
+            node_time = time.CumulVar(self.index_manager.NodeToIndex(node))
+            start = self.time_dimension_converter.epoch_to_time_dimension(start_epoch)
+            self.log.info('Adding appointment: %s %s - %s with offset %s for node %d', self.locations[node],
+                          from_epoch(start_epoch, self.timezone), from_epoch(end_epoch, self.timezone), start, node)
             self.solver.Add(node_time == start)
 
     def _nodes_involved_in_repeats(self) -> AbstractSet[int]:
@@ -347,80 +586,118 @@ class CP(Solver):
             nodes.update(repeat.duplicate_indices)
         return nodes
 
-    def _add_disjunction(self):
-        # FIXME
-        self.log.info('Adding disjunctions')
-        origin_location = self.locations[0]
-        base_penalty = 100000
+    def _node_penalties(self) -> List[int]:
+        """The disjunctive penalty of skipping each node"""
+        location_ids = self.problem.location_ids
+        appointment_ids = set(location_ids[self.problem.appointment_nodes].tolist())
         repeat_nodes = self._nodes_involved_in_repeats()
-        for node, location in enumerate(self.locations):
-            if (location.is_same_doctor(origin_location)
-                    or location in {app.location for app in self.appointments}
+        penalties = []
+        for node, source in enumerate(self.node_sources.tolist()):
+            if source == NO_NODE:
+                penalties.append(BASE_SKIP_PENALTY)
+            elif (location_ids[source] == location_ids[0]
+                    or location_ids[source] in appointment_ids
                     or node in repeat_nodes
-                    or getattr(location, 'is_required', False)
+                    or self.problem.is_required[source]
             ):
-                self.routing_model.AddDisjunction([node], 100000000)
+                penalties.append(REQUIRED_SKIP_PENALTY)
             else:
-                multiplier = getattr(location, 'skip_cost_multiplier', 1)
-                penalty = int(multiplier * base_penalty)
-                self.routing_model.AddDisjunction([node], penalty)
+                penalties.append(int(self.problem.skip_cost_multipliers[source] * BASE_SKIP_PENALTY))
+        return penalties
+
+    def _add_disjunction(self):
+        # FIXME
+        self.log.info('Adding disjunctions')
+        nodes_without_index = self._nodes_without_index()
+        for node, penalty in enumerate(self._node_penalties()):
+            if node not in nodes_without_index:
+                self.routing_model.AddDisjunction([self.index_manager.NodeToIndex(node)], penalty)
 
-    def _route_indices(self) -> List[RouteElement]:
+    def _nodes_without_index(self) -> AbstractSet[int]:
+        """Nodes that are only the starts and ends of vehicles so can't be constrained or skipped"""
+        return set()
+
+    def _route_indices(self, vehicle: int = 0) -> List[RouteElement]:
         """Get an list of the route indices"""
         if not self.assignment:
             raise NoSolutionFoundError('No assignment was found')
 
         indices = []
-        index = self.routing_model.Start(0)
+        index = self.routing_model.Start(vehicle)
         while not self.routing_model.IsEnd(index):
-            node_index = self.routing_model.IndexToNode(index)
+            node_index = self.index_manager.IndexToNode(index)
             indices.append(RouteElement(index, node_index))
             index = self.assignment.Value(self.routing_model.NextVar(index))
 
-        node_index = self.routing_model.IndexToNode(index)
+        node_index = self.index_manager.IndexToNode(index)
         indices.append(RouteElement(index, node_index))
 
         return indices
 
+    def _vehicle_route_indices(self) -> List[List[RouteElement]]:
+        """The route indices of each vehicle"""
+        route_indices = self._route_indices()
+        start_node = self.locations[route_indices[0].node_index]
+        if (len(route_indices) >= 2
+                and self.locations[route_indices[-1].node_index].is_same_doctor(start_node)
+                and self.locations[route_indices[-2].node_index].is_same_doctor(start_node)):
+            self.log.info('Removing duplicate duplicate origin node at end of route')
+            del route_indices[-1]
+        return [route_indices]
+
+    def _vehicle_travel_time(self, vehicle: int, from_node: int, to_node: int) -> int:
+        return int(self.travel_time_callback(from_node, to_node))
+
+    def _is_visit(self, node: int) -> bool:
+        """Whether the node is a visit rather than the origin or a stand in for time off"""
+        return node not in self.duplicate_origin_indices and node != 0
+
     def _solve(self):
         time_dimension = self.routing_model.GetDimensionOrDie(TIME)
         route = []
 
         start_index = self.routing_model.Start(0)
         plan_output = 'Route {0}:'.format(0)
-        start_node = self.locations[self.routing_model.IndexToNode(start_index)]
+        start_node = self.locations[self.index_manager.IndexToNode(start_index)]
         num_doctors_visited = 0
         total_travel_time = 0
-        prev_node = None
-
-        route_indices = self._route_indices()
-        if (len(route_indices) >= 2
-                and self.locations[route_indices[-1].node_index].is_same_doctor(start_node)
-                and self.locations[route_indices[-2].node_index].is_same_doctor(start_node)):
-            self.log.info('Removing duplicate duplicate origin node at end of route')
-            del route_indices[-1]
 
-        for route_idx in route_indices:
-            index, node_index = route_idx.index, route_idx.node_index
-            if not self.locations[node_index].is_same_doctor(start_node):
-                num_doctors_visited += 1
-            time_var = time_dimension.CumulVar(index)
-            min_time = self.assignment.Min(time_var)
-            location = copy.copy(self.locations[node_index])
-            arrival_time = min_time
-            location.arrival_time = str(self.time_dimension_converter.time_dimension_to_datetime(arrival_time))
-            end_time = self.service_time_callback(node_index, None) + arrival_time
-            location.end_time = str(self.time_dimension_converter.time_dimension_to_datetime(end_time))
-            route.append(location)
-            plan_output += \
-                " {node_index} Time({tmin}, {tmax}) -> ".format(
-                    node_index=node_index,
-                    tmin=str(min_time),
-                    tmax=str(self.assignment.Max(time_var)))
-            if prev_node is not None:
-                total_travel_time += int(self.travel_time_callback(prev_node, node_index))
-                location.travel_to_time = int(self.travel_time_callback(prev_node, node_index))
-            prev_node = node_index
+        vehicle_routes = self._vehicle_route_indices()
+        route_indices = [route_idx for vehicle_route in vehicle_routes for route_idx in vehicle_route]
+        last_vehicle = len(vehicle_routes) - 1
+        for vehicle, vehicle_route in enumerate(vehicle_routes):
+            prev_node = None
+            for position, route_idx in enumerate(vehicle_route):
+                index, node_index = route_idx.index, route_idx.node_index
+                travel_time = None
+                if prev_node is not None:
+                    travel_time = self._vehicle_travel_time(vehicle, prev_node, node_index)
+                    total_travel_time += travel_time
+                prev_node = node_index
+                # The route starts at the start of the first vehicle and ends at the end of the last one
+                if (position == 0 and vehicle > 0) or (position == len(vehicle_route) - 1 and vehicle < last_vehicle):
+                    continue
+
+                if not self.locations[node_index].is_same_doctor(start_node):
+                    num_doctors_visited += 1
+                time_var = time_dimension.CumulVar(index)
+                min_time = self.assignment.Min(time_var)
+                location = copy.copy(self.locations[node_index])
+                arrival_time = min_time
+                end_time = self.service_time_callback(node_index, None) + arrival_time
+                location.arrival_epoch = self.time_dimension_converter.time_dimension_to_epoch(arrival_time)
+                location.end_epoch = self.time_dimension_converter.time_dimension_to_epoch(end_time)
+                # The formatted times are only for the saved solution
+                location.arrival_time = str(from_epoch(location.arrival_epoch, self.timezone))
+                location.end_time = str(from_epoch(location.end_epoch, self.timezone))
+                route.append(location)
+                plan_output += \
+                    " {node_index} Time({tmin}, {tmax}) -> ".format(
+                        node_index=node_index,
+                        tmin=str(min_time),
+                        tmax=str(self.assignment.Max(time_var)))
+                if travel_time is not None:
+                    location.travel_to_time = travel_time
 
         # FIXME fix doctors count and visited count
         self.metrics['doctors_visited'] = 0
@@ -430,12 +707,22 @@ class CP(Solver):
         self.metrics['total_visit_time'] = sum(
             self.service_time_callback(route_idx.node_index, route_idx.node_index)
             for route_idx in route_indices
-            if route_idx.node_index not in self.duplicate_origin_indices and route_idx.node_index != 0
+            if self._is_visit(route_idx.node_index)
         )
-        self.metrics['total_work_time'] = sum(wp.in_seconds() for wp in self.work_periods)
+        self.metrics['total_work_time'] = sum(end - start for start, end in self.work_intervals)
+        self.metrics['breaks'] = [
+            {
+                'start_time': str(from_epoch(
+                    self.time_dimension_converter.time_dimension_to_epoch(self.assignment.StartValue(brk)),
+                    self.timezone)),
+                'duration_seconds': self.time_dimension_converter.time_dimension_to_seconds(brk.DurationMin()),
+            }
+            for brk in self.break_intervals
+        ]
         self.metrics['total_idle_time'] = self.metrics['total_work_time'] - self.metrics['total_visit_time'] - self.metrics['total_travel_time']
 
-        objective_cost_evaluator = ObjectiveCostEvaluator(self.locations, route_indices, self.routing_model)
+        objective_cost_evaluator = ObjectiveCostEvaluator(self.locations, route_indices, self.routing_model,
+                                                          self.index_manager, vehicle_routes)
         self.metrics['objective_costs'] = {
             'travel': objective_cost_evaluator.total_travel_cost(),
             'disjunctive': objective_cost_evaluator.total_disjunctive_cost(),
@@ -455,6 +742,7 @@ class CP(Solver):
             end = timer()
             running_time = end - start
             solution.metrics['running_time'] = running_time
+            self.cache_stats.add_to(solution.metrics)
             return solution
         except Exception:
             self.log.exception('Error encountered while running MIP')
@@ -462,46 +750,211 @@ class CP(Solver):
 
     def calculate_location_visit_times(self):
         # FIXME
-        assert vars(self.locations[0]).get('visit_time_seconds', 0) == 0
+        assert self.problem.service_seconds[0] in (0, DEFAULT_SERVICE_SECONDS)
         self.locations[0].visit_time_seconds = 0
 
         visit_times = []
-        for node, location in enumerate(self.locations):
+        for node, source in enumerate(self.node_sources.tolist()):
             if node == 0:
                 visit_times.append(0)
             elif node in self.node_appointment_times:
                 visit_times.append(self.node_appointment_times[node])
             elif node in self.node_time_off_map:
                 visit_times.append(self.node_time_off_map[node])
-            elif 'visit_time_seconds' in vars(location):
-                visit_times.append(location.visit_time_seconds)
-            elif node in self.repeat_to_original_indices and 'visit_time_seconds' in vars(
-                    self.locations[self.repeat_to_original_indices[node]]):
-                visit_times.append(self.locations[self.repeat_to_original_indices[node]].visit_time_seconds)
+            elif source != NO_NODE and self.problem.service_seconds[source] != DEFAULT_SERVICE_SECONDS:
+                visit_times.append(int(self.problem.service_seconds[source]))
             else:
-                visit_times.append(self.time_dimension_converter.duration_to_time_dimension(SERVICE_TIME_DURATION))
+                visit_times.append(self.time_dimension_converter.seconds_to_time_dimension(SERVICE_TIME_SECONDS))
 
         return visit_times
 
     def _initial_route_from_high_priority_nodes(self):
         route = []
         route_ids = []
-        for node, loc in enumerate(self.locations):
-            multiplier = getattr(loc, 'skip_cost_multiplier', 1)
-            if multiplier > 1:
+        for node, (loc, source) in enumerate(zip(self.locations, self.node_sources.tolist())):
+            if source != NO_NODE and self.problem.skip_cost_multipliers[source] > 1:
                 route.append(node)
                 route_ids.append(loc.id)
         random.shuffle(route)
         self.log.info('Using initial route from high priority locations: %s', route_ids)
         return [route]
 
+    def _initial_routes_from_insertion_heuristic(self) -> List[List[int]]:
+        """Build the initial route with `InsertionHeuristic`
+
+        The duplicate origins form the skeleton of the route, one per work period at the end of the period."""
+        num_nodes = len(self.locations)
+        duplicate_origin_times = self._duplicate_origin_times()
+        fixed_times = dict(duplicate_origin_times)
+        for node, (start, _) in self.node_appointments.items():
+            fixed_times[node] = self.time_dimension_converter.epoch_to_time_dimension(start)
+
+        penalties = self._node_penalties()
+        heuristic = InsertionHeuristic(
+            travel_times=self.travel_times,
+            service_times=[self.service_time_callback(node, node) for node in range(num_nodes)],
+            blackouts=self._node_blackout_intervals(),
+            horizon=self.max_time_dimension,
+            skeleton=sorted(duplicate_origin_times, key=duplicate_origin_times.get),
+            fixed_times=fixed_times,
+            candidates=[node for node in range(num_nodes) if node != self.fake_origin_idx],
+            priority_nodes=[node for node, penalty in enumerate(penalties) if penalty >= REQUIRED_SKIP_PENALTY],
+            penalties=penalties,
+            repeat_groups=[
+                ([rep.original_idx] + list(rep.duplicate_indices), self._repeat_gap_time(rep))
+                for rep in self.repeat_locations
+            ],
+            depot=MIP_CONFIG['depot_idx'],
+        )
+        route = heuristic.build()
+        self.metrics['initial_solution'] = dict(heuristic.metrics)
+        return [route]
+
     def _add_required_constraints(self):
-        required_nodes = [node for node, loc in enumerate(self.locations) if getattr(loc, 'is_required', False)]
+        # Vehicle starts and ends are always visited
+        nodes_without_index = self._nodes_without_index()
+        required_nodes = [node for node, source in enumerate(self.node_sources.tolist())
+                          if source != NO_NODE and self.problem.is_required[source] and node not in nodes_without_index]
         for node in required_nodes:
-            index = self.routing_model.NodeToIndex(node)
+            index = self.index_manager.NodeToIndex(node)
             self.solver.Add(self.routing_model.ActiveVar(index) == 1)
 
 
+class WorkPeriodVehiclesCP(CP):
+    """CP with a vehicle for every work period instead of duplicate origin nodes
+
+    Each vehicle starts at the start location and ends at the end location of its work period, and its time is
+    limited to the work period. The time off between work periods needs neither pseudo visits nor blackouts, and
+    repeat gaps are constraints between the times of visits on different vehicles. Work periods without start and
+    end locations start and end at the origin.
+    """
+
+    def __init__(
+            self,
+            problem: ProblemInstance,
+            locations: Optional[Sequence[Location]] = None,
+            travel_time_tensor: Optional[TravelTimeTensor] = None,
+            **kwargs
+    ):
+        if kwargs.get('use_insertion_heuristic'):
+            raise RuntimeError('The insertion heuristic only supports a single vehicle')
+        # The work periods in order of their start and end, sorting is stable like `sorted`
+        self.vehicle_periods = np.lexsort((problem.work_ends, problem.work_starts))
+        self.vehicle_work_intervals = [(int(problem.work_starts[i]), int(problem.work_ends[i]))
+                                       for i in self.vehicle_periods]
+        self.travel_time_tensor = travel_time_tensor
+        super().__init__(problem, locations, **kwargs)
+        self.metrics['num_vehicles'] = self.num_vehicles
+
+    @staticmethod
+    def _locations_with_duplicates_and_origin(
+            locations,
+            time_off,
+            problem: Optional[ProblemInstance] = None,
+    ) -> Tuple[Sequence[Location], Sequence[RepeatLocation]]:
+        locations, repeat_locations = CP._locations_with_repeats(locations, problem)
+        return locations, repeat_locations, None
+
+    def _create_routing_model(self) -> pywrapcp.RoutingModel:
+        def depot_node(node):
+            return MIP_CONFIG['depot_idx'] if node == NO_NODE else node
+
+        self.vehicle_starts = [depot_node(node) for node in self.problem.work_start_nodes[self.vehicle_periods].tolist()]
+        self.vehicle_ends = [depot_node(node) for node in self.problem.work_end_nodes[self.vehicle_periods].tolist()]
+        self.num_vehicles = len(self.vehicle_work_intervals)
+        self.log.info('Specifying model with %d locations and %d vehicles', len(self.locations), self.num_vehicles)
+        self.index_manager = pywrapcp.RoutingIndexManager(
+            len(self.locations), self.num_vehicles, self.vehicle_starts, self.vehicle_ends)
+        return pywrapcp.RoutingModel(self.index_manager)
+
+    def _vehicle_work_intervals(self) -> List[Tuple[int, Interval]]:
+        return list(enumerate(self.vehicle_work_intervals))
+
+    def _nodes_without_index(self) -> AbstractSet[int]:
+        return set(self.vehicle_starts) | set(self.vehicle_ends)
+
+    def _global_blackout_intervals(self) -> List[Interval]:
+        # Vehicles only work during their work period so time off isn't a blackout
+        self.log.info('Adding global blackouts: %s', self.blackout_intervals)
+        return self.blackout_intervals
+
+    def _vehicle_travel_time_callbacks(self) -> List:
+        """A travel time callback per vehicle for the departure time of its work period"""
+        callbacks_by_bucket = {}
+        callbacks = []
+        self.metrics['travel_time_bucket_hours'] = []
+        for start, _ in self.vehicle_work_intervals:
+            departure_time = from_epoch(start, self.timezone)
+            bucket = self.travel_time_tensor.bucket(departure_time)
+            if bucket not in callbacks_by_bucket:
+                matrix = self.travel_time_tensor.matrix(departure_time)
+                travel_times = CreateTravelTimeCallback(matrix, self.repeat_to_original_indices).travel_time_matrix(
+                    len(self.locations))
+                callbacks_by_bucket[bucket] = CreateTravelTimeCallback(travel_times).get_travel_time
+            callbacks.append(callbacks_by_bucket[bucket])
+            self.metrics['travel_time_bucket_hours'].append(self.travel_time_tensor.bucket_hours[bucket])
+        return callbacks
+
+    def _add_time_dimension(self):
+        self.max_time_dimension = self.time_dimension_converter.epoch_to_time_dimension(self.work_intervals[-1][1])
+        if self.travel_time_tensor is None:
+            total_time_callback = CreateTotalTimeCallback(
+                self.travel_time_callback, self.service_time_callback).get_total_time
+            self.routing_model.SetArcCostEvaluatorOfAllVehicles(
+                self._register_node_callback(self.travel_time_callback))
+            self.routing_model.AddDimension(
+                self._register_node_callback(total_time_callback),
+                self.max_time_dimension,
+                self.max_time_dimension,
+                False,
+                TIME
+            )
+        else:
+            # Vehicles departing in the same bucket share their registered callbacks
+            self.vehicle_travel_time_callbacks = self._vehicle_travel_time_callbacks()
+            travel_time_indices = {}
+            total_time_indices = {}
+            for callback in self.vehicle_travel_time_callbacks:
+                if callback not in travel_time_indices:
+                    travel_time_indices[callback] = self._register_node_callback(callback)
+                    total_time_indices[callback] = self._register_node_callback(
+                        CreateTotalTimeCallback(callback, self.service_time_callback).get_total_time)
+            for vehicle, callback in enumerate(self.vehicle_travel_time_callbacks):
+                self.routing_model.SetArcCostEvaluatorOfVehicle(travel_time_indices[callback], vehicle)
+            self.routing_model.AddDimensionWithVehicleTransits(
+                [total_time_indices[callback] for callback in self.vehicle_travel_time_callbacks],
+                self.max_time_dimension,
+                self.max_time_dimension,
+                False,
+                TIME
+            )
+        self.time = self.routing_model.GetDimensionOrDie(TIME)
+        for vehicle, (work_start, work_end) in self._vehicle_work_intervals():
+            start = self.time_dimension_converter.epoch_to_time_dimension(work_start)
+            end = self.time_dimension_converter.epoch_to_time_dimension(work_end)
+            self.time.CumulVar(self.routing_model.Start(vehicle)).SetRange(start, end)
+            end_time = self.time.CumulVar(self.routing_model.End(vehicle))
+            end_time.SetRange(start, end)
+            self.routing_model.AddVariableMinimizedByFinalizer(end_time)
+
+        self.duplicate_origin_indices = []
+
+    def _add_duplicate_origin_constraints(self):
+        """There are no duplicate origins, the time windows of the vehicles are set with the time dimension"""
+
+    def _vehicle_route_indices(self) -> List[List[RouteElement]]:
+        """The route indices of every vehicle in order of their work periods"""
+        return [self._route_indices(vehicle) for vehicle in range(self.num_vehicles)]
+
+    def _vehicle_travel_time(self, vehicle: int, from_node: int, to_node: int) -> int:
+        if self.travel_time_tensor is None:
+            return super()._vehicle_travel_time(vehicle, from_node, to_node)
+        return int(self.vehicle_travel_time_callbacks[vehicle](from_node, to_node))
+
+    def _is_visit(self, node: int) -> bool:
+        return super()._is_visit(node) and node not in self._nodes_without_index()
+
+
 class CreateTravelTimeCallback(object):
     def __init__(
             self,
@@ -528,14 +981,24 @@ class CreateTravelTimeCallback(object):
 
         return self.distance_matrix[from_node, to_node]
 
+    def travel_time_matrix(self, num_nodes: int) -> np.ndarray:
+        """The (num_nodes x num_nodes) matrix of `get_travel_time` for every pair of nodes"""
+        matrix_nodes = np.arange(num_nodes)
+        matrix_nodes[matrix_nodes >= len(self.distance_matrix)] = -1
+        for repeat_node, original_node in self.repeat_to_original_indices.items():
+            matrix_nodes[repeat_node] = original_node
+
+        has_distance = matrix_nodes >= 0
+        travel_times = np.zeros(shape=(num_nodes, num_nodes), dtype=np.int64)
+        travel_times[np.ix_(has_distance, has_distance)] = self.distance_matrix[
+            np.ix_(matrix_nodes[has_distance], matrix_nodes[has_distance])]
+        return travel_times
+
 
-def make_node_appointments_map(locations, appointments):
-    """Creates a node -> appointment map from appointments"""
-    node_appointments = {}
-    for appointment in appointments:
-        node = locations.index(appointment.location)
-        node_appointments[node] = appointment
-    return node_appointments
+def _combine_work_intervals(work_intervals: Sequence[Interval]) -> Tuple[List[Interval], List[Interval]]:
+    """The combined work intervals and the time off between them"""
+    combined_work_intervals = IntervalSet.from_intervals(work_intervals).to_list()
+    return combined_work_intervals, time_off_intervals(combined_work_intervals)
 
 
 class CreateServiceTimeCallback(object):
@@ -562,51 +1025,136 @@ class CreateTotalTimeCallback(object):
 
 def run_model(
         solution_name,
-        work_periods: Sequence[pendulum.Period],
+        work_periods: Optional[Sequence[pendulum.Period]] = None,
         distance_matrix=None,
         time_limit_ms=10 * 1000,
-        locations=REAL_LONG_ISLAND_DATA,
+        locations=None,
         appointments=None,
         lunch_hour_start=None,
         lunch_minutes=None,
+        lunch_model: LunchModel = LunchModel.BLACKOUT,
+        lunch_flexibility_minutes: int = DEFAULT_LUNCH_FLEXIBILITY_MINUTES,
+        vehicle_per_work_period: bool = False,
+        persist: bool = True,
+        solution_sink: Optional[SolutionSink] = None,
+        distance_provider: Optional[DistanceProvider] = None,
+        travel_time_tensor: Optional[TravelTimeTensor] = None,
+        time_dependent: bool = True,
+        problem_instance: Optional[ProblemInstance] = None,
+        problem_instance_path: Optional[Path] = None,
+        deadline: Optional[float] = None,
         **kwargs,
 ) -> Solution:
-    locations = copy.deepcopy(locations)
-
-    distance_matrix = distance_matrix if distance_matrix is not None else load_distance_matrix_data(locations)
-
-    # Lunch is from noon to 1 PM but we subtract service time from the beginning
-    # so that a node cannot start lunch during its service time.
-    lunch_intervals: Sequence[pendulum.Period] = []
-    if lunch_hour_start and lunch_minutes:
-        # All of the dates where work is performed
-        work_dates = {p.start.date() for p in work_periods}
-        work_dates.update(p.end.date() for p in work_periods)
-
-        for dt in work_dates:
-            lunch_start = pendulum.datetime(year=dt.year, month=dt.month, day=dt.day,
-                                            hour=lunch_hour_start) - SERVICE_TIME_DURATION
-            lunch_end = lunch_start + pendulum.duration(minutes=lunch_minutes)
-            lunch_intervals.append(lunch_end - lunch_start)
-
-    cp = CP(
-        locations,
-        work_periods=work_periods,
-        distance_matrix=distance_matrix,
-        appointments=appointments,
-        blackout_intervals=lunch_intervals,
+    """Solve and validate a route
+
+    With `LunchModel.BREAK` lunch is a break of `lunch_minutes` that starts within `lunch_flexibility_minutes` of
+    `lunch_hour_start` instead of a blackout at exactly that time. With `vehicle_per_work_period` the route is solved
+    with `WorkPeriodVehiclesCP`.
+
+    Solutions are persisted by `solution_sink`, the shared background sink by default, unless `persist` is False.
+
+    Without a `distance_matrix` travel times come from `travel_time_tensor` for the departure at the start of the
+    first work period, from `distance_provider`, or from the cached Google distance matrix. With
+    `vehicle_per_work_period` every vehicle uses the tensor for the start of its own work period. If not
+    `time_dependent` the 8 AM travel times of the tensor are used throughout.
+
+    The inputs are compiled to a `ProblemInstance` that the model and the validator read, which is saved to
+    `problem_instance_path` if there is one. A saved `problem_instance` can be solved again instead of the locations,
+    work periods, appointments, distances and lunch.
+
+    With a `deadline`, in `time.time()` seconds, the solver gets at most the time that is left of it once the problem
+    is compiled and the model is initialized, so fetching travel times counts against the time budget."""
+    if isinstance(lunch_model, str):
+        lunch_model = LunchModel[lunch_model.upper()]
+    if problem_instance is None:
+        locations = locations if locations is not None else REAL_LONG_ISLAND_DATA
+        problem_instance = _compile_problem_instance(
+            locations, work_periods, distance_matrix, appointments, lunch_hour_start, lunch_minutes, lunch_model,
+            lunch_flexibility_minutes, distance_provider, travel_time_tensor, time_dependent)
+    if problem_instance_path is not None:
+        problem_instance.save(problem_instance_path)
+
+    solver_class = WorkPeriodVehiclesCP if vehicle_per_work_period else CP
+    if vehicle_per_work_period and travel_time_tensor is not None and time_dependent:
+        kwargs['travel_time_tensor'] = travel_time_tensor
+    cp = solver_class(
+        problem_instance,
+        # The model sets attributes on its locations, copies share everything else with the caller's locations
+        [copy.copy(location) for location in locations] if locations is not None else None,
         solution_name=solution_name,
         time_limit_ms=time_limit_ms,
         **kwargs
     )
+    if deadline is not None:
+        remaining_ms = int((deadline - time.time()) * 1000)
+        if remaining_ms <= 0:
+            raise phocus.errors.TimeBudgetExhaustedError(
+                'The time budget of %s was exhausted before solving' % solution_name)
+        if remaining_ms < cp.time_limit_ms:
+            logger.info('Limiting the solver to the %d ms left of the time budget', remaining_ms)
+            cp.time_limit_ms = remaining_ms
     solution = cp.solve()
 
-    validator = phocus.cp.solution_validator.SolutionValidator(cp.appointments, cp.locations, cp.repeat_locations,
-                                                               solution)
+    validator = phocus.cp.solution_validator.SolutionValidator.from_problem_instance(
+        problem_instance, solution, cp.node_sources)
     is_valid = validator.validate(_raise=False)
 
-    solution_filename = 'mip-%s-%s.json' % (current_isotime_for_filename(), solution_name)
-    solution.save(solution_filename)
+    if persist:
+        sink = solution_sink if solution_sink is not None else phocus.model.solution_sink.solution_sink
+        sink.submit(solution, 'mip-%s-%s' % (current_isotime_for_filename(), solution_name))
     if not is_valid:
         raise phocus.errors.InvalidSolutionError('Invalid solutions found during CP solution')
     return solution
+
+
+def _compile_problem_instance(
+        locations: Sequence[Location],
+        work_periods: Sequence[pendulum.Period],
+        distance_matrix,
+        appointments,
+        lunch_hour_start,
+        lunch_minutes,
+        lunch_model: LunchModel,
+        lunch_flexibility_minutes: int,
+        distance_provider: Optional[DistanceProvider],
+        travel_time_tensor: Optional[TravelTimeTensor],
+        time_dependent: bool,
+) -> ProblemInstance:
+    """The problem instance of the arguments of `run_model`, with the travel times and lunch they ask for"""
+    if work_periods is None:
+        raise RuntimeError('Expected work periods or a problem instance')
+    # The periods are only passed on for their locations, `ProblemInstance.compile` converts them to intervals too
+    work_intervals = [period_to_interval(p) for p in work_periods]
+    timezone = min(p.start for p in work_periods).timezone
+
+    if travel_time_tensor is not None and travel_time_tensor.num_nodes != len(locations):
+        raise RuntimeError('The travel time tensor has %d nodes but there are %d locations' % (
+            travel_time_tensor.num_nodes, len(locations)))
+
+    if distance_matrix is None:
+        if travel_time_tensor is not None:
+            departure_time = from_epoch(min(start for start, _ in work_intervals), timezone)
+            distance_matrix = travel_time_tensor.matrix(departure_time, time_dependent=time_dependent)
+        elif distance_provider is not None:
+            distance_matrix = distance_provider.travel_time_matrix(locations)
+        else:
+            distance_matrix = load_distance_matrix_data(locations)
+
+    lunch_intervals: List[Interval] = []
+    breaks: List[Break] = []
+    if lunch_hour_start and lunch_minutes:
+        # All of the dates where work is performed
+        work_dates = {from_epoch(epoch, timezone).date() for interval in work_intervals for epoch in interval}
+
+        for dt in sorted(work_dates):
+            # The lunch hour is in UTC, as pendulum.datetime made it before times were epochs
+            lunch_start = date_to_epoch(dt) + lunch_hour_start * SECONDS_PER_HOUR
+            if lunch_model == LunchModel.BREAK:
+                breaks.append(Break(lunch_start, lunch_start + lunch_flexibility_minutes * 60, lunch_minutes * 60))
+            else:
+                # Lunch is from noon to 1 PM but we subtract service time from the beginning
+                # so that a node cannot start lunch during its service time.
+                lunch_start -= SERVICE_TIME_SECONDS
+                lunch_intervals.append((lunch_start, lunch_start + lunch_minutes * 60))
+
+    return ProblemInstance.compile(locations, distance_matrix, work_periods, appointments, lunch_intervals, breaks)
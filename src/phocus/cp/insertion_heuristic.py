@@ -0,0 +1,299 @@
+"""Constructive insertion heuristic used to seed the routing search with a time feasible first solution"""
+import bisect
+from timeit import default_timer as timer
+from typing import Sequence, Tuple, Mapping, Optional, List, Iterable
+
+import numpy as np
+
+from phocus.utils.mixins import Base
+
+# Sentinel for "no feasible value". Kept well below the int64 limit so sums of a few sentinels do not overflow.
+INFEASIBLE = np.iinfo(np.int64).max // 8
+
+# Upper bound on the number of (candidate, position, window) elements evaluated at once
+_MAX_CHUNK_ELEMENTS = 1 << 22
+
+
+def merge_intervals(starts: Sequence[int], ends: Sequence[int]) -> Tuple[List[int], List[int]]:
+    """Sort inclusive integer intervals and merge the ones that overlap or touch"""
+    merged_starts, merged_ends = [], []
+    for start, end in sorted(zip(starts, ends)):
+        if merged_ends and start <= merged_ends[-1] + 1:
+            merged_ends[-1] = max(merged_ends[-1], end)
+        else:
+            merged_starts.append(start)
+            merged_ends.append(end)
+    return merged_starts, merged_ends
+
+
+class InsertionHeuristic(Base):
+    """Regret insertion heuristic for the single vehicle time dimension model
+
+    The route starts as the skeleton (the nodes with fixed times such as duplicate origins). Appointments are inserted
+    first, then the priority nodes (required and repeat nodes) and finally all other candidates. Within a phase the
+    candidate with the highest regret (difference between its best and second best insertion cost) is inserted
+    first, ties are broken in favor of the candidate with the least open time.
+
+    Insertion positions are evaluated for all candidates at once on (candidates x positions) arrays using the
+    earliest schedule of the current route and the latest feasible start of every route node. The chosen insertion
+    is then verified with an exact forward schedule.
+
+    :arg travel_times: (nodes x nodes) travel times in time dimension units
+    :arg service_times: the service time of every node in time dimension units
+    :arg blackouts: per node (starts, ends) of inclusive time dimension values the node cannot be started at
+    :arg horizon: the largest allowed time dimension value
+    :arg skeleton: nodes that are always on the route, in route order
+    :arg fixed_times: node -> the only time dimension value the node can be started at
+    :arg candidates: nodes that may be inserted into the route
+    :arg priority_nodes: candidates that are inserted before the others regardless of their skip penalty
+    :arg penalties: per node cost of leaving the node out of the route
+    :arg repeat_groups: (nodes, gap) pairs where all visits to the nodes must start at least gap apart
+    :arg depot: the start and end node of the route. Its time is fixed to 0.
+    """
+
+    def __init__(
+            self,
+            travel_times: np.ndarray,
+            service_times: Sequence[int],
+            blackouts: Sequence[Tuple[Sequence[int], Sequence[int]]],
+            horizon: int,
+            skeleton: Sequence[int],
+            fixed_times: Optional[Mapping[int, int]] = None,
+            candidates: Optional[Iterable[int]] = None,
+            priority_nodes: Optional[Iterable[int]] = None,
+            penalties: Optional[Sequence[int]] = None,
+            repeat_groups: Optional[Sequence[Tuple[Sequence[int], int]]] = None,
+            depot: int = 0,
+    ):
+        self.travel_times = np.asarray(travel_times, dtype=np.int64)
+        self.service_times = np.asarray(service_times, dtype=np.int64)
+        self.num_nodes = len(self.service_times)
+        self.horizon = int(horizon)
+        self.depot = depot
+        self.skeleton = list(skeleton)
+        self.fixed_times = dict(fixed_times) if fixed_times else {}
+        skeleton_nodes = set(self.skeleton)
+        if candidates is None:
+            candidates = range(self.num_nodes)
+        self.candidates = [node for node in candidates if node != depot and node not in skeleton_nodes]
+        self.priority_nodes = set(priority_nodes) if priority_nodes else set()
+        self.penalties = (np.asarray(penalties, dtype=np.int64) if penalties is not None
+                          else np.full(self.num_nodes, INFEASIBLE, dtype=np.int64))
+
+        # Scalar lookups use sorted python lists; vectorized lookups use padded (nodes x windows) arrays
+        self._starts, self._ends = [], []
+        for starts, ends in blackouts:
+            merged_starts, merged_ends = merge_intervals([int(s) for s in starts], [int(e) for e in ends])
+            self._starts.append(merged_starts)
+            self._ends.append(merged_ends)
+        width = max([1] + [len(starts) for starts in self._starts])
+        self._padded_starts = np.full((self.num_nodes, width), INFEASIBLE, dtype=np.int64)
+        self._padded_ends = np.full((self.num_nodes, width), -INFEASIBLE, dtype=np.int64)
+        for node, (starts, ends) in enumerate(zip(self._starts, self._ends)):
+            self._padded_starts[node, :len(starts)] = starts
+            self._padded_ends[node, :len(ends)] = ends
+
+        self._fixed = np.full(self.num_nodes, -1, dtype=np.int64)
+        for node, time in self.fixed_times.items():
+            self._fixed[node] = time
+
+        self._group_of = np.full(self.num_nodes, -1, dtype=np.int64)
+        self._group_gaps = []
+        for group, (nodes, gap) in enumerate(repeat_groups or []):
+            self._group_of[list(nodes)] = group
+            self._group_gaps.append(int(gap))
+
+        # Number of time dimension values each node can be started at
+        clipped = np.clip(self._padded_ends, -1, self.horizon) - np.clip(self._padded_starts, 0, self.horizon + 1) + 1
+        self.open_time = self.horizon + 1 - np.maximum(clipped, 0).sum(axis=1)
+        self.open_time[self._fixed >= 0] = 1
+
+        self.metrics = {}
+
+    def _earliest_allowed(self, node: int, time: int) -> Optional[int]:
+        fixed = self.fixed_times.get(node)
+        if fixed is not None:
+            return fixed if time <= fixed else None
+        idx = bisect.bisect_right(self._starts[node], time) - 1
+        if idx >= 0 and time <= self._ends[node][idx]:
+            time = self._ends[node][idx] + 1
+        return time if time <= self.horizon else None
+
+    def _latest_allowed(self, node: int, time: int) -> int:
+        fixed = self.fixed_times.get(node)
+        if fixed is not None:
+            return fixed if fixed <= time else -INFEASIBLE
+        idx = bisect.bisect_right(self._starts[node], time) - 1
+        if idx >= 0 and time <= self._ends[node][idx]:
+            time = self._starts[node][idx] - 1
+        return time if time >= 0 else -INFEASIBLE
+
+    def schedule(self, route: Sequence[int]) -> Optional[np.ndarray]:
+        """The earliest start time of every node in `route` or None if the route is infeasible"""
+        times = np.empty(len(route), dtype=np.int64)
+        prev, prev_time = self.depot, 0
+        last_group_time = {}
+        for pos, node in enumerate(route):
+            arrival = prev_time + int(self.service_times[prev]) + int(self.travel_times[prev, node])
+            group = self._group_of[node]
+            if group >= 0 and group in last_group_time:
+                arrival = max(arrival, last_group_time[group] + self._group_gaps[group])
+            time = self._earliest_allowed(node, arrival)
+            if time is None:
+                return None
+            times[pos] = time
+            if group >= 0:
+                last_group_time[group] = time
+            prev, prev_time = node, time
+
+        if prev_time + self.service_times[prev] + self.travel_times[prev, self.depot] > self.horizon:
+            return None
+        return times
+
+    def _latest_times(self, route: Sequence[int]) -> np.ndarray:
+        """The latest start time of every node in `route` that keeps the rest of the route feasible
+
+        The last entry is for the return to the depot at the end of the route"""
+        latest = np.empty(len(route) + 1, dtype=np.int64)
+        latest[-1] = self.horizon
+        next_node, next_group_latest = self.depot, {}
+        for pos in range(len(route) - 1, -1, -1):
+            node = route[pos]
+            bound = int(latest[pos + 1]) - int(self.service_times[node]) - int(self.travel_times[node, next_node])
+            group = self._group_of[node]
+            if group >= 0 and group in next_group_latest:
+                bound = min(bound, next_group_latest[group] - self._group_gaps[group])
+            latest[pos] = self._latest_allowed(node, bound)
+            if group >= 0:
+                next_group_latest[group] = int(latest[pos])
+            next_node = node
+        return latest
+
+    def _earliest_allowed_many(self, nodes: np.ndarray, arrivals: np.ndarray) -> np.ndarray:
+        """Vectorized `_earliest_allowed` for (nodes x positions) arrivals. Infeasible entries are INFEASIBLE."""
+        starts = self._padded_starts[nodes][:, None, :]
+        ends = self._padded_ends[nodes][:, None, :]
+        inside = (starts <= arrivals[:, :, None]) & (arrivals[:, :, None] <= ends)
+        # Blackouts are merged so at most one of them contains the arrival
+        allowed = np.where(inside, ends + 1, arrivals[:, :, None]).max(axis=2)
+
+        fixed = self._fixed[nodes][:, None]
+        allowed = np.where(fixed >= 0, np.where(arrivals <= fixed, fixed, INFEASIBLE), allowed)
+        allowed[allowed > self.horizon] = INFEASIBLE
+        return allowed
+
+    def _repeat_bounds(self, nodes: np.ndarray, route: Sequence[int], times: np.ndarray, latest: np.ndarray):
+        """Lower and upper bounds on the start of `nodes` at every insertion position due to repeat visit gaps"""
+        num_positions = len(route) + 1
+        lower = np.full((len(nodes), num_positions), -INFEASIBLE, dtype=np.int64)
+        upper = np.full((len(nodes), num_positions), INFEASIBLE, dtype=np.int64)
+        route_groups = self._group_of[np.asarray(route, dtype=np.int64)]
+        for row, node in enumerate(nodes):
+            group = self._group_of[node]
+            if group < 0:
+                continue
+            sibling_positions = np.flatnonzero(route_groups == group)
+            if not len(sibling_positions):
+                continue
+            gap = self._group_gaps[group]
+            # Inserting at position p places the node after every sibling before p and before every sibling at/after p
+            lower_row = lower[row]
+            lower_row[sibling_positions + 1] = times[sibling_positions] + gap
+            lower[row] = np.maximum.accumulate(lower_row)
+            upper_row = upper[row]
+            upper_row[sibling_positions] = latest[sibling_positions] - gap
+            upper[row] = np.minimum.accumulate(upper_row[::-1])[::-1]
+        return lower, upper
+
+    def insertion_costs(self, nodes: np.ndarray, route: Sequence[int], times: np.ndarray,
+                        latest: np.ndarray) -> np.ndarray:
+        """(nodes x positions) detour cost of inserting each node before each route position
+
+        The last position is before the return to the depot. Infeasible insertions have a cost of INFEASIBLE."""
+        chunk_size = max(1, _MAX_CHUNK_ELEMENTS // ((len(route) + 1) * self._padded_starts.shape[1]))
+        if len(nodes) > chunk_size:
+            return np.concatenate([
+                self.insertion_costs(nodes[i:i + chunk_size], route, times, latest)
+                for i in range(0, len(nodes), chunk_size)
+            ])
+
+        route_nodes = np.asarray(list(route) + [self.depot], dtype=np.int64)
+        prev_nodes = np.concatenate(([self.depot], route_nodes[:-1]))
+        prev_times = np.concatenate(([0], times))
+        departures = prev_times + self.service_times[prev_nodes]
+
+        travel_in = self.travel_times[np.ix_(prev_nodes, nodes)].T
+        travel_out = self.travel_times[np.ix_(nodes, route_nodes)]
+        lower, upper = self._repeat_bounds(nodes, route, times, latest)
+
+        starts = self._earliest_allowed_many(nodes, np.maximum(departures[None, :] + travel_in, lower))
+        finishes = starts + self.service_times[nodes][:, None] + travel_out
+        feasible = (starts < INFEASIBLE) & (starts <= upper) & (finishes <= latest[None, :])
+
+        detours = travel_in + travel_out - self.travel_times[prev_nodes, route_nodes][None, :]
+        return np.where(feasible, detours, INFEASIBLE)
+
+    def _insert_all(self, nodes: Sequence[int], route: List[int], times: np.ndarray, respect_penalties: bool):
+        pending = np.asarray(nodes, dtype=np.int64)
+        while len(pending):
+            latest = self._latest_times(route)
+            costs = self.insertion_costs(pending, route, times, latest)
+            best = costs.min(axis=1)
+            if costs.shape[1] > 1:
+                second = np.partition(costs, 1, axis=1)[:, 1]
+            else:
+                second = np.full(len(pending), INFEASIBLE, dtype=np.int64)
+            limits = self.penalties[pending] if respect_penalties else np.full(len(pending), INFEASIBLE)
+            insertable = best < np.minimum(limits, INFEASIBLE)
+            if not insertable.any():
+                break
+
+            # Candidates with a single feasible position have infinite regret
+            regret = np.where(second >= INFEASIBLE, INFEASIBLE, second - best)
+            order = np.lexsort((self.open_time[pending], -regret))
+
+            finished = []
+            for idx in order[insertable[order]]:
+                finished.append(idx)
+                node = int(pending[idx])
+                inserted = False
+                for pos in np.argsort(costs[idx], kind='mergesort'):
+                    if costs[idx, pos] >= limits[idx] or costs[idx, pos] >= INFEASIBLE:
+                        break
+                    candidate_route = route[:pos] + [node] + route[pos:]
+                    candidate_times = self.schedule(candidate_route)
+                    if candidate_times is not None:
+                        route, times, inserted = candidate_route, candidate_times, True
+                        break
+                if inserted:
+                    break
+                # Insertions only make the route tighter, so a node that cannot be placed now never will be
+                self.log.debug('Dropping node %d, no verified insertion position', node)
+
+            pending = np.delete(pending, finished)
+
+        return route, times
+
+    def build(self) -> List[int]:
+        """Build a route (excluding the depot) that satisfies time, appointment and repeat visit constraints"""
+        start = timer()
+        route = list(self.skeleton)
+        times = self.schedule(route)
+        if times is None:
+            self.log.warning('Skeleton route is infeasible, returning it without insertions')
+            return route
+
+        appointments = [node for node in self.candidates if node in self.fixed_times]
+        priority = [node for node in self.candidates if node in self.priority_nodes and node not in self.fixed_times]
+        others = [node for node in self.candidates if node not in self.priority_nodes and node not in self.fixed_times]
+        for nodes, respect_penalties in ((appointments, False), (priority, False), (others, True)):
+            if nodes:
+                route, times = self._insert_all(nodes, route, times, respect_penalties)
+
+        self.metrics = {
+            'inserted_nodes': len(route) - len(self.skeleton),
+            'candidate_nodes': len(self.candidates),
+            'running_time': timer() - start,
+        }
+        self.log.info('Insertion heuristic built route: %s', self.metrics)
+        return route
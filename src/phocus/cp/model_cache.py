@@ -0,0 +1,139 @@
+"""In process cache of compiled model inputs
+
+Reps re-plan the same territory many times a day with small edits. The expensive parts of turning API parameters
+into a routing model (open time to blackout conversion, per node blackout intervals, transit matrices) only depend on
+a single location and the territory wide settings, so they are cached by their inputs. A changed location only misses
+the entries of that location, the stale ones are evicted once they are the least recently used.
+
+Cached values are shared by every request of the process, so they are stored read-only: arrays can't be written and
+lists become tuples.
+"""
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+from timeit import default_timer as timer
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+from phocus.utils.mixins import Base
+
+"""Default bound of the bytes of the cached values"""
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+
+def fingerprint_array(array: np.ndarray) -> Tuple[Tuple[int, ...], str]:
+    """A hashable fingerprint of an array's shape and contents"""
+    array = np.ascontiguousarray(array)
+    return array.shape, hashlib.sha1(array.view(np.uint8)).hexdigest()
+
+
+def freeze(value):
+    """`value` with its arrays made read-only and its lists made tuples"""
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+        return value
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    if type(value) is tuple:
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def size_of(value) -> int:
+    """The approximate bytes of `value`, counting the buffers of arrays and the items of containers"""
+    if isinstance(value, np.ndarray):
+        return sys.getsizeof(value) + (value.nbytes if value.base is not None else 0)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(size_of(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(size_of(k) + size_of(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class CacheStats(object):
+    """Hit and miss counts of cache lookups made for a single request"""
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.time_saved = 0.
+
+    def add_to(self, metrics: Dict[str, Any]):
+        """Add these stats to `metrics['model_cache']`"""
+        cache_metrics = metrics.setdefault('model_cache', {'hits': 0, 'misses': 0, 'preprocessing_time_saved': 0.})
+        cache_metrics['hits'] += self.hits
+        cache_metrics['misses'] += self.misses
+        cache_metrics['preprocessing_time_saved'] += self.time_saved
+
+
+class _Entry(object):
+    __slots__ = ('value', 'compute_time', 'size')
+
+    def __init__(self, value, compute_time, size):
+        self.value = value
+        self.compute_time = compute_time
+        self.size = size
+
+
+class ModelInputCache(Base):
+    """Thread safe LRU cache of compiled model inputs within `max_bytes`, see the module docstring"""
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self._entries: 'OrderedDict[Hashable, _Entry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(
+            self,
+            key: Hashable,
+            compute: Callable[[], Any],
+            stats: Optional[CacheStats] = None,
+    ):
+        """Get the read-only value for `key`, calling `compute` to create it if it is missing
+
+        The time `compute` took is remembered so that hits can report the preprocessing time they saved.
+        """
+        start = timer()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is not None:
+            if stats:
+                stats.hits += 1
+                stats.time_saved += max(0., entry.compute_time - (timer() - start))
+            return entry.value
+
+        start = timer()
+        value = freeze(compute())
+        entry = _Entry(value, timer() - start, size_of(value))
+        if stats:
+            stats.misses += 1
+        if entry.size > self.max_bytes:
+            self.log.debug('Not caching a value of %d bytes, more than the cache holds', entry.size)
+            return value
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.num_bytes -= previous.size
+            self._entries[key] = entry
+            self.num_bytes += entry.size
+            while self.num_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.num_bytes -= evicted.size
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.num_bytes = 0
+
+
+"""ModelInputCache Singleton shared by all requests in the process"""
+model_input_cache = ModelInputCache()
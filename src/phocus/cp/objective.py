@@ -1,9 +1,9 @@
 from enum import auto, Enum
 
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional
 
-from ortools.constraint_solver.pywrapcp import RoutingModel
+from ortools.constraint_solver.pywrapcp import RoutingIndexManager, RoutingModel
 
 from phocus.cp.utils import RouteElement
 from phocus.model.location import Location
@@ -23,24 +23,33 @@ class Cost:
 
 @dataclass
 class ObjectiveCostEvaluator:
-    """Evaluate various objective costs"""
+    """Evaluate various objective costs
+
+    The travel costs of models with several vehicles are summed over the `vehicle_routes`, `route` has every route
+    element of all of them."""
     locations: List[Location]
     route: List[RouteElement]
     routing_model: RoutingModel
+    index_manager: RoutingIndexManager
+    vehicle_routes: Optional[List[List[RouteElement]]] = None
 
     def __post_init__(self):
         self.missing_nodes = set(range(len(self.locations))) - set(r.node_index for r in self.route)
-        self.missing_indices = map(self.routing_model.NodeToIndex, self.missing_nodes)
+        self.missing_indices = map(self.index_manager.NodeToIndex, self.missing_nodes)
 
-        indices = [r.index for r in self.route]
-        index_pairs = {i: j for i, j in zip(indices, indices[1:])}
+        vehicle_routes = self.vehicle_routes if self.vehicle_routes is not None else [self.route]
+        index_pairs = {}
+        for vehicle, vehicle_route in enumerate(vehicle_routes):
+            indices = [r.index for r in vehicle_route]
+            index_pairs.update({i: (j, vehicle) for i, j in zip(indices, indices[1:])})
         self.costs = []
         for node, _ in enumerate(self.locations):
-            index = self.routing_model.NodeToIndex(node)
+            index = self.index_manager.NodeToIndex(node)
             if node in self.missing_nodes:
                 self.costs.append(Cost(CostType.DISJUNCTIVE, self.routing_model.UnperformedPenalty(index)))
             elif index in index_pairs:
-                self.costs.append(Cost(CostType.TRAVEL, self.routing_model.GetCost(index, index_pairs[index], v=0)))
+                next_index, vehicle = index_pairs[index]
+                self.costs.append(Cost(CostType.TRAVEL, self.routing_model.GetArcCostForVehicle(index, next_index, vehicle)))
 
     def cost(self, node) -> Cost:
         return self.costs[node]
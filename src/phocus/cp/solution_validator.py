@@ -1,104 +1,192 @@
 """Validate a given solution"""
-from collections import defaultdict
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
+import numpy as np
 import pendulum
-from typing import Sequence
 
 import phocus.cp.cp_app
 from phocus.errors import InvalidSolutionError
 from phocus.model.appointment import Appointment
-from phocus.model.location import Location, convert_date_str
+from phocus.model.location import Location, location_blackout_intervals
+from phocus.model.problem_instance import ProblemInstance
 from phocus.model.solution import Solution
+from phocus.utils.epoch import Interval, SECONDS_PER_DAY, from_epoch, interval_to_period, to_epoch
+from phocus.utils.interval_set import IntervalSet
 from phocus.utils.mixins import Base
 
 
-def _period_from_solution(solution_location) -> pendulum.Period:
-    return pendulum.parse(solution_location.end_time) - pendulum.parse(solution_location.arrival_time)
+def _interval_from_solution(solution_location) -> Interval:
+    """The epoch seconds of the visit, parsing the formatted times of solutions that were loaded from disk"""
+    if hasattr(solution_location, 'arrival_epoch'):
+        return solution_location.arrival_epoch, solution_location.end_epoch
+    return (to_epoch(pendulum.parse(solution_location.arrival_time)),
+            to_epoch(pendulum.parse(solution_location.end_time)))
+
+
+class RouteArrays(object):
+    """The visits of a route as epoch arrays with the route positions of every location key
+
+    The times of each visit are only converted once, so the checks are array operations on route positions."""
+    def __init__(self, route: Sequence[Location]):
+        self.route = list(route)
+        intervals = [_interval_from_solution(loc) for loc in self.route]
+        self.starts = np.array([start for start, _ in intervals], dtype=np.int64)
+        self.ends = np.array([end for _, end in intervals], dtype=np.int64)
+
+        positions_by_key = {}
+        for position, loc in enumerate(self.route):
+            positions_by_key.setdefault(loc.key(), []).append(position)
+        self._positions_by_key = {key: np.array(positions, dtype=np.int64)
+                                  for key, positions in positions_by_key.items()}
+
+    def positions(self, key) -> np.ndarray:
+        """The route positions of the visits to the location with `key` in route order"""
+        return self._positions_by_key.get(key, np.zeros(0, dtype=np.int64))
+
+    def last_positions(self) -> Dict[Any, int]:
+        """The route position of the last visit to each location"""
+        return {key: int(positions[-1]) for key, positions in self._positions_by_key.items()}
 
 
 class SolutionValidator(Base):
+    """Validates a solution against the blackouts, repeat visits and appointments of its problem
+
+    They are read from the `problem` instance if there is one, otherwise from the locations, repeat locations and
+    appointments. With a problem, `node_sources` are the location of each node of the model that was solved, like
+    `CP.node_sources`, to check that the model had a node per visit of every repeatedly visited location."""
     def __init__(
             self,
             appointments: Sequence[Appointment],
             locations: Sequence[Location],
             repeat_locations: 'Sequence[phocus.cp.cp_app.RepeatLocation]',
-            solution: Solution
+            solution: Solution,
+            problem: Optional[ProblemInstance] = None,
+            node_sources: Optional[np.ndarray] = None,
     ):
         self.appointments = appointments
         self.locations = locations
         self.repeat_locations = repeat_locations
         self.solution = solution
+        self.problem = problem
+        self.node_sources = node_sources
+        self._route_arrays = None
+
+    @classmethod
+    def from_problem_instance(
+            cls,
+            problem: ProblemInstance,
+            solution: Solution,
+            node_sources: Optional[np.ndarray] = None,
+    ) -> 'SolutionValidator':
+        return cls([], [], [], solution, problem=problem, node_sources=node_sources)
+
+    @property
+    def route_arrays(self) -> RouteArrays:
+        if self._route_arrays is None:
+            self._route_arrays = RouteArrays(self.solution.route)
+        return self._route_arrays
 
     def _is_location_an_appointment(self, location: Location):
         return any(location.is_same_doctor(loc) for loc in self.solution.route)
 
+    def _blackout_windows_by_key(self) -> Dict[Any, Tuple[str, List[Interval]]]:
+        """Map of location key -> the name and blackout windows of the location"""
+        if self.problem is not None:
+            # Named like str(Location) so the messages match the ones of locations
+            return {location_id: ('<Location: %s>' % location_id, self.problem.windows(node))
+                    for node, location_id in enumerate(self.problem.location_ids.tolist())}
+        return {doc.key(): (str(doc), location_blackout_intervals(doc)) for doc in self.locations}
+
     def _validate_location_blackout_windows(self):
-        solution_route_by_key = {loc.key(): loc for loc in self.solution.route}
-        input_doctors_by_key = {doc.key(): doc for doc in self.locations}
+        route = self.route_arrays
+        windows_by_key = self._blackout_windows_by_key()
+
         invalid_solutions = []
-        for key, loc in solution_route_by_key.items():
-            doc = input_doctors_by_key.get(key)
-            if not doc:
+        for key, position in route.last_positions().items():
+            if key not in windows_by_key or not windows_by_key[key][1]:
                 continue
-            solution_period = _period_from_solution(loc)
-            blackouts: Sequence[pendulum.Period] = getattr(doc, 'blackout_windows', [])
-            for blackout in blackouts:
-                # offset times so that they don't return a false positive on overlap due to inclusive check
-                blackout = (blackout.end - pendulum.duration(seconds=1)) - blackout.start
-                if solution_period.start in blackout or solution_period.end in blackout or (solution_period.start < blackout.start and solution_period.end > blackout.end):
-                    invalid_solutions.append(
-                        f'Solution ({solution_period}) for doctor ({doc}) was in blackout ({blackout})')
+            name, windows = windows_by_key[key]
+            blackout_starts, blackout_ends = np.array(windows, dtype=np.int64).T
+            # offset times so that they don't return a false positive on overlap due to inclusive check
+            blackout_ends = blackout_ends - 1
+            start, end = int(route.starts[position]), int(route.ends[position])
+            # Every blackout is checked against the visit rather than the other way around so that each blackout
+            # the visit overlaps gets its own message, a set of the blackouts would combine the touching ones
+            is_in_blackout = IntervalSet([start], [end]).overlaps(blackout_starts, blackout_ends)
+            solution_period = interval_to_period((start, end))
+            for blackout_start, blackout_end in zip(blackout_starts[is_in_blackout].tolist(),
+                                                    blackout_ends[is_in_blackout].tolist()):
+                blackout = interval_to_period((blackout_start, blackout_end))
+                invalid_solutions.append(
+                    f'Solution ({solution_period}) for doctor ({name}) was in blackout ({blackout})')
 
         return invalid_solutions
 
-    def _validate_repeat_visits(self):
-        error_messages = []
+    def _repeat_visits(self) -> List[Tuple[Any, str, int, Optional[int], float]]:
+        """The key, name, expected visits, input instances and minimum gap in days of every repeatedly visited location
+
+        The input instances are None for a problem without the `node_sources` of its model."""
+        if self.problem is not None:
+            problem = self.problem
+            node_counts = (np.bincount(self.node_sources[self.node_sources >= 0], minlength=problem.num_locations)
+                           if self.node_sources is not None else None)
+            return [(str(problem.location_ids[node]), str(problem.doctor_names[node]), int(problem.num_visits[node]),
+                     int(node_counts[node]) if node_counts is not None else None,
+                     float(problem.min_visit_gap_days[node]))
+                    for node in np.flatnonzero(problem.num_visits > 1).tolist()]
+
+        input_key_counts = Counter(loc.key() for loc in self.locations)
+        repeat_visits = []
         for rep in self.repeat_locations:
             original_location = self.locations[rep.original_idx]
-            name = original_location.doctor_name
-            location_instances = [l for l in self.locations if l.is_same_doctor(original_location)]
-            # Make sure we have the right number of repeats
             # Add 1 to include the original (non-repeat)
-            expected_instances = len(rep.duplicate_indices) + 1
-            if len(location_instances) != expected_instances:
+            repeat_visits.append((original_location.key(), original_location.doctor_name, len(rep.duplicate_indices) + 1,
+                                  input_key_counts[original_location.key()], rep.gap_days))
+        return repeat_visits
+
+    def _validate_repeat_visits(self):
+        error_messages = []
+        route = self.route_arrays
+        for key, name, expected_instances, num_location_instances, gap_days in self._repeat_visits():
+            # Make sure we have the right number of repeats
+            if num_location_instances is not None and num_location_instances != expected_instances:
                 error_messages.append(
-                    f'Expected {expected_instances:d} instances of {name} in input locations, but got {len(location_instances):d}')
-
-            solution_instances = [l for l in self.solution.route if l.is_same_doctor(original_location)]
-            if len(solution_instances) != expected_instances:
-                error_messages.append(f'Expected {expected_instances:d} instances of {name} in solution, but got {len(solution_instances):d}')
-            solution_periods = [_period_from_solution(l) for l in solution_instances]
-            solution_starts = [p.start for p in solution_periods]
-            for i, s1 in enumerate(solution_starts[:-1]):
-                s2 = solution_starts[i + 1]
-                days_diff = (s2 - s1).total_days()
-                if days_diff < rep.gap_days:
-                    error_messages.append(f'Expected {rep.gap_days} days between {name} but got {days_diff} days')
+                    f'Expected {expected_instances:d} instances of {name} in input locations, but got {num_location_instances:d}')
+
+            solution_starts = route.starts[route.positions(key)]
+            if len(solution_starts) != expected_instances:
+                error_messages.append(f'Expected {expected_instances:d} instances of {name} in solution, but got {len(solution_starts):d}')
+            days_diffs = np.diff(solution_starts) / SECONDS_PER_DAY
+            for days_diff in days_diffs[days_diffs < gap_days].tolist():
+                error_messages.append(f'Expected {gap_days} days between {name} but got {days_diff} days')
         return error_messages
 
+    def _expected_appointments(self) -> Dict[Tuple[Any, int, int], Tuple[Any, Any, Any]]:
+        """Map of (location key, start epoch, end epoch) -> what to call the location, start and end in messages"""
+        if self.problem is not None:
+            problem = self.problem
+            # Named by the first item of the key like the appointments of locations
+            return {
+                (str(problem.location_ids[node]), start, end):
+                (str(problem.location_ids[node])[0], from_epoch(start, problem.tzinfo), from_epoch(end, problem.tzinfo))
+                for node, start, end in zip(problem.appointment_nodes.tolist(), problem.appointment_starts.tolist(),
+                                            problem.appointment_ends.tolist())
+            }
+        return {(app.location.key(), to_epoch(app.start_time), to_epoch(app.end_time)):
+                (app.location.key()[0], app.start_time, app.end_time)
+                for app in self.appointments}
+
     def _validate_appointments(self):
         error_messages = []
-        if not self.appointments:
+        if not self.appointments and (self.problem is None or not len(self.problem.appointment_nodes)):
             return error_messages
 
-        location_appointment_times = {}
-        for app in self.appointments:
-            location_appointment_times.setdefault(app.location.key(), set()).add((app.start_time, app.end_time))
-
-        found_location_times = set()
-        for loc in self.solution.route:
-            times = location_appointment_times.get(loc.key(), [])
-            arrival_time = convert_date_str(loc.arrival_time)
-            end_time = convert_date_str(loc.end_time)
-
-            for start, end in times:
-                if arrival_time == start and end_time == end:
-                    found_location_times.add((loc.key(), start, end))
-
-        expected_location_times = {(app.location.key(), app.start_time, app.end_time) for app in self.appointments}
-        missing_location_times = expected_location_times - found_location_times
-        for missing in missing_location_times:
-            error_messages.append('Expected appointment with %s at %s - %s' % (missing[0][0], missing[1], missing[2]))
+        route = self.route_arrays
+        for (key, start, end), (name, start_time, end_time) in self._expected_appointments().items():
+            positions = route.positions(key)
+            if not np.any((route.starts[positions] == start) & (route.ends[positions] == end)):
+                error_messages.append('Expected appointment with %s at %s - %s' % (name, start_time, end_time))
 
         return error_messages
 
@@ -2,8 +2,10 @@
 import datetime
 from enum import Enum
 
+import numpy as np
 import pendulum
 
+from phocus.utils.epoch import SECONDS_PER_MINUTE, to_epoch
 from phocus.utils.mixins import Base
 
 
@@ -17,9 +19,11 @@ class TimeDimensionConverter(Base):
     def __init__(self, granularity, start_datetime: pendulum.DateTime):
         self.granularity = granularity
         self.start_datetime = start_datetime
-        
+        self.start_epoch = to_epoch(start_datetime)
+
         if self.granularity not in (Granularity.SECOND, Granularity.MINUTE):
             raise NotImplementedError('Time dimension converter is not implemented for granularity: %s' % granularity)
+        self.seconds_per_unit = 1 if self.granularity is Granularity.SECOND else SECONDS_PER_MINUTE
 
     def duration_to_time_dimension(self, duration: pendulum.Duration):
         if self.granularity is Granularity.SECOND:
@@ -30,6 +34,24 @@ class TimeDimensionConverter(Base):
     def datetime_to_time_dimension(self, dt: datetime.datetime) -> int:
         return self.duration_to_time_dimension(pendulum.instance(dt) - self.start_datetime)
 
+    def seconds_to_time_dimension(self, seconds: int) -> int:
+        """Like `duration_to_time_dimension` for a duration in seconds"""
+        return int(seconds / self.seconds_per_unit)
+
+    def time_dimension_to_seconds(self, time_dimension: int) -> int:
+        return time_dimension * self.seconds_per_unit
+
+    def epoch_to_time_dimension(self, epoch: int) -> int:
+        """Like `datetime_to_time_dimension` for epoch seconds"""
+        return self.seconds_to_time_dimension(epoch - self.start_epoch)
+
+    def epochs_to_time_dimension(self, epochs: np.ndarray) -> np.ndarray:
+        """Vectorized `epoch_to_time_dimension`"""
+        return np.trunc((np.asarray(epochs, dtype=np.int64) - self.start_epoch) / self.seconds_per_unit).astype(np.int64)
+
+    def time_dimension_to_epoch(self, time_dimension: int) -> int:
+        return self.start_epoch + self.time_dimension_to_seconds(time_dimension)
+
     def time_dimension_to_datetime(self, time_dimension: int) -> pendulum.DateTime:
         return self.start_datetime + self.time_dimension_to_duration(time_dimension)
 
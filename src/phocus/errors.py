@@ -8,3 +8,7 @@ class NoSolutionFoundError(SolutionError):
 
 class InvalidSolutionError(SolutionError):
     pass
+
+
+class TimeBudgetExhaustedError(SolutionError):
+    pass
@@ -0,0 +1,267 @@
+"""Micro benchmarks of the model preprocessing
+
+Run with `python -m phocus.experiments.benchmarks <benchmark>`"""
+import copy
+import random
+from timeit import default_timer as timer
+from typing import Callable, Dict, List
+
+import click
+import numpy as np
+import pendulum
+
+from phocus.mdp.env import Environment, VectorEnvironment
+from phocus.model.location import Location
+from phocus.utils.date_utils import convert_open_times_to_blackout_windows, next_weekday
+
+WORK_DAY_START = pendulum.datetime(2018, 6, 18, 13)
+
+
+def time_it(fn: Callable[[], object], repeat: int = 3) -> float:
+    """The best running time of `fn` in seconds over `repeat` runs"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = timer()
+        fn()
+        best = min(best, timer() - start)
+    return best
+
+
+def work_periods_for_days(num_days: int) -> List[pendulum.Period]:
+    """8 hour work periods on consecutive weekdays"""
+    work_periods = []
+    day = WORK_DAY_START
+    for _ in range(num_days):
+        work_periods.append(day.add(hours=8) - day)
+        day = next_weekday(day)
+    return work_periods
+
+
+def random_open_times(work_periods: List[pendulum.Period], rng: random.Random) -> List[pendulum.Period]:
+    """A morning and an afternoon open time on most work days, like the doctors in the API test data"""
+    open_times = []
+    for wp in work_periods:
+        if rng.random() < 0.2:
+            continue
+        morning = wp.start.add(minutes=rng.randrange(0, 120))
+        open_times.append(morning.add(minutes=rng.randrange(60, 180)) - morning)
+        afternoon = wp.start.add(minutes=rng.randrange(240, 360))
+        open_times.append(afternoon.add(minutes=rng.randrange(30, 120)) - afternoon)
+    return open_times
+
+
+def benchmark_open_time_conversion(num_locations: int, num_days: int, seed: int = 0) -> Dict[str, float]:
+    work_periods = work_periods_for_days(num_days)
+    rng = random.Random(seed)
+    all_open_times = [random_open_times(work_periods, rng) for _ in range(num_locations)]
+
+    def convert_all():
+        for open_times in all_open_times:
+            convert_open_times_to_blackout_windows(open_times, work_periods)
+
+    running_time = time_it(convert_all)
+    return {
+        'num_locations': num_locations,
+        'num_days': num_days,
+        'running_time': running_time,
+        'locations_per_second': num_locations / running_time,
+    }
+
+
+def benchmark_locations(num_locations: int, seed: int = 0) -> Dict[str, float]:
+    """Time constructing and copying locations like the API and `run_model` do"""
+    rng = random.Random(seed)
+    kwargs = [{
+        'doctor_name': 'Doctor %d' % i,
+        'address': '%d Main St' % i,
+        'lat': 40.6 + rng.random() / 2,
+        'lon': -73.9 + rng.random() / 2,
+        'id': str(i),
+        'visit_time_seconds': 1200,
+        'blackout_intervals': [(0, 3600)],
+    } for i in range(num_locations)]
+    locations = [Location(**kw) for kw in kwargs]
+    return {
+        'num_locations': num_locations,
+        'construction_time': time_it(lambda: [Location(**kw) for kw in kwargs]),
+        'copy_time': time_it(lambda: [copy.copy(location) for location in locations]),
+        'deepcopy_time': time_it(lambda: copy.deepcopy(locations)),
+    }
+
+
+def benchmark_mdp_env(num_episodes: int, num_nodes: int, seed: int = 0) -> Dict[str, float]:
+    """Steps per second of rolling out episodes one at a time with `Environment` and all at once with
+    `VectorEnvironment`, each episode following the greedy valid action of its own random scores"""
+    from phocus.mdp.po.main import EPISODE_SEGMENTS, SALES_TIME, TRAVEL_SPEED, WORLD_SIZE
+
+    rng = np.random.RandomState(seed)
+    node_locations = rng.rand(num_nodes, 2) * WORLD_SIZE
+    node_rewards = np.ones(num_nodes)
+    scores = rng.rand(num_episodes, num_nodes)
+    env = Environment(node_locations, node_rewards, TRAVEL_SPEED, SALES_TIME, EPISODE_SEGMENTS)
+    vector_env = VectorEnvironment(node_locations, node_rewards, TRAVEL_SPEED, SALES_TIME, EPISODE_SEGMENTS, num_episodes)
+
+    def roll_out_serially():
+        num_steps = 0
+        for episode_scores in scores:
+            env.reset()
+            while not env.is_terminal():
+                env.step((episode_scores * env.valid_actions).argmax())
+                num_steps += 1
+        return num_steps
+
+    def roll_out_together():
+        num_steps = 0
+        vector_env.reset()
+        while not vector_env.done.all():
+            num_steps += int(np.count_nonzero(~vector_env.done))
+            vector_env.step((scores * vector_env.valid_actions).argmax(axis=1))
+        return num_steps
+
+    num_steps = roll_out_serially()
+    if roll_out_together() != num_steps:
+        raise RuntimeError('The environments took a different number of steps')
+    serial_time = time_it(roll_out_serially)
+    vector_time = time_it(roll_out_together)
+    return {
+        'num_episodes': num_episodes,
+        'num_nodes': num_nodes,
+        'num_steps': num_steps,
+        'serial_steps_per_second': num_steps / serial_time,
+        'vector_steps_per_second': num_steps / vector_time,
+        'speedup': serial_time / vector_time,
+    }
+
+
+def benchmark_mdp_population(worker_counts: List[int], num_generations: int, seed: int = 0) -> Dict[int, float]:
+    """Evolution Strategies generations per minute with the population evaluated on each number of workers"""
+    import contextlib
+    import io
+
+    from phocus.mdp.po.main import (EPISODE_SEGMENTS, NUM_NODES, SALES_TIME, TRAVEL_SPEED, WORLD_SIZE,
+                                    train_evolution_strategies)
+
+    node_locations = np.random.RandomState(seed).rand(NUM_NODES, 2) * WORLD_SIZE
+    env = Environment(node_locations, np.ones(NUM_NODES), TRAVEL_SPEED, SALES_TIME, EPISODE_SEGMENTS)
+    generations_per_minute = {}
+    for num_workers in worker_counts:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = train_evolution_strategies(env, node_locations, num_workers=num_workers, seed=seed,
+                                                max_generations=num_generations)
+        generations_per_minute[num_workers] = 60 * len(result.generation_seconds) / sum(result.generation_seconds)
+    return generations_per_minute
+
+
+def benchmark_policy_batch(num_members: int, seed: int = 0) -> Dict[str, float]:
+    """Time scoring a population of random policies one trajectory at a time with `Policy` and `Environment`, and all
+    at once with `PolicyBatch` and `VectorEnvironment`"""
+    from phocus.mdp.po.main import EPISODE_SEGMENTS, NUM_NODES, SALES_TIME, TRAVEL_SPEED, WORLD_SIZE
+    from phocus.mdp.po.population import PolicyShape, batch_rewards, sample_trajectory
+
+    rng = np.random.RandomState(seed)
+    node_locations = rng.rand(NUM_NODES, 2) * WORLD_SIZE
+    env = Environment(node_locations, np.ones(NUM_NODES), TRAVEL_SPEED, SALES_TIME, EPISODE_SEGMENTS)
+    vector_env = VectorEnvironment.from_environment(env, num_members)
+    shape = PolicyShape.for_nodes(NUM_NODES)
+    thetas = rng.randn(num_members, shape.dim_theta)
+
+    def score_serially():
+        return [sample_trajectory(shape.policy(theta), env)[1] for theta in thetas]
+
+    def score_together():
+        return batch_rewards(shape.policy_batch(thetas), vector_env)
+
+    if score_together().tolist() != score_serially():
+        raise RuntimeError('The policies got different rewards')
+    serial_time = time_it(score_serially)
+    batch_time = time_it(score_together)
+    return {
+        'num_members': num_members,
+        'serial_seconds': serial_time,
+        'batch_seconds': batch_time,
+        'speedup': serial_time / batch_time,
+    }
+
+
+def benchmark_road_network(num_origins: int, grid_side: int, num_workers: int, seed: int = 0) -> Dict[str, float]:
+    """Time a travel time matrix between random points on a grid of roads with `grid_side` squared nodes"""
+    from phocus.utils.road_network import RoadNetwork, RoadNetworkDistanceProvider
+
+    rng = np.random.RandomState(seed)
+    node_ids = np.arange(grid_side ** 2).reshape(grid_side, grid_side)
+    sources = np.concatenate([node_ids[:, :-1].ravel(), node_ids[:-1, :].ravel()])
+    targets = np.concatenate([node_ids[:, 1:].ravel(), node_ids[1:, :].ravel()])
+    seconds = rng.uniform(20, 80, len(sources))
+    # Blocks of about 100 meters
+    node_lats, node_lons = np.divmod(np.arange(grid_side ** 2), grid_side)
+    network = RoadNetwork(40.6 + node_lats / 1000, -73.7 + node_lons / 1000, np.concatenate([sources, targets]),
+                          np.concatenate([targets, sources]), np.concatenate([seconds, seconds]))
+    points = [(40.6 + lat, -73.7 + lon) for lat, lon in rng.rand(num_origins, 2) * grid_side / 1000]
+
+    with RoadNetworkDistanceProvider(network, max_workers=num_workers) as provider:
+        start = timer()
+        provider.travel_time_matrix(points)
+        first_seconds = timer() - start
+        snap_seconds = time_it(lambda: network.nearest_nodes(points))
+    return {
+        'num_nodes': network.num_nodes,
+        'num_origins': num_origins,
+        'matrix_seconds': first_seconds,
+        'snap_seconds': snap_seconds,
+    }
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command('open-times')
+@click.option('--locations', 'num_locations', default=1000)
+@click.option('--days', 'num_days', default=22)
+def open_times_command(num_locations, num_days):
+    """Time converting open times to blackout windows"""
+    click.echo(benchmark_open_time_conversion(num_locations, num_days))
+
+
+@main.command('locations')
+@click.option('--locations', 'num_locations', default=10000)
+def locations_command(num_locations):
+    """Time constructing and copying locations"""
+    click.echo(benchmark_locations(num_locations))
+
+
+@main.command('mdp-env')
+@click.option('--episodes', 'num_episodes', default=50)
+@click.option('--nodes', 'num_nodes', default=50)
+def mdp_env_command(num_episodes, num_nodes):
+    """Steps per second of the MDP environment stepping one episode or a batch of episodes at a time"""
+    click.echo(benchmark_mdp_env(num_episodes, num_nodes))
+
+
+@main.command('mdp-policy')
+@click.option('--members', 'num_members', default=50)
+def mdp_policy_command(num_members):
+    """Time scoring a population of policies one at a time or as a batch"""
+    click.echo(benchmark_policy_batch(num_members))
+
+
+@main.command('mdp-population')
+@click.option('--workers', 'worker_counts', default=[1, 2, 4], multiple=True)
+@click.option('--generations', 'num_generations', default=20)
+def mdp_population_command(worker_counts, num_generations):
+    """Generations per minute of Evolution Strategies on each number of workers"""
+    click.echo(benchmark_mdp_population(list(worker_counts), num_generations))
+
+
+@main.command('road-network')
+@click.option('--origins', 'num_origins', default=100)
+@click.option('--grid-side', default=200)
+@click.option('--workers', 'num_workers', default=1)
+def road_network_command(num_origins, grid_side, num_workers):
+    """Time a travel time matrix on a grid of roads"""
+    click.echo(benchmark_road_network(num_origins, grid_side, num_workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,7 @@ from enum import Enum
 from ortools.constraint_solver import routing_enums_pb2
 
 from phocus.app import plan_route
+from phocus.cp.cp_app import LunchModel
 from phocus.errors import NoSolutionFoundError
 from phocus.cp.time_dimension_converter import Granularity
 from phocus.utils import bootstrap_project, memory
@@ -39,7 +40,7 @@ class Strategy(Enum):
 
 
 class Experiment(Base):
-    def __init__(self, params, granularity, strategy: Strategy, max_run_millis: int, metrics=None):
+    def __init__(self, params, granularity, strategy: Strategy, max_run_millis: int, metrics=None, overrides=None):
         self.granularity = granularity
         self.strategy = strategy
         self.params = copy.deepcopy(params)
@@ -48,6 +49,7 @@ class Experiment(Base):
             'time_dimension_granularity': granularity,
             'first_solution_strategy': strategy.value,
         }
+        self.params['overrides'].update(overrides if overrides else {})
         self._metrics = metrics if metrics else {}
         self._solution = None
 
@@ -89,6 +91,51 @@ def run_experiments():
     return experiments
 
 
+def run_model_comparison(overrides_by_name, max_runtimes=(1000, 5000, 10000)):
+    """Compare variants of the routing model given by the run_model overrides of each
+
+    Logs the model size, model build time and solution quality of each variant"""
+    experiments = []
+    for (name, overrides), runtime in itertools.product(overrides_by_name.items(), max_runtimes):
+        experiment = Experiment(
+            full_api_params(),
+            Granularity.MINUTE,
+            Strategy.PARALLEL_CHEAPEST_INSERTION,
+            runtime,
+            metrics={'model': name},
+            overrides=overrides,
+        )
+        try:
+            metrics = experiment.run()
+        except NoSolutionFoundError:
+            logger.info('No solution found with %s in %d ms', name, runtime)
+            continue
+        logger.info(
+            'Model: %s, Runtime: %d, Blackout intervals: %s, Breaks: %s, Build time: %.3f, Objective: %s',
+            name,
+            runtime,
+            metrics.get('num_blackout_intervals'),
+            metrics.get('num_breaks'),
+            metrics.get('model_build_time', float('nan')),
+            metrics['objective_costs']['total'],
+        )
+        experiments.append(experiment)
+    return experiments
+
+
+def run_lunch_model_experiments():
+    """Compare lunch as per node blackouts with lunch as vehicle breaks"""
+    return run_model_comparison({lunch_model.name: {'lunch_model': lunch_model} for lunch_model in LunchModel})
+
+
+def run_vehicle_model_experiments():
+    """Compare duplicate origin nodes with a vehicle per work period"""
+    return run_model_comparison({
+        'Duplicate origins': {'vehicle_per_work_period': False},
+        'Vehicle per work period': {'vehicle_per_work_period': True},
+    })
+
+
 if __name__ == '__main__':
     bootstrap_project(log_title='optimization')
     run_experiments()
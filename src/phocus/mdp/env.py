@@ -1,8 +1,37 @@
-from typing import Sequence
+"""Episodes of visiting nodes in time segments
+
+`Environment` steps a single episode. `VectorEnvironment` steps a batch of episodes of the same problem at once on
+(episodes x nodes) arrays, which is how populations of policies are rolled out:
+
+    python -m phocus.experiments.benchmarks mdp-env
+"""
+from typing import List, Sequence
 
 import numpy as np
 
 from phocus.mdp import Segment
+from phocus.utils.geo import manhattan_matrix
+
+"""Episodes end when less than this fraction of their time is left"""
+TERMINAL_TIME = 1e-6
+
+
+def episode_distance_matrix(node_locations, sales_time: float, travel_speed: float, episode_time: float) -> np.ndarray:
+    """The time of travelling between nodes and making a sale as a fraction of the episode time"""
+    # Compute travel times based on manhattan distance and travel speed
+    travel_times = manhattan_matrix(node_locations, dtype=np.float64) / travel_speed
+
+    # Incorporate sales time into the distance matrix
+    travel_times += sales_time
+
+    return travel_times / episode_time
+
+
+def reserved_nodes(segments: Sequence[Segment]) -> List[int]:
+    """The start and end nodes of the segments, which are never actions"""
+    nodes = {segment.start_node for segment in segments} | {segment.end_node for segment in segments}
+    nodes.discard(None)
+    return sorted(nodes)
 
 
 class Environment(object):
@@ -16,11 +45,10 @@ class Environment(object):
     ):
         # Static assignments
         self.num_nodes: int = len(node_locations)
-        self.reserved_nodes = set()
-        for segment in segments:
-            self.reserved_nodes.add(segment.start_node)
-            self.reserved_nodes.add(segment.end_node)
-        self.reserved_nodes.discard(None)
+        self.node_locations = node_locations
+        self.travel_speed = travel_speed
+        self.sales_time = sales_time
+        self.reserved_nodes = np.array(reserved_nodes(segments), dtype=np.int64)
         self.node_rewards = node_rewards
         # Normalized segment times
         total_time = sum(map(lambda _: _.hours, segments))
@@ -28,7 +56,7 @@ class Environment(object):
         self.segment_times: Sequence[float] = list(map(lambda _: _.hours / total_time, segments))
         self.distance_matrix = self.compute_distance_matrix(
             node_locations, sales_time, travel_speed, total_time)
-        self.visited_nodes = np.zeros(shape=[self.num_nodes], dtype=np.int)
+        self.visited_nodes = np.zeros(shape=[self.num_nodes], dtype=np.int64)
 
         # Dynamic state
         self.segment_start_node = self.segments[0].start_node
@@ -60,20 +88,10 @@ class Environment(object):
         self.state[-1] = self.time_remaining
 
     def compute_distance_matrix(self, node_locations, sales_time: float, travel_speed: float, episode_time: float):
-        # Compute travel times based on manhattan distance and travel speed
-        travel_times = np.zeros(shape=(self.num_nodes, self.num_nodes))
-
-        for i in range(self.num_nodes):
-            for j in range(self.num_nodes):
-                travel_times[i, j] = np.sum(np.abs(node_locations[i] - node_locations[j])) / travel_speed
-
-        # Incorporate sales time into the distance matrix
-        travel_times += sales_time
-
-        return travel_times / episode_time
+        return episode_distance_matrix(node_locations, sales_time, travel_speed, episode_time)
 
     def is_terminal(self):
-        return self.time_remaining < 1e-6
+        return self.time_remaining < TERMINAL_TIME
 
     def reset_visited_nodes(self, start_node: int):
         self.num_visited = 0
@@ -82,7 +100,7 @@ class Environment(object):
 
     def reset_valid_actions(self):
         self.valid_actions.fill(1)
-        self.valid_actions[list(self.reserved_nodes)] = 0.
+        self.valid_actions[self.reserved_nodes] = 0.
         self.valid_actions[self.visited_nodes] = 0.
 
     def visit_node(self, node_idx):
@@ -106,7 +124,7 @@ class Environment(object):
                                   self.current_segment_times[self.current_segment_idx]
 
         # Handle end of segment
-        if np.count_nonzero(self.valid_actions) is 0:
+        if np.count_nonzero(self.valid_actions) == 0:
             # Drain remaining segment time
             self.time_remaining -= self.current_segment_times[self.current_segment_idx]
             self.current_segment_times[self.current_segment_idx] = 0
@@ -125,3 +143,151 @@ class Environment(object):
         self.state[-2] = self.current_segment_times[self.current_segment_idx]
 
         return self.node_rewards[node_idx], self.state
+
+
+class VectorEnvironment(object):
+    """`num_episodes` episodes of an `Environment` stepped together
+
+    The state, visited nodes, valid actions and segment times of every episode are rows of (episodes x nodes) and
+    (episodes x segments) arrays that are updated in place, so a step allocates nothing the size of those arrays.
+    Every episode takes the same transitions as `Environment` would for the same actions. Episodes that are done
+    ignore their actions and get no reward until `reset`."""
+    def __init__(
+        self,
+        node_locations,
+        node_rewards: np.ndarray,
+        travel_speed: float,
+        sales_time: float,
+        segments: Sequence[Segment],
+        num_episodes: int,
+    ):
+        self.num_nodes: int = len(node_locations)
+        self.num_episodes = num_episodes
+        self.segments = segments
+        self.node_rewards = np.asarray(node_rewards, dtype=np.float64)
+        total_time = sum(segment.hours for segment in segments)
+        self.segment_times = np.array([segment.hours / total_time for segment in segments], dtype=np.float64)
+        self.distance_matrix = episode_distance_matrix(node_locations, sales_time, travel_speed, total_time)
+        self.start_node = segments[0].start_node
+
+        # Like `Environment` reserved nodes are never actions. Neither is node 0, which `Environment` masks with the
+        # unused entries of its visited nodes.
+        self.closed_actions = np.zeros(self.num_nodes, dtype=bool)
+        self.closed_actions[reserved_nodes(segments)] = True
+        self.closed_actions[0] = True
+        self.segment_end_nodes = np.array([-1 if s.end_node is None else s.end_node for s in segments], dtype=np.int64)
+        # The time to each segment's end node from every node, segments without one can always be left
+        self.segment_end_times = np.full((len(segments), self.num_nodes), -np.inf)
+        for idx, end_node in enumerate(self.segment_end_nodes.tolist()):
+            if end_node >= 0:
+                self.segment_end_times[idx] = self.distance_matrix[:, end_node]
+
+        # Dynamic state, a route can't be longer than the nodes plus the end nodes of its segments
+        shape = (num_episodes, self.num_nodes)
+        self.episodes = np.arange(num_episodes)
+        self.state = np.zeros((num_episodes, self.num_nodes * 2 + 2))
+        self.visited = np.zeros(shape, dtype=bool)
+        self.visited_nodes = np.zeros((num_episodes, self.num_nodes + len(segments)), dtype=np.int64)
+        self.num_visited = np.zeros(num_episodes, dtype=np.int64)
+        self.valid_actions = np.zeros(shape, dtype=bool)
+        self.current_segment_times = np.zeros((num_episodes, len(segments)))
+        self.current_segment_idx = np.zeros(num_episodes, dtype=np.int64)
+        self.time_remaining = np.zeros(num_episodes)
+        self.done = np.zeros(num_episodes, dtype=bool)
+        self.rewards = np.zeros(num_episodes)
+
+        # Buffers of each step
+        self._active = np.zeros(num_episodes, dtype=bool)
+        self._exhausted = np.zeros(num_episodes, dtype=bool)
+        self._segment_time = np.zeros(num_episodes)
+        self._distance = np.zeros(num_episodes)
+        self._times = np.zeros(shape)
+        self._mask = np.zeros(shape, dtype=bool)
+        self.reset()
+
+    @classmethod
+    def from_environment(cls, env: Environment, num_episodes: int) -> 'VectorEnvironment':
+        """`num_episodes` episodes of the problem of `env`"""
+        return cls(env.node_locations, env.node_rewards, env.travel_speed, env.sales_time, env.segments, num_episodes)
+
+    def reset(self):
+        self.visited.fill(False)
+        self.visited_nodes.fill(0)
+        self.visited_nodes[:, 0] = self.start_node
+        self.visited[:, self.start_node] = True
+        self.num_visited.fill(0)
+        self.current_segment_times[:] = self.segment_times
+        self.current_segment_idx.fill(0)
+        self.time_remaining.fill(1.)
+        self.done.fill(False)
+        self.valid_actions[:] = ~self.closed_actions & ~self.visited
+        self.state.fill(0)
+        self.state[:, self.num_nodes:-2] = self.distance_matrix[self.start_node]
+        self.state[:, -2] = self.segment_times[0]
+        self.state[:, -1] = 1.
+
+    def is_terminal(self) -> np.ndarray:
+        return self.time_remaining < TERMINAL_TIME
+
+    def routes(self) -> List[np.ndarray]:
+        """The nodes visited so far by every episode"""
+        return [self.visited_nodes[episode, :num_visited + 1]
+                for episode, num_visited in enumerate(self.num_visited.tolist())]
+
+    def _visit(self, nodes: np.ndarray, is_visited: np.ndarray):
+        """Append `nodes` to the routes of the episodes where `is_visited`"""
+        self.num_visited += is_visited
+        slots = self.visited_nodes[self.episodes, self.num_visited]
+        self.visited_nodes[self.episodes, self.num_visited] = np.where(is_visited, nodes, slots)
+        self.visited[self.episodes, nodes] |= is_visited
+
+    def step(self, actions: np.ndarray) -> (np.ndarray, np.ndarray):
+        """Visit node `actions[i]` in episode i, returning the rewards and the states of every episode"""
+        actions = np.asarray(actions, dtype=np.int64)
+        active = np.logical_not(self.done, out=self._active)
+        episodes = self.episodes
+        segment_idx = self.current_segment_idx
+        previous_nodes = self.visited_nodes[episodes, self.num_visited]
+        distance = np.multiply(self.distance_matrix[previous_nodes, actions], active, out=self._distance)
+
+        # Mark nodes as visited
+        self._visit(actions, active)
+        # Update time remaining in segment and episode
+        self.current_segment_times[episodes, segment_idx] -= distance
+        self.time_remaining -= distance
+        segment_time = self._segment_time
+        segment_time[:] = self.current_segment_times[episodes, segment_idx]
+        # Update valid actions, the actions of episodes that are done don't matter
+        self.valid_actions[episodes, actions] &= ~active
+        np.take(self.distance_matrix, actions, axis=0, out=self._times)
+        self.valid_actions &= np.less(self._times, segment_time[:, None], out=self._mask)
+        np.take(self.segment_end_times, segment_idx, axis=0, out=self._times)
+        self.valid_actions &= np.less(self._times, segment_time[:, None], out=self._mask)
+
+        # Handle end of segments
+        exhausted = np.logical_and(active, ~self.valid_actions.any(axis=1), out=self._exhausted)
+        if exhausted.any():
+            # Drain remaining segment time
+            self.time_remaining -= np.where(exhausted, segment_time, 0.)
+            segment_time[exhausted] = 0.
+            self.current_segment_times[episodes, segment_idx] = segment_time
+            # Go to end node of segment if exists
+            end_nodes = self.segment_end_nodes[segment_idx]
+            self._visit(np.maximum(end_nodes, 0), exhausted & (end_nodes >= 0))
+            # Advance to next segment
+            advance = exhausted & ~self.is_terminal()
+            segment_idx += advance
+            np.logical_or(self.visited, self.closed_actions, out=self._mask)
+            np.copyto(self.valid_actions, np.logical_not(self._mask, out=self._mask), where=advance[:, None])
+            segment_time[advance] = self.current_segment_times[advance, segment_idx[advance]]
+
+        # Update state vectors
+        self.state[episodes, actions] = np.where(active, 1., self.state[episodes, actions])
+        np.take(self.distance_matrix, actions, axis=0, out=self._times)
+        np.copyto(self.state[:, self.num_nodes:-2], self._times, where=active[:, None])
+        self.state[:, -1] = self.time_remaining
+        self.state[:, -2] = segment_time
+
+        np.multiply(self.node_rewards[actions], active, out=self.rewards)
+        self.done |= self.is_terminal()
+        return self.rewards, self.state
@@ -1,16 +1,22 @@
-from typing import Sequence
+from collections import namedtuple
+from timeit import default_timer as timer
+from typing import Optional, Sequence
 
+import click
 import numpy as np
 
 from phocus.mdp import Segment
 from phocus.mdp.env import Environment
-from phocus.mdp.po.policy import Policy
+from phocus.mdp.po.population import HIDDEN_DIM_FACTOR, PolicyShape, PopulationEvaluator, sample_trajectory
 
 """
 Policy Optimization approach to solving MDP
 Maximize the log probability of parameters theta
 1. DFO: Cross Entropy Method, Evolution Strategies, Simulated Annealing
 2. Policy Gradients
+
+The DFO trainers evaluate their populations on `num_workers` processes, see `phocus.mdp.po.population`, and draw all
+their random numbers from `seed`.
 """
 
 NUM_NODES = 50
@@ -25,7 +31,6 @@ EPISODE_SEGMENTS = [
 ]
 POPULATION = 50
 NUM_HIDDEN_LAYERS = 1
-HIDDEN_DIM_FACTOR = 2
 
 # Evolution Strategies Parameters
 ES_SIGMA = 0.2  # Noise std dev
@@ -40,199 +45,192 @@ CE_EPSILON_STOPPING = 1E-2  # max std dev of theta as stopping criteria
 K_MAX = 20000
 SA_SIGMA = 1E-2
 
+"""The final theta, its path and reward, and the seconds each generation took"""
+TrainingResult = namedtuple('TrainingResult', ['theta', 'path', 'reward', 'generation_seconds'])
 
-def sample_trajectory(policy: Policy, env: Environment) -> (Sequence[int], float):
-    total_reward = 0
-
-    env.reset()
-
-    while True:
-        a = policy.sample_action(env.state, env.valid_actions)
-        reward, state = env.step(node_idx=a)
-        total_reward += reward
-        if env.is_terminal():
-            break
 
-    return env.visited_nodes[:env.num_visited + 1], total_reward
+def report_timing(name: str, generation: int, generation_seconds: Sequence[float]):
+    recent = generation_seconds[-100:]
+    print("%s %i took %.3f s, %.1f per minute over the last %i" % (
+        name, generation, generation_seconds[-1], 60 * len(recent) / max(sum(recent), 1E-9), len(recent)))
 
 
-def train_cross_entropy(env: Environment, node_locations):
-    state_size = 2 * NUM_NODES + 2
-    action_size = NUM_NODES
-    hidden_dim = HIDDEN_DIM_FACTOR * int(np.ceil(np.sqrt(state_size)))
-    dim_theta = (state_size + 1) * hidden_dim + (hidden_dim + 1) * action_size
+def train_cross_entropy(
+        env: Environment,
+        node_locations,
+        num_workers: int = 1,
+        seed: Optional[int] = None,
+        max_generations: Optional[int] = None,
+) -> TrainingResult:
+    shape = PolicyShape.for_nodes(env.num_nodes, HIDDEN_DIM_FACTOR)
+    dim_theta = shape.dim_theta
+    rng = np.random.RandomState(seed)
 
-    theta_mean = np.random.randn(dim_theta)
+    theta_mean = rng.randn(dim_theta)
     theta_std = np.ones(dim_theta)
 
     # Sample trajectory from this policy
-    sample_path, total_reward = sample_trajectory(
-        Policy(action_size=action_size, state_size=state_size, hidden_dim=hidden_dim, theta=theta_mean),
-        env=env,
-    )
+    sample_path, total_reward = sample_trajectory(shape.policy(theta_mean), env=env)
     print("Train using Cross Entropy Method")
     print("Initial random path {0}\nInitial reward {1}".format(sample_path, total_reward))
 
+    generation_seconds = []
     iteration = 0
-    while True:
-        # Sample parameter vectors
-        thetas = np.random.normal(
-            loc=np.tile(theta_mean, POPULATION),
-            scale=np.tile(theta_std, POPULATION),
-        ).reshape(POPULATION, dim_theta)
-        rewards = [
-            sample_trajectory(
-                Policy(action_size=action_size, state_size=state_size, hidden_dim=hidden_dim, theta=theta),
-                env=env,
-            )[1]
-            for theta in thetas
-        ]
-        # Get elite parameters
-        n_elite = int(POPULATION * ELITE_RATIO)
-        elite_indices = np.argsort(rewards)[POPULATION - n_elite:POPULATION]
-        elite_thetas = thetas[elite_indices]
-        # Update theta parameters
-        theta_mean = np.mean(elite_thetas, axis=0)
-        theta_std = np.std(elite_thetas, axis=0)
-
-        # Check if stopping condition met
-        if theta_std.max() < CE_EPSILON_STOPPING:
-            break
-
-        if iteration % 100 == 0:
-            print("Iteration %i. mean: %8.3g max: %8.3g" % (iteration, np.mean(rewards).item(), np.max(rewards)))
-            print("theta mean %s \n theta std %s" % (theta_mean, theta_std))
-            # Sample trajectory from this policy
-            sample_path, total_reward = sample_trajectory(
-                Policy(action_size=action_size, state_size=state_size, hidden_dim=hidden_dim, theta=theta_mean),
-                env=env,
-            )
-            print("Sample path {0}\nTotal reward {1}".format(sample_path, total_reward))
-
-        iteration += 1
-
-    sample_path, total_reward = sample_trajectory(
-        Policy(action_size=action_size, state_size=state_size, hidden_dim=hidden_dim, theta=theta_mean),
-        env=env,
-    )
+    with PopulationEvaluator(env, shape, num_workers=num_workers) as evaluator:
+        while max_generations is None or iteration < max_generations:
+            start_time = timer()
+            # Sample parameter vectors
+            thetas = rng.normal(
+                loc=np.tile(theta_mean, POPULATION),
+                scale=np.tile(theta_std, POPULATION),
+            ).reshape(POPULATION, dim_theta)
+            rewards = evaluator.rewards(thetas)
+            # Get elite parameters
+            n_elite = int(POPULATION * ELITE_RATIO)
+            elite_indices = np.argsort(rewards)[POPULATION - n_elite:POPULATION]
+            elite_thetas = thetas[elite_indices]
+            # Update theta parameters
+            theta_mean = np.mean(elite_thetas, axis=0)
+            theta_std = np.std(elite_thetas, axis=0)
+            generation_seconds.append(timer() - start_time)
+
+            # Check if stopping condition met
+            if theta_std.max() < CE_EPSILON_STOPPING:
+                break
+
+            if iteration % 100 == 0:
+                print("Iteration %i. mean: %8.3g max: %8.3g" % (iteration, np.mean(rewards).item(), np.max(rewards)))
+                report_timing("Iteration", iteration, generation_seconds)
+                print("theta mean %s \n theta std %s" % (theta_mean, theta_std))
+                # Sample trajectory from this policy
+                sample_path, total_reward = sample_trajectory(shape.policy(theta_mean), env=env)
+                print("Sample path {0}\nTotal reward {1}".format(sample_path, total_reward))
+
+            iteration += 1
+
+    sample_path, total_reward = sample_trajectory(shape.policy(theta_mean), env=env)
     print("Final path {0}\nCoordinates: {1}\nReward {2}".format(
         sample_path,
         list(map(lambda idx: node_locations[idx], sample_path)),
         total_reward,
     ))
+    return TrainingResult(theta_mean, sample_path, total_reward, generation_seconds)
 
 
-def train_evolution_strategies(env: Environment, node_locations):
-    state_size = 2 * NUM_NODES + 2
-    action_size = NUM_NODES
-    hidden_dim = HIDDEN_DIM_FACTOR * int(np.ceil(np.sqrt(state_size)))
-    dim_theta = (state_size + 1) * hidden_dim + (hidden_dim + 1) * action_size
+def train_evolution_strategies(
+        env: Environment,
+        node_locations,
+        num_workers: int = 1,
+        seed: Optional[int] = None,
+        max_generations: Optional[int] = None,
+) -> TrainingResult:
+    """Perturbations are slices of the noise table of the `PopulationEvaluator` at random offsets, so the workers only
+    receive theta and the offsets of their members"""
+    shape = PolicyShape.for_nodes(env.num_nodes, HIDDEN_DIM_FACTOR)
+    rng = np.random.RandomState(seed)
 
-    theta = np.random.randn(dim_theta)
+    theta = rng.randn(shape.dim_theta)
 
     # Sample trajectory from this policy
-    sample_path, total_reward = sample_trajectory(
-        Policy(action_size=action_size, state_size=state_size, hidden_dim=hidden_dim, theta=theta),
-        env=env,
-    )
+    sample_path, total_reward = sample_trajectory(shape.policy(theta), env=env)
     print("Train using Evolution Strategies")
     print("Initial random path {0}\nInitial reward {1}".format(sample_path, total_reward))
 
+    generation_seconds = []
     generation_idx = 0
 
-    while True:
-        # Sample parameter vectors
-        noise = np.random.randn(POPULATION, dim_theta)
-        rewards = np.zeros(POPULATION)
-        for member_idx in range(POPULATION):
-            theta_member = theta + ES_SIGMA * noise[member_idx]
-            policy = Policy(
-                state_size=state_size,
-                action_size=action_size,
-                hidden_dim=hidden_dim,
-                theta=theta_member,
-            )
-            _, rewards[member_idx] = sample_trajectory(env=env, policy=policy)
-
-        rewards_norm = (rewards - np.mean(rewards)) / (np.std(rewards) + 1E-6)
-        theta_update = ALPHA / (POPULATION * ES_SIGMA) * np.dot(noise.T, rewards_norm)
-        if theta_update.max() < ES_EPSILON_STOPPING:
-            break
-        theta += theta_update
-
-        if generation_idx % 100 == 0:
-            print("Generation %i. mean: %8.3g max: %8.3g" % (generation_idx, np.mean(rewards).item(), np.max(rewards)))
-            print("theta mean %s" % theta)
-            # Sample trajectory from this policy
-            sample_path, total_reward = sample_trajectory(
-                Policy(action_size=action_size, state_size=state_size, hidden_dim=hidden_dim, theta=theta),
-                env=env,
-            )
-            print("Sample path {0}\nTotal reward {1}".format(sample_path, total_reward))
-
-        generation_idx += 1
-
-    sample_path, total_reward = sample_trajectory(
-        Policy(action_size=action_size, state_size=state_size, hidden_dim=hidden_dim, theta=theta),
-        env=env,
-    )
+    with PopulationEvaluator(env, shape, num_workers=num_workers) as evaluator:
+        while max_generations is None or generation_idx < max_generations:
+            start_time = timer()
+            # Sample parameter vectors
+            offsets = evaluator.noise_offsets(rng, POPULATION)
+            rewards = evaluator.perturbed_rewards(theta, ES_SIGMA, offsets)
+
+            rewards_norm = (rewards - np.mean(rewards)) / (np.std(rewards) + 1E-6)
+            theta_update = ALPHA / (POPULATION * ES_SIGMA) * np.dot(evaluator.perturbations(offsets).T, rewards_norm)
+            generation_seconds.append(timer() - start_time)
+            if theta_update.max() < ES_EPSILON_STOPPING:
+                break
+            theta += theta_update
+
+            if generation_idx % 100 == 0:
+                print("Generation %i. mean: %8.3g max: %8.3g" % (
+                    generation_idx, np.mean(rewards).item(), np.max(rewards)))
+                report_timing("Generation", generation_idx, generation_seconds)
+                print("theta mean %s" % theta)
+                # Sample trajectory from this policy
+                sample_path, total_reward = sample_trajectory(shape.policy(theta), env=env)
+                print("Sample path {0}\nTotal reward {1}".format(sample_path, total_reward))
+
+            generation_idx += 1
+
+    sample_path, total_reward = sample_trajectory(shape.policy(theta), env=env)
     print("Final path {0}\nCoordinates: {1}\nReward {2}".format(
         sample_path,
         list(map(lambda idx: node_locations[idx], sample_path)),
         total_reward,
     ))
+    return TrainingResult(theta, sample_path, total_reward, generation_seconds)
 
 
-def train_simulated_annealing(env: Environment, node_locations):
-    state_size = 2 * NUM_NODES + 2
-    action_size = NUM_NODES
-    hidden_dim = HIDDEN_DIM_FACTOR * int(np.ceil(np.sqrt(state_size)))
-    dim_theta = (state_size + 1) * hidden_dim + (hidden_dim + 1) * action_size
+def train_simulated_annealing(
+        env: Environment,
+        node_locations,
+        num_workers: int = 1,
+        seed: Optional[int] = None,
+        k_max: int = K_MAX,
+) -> TrainingResult:
+    """Each generation evaluates `num_workers` neighbors of theta at once and tests them for acceptance in order.
+    Rejected candidates leave theta unchanged, so the ones after them are still its neighbors, and the candidates after
+    an accepted one are dropped. The chain is the same as evaluating one candidate at a time, but which random draws it
+    uses depends on `num_workers`."""
+    shape = PolicyShape.for_nodes(env.num_nodes, HIDDEN_DIM_FACTOR)
+    rng = np.random.RandomState(seed)
 
-    theta = np.random.randn(dim_theta)
+    theta = rng.randn(shape.dim_theta)
 
     # Sample trajectory from this policy
-    sample_path, total_reward = sample_trajectory(
-        Policy(action_size=action_size, state_size=state_size, hidden_dim=hidden_dim, theta=theta),
-        env=env,
-    )
+    sample_path, total_reward = sample_trajectory(shape.policy(theta), env=env)
     print("Train using Simulated Annealing")
     print("Initial random path {0}\nInitial reward {1}".format(sample_path, total_reward))
 
     current_score = total_reward
-
-    for k in range(K_MAX):
-        candidate_theta = neighbor(theta)
-        _, candidate_score = sample_trajectory(
-            policy=Policy(action_size=action_size, state_size=state_size, hidden_dim=hidden_dim, theta=candidate_theta),
-            env=env,
-        )
-        temperature = get_temperature(k, K_MAX)
-        accept_prob = acceptance_probability(current=current_score, candidate=candidate_score, temperature=temperature)
-
-        if np.random.rand() < accept_prob:
-            current_score = candidate_score
-            theta = candidate_theta
-
-        if k % 1000 == 0:
-            print("Iteration %i. reward: %8.3g" % (k, current_score))
-            print("theta mean %s" % theta)
-            # Sample trajectory from this policy
-            sample_path, total_reward = sample_trajectory(
-                Policy(action_size=action_size, state_size=state_size, hidden_dim=hidden_dim, theta=theta),
-                env=env,
-            )
-            print("Sample path {0}\nTotal reward {1}".format(sample_path, total_reward))
-
-    sample_path, total_reward = sample_trajectory(
-        Policy(action_size=action_size, state_size=state_size, hidden_dim=hidden_dim, theta=theta),
-        env=env,
-    )
+    generation_seconds = []
+
+    k = 0
+    with PopulationEvaluator(env, shape, num_workers=num_workers) as evaluator:
+        while k < k_max:
+            start_time = timer()
+            candidate_thetas = np.array([neighbor(theta, rng) for _ in range(min(num_workers, k_max - k))])
+            candidate_scores = evaluator.rewards(candidate_thetas)
+            for candidate_theta, candidate_score in zip(candidate_thetas, candidate_scores):
+                temperature = get_temperature(k, k_max)
+                accept_prob = acceptance_probability(
+                    current=current_score, candidate=candidate_score, temperature=temperature)
+                accepted = rng.rand() < accept_prob
+                if accepted:
+                    current_score = candidate_score
+                    theta = candidate_theta
+
+                if k % 1000 == 0:
+                    print("Iteration %i. reward: %8.3g" % (k, current_score))
+                    print("theta mean %s" % theta)
+                    # Sample trajectory from this policy
+                    sample_path, total_reward = sample_trajectory(shape.policy(theta), env=env)
+                    print("Sample path {0}\nTotal reward {1}".format(sample_path, total_reward))
+
+                k += 1
+                if accepted:
+                    break
+            generation_seconds.append(timer() - start_time)
+
+    sample_path, total_reward = sample_trajectory(shape.policy(theta), env=env)
     print("Final path {0}\nCoordinates: {1}\nReward {2}".format(
         sample_path,
         list(map(lambda idx: node_locations[idx], sample_path)),
         total_reward,
     ))
+    return TrainingResult(theta, sample_path, total_reward, generation_seconds)
 
 
 def get_temperature(k: float, k_max: float) -> float:
@@ -246,13 +244,16 @@ def acceptance_probability(current: float, candidate: float, temperature: float)
         return np.exp((candidate - current) / temperature)
 
 
-def neighbor(theta: np.ndarray) -> np.ndarray:
-    return theta + np.random.randn(theta.shape[0]) * SA_SIGMA
+def neighbor(theta: np.ndarray, rng: np.random.RandomState = np.random) -> np.ndarray:
+    return theta + rng.randn(theta.shape[0]) * SA_SIGMA
 
 
-def main():
+@click.command()
+@click.option('--workers', 'num_workers', default=1, help='Processes that evaluate the population')
+@click.option('--seed', type=int, default=None)
+def main(num_workers, seed):
     # Node 0 is home
-    node_locations = np.random.rand(NUM_NODES, 2) * WORLD_SIZE
+    node_locations = np.random.RandomState(seed).rand(NUM_NODES, 2) * WORLD_SIZE
     node_rewards = np.ones(NUM_NODES)
     env = Environment(
         node_locations=node_locations,
@@ -261,16 +262,10 @@ def main():
         sales_time=SALES_TIME,
         segments=EPISODE_SEGMENTS,
     )
-    import time
-    start_time = time.time()
-    train_cross_entropy(env=env, node_locations=node_locations)
-    print("Elapsed: ", time.time() - start_time)
-    start_time = time.time()
-    train_evolution_strategies(env=env, node_locations=node_locations)
-    print("Elapsed: ", time.time() - start_time)
-    start_time = time.time()
-    train_simulated_annealing(env=env, node_locations=node_locations)
-    print("Elapsed: ", time.time() - start_time)
+    for train in (train_cross_entropy, train_evolution_strategies, train_simulated_annealing):
+        start_time = timer()
+        train(env=env, node_locations=node_locations, num_workers=num_workers, seed=seed)
+        print("Elapsed: ", timer() - start_time)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,28 @@
 import numpy as np
 
 
+def split_theta(theta: np.ndarray, state_size: int, action_size: int, hidden_dim: int):
+    """The input weights, input bias, output weights and output bias in the last axis of `theta`
+
+    Leading axes are kept, so a (members x parameters) theta gives (members x state_size x hidden_dim) input weights."""
+    assert theta.shape[-1] == (state_size + 1) * hidden_dim + (hidden_dim + 1) * action_size
+    leading = theta.shape[:-1]
+    acc_idx = 0
+    weights_in_slice: np.ndarray = theta[..., :state_size * hidden_dim]
+    acc_idx += weights_in_slice.shape[-1]
+    bias_in_slice: np.ndarray = theta[..., acc_idx: acc_idx + hidden_dim]
+    acc_idx += bias_in_slice.shape[-1]
+    weights_out_slice: np.ndarray = theta[..., acc_idx: acc_idx + hidden_dim * action_size]
+    acc_idx += weights_out_slice.shape[-1]
+    bias_out_slice: np.ndarray = theta[..., acc_idx:]
+    return (
+        weights_in_slice.reshape(leading + (state_size, hidden_dim)),
+        bias_in_slice.reshape(leading + (1, hidden_dim)),
+        weights_out_slice.reshape(leading + (hidden_dim, action_size)),
+        bias_out_slice.reshape(leading + (1, action_size)),
+    )
+
+
 class Policy(object):
     def __init__(self, state_size: int, action_size: int, hidden_dim: int, theta: np.ndarray):
         """
@@ -9,19 +31,8 @@ class Policy(object):
         :param action_size: number of discrete actions
         :param theta: flattened weight vector
         """
-        assert len(theta) == (state_size + 1) * hidden_dim + (hidden_dim + 1) * action_size
-        acc_idx = 0
-        weights_in_slice: np.ndarray = theta[:state_size * hidden_dim]
-        acc_idx += weights_in_slice.shape[0]
-        bias_in_slice: np.ndarray = theta[acc_idx: acc_idx + hidden_dim]
-        acc_idx += bias_in_slice.shape[0]
-        weights_out_slice: np.ndarray = theta[acc_idx: acc_idx + hidden_dim * action_size]
-        acc_idx += weights_out_slice.shape[0]
-        bias_out_slice: np.ndarray = theta[acc_idx:]
-        self.weights_in: np.ndarray = weights_in_slice.reshape(state_size, hidden_dim)
-        self.bias_in: np.ndarray = bias_in_slice.reshape(1, hidden_dim)
-        self.weights_out: np.ndarray = weights_out_slice.reshape(hidden_dim, action_size)
-        self.bias_out = bias_out_slice.reshape(1, action_size)
+        self.weights_in, self.bias_in, self.weights_out, self.bias_out = split_theta(
+            theta, state_size, action_size, hidden_dim)
 
     def score_actions(self, state: np.ndarray) -> np.ndarray:
         hidden = state.dot(self.weights_in) + self.bias_in
@@ -46,3 +57,46 @@ class Policy(object):
         y_masked = y * valid_actions
         a = y_masked.argmax()
         return a
+
+
+class PolicyBatch(object):
+    def __init__(self, state_size: int, action_size: int, hidden_dim: int, thetas: np.ndarray):
+        """
+        The `Policy` of each row of `thetas`, acting on a state per member at once
+        :param state_size: dimensionality of state vector
+        :param action_size: number of discrete actions
+        :param thetas: (members x parameters) flattened weight vectors
+        """
+        self.num_members = len(thetas)
+        weights_in, bias_in, weights_out, bias_out = split_theta(
+            np.asarray(thetas, dtype=np.float64), state_size, action_size, hidden_dim)
+        # Contiguous copies so the products don't stride through the flattened thetas
+        self.weights_in: np.ndarray = np.ascontiguousarray(weights_in)
+        self.bias_in: np.ndarray = bias_in[:, 0, :].copy()
+        self.weights_out: np.ndarray = np.ascontiguousarray(weights_out)
+        self.bias_out: np.ndarray = bias_out[:, 0, :].copy()
+        self._hidden = np.zeros((self.num_members, hidden_dim))
+        self._scores = np.zeros((self.num_members, action_size))
+
+    def score_actions(self, states: np.ndarray) -> np.ndarray:
+        """The (members x actions) scores of member i in state `states[i]`"""
+        # Batched (1 x state) @ (state x hidden) and (1 x hidden) @ (hidden x actions) products of every member
+        hidden = self._hidden
+        np.matmul(states[:, None, :], self.weights_in, out=hidden[:, None, :])
+        hidden += self.bias_in
+        np.tanh(hidden, out=hidden)
+        output = self._scores
+        np.matmul(hidden[:, None, :], self.weights_out, out=output[:, None, :])
+        output += self.bias_out
+        return output
+
+    def sample_actions(self, states: np.ndarray, valid_actions: np.ndarray) -> np.ndarray:
+        """
+        Return index of highest scoring action of each member, like `Policy.sample_action`
+        :param states: (members x state size) states
+        :param valid_actions: (members x actions) binary masks of valid actions
+        :return: index of highest score action of each member
+        """
+        y = np.exp(self.score_actions(states), out=self._scores)
+        y *= valid_actions
+        return y.argmax(axis=1)
@@ -0,0 +1,201 @@
+"""Evaluating populations of policy parameters on worker processes
+
+The derivative free trainers in `phocus.mdp.po.main` score each candidate theta by the total reward of its trajectory.
+A `PopulationEvaluator` splits the candidates of a generation into one chunk per worker of a process pool. The workers
+get their own copy of the environment once when the pool starts, so a generation only sends the candidates. Each chunk
+is rolled out together, a `PolicyBatch` choosing the actions of all its members on a `VectorEnvironment` each step:
+
+    with PopulationEvaluator(env, PolicyShape.for_nodes(env.num_nodes), num_workers=4) as evaluator:
+        rewards = evaluator.rewards(thetas)
+
+Evolution Strategies perturbations are rows of a table of standard normal noise that every process builds from the same
+seed, so ES sends the mean theta and an offset into the table per member instead of the perturbed thetas. Rewards come
+back in the order of the candidates, so the results do not depend on the number of workers.
+"""
+import multiprocessing
+from collections import namedtuple
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+from phocus.mdp.env import Environment, VectorEnvironment
+from phocus.mdp.po.policy import Policy, PolicyBatch
+from phocus.utils.mixins import Base
+
+"""Number of values in the ES noise table, perturbations are slices of it"""
+NOISE_TABLE_SIZE = 2 ** 22
+DEFAULT_NOISE_SEED = 0
+HIDDEN_DIM_FACTOR = 2
+
+"""Noise tables built by this process by (seed, size), forked workers inherit them instead of building them again"""
+_noise_tables: Dict[Tuple[int, int], np.ndarray] = {}
+"""The rollouts of a worker process, set by `_start_worker`"""
+_worker_rollouts = None
+
+
+class PolicyShape(namedtuple('PolicyShape', ['state_size', 'action_size', 'hidden_dim'])):
+    """The layer sizes of a `Policy`"""
+    __slots__ = ()
+
+    @classmethod
+    def for_nodes(cls, num_nodes: int, hidden_dim_factor: int = HIDDEN_DIM_FACTOR) -> 'PolicyShape':
+        """The shape of policies acting on an environment of `num_nodes` nodes"""
+        state_size = 2 * num_nodes + 2
+        return cls(state_size, num_nodes, hidden_dim_factor * int(np.ceil(np.sqrt(state_size))))
+
+    @property
+    def dim_theta(self) -> int:
+        return (self.state_size + 1) * self.hidden_dim + (self.hidden_dim + 1) * self.action_size
+
+    def policy(self, theta: np.ndarray) -> Policy:
+        return Policy(state_size=self.state_size, action_size=self.action_size, hidden_dim=self.hidden_dim, theta=theta)
+
+    def policy_batch(self, thetas: np.ndarray) -> PolicyBatch:
+        return PolicyBatch(state_size=self.state_size, action_size=self.action_size, hidden_dim=self.hidden_dim,
+                           thetas=thetas)
+
+
+def noise_table(seed: int = DEFAULT_NOISE_SEED, size: int = NOISE_TABLE_SIZE) -> np.ndarray:
+    """A read-only table of standard normal noise, the same in every process for the same seed"""
+    key = (seed, size)
+    if key not in _noise_tables:
+        table = np.random.RandomState(seed).randn(size)
+        table.flags.writeable = False
+        _noise_tables[key] = table
+    return _noise_tables[key]
+
+
+def perturbations(noise: np.ndarray, offsets: np.ndarray, dim_theta: int) -> np.ndarray:
+    """The (members x parameters) slices of `noise` at `offsets`"""
+    return noise[np.asarray(offsets)[:, None] + np.arange(dim_theta)]
+
+
+def sample_trajectory(policy: Policy, env: Environment) -> (Sequence[int], float):
+    total_reward = 0
+
+    env.reset()
+
+    while True:
+        a = policy.sample_action(env.state, env.valid_actions)
+        reward, state = env.step(node_idx=a)
+        total_reward += reward
+        if env.is_terminal():
+            break
+
+    return env.visited_nodes[:env.num_visited + 1], total_reward
+
+
+def batch_rewards(policies: PolicyBatch, env: VectorEnvironment) -> np.ndarray:
+    """The total reward of each member's trajectory, rolling out one episode of `env` per member"""
+    if policies.num_members != env.num_episodes:
+        raise RuntimeError('Expected an episode per member of the %d policies but got %d episodes' % (
+            policies.num_members, env.num_episodes))
+    total_rewards = np.zeros(env.num_episodes)
+
+    env.reset()
+
+    while not env.done.all():
+        rewards, _ = env.step(policies.sample_actions(env.state, env.valid_actions))
+        total_rewards += rewards
+
+    return total_rewards
+
+
+class _Rollouts(object):
+    """Total rewards of thetas on an environment, in the main process or a worker
+
+    The members are rolled out together on a `VectorEnvironment` with a `PolicyBatch`."""
+    def __init__(self, env: Environment, shape: PolicyShape, noise_seed: int, noise_size: int):
+        self.env = env
+        self.shape = shape
+        self.noise = noise_table(noise_seed, noise_size)
+        self._vector_envs: Dict[int, VectorEnvironment] = {}
+
+    def rewards(self, thetas: np.ndarray) -> np.ndarray:
+        num_members = len(thetas)
+        if num_members not in self._vector_envs:
+            self._vector_envs[num_members] = VectorEnvironment.from_environment(self.env, num_members)
+        return batch_rewards(self.shape.policy_batch(thetas), self._vector_envs[num_members])
+
+    def perturbed_rewards(self, theta: np.ndarray, sigma: float, offsets: np.ndarray) -> np.ndarray:
+        return self.rewards(theta + sigma * perturbations(self.noise, offsets, len(theta)))
+
+
+def _start_worker(env: Environment, shape: PolicyShape, noise_seed: int, noise_size: int):
+    global _worker_rollouts
+    _worker_rollouts = _Rollouts(env, shape, noise_seed, noise_size)
+
+
+def _worker_rewards(thetas: np.ndarray) -> np.ndarray:
+    return _worker_rollouts.rewards(thetas)
+
+
+def _worker_perturbed_rewards(args) -> np.ndarray:
+    return _worker_rollouts.perturbed_rewards(*args)
+
+
+class PopulationEvaluator(Base):
+    """Total rewards of a population of thetas on `num_workers` processes, or in this process for a single worker
+
+    Use it as a context manager or `close` it to stop the workers."""
+    def __init__(
+            self,
+            env: Environment,
+            shape: PolicyShape,
+            num_workers: int = 1,
+            noise_seed: int = DEFAULT_NOISE_SEED,
+            noise_size: int = NOISE_TABLE_SIZE,
+    ):
+        if noise_size < shape.dim_theta:
+            raise RuntimeError('The noise table of %d values is smaller than the %d parameters of the policy' % (
+                noise_size, shape.dim_theta))
+        self.shape = shape
+        self.num_workers = num_workers
+        self._rollouts = _Rollouts(env, shape, noise_seed, noise_size)
+        self._pool = None
+        if num_workers > 1:
+            # Pool initializers work on every Python version, unlike those of ProcessPoolExecutor before 3.7
+            self._pool = multiprocessing.Pool(num_workers, initializer=_start_worker,
+                                              initargs=(env, shape, noise_seed, noise_size))
+
+    @property
+    def noise(self) -> np.ndarray:
+        return self._rollouts.noise
+
+    def noise_offsets(self, rng: np.random.RandomState, num_members: int) -> np.ndarray:
+        """Random offsets of the perturbations of `num_members` members into the noise table"""
+        return rng.randint(0, len(self.noise) - self.shape.dim_theta + 1, size=num_members)
+
+    def perturbations(self, offsets: np.ndarray) -> np.ndarray:
+        """The (members x parameters) standard normal perturbations at `offsets` of the noise table"""
+        return perturbations(self.noise, offsets, self.shape.dim_theta)
+
+    def _chunks(self, num_members: int):
+        return [chunk for chunk in np.array_split(np.arange(num_members), self.num_workers) if len(chunk)]
+
+    def rewards(self, thetas: np.ndarray) -> np.ndarray:
+        """The total reward of the trajectory of each row of `thetas`"""
+        if self._pool is None:
+            return self._rollouts.rewards(thetas)
+        chunk_rewards = self._pool.map(_worker_rewards, [thetas[chunk] for chunk in self._chunks(len(thetas))])
+        return np.concatenate(chunk_rewards)
+
+    def perturbed_rewards(self, theta: np.ndarray, sigma: float, offsets: np.ndarray) -> np.ndarray:
+        """The total reward of `theta` perturbed by `sigma` times the noise at each offset"""
+        if self._pool is None:
+            return self._rollouts.perturbed_rewards(theta, sigma, offsets)
+        chunk_rewards = self._pool.map(_worker_perturbed_rewards,
+                                       [(theta, sigma, offsets[chunk]) for chunk in self._chunks(len(offsets))])
+        return np.concatenate(chunk_rewards)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self) -> 'PopulationEvaluator':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -14,12 +14,16 @@ class HCP(Base):
     def __init__(self, **kwargs):
         pass
 
+    @property
+    def address(self) -> str:
+        return ', '.join((self.street_address, self.city, self.state, self.zip))
+
     @property
     def lat(self):
         try:
             return self._lat
         except AttributeError:
-            self._lat, self._lon = MapsUtils().get_lat_long(', '.join((self.street_address, self.city, self.state, self.zip)))
+            self._lat, self._lon = MapsUtils().get_lat_long(self.address)
             return self._lat
 
     @property
@@ -27,10 +31,19 @@ class HCP(Base):
         try:
             return self._lon
         except AttributeError:
-            self._lat, self._lon = MapsUtils().get_lat_long(', '.join((self.street_address, self.city, self.state, self.zip)))
+            self._lat, self._lon = MapsUtils().get_lat_long(self.address)
             return self._lon
 
 
+def geocode_hcps(hcps: Sequence[HCP]):
+    """Geocode the addresses of all HCPs at once instead of one at a time when their lat or lon is first used"""
+    from phocus.utils.geocoder import geocoder
+
+    for hcp, result in zip(hcps, geocoder.geocode_many([hcp.address for hcp in hcps])):
+        if result.coordinate is not None:
+            hcp._lat, hcp._lon = result.coordinate
+
+
 class HCPFileReader:
     """Reads file with HCP data in it"""
     def __init__(self, path: Path):
@@ -1,12 +1,14 @@
+import copy
+import copyreg
 import json
 from collections import namedtuple
 from logging import getLogger
 from math import radians, cos, sin, asin, sqrt
-from typing import Sequence, Dict
+from typing import Sequence, Dict, List
 
 import pendulum
 
-from phocus.utils.decorators import auto_assign_arguments
+from phocus.utils.epoch import Interval, period_to_interval
 from phocus.utils.mixins import Base
 
 logger = getLogger(__name__)
@@ -14,9 +16,54 @@ Doctor = namedtuple('Doctor', 'name address lat lon')
 
 
 class Location(Base):
-    @auto_assign_arguments
-    def __init__(self, doctor_name, address, lat, lon, city=None, state=None, is_repeat=False, is_duplicate_origin=False, **kwargs):
-        pass
+    """A place to visit
+
+    The fields every location has are slots. Any other keyword arguments, like the `id` and the visit times set by the
+    model, are `extras` that read and write like attributes. Copies are shallow and share their extras until either
+    one sets an extra."""
+    FIELDS = ('doctor_name', 'address', 'lat', 'lon', 'city', 'state', 'is_repeat', 'is_duplicate_origin')
+    __slots__ = FIELDS + ('extras', '_owns_extras', '_logger')
+
+    def __init__(self, doctor_name, address, lat, lon, city=None, state=None, is_repeat=False, is_duplicate_origin=False,
+                 **extras):
+        self.doctor_name = doctor_name
+        self.address = address
+        self.lat = lat
+        self.lon = lon
+        self.city = city
+        self.state = state
+        self.is_repeat = is_repeat
+        self.is_duplicate_origin = is_duplicate_origin
+        object.__setattr__(self, 'extras', extras)
+        object.__setattr__(self, '_owns_extras', True)
+
+    def __getattr__(self, name):
+        # Only called for names that are not slots
+        try:
+            return object.__getattribute__(self, 'extras')[name]
+        except KeyError:
+            raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
+
+    def __setattr__(self, name, value):
+        if name in _LOCATION_SLOTS:
+            object.__setattr__(self, name, value)
+        else:
+            self._writable_extras()[name] = value
+
+    def __delattr__(self, name):
+        if name in _LOCATION_SLOTS:
+            object.__delattr__(self, name)
+        else:
+            try:
+                del self._writable_extras()[name]
+            except KeyError:
+                raise AttributeError(name)
+
+    def _writable_extras(self) -> Dict:
+        if not self._owns_extras:
+            object.__setattr__(self, 'extras', dict(self.extras))
+            object.__setattr__(self, '_owns_extras', True)
+        return self.extras
 
     def __hash__(self):
         return hash(self.id)
@@ -27,12 +74,54 @@ class Location(Base):
     def __str__(self):
         return '<Location: %s>' % self.id
 
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join('%s=%s' % item for item in self.to_dict().items()))
+
     def __copy__(self):
-        return Location(**vars(self))
+        location = object.__new__(self.__class__)
+        for field in self.FIELDS:
+            object.__setattr__(location, field, getattr(self, field))
+        object.__setattr__(location, 'extras', self.extras)
+        object.__setattr__(location, '_owns_extras', False)
+        object.__setattr__(self, '_owns_extras', False)
+        return location
+
+    def __deepcopy__(self, memo):
+        location = object.__new__(self.__class__)
+        memo[id(self)] = location
+        for field in self.FIELDS:
+            object.__setattr__(location, field, getattr(self, field))
+        object.__setattr__(location, 'extras', copy.deepcopy(self.extras, memo))
+        object.__setattr__(location, '_owns_extras', True)
+        return location
+
+    def __reduce_ex__(self, protocol):
+        # The layout of a location with a __dict__, so joblib hashes of locations, and the caches keyed by them, are
+        # the same as before the fields were slots
+        state = {field: getattr(self, field) for field in _PICKLED_FIELDS}
+        state.update(self.extras)
+        try:
+            state['_logger'] = object.__getattribute__(self, '_logger')
+        except AttributeError:
+            pass
+        return copyreg.__newobj__, (self.__class__,), state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        for field in _LOCATION_SLOTS.intersection(state):
+            object.__setattr__(self, field, state.pop(field))
+        object.__setattr__(self, 'extras', state)
+        object.__setattr__(self, '_owns_extras', True)
 
     def copy(self):
         return self.__copy__()
 
+    def to_dict(self) -> Dict:
+        """The fields and extras of the location"""
+        d = {field: getattr(self, field) for field in self.FIELDS}
+        d.update(self.extras)
+        return d
+
     def is_same_doctor(self, other):
         return self.key() == other.key()
 
@@ -41,9 +130,24 @@ class Location(Base):
         return self.id
 
 
-def locations_dicts(locations, blacklist={'blackout_windows', '_logger', 'time_off_period'}):
+_LOCATION_SLOTS = frozenset(Location.__slots__)
+"""The fields in the order their attributes were set when locations had a __dict__"""
+_PICKLED_FIELDS = ('is_duplicate_origin', 'is_repeat', 'state', 'city', 'doctor_name', 'address', 'lat', 'lon')
+
+
+def location_blackout_intervals(location: Location) -> List[Interval]:
+    """The blackout windows of a location as epoch second intervals
+
+    Locations parsed from the API only have `blackout_intervals`, others are converted from `blackout_windows`"""
+    blackout_intervals = getattr(location, 'blackout_intervals', None)
+    if blackout_intervals is not None:
+        return blackout_intervals
+    return [period_to_interval(b) for b in getattr(location, 'blackout_windows', [])]
+
+
+def locations_dicts(locations, blacklist={'blackout_windows', 'blackout_intervals', '_logger', 'time_off_period'}):
     """Get a dictionary per location omitting the blacklist fields"""
-    return [{k: v for k, v in vars(loc).items() if k not in blacklist} for loc in locations]
+    return [{k: v for k, v in loc.to_dict().items() if k not in blacklist} for loc in locations]
 
 
 def save_locations(locations, path):
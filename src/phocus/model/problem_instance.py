@@ -0,0 +1,262 @@
+"""Solver inputs compiled to read-only arrays
+
+A `ProblemInstance` holds everything that `CP` and the `SolutionValidator` read about a routing problem as a struct of
+NumPy arrays with a row per input location: service times, skip cost multipliers, required flags, repeat visits,
+blackout windows in CSR layout (the windows of location i are `window_starts[window_offsets[i]:window_offsets[i + 1]]`),
+appointments, work periods, global blackouts, breaks and the travel time matrix.
+
+It is compiled once from the locations and appointments, reading their optional attributes in one place, and can be
+saved to and loaded from an .npz file to replay a problem exactly:
+
+    problem = ProblemInstance.from_api_params(params)
+    problem.save('problem.npz')
+    run_model('replay', problem_instance=ProblemInstance.load('problem.npz'))
+"""
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pendulum
+
+from phocus.model.location import Location, location_blackout_intervals
+from phocus.utils.epoch import Interval, period_to_interval, to_epoch
+from phocus.utils.mixins import Base
+
+"""Service time of locations without their own, the solver uses its default for them"""
+DEFAULT_SERVICE_SECONDS = -1
+"""Work period start or end node of periods without a start or end location"""
+NO_NODE = -1
+
+LOCATION_STRING_ARRAYS = ('location_ids', 'doctor_names', 'addresses', 'cities', 'states')
+ARRAYS = LOCATION_STRING_ARRAYS + (
+    'lats', 'lons',
+    'service_seconds', 'skip_cost_multipliers', 'is_required', 'num_visits', 'min_visit_gap_days',
+    'window_offsets', 'window_starts', 'window_ends',
+    'appointment_nodes', 'appointment_starts', 'appointment_ends',
+    'work_starts', 'work_ends', 'work_start_nodes', 'work_end_nodes',
+    'blackout_starts', 'blackout_ends',
+    'break_earliest_starts', 'break_latest_starts', 'break_durations',
+    'travel_times',
+)
+
+
+def _timezone(name: str):
+    """The pendulum timezone of a timezone name, or of an offset like +05:00 for fixed offsets"""
+    if name[:1] in ('+', '-'):
+        hours, minutes = name[1:].split(':')
+        sign = -1 if name[0] == '-' else 1
+        return pendulum.tz.fixed_timezone(sign * (int(hours) * 3600 + int(minutes) * 60))
+    return pendulum.timezone(name)
+
+
+def _strings(values) -> np.ndarray:
+    return np.array(['' if value is None else str(value) for value in values], dtype=str)
+
+
+def _array_equal(a: np.ndarray, b: np.ndarray) -> bool:
+    """`np.array_equal` where nan equals nan"""
+    if a.shape != b.shape:
+        return False
+    if a.dtype.kind == 'f':
+        return bool(np.all((a == b) | (np.isnan(a) & np.isnan(b))))
+    return bool(np.all(a == b))
+
+
+def _intervals(intervals: Sequence[Interval]) -> Tuple[np.ndarray, np.ndarray]:
+    intervals = list(intervals)
+    return (np.array([start for start, _ in intervals], dtype=np.int64),
+            np.array([end for _, end in intervals], dtype=np.int64))
+
+
+def location_repeat_visits(locations: Sequence[Location]) -> Tuple[List[int], List[float]]:
+    """The number of visits to each location and the minimum days between them"""
+    num_visits = [getattr(location, 'num_total_visits', 1) for location in locations]
+    min_visit_gap_days = [location.min_visit_gap_days if visits > 1 else 0
+                          for location, visits in zip(locations, num_visits)]
+    return num_visits, min_visit_gap_days
+
+
+class ProblemInstance(Base):
+    """The inputs of a routing problem as read-only arrays, see the module docstring for the layout
+
+    Node i of the arrays is location i, the solver appends its repeat visit and origin nodes after them."""
+    def __init__(self, timezone: str, **arrays):
+        missing = set(ARRAYS) - set(arrays)
+        unknown = set(arrays) - set(ARRAYS)
+        if missing or unknown:
+            raise RuntimeError('Expected the arrays %s, missing %s and unknown %s' % (
+                ', '.join(ARRAYS), sorted(missing), sorted(unknown)))
+
+        self.timezone = timezone
+        for name in ARRAYS:
+            array = np.array(arrays[name])
+            array.flags.writeable = False
+            setattr(self, name, array)
+
+        num_locations = len(self.location_ids)
+        if self.travel_times.shape != (num_locations, num_locations):
+            raise RuntimeError('Expected a %d x %d travel time matrix but got %s' % (
+                num_locations, num_locations, self.travel_times.shape))
+        if len(self.window_offsets) != num_locations + 1 or self.window_offsets[-1] != len(self.window_starts):
+            raise RuntimeError('The window offsets do not match the %d locations and %d windows' % (
+                num_locations, len(self.window_starts)))
+
+    @classmethod
+    def compile(
+            cls,
+            locations: Sequence[Location],
+            distance_matrix,
+            work_periods: Sequence[pendulum.Period],
+            appointments=None,
+            blackout_intervals: Optional[Sequence[Interval]] = None,
+            breaks=None,
+    ) -> 'ProblemInstance':
+        """Compile the inputs of `CP` to a problem instance
+
+        `breaks` are objects with an `earliest_start`, a `latest_start` and a `duration_seconds` like `Break`."""
+        locations = list(locations)
+        nodes_by_id = {}
+        for node, location in enumerate(locations):
+            nodes_by_id.setdefault(location.id, node)
+
+        def node_of(location_id):
+            if location_id is None:
+                return NO_NODE
+            if location_id not in nodes_by_id:
+                raise RuntimeError('Work period location %s is not one of the locations' % location_id)
+            return nodes_by_id[location_id]
+
+        def appointment_node(appointment):
+            if appointment.location.id not in nodes_by_id:
+                raise RuntimeError('The location %s of the appointment with %s at %s - %s is not one of the locations' % (
+                    appointment.location.id, appointment.location.doctor_name, appointment.start_time,
+                    appointment.end_time))
+            return nodes_by_id[appointment.location.id]
+
+        service_seconds = []
+        window_offsets = [0]
+        windows = []
+        for location in locations:
+            visit_time_seconds = getattr(location, 'visit_time_seconds', None)
+            service_seconds.append(DEFAULT_SERVICE_SECONDS if visit_time_seconds is None else visit_time_seconds)
+            windows.extend(location_blackout_intervals(location))
+            window_offsets.append(len(windows))
+        window_starts, window_ends = _intervals(windows)
+        num_visits, min_visit_gap_days = location_repeat_visits(locations)
+
+        appointments = list(appointments) if appointments else []
+        appointment_nodes = [appointment_node(app) for app in appointments]
+        appointment_starts, appointment_ends = _intervals(
+            [(to_epoch(app.start_time), to_epoch(app.end_time)) for app in appointments])
+        work_starts, work_ends = _intervals([period_to_interval(p) for p in work_periods])
+        blackout_starts, blackout_ends = _intervals(blackout_intervals or [])
+        breaks = list(breaks) if breaks else []
+
+        return cls(
+            timezone=min(p.start for p in work_periods).timezone.name,
+            location_ids=_strings(location.id for location in locations),
+            doctor_names=_strings(location.doctor_name for location in locations),
+            addresses=_strings(location.address for location in locations),
+            cities=_strings(location.city for location in locations),
+            states=_strings(location.state for location in locations),
+            lats=np.array([np.nan if location.lat is None else location.lat for location in locations], dtype=np.float64),
+            lons=np.array([np.nan if location.lon is None else location.lon for location in locations], dtype=np.float64),
+            service_seconds=np.array(service_seconds, dtype=np.int64),
+            skip_cost_multipliers=np.array([getattr(location, 'skip_cost_multiplier', 1) for location in locations],
+                                           dtype=np.float64),
+            is_required=np.array([bool(getattr(location, 'is_required', False)) for location in locations], dtype=bool),
+            num_visits=np.array(num_visits, dtype=np.int64),
+            min_visit_gap_days=np.array(min_visit_gap_days, dtype=np.float64),
+            window_offsets=np.array(window_offsets, dtype=np.int64),
+            window_starts=window_starts,
+            window_ends=window_ends,
+            appointment_nodes=np.array(appointment_nodes, dtype=np.int64),
+            appointment_starts=appointment_starts,
+            appointment_ends=appointment_ends,
+            work_starts=work_starts,
+            work_ends=work_ends,
+            work_start_nodes=np.array([node_of(getattr(p, 'start_location_id', None)) for p in work_periods],
+                                      dtype=np.int64),
+            work_end_nodes=np.array([node_of(getattr(p, 'end_location_id', None)) for p in work_periods], dtype=np.int64),
+            blackout_starts=blackout_starts,
+            blackout_ends=blackout_ends,
+            break_earliest_starts=np.array([brk.earliest_start for brk in breaks], dtype=np.int64),
+            break_latest_starts=np.array([brk.latest_start for brk in breaks], dtype=np.int64),
+            break_durations=np.array([brk.duration_seconds for brk in breaks], dtype=np.int64),
+            travel_times=np.asarray(distance_matrix),
+        )
+
+    @classmethod
+    def from_api_params(
+            cls,
+            params,
+            blackout_intervals: Optional[Sequence[Interval]] = None,
+            breaks=None,
+    ) -> 'ProblemInstance':
+        """Compile the locations, appointments, work periods and distances of `phocus.app.APIParams`"""
+        return cls.compile(params.locations, params.distance_matrix, params.work_periods, params.appointments,
+                           blackout_intervals, breaks)
+
+    @property
+    def num_locations(self) -> int:
+        return len(self.location_ids)
+
+    @property
+    def tzinfo(self):
+        """The timezone of the first work period, solutions are formatted in it"""
+        return _timezone(self.timezone)
+
+    def windows(self, node: int) -> List[Interval]:
+        """The blackout windows of location `node`"""
+        start, end = self.window_offsets[node], self.window_offsets[node + 1]
+        return list(zip(self.window_starts[start:end].tolist(), self.window_ends[start:end].tolist()))
+
+    def work_intervals(self) -> List[Interval]:
+        """The work periods in the order they were given"""
+        return list(zip(self.work_starts.tolist(), self.work_ends.tolist()))
+
+    def blackout_intervals(self) -> List[Interval]:
+        """The blackouts of every location"""
+        return list(zip(self.blackout_starts.tolist(), self.blackout_ends.tolist()))
+
+    def break_windows(self) -> List[Tuple[int, int, int]]:
+        """The (earliest start, latest start, duration) of each break"""
+        return list(zip(self.break_earliest_starts.tolist(), self.break_latest_starts.tolist(),
+                        self.break_durations.tolist()))
+
+    def appointment_intervals(self) -> Dict[int, Interval]:
+        """Map of location node -> the epoch interval of its appointment"""
+        return {node: (start, end) for node, start, end in zip(
+            self.appointment_nodes.tolist(), self.appointment_starts.tolist(), self.appointment_ends.tolist())}
+
+    def to_locations(self) -> List[Location]:
+        """Locations with the fields and ids of the compiled locations, for instances that were loaded from a file"""
+        def optional(value):
+            return value if value else None
+
+        return [
+            Location(str(name), optional(str(address)), None if np.isnan(lat) else float(lat),
+                     None if np.isnan(lon) else float(lon), optional(str(city)), optional(str(state)),
+                     id=str(location_id))
+            for location_id, name, address, lat, lon, city, state in zip(
+                self.location_ids, self.doctor_names, self.addresses, self.lats, self.lons, self.cities, self.states)
+        ]
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {name: getattr(self, name) for name in ARRAYS}
+        arrays['timezone'] = np.array(self.timezone)
+        return arrays
+
+    def save(self, path: Union[str, Path]):
+        """Save the arrays to a compressed .npz file"""
+        np.savez_compressed(str(path), **self.to_arrays())
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'ProblemInstance':
+        with np.load(str(path), allow_pickle=False) as data:
+            arrays = {name: data[name] for name in ARRAYS}
+            return cls(timezone=str(data['timezone']), **arrays)
+
+    def equals(self, other: 'ProblemInstance') -> bool:
+        return self.timezone == other.timezone and all(
+            _array_equal(getattr(self, name), getattr(other, name)) for name in ARRAYS)
@@ -1,16 +1,21 @@
+import copy
 import datetime
 import json
 import logging
 from pathlib import Path
-from typing import Sequence
+from typing import Optional, Sequence
 
 from phocus.model.location import Location, locations_dicts
+from phocus.utils.constants import OUTPUT_PATH
 from phocus.utils.files import make_output_dir
 from phocus.utils.mixins import Base
 
 
 logger = logging.getLogger(__name__)
 
+"""Default directory of saved solutions, made when it is first used rather than at import"""
+SOLUTIONS_PATH = OUTPUT_PATH / 'solutions'
+
 
 class Solution(Base):
     def __init__(self, model_name, run_datetime, route, metrics):
@@ -19,23 +24,28 @@ class Solution(Base):
         self.route: Sequence[Location] = route
         self.metrics = metrics
 
-    def save(self, filename, output_dir=make_output_dir() / 'solutions'):
-        output_dir.mkdir(parents=True, exist_ok=True)
-        path = output_dir / filename
-        solution_dict = {
+    def to_dict(self) -> dict:
+        return {
             'model_name': self.model_name,
             'run_datetime': self.run_datetime.replace(microsecond=0).isoformat(),
             'route': locations_dicts(self.route),
-            'metrics': self.metrics
+            'metrics': copy.deepcopy(self.metrics)
         }
+
+    def save(self, filename, output_dir: Optional[Path] = None):
+        output_dir = output_dir if output_dir is not None else SOLUTIONS_PATH
+        output_dir.mkdir(parents=True, exist_ok=True)
+        path = output_dir / filename
         with path.open(mode='w') as f:
-            json.dump(solution_dict, f, indent=2)
+            json.dump(self.to_dict(), f, indent=2)
 
     @staticmethod
     def load(path: Path):
         with path.open() as f:
-            solution_json = json.load(f)
+            return Solution.from_dict(json.load(f))
 
+    @staticmethod
+    def from_dict(solution_json: dict):
         return Solution(
             model_name=solution_json['model_name'],
             run_datetime=datetime.datetime.strptime(solution_json['run_datetime'], '%Y-%m-%dT%H:%M:%S'),
@@ -44,14 +54,20 @@ class Solution(Base):
         )
 
 
-def solution_str_paths(output_dir=make_output_dir() / 'solutions'):
+def solution_str_paths(output_dir: Optional[Path] = None):
+    output_dir = output_dir if output_dir is not None else make_output_dir(SOLUTIONS_PATH)
     return [str(x) for x in output_dir.iterdir()]
 
 
-def load_all_solutions(output_dir=make_output_dir() / 'solutions'):
+def load_all_solutions(output_dir: Optional[Path] = None):
+    from phocus.model.solution_sink import SOLUTIONS_FILE_SUFFIX, load_solutions_jsonl  # Avoid circular import
+    output_dir = output_dir if output_dir is not None else make_output_dir(SOLUTIONS_PATH)
     solutions = []
     paths = sorted(output_dir.resolve().iterdir())
     for path in paths:
         logger.info('Loading solution %s', path)
-        solutions.append(Solution.load(path))
+        if path.name.endswith(SOLUTIONS_FILE_SUFFIX):
+            solutions.extend(load_solutions_jsonl(path))
+        else:
+            solutions.append(Solution.load(path))
     return solutions
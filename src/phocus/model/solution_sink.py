@@ -0,0 +1,244 @@
+"""Persistence of solutions off the request path
+
+`run_model` submits every solution to a sink. `BackgroundSolutionSink` queues them and a writer thread appends them
+in batches to a gzipped JSON lines file per day and process, so writing to disk never adds to the latency of a request.
+"""
+import abc
+import atexit
+import datetime
+import gzip
+import json
+import multiprocessing
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from phocus.model.solution import SOLUTIONS_PATH, Solution
+from phocus.model.solution_store import SolutionStore, solution_store as default_solution_store
+from phocus.utils.mixins import Base
+
+SOLUTIONS_FILE_PREFIX = 'solutions-'
+SOLUTIONS_FILE_SUFFIX = '.jsonl.gz'
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL_SECONDS = 1.
+DEFAULT_MAX_QUEUE_SIZE = 10000
+DEFAULT_RETENTION_DAYS = 30
+"""Seconds to wait at exit for the queued solutions to be written"""
+DEFAULT_CLOSE_TIMEOUT_SECONDS = 30.
+
+
+class SolutionSink(Base, abc.ABC):
+    """Where solutions are persisted"""
+    @abc.abstractmethod
+    def submit(self, solution: Solution, name: str):
+        pass
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every submitted solution is persisted, returning False on timeout"""
+        return True
+
+    def close(self, timeout: Optional[float] = None):
+        self.flush(timeout)
+
+
+class NullSolutionSink(SolutionSink):
+    """Drops solutions, for latency critical calls"""
+    def submit(self, solution: Solution, name: str):
+        self.log.debug('Not persisting solution %s', name)
+
+
+class FileSolutionSink(SolutionSink):
+    """Saves each solution synchronously as its own JSON file with `Solution.save`"""
+    def __init__(self, output_dir: Optional[Path] = None):
+        self.output_dir = output_dir if output_dir is not None else SOLUTIONS_PATH
+
+    def submit(self, solution: Solution, name: str):
+        solution.save(name + '.json', self.output_dir)
+
+
+class BackgroundSolutionSink(SolutionSink):
+    """Appends solutions to a gzipped JSON lines file per day and process from a writer thread
+
+    `submit` never blocks: solutions are dropped with a warning when the queue is full. The writer thread is started
+    by the first submit and `close`, which also runs at exit, writes what is still queued. Child processes like the
+    workers of `plan_routes` may exit without running atexit hooks, so they write each solution synchronously instead.
+    Each process appends to its own file and each batch is written as its own gzip member, so files stay readable if
+    the process dies while writing. Batches are also added to `store` if it is given so that dashboards can query them.
+    Files and stored solutions older than `retention_days` are deleted.
+    """
+    def __init__(
+            self,
+            output_dir: Optional[Path] = None,
+            batch_size: int = DEFAULT_BATCH_SIZE,
+            flush_interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS,
+            max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+            retention_days: Optional[int] = DEFAULT_RETENTION_DAYS,
+            store: Optional[SolutionStore] = None,
+    ):
+        # Made by the first write, so importing the module does not create it
+        self.output_dir = output_dir if output_dir is not None else SOLUTIONS_PATH
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.num_dropped = 0
+        self.num_written = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self._last_retention_date = None
+        self._closed = False
+
+    def submit(self, solution: Solution, name: str):
+        # The dict is made now since callers may keep changing the metrics of the solution
+        solution_dict = solution.to_dict()
+        solution_dict['name'] = name
+        if self._closed or multiprocessing.current_process().name != 'MainProcess':
+            self._write_now([solution_dict])
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(solution_dict)
+        except queue.Full:
+            self.num_dropped += 1
+            self.log.warning('Solution queue is full, dropping solution %s', name)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        if self._thread is None:
+            return True
+        flushed = threading.Event()
+        try:
+            self._queue.put(flushed, timeout=timeout)
+        except queue.Full:
+            return False
+        return flushed.wait(timeout)
+
+    def close(self, timeout: Optional[float] = DEFAULT_CLOSE_TIMEOUT_SECONDS):
+        """Write the queued solutions and stop the writer thread, later solutions are written synchronously"""
+        with self._thread_lock:
+            self._closed = True
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            self.log.warning('Solution queue did not drain, %d solutions were not persisted', self._queue.qsize())
+            return
+        thread.join(timeout)
+        if thread.is_alive():
+            self.log.warning('Solution writer did not finish within %s seconds', timeout)
+            return
+        # Solutions submitted while closing
+        remaining = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is not None:
+                remaining.append(item)
+        self._write_now(remaining)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name='solution-sink', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            batch, flushed_events, stop = self._next_batch()
+            self._write_now(batch)
+            for event in flushed_events:
+                event.set()
+            if stop:
+                return
+
+    def _write_now(self, batch: List[dict]):
+        try:
+            if batch:
+                self._write(batch)
+            self._apply_retention()
+        except Exception:
+            self.log.exception('Error persisting %d solutions', len(batch))
+
+    def _next_batch(self):
+        """Block for the first item then take whatever else arrives within the flush interval
+
+        Also returns whether `close` asked the thread to stop after writing the batch."""
+        batch: List[dict] = []
+        flushed_events: List[threading.Event] = []
+        item = self._queue.get()
+        while True:
+            if item is None:
+                return batch, flushed_events, True
+            if isinstance(item, threading.Event):
+                # Write everything submitted before the flush right away
+                flushed_events.append(item)
+                return batch, flushed_events, False
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, flushed_events, False
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                return batch, flushed_events, False
+
+    def _write(self, batch: List[dict]):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        path = self.output_dir / solutions_filename(datetime.date.today(), os.getpid())
+        lines = ''.join(json.dumps(solution_dict) + '\n' for solution_dict in batch)
+        with gzip.open(str(path), mode='at') as f:
+            f.write(lines)
+        if self.store is not None:
+            self.store.add_dicts(batch)
+        self.num_written += len(batch)
+        self.log.debug('Wrote %d solutions to %s', len(batch), path)
+
+    def _apply_retention(self):
+        today = datetime.date.today()
+        if self.retention_days is None or self._last_retention_date == today:
+            return
+        self._last_retention_date = today
+        oldest_kept = today - datetime.timedelta(days=self.retention_days)
+        for path in self.output_dir.glob(SOLUTIONS_FILE_PREFIX + '*' + SOLUTIONS_FILE_SUFFIX):
+            date = solutions_file_date(path)
+            if date is not None and date < oldest_kept:
+                self.log.info('Removing solutions older than %d days: %s', self.retention_days, path)
+                path.unlink()
+        if self.store is not None:
+            self.store.delete_before(datetime.datetime.combine(oldest_kept, datetime.time()))
+
+
+def solutions_filename(date: datetime.date, pid: Optional[int] = None) -> str:
+    """The file of the solutions written on `date` by process `pid`, concurrent appends to one gzip file interleave"""
+    process_suffix = '' if pid is None else '-%d' % pid
+    return SOLUTIONS_FILE_PREFIX + date.isoformat() + process_suffix + SOLUTIONS_FILE_SUFFIX
+
+
+def solutions_file_date(path: Path) -> Optional[datetime.date]:
+    """The date of a file written by `BackgroundSolutionSink` or None for other files"""
+    if not (path.name.startswith(SOLUTIONS_FILE_PREFIX) and path.name.endswith(SOLUTIONS_FILE_SUFFIX)):
+        return None
+    date_str = path.name[len(SOLUTIONS_FILE_PREFIX):len(SOLUTIONS_FILE_PREFIX) + len('YYYY-MM-DD')]
+    try:
+        return datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def load_solutions_jsonl(path: Path) -> Iterator[Solution]:
+    """Load the solutions written by `BackgroundSolutionSink` to `path`"""
+    with gzip.open(str(path), mode='rt') as f:
+        for line in f:
+            if line.strip():
+                yield Solution.from_dict(json.loads(line))
+
+
+"""SolutionSink Singleton used by run_model"""
+solution_sink = BackgroundSolutionSink(store=default_solution_store)
@@ -0,0 +1,314 @@
+"""SQLite index of persisted solutions
+
+Solutions are stored as one row of indexed summary columns plus the route stored column-wise in a separate table,
+so listing and filtering solutions never reads or parses routes. The route of a `StoredSolution` is only loaded when
+it is used.
+
+Existing solution files can be imported with `python -m phocus.model.solution_store import-files`.
+"""
+import datetime
+import json
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import click
+
+from phocus.model.location import Location
+from phocus.model.solution import SOLUTIONS_PATH, Solution
+from phocus.utils.constants import OUTPUT_PATH
+from phocus.utils.mixins import Base
+
+DEFAULT_STORE_PATH = OUTPUT_PATH / 'solutions.sqlite'
+RUN_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+"""Metrics that are copied into their own indexed columns"""
+INDEXED_METRICS = ('total_travel_time', 'total_idle_time', 'running_time')
+ORDER_BY_COLUMNS = {'id', 'model_name', 'run_datetime', 'num_visits', 'objective_cost'} | set(INDEXED_METRICS)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS solutions (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    model_name TEXT NOT NULL,
+    run_datetime TEXT NOT NULL,
+    num_visits INTEGER NOT NULL,
+    objective_cost REAL,
+    total_travel_time REAL,
+    total_idle_time REAL,
+    running_time REAL,
+    metrics TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS solutions_model_name ON solutions (model_name, run_datetime);
+CREATE INDEX IF NOT EXISTS solutions_run_datetime ON solutions (run_datetime);
+CREATE INDEX IF NOT EXISTS solutions_objective_cost ON solutions (objective_cost);
+CREATE TABLE IF NOT EXISTS routes (
+    solution_id INTEGER PRIMARY KEY REFERENCES solutions (id),
+    columns BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS imported_files (
+    path TEXT PRIMARY KEY,
+    solution_id INTEGER REFERENCES solutions (id)
+);
+''' + ''.join(
+    'CREATE INDEX IF NOT EXISTS solutions_%s ON solutions (%s);\n' % (metric, metric) for metric in INDEXED_METRICS)
+
+"""Created after the migration of stores whose imported_files have no solution_id"""
+_IMPORTED_FILES_INDEX = 'CREATE INDEX IF NOT EXISTS imported_files_solution_id ON imported_files (solution_id)'
+
+
+class StoredSolution(Solution):
+    """A solution from a `SolutionStore` that loads its route on first use"""
+    def __init__(self, store: 'SolutionStore', solution_id: int, name, model_name, run_datetime, metrics):
+        self.store = store
+        self.solution_id = solution_id
+        self.name = name
+        super().__init__(model_name, run_datetime, None, metrics)
+
+    @property
+    def route(self) -> List[Location]:
+        if self._route is None:
+            self._route = self.store.load_route(self.solution_id)
+        return self._route
+
+    @route.setter
+    def route(self, route):
+        self._route = route
+
+
+def route_to_columns(route_dicts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Transpose route location dicts to a list of values per key
+
+    The positions of the locations that don't have a key are listed under `missing` so they can be left out again."""
+    keys = []
+    for location_dict in route_dicts:
+        keys.extend(k for k in location_dict if k not in keys)
+    missing = {}
+    for k in keys:
+        positions = [i for i, location_dict in enumerate(route_dicts) if k not in location_dict]
+        if positions:
+            missing[k] = positions
+    return {
+        'num_locations': len(route_dicts),
+        'values': {k: [location_dict.get(k) for location_dict in route_dicts] for k in keys},
+        'missing': missing,
+    }
+
+
+def columns_to_route(columns: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The inverse of `route_to_columns`"""
+    route_dicts = [{} for _ in range(columns['num_locations'])]
+    for k, values in columns['values'].items():
+        missing = set(columns['missing'].get(k, ()))
+        for i, value in enumerate(values):
+            if i not in missing:
+                route_dicts[i][k] = value
+    return route_dicts
+
+
+class SolutionStore(Base):
+    """SQLite store of solutions with indexes on model name, run datetime and key metrics
+
+    The database is opened on first use. A single connection is shared between threads behind a lock."""
+    def __init__(self, path: Path = DEFAULT_STORE_PATH):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._connection is None:
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+                self._connection.executescript(_SCHEMA)
+                self._migrate_imported_files()
+                self._connection.execute(_IMPORTED_FILES_INDEX)
+            return self._connection
+
+    def _migrate_imported_files(self):
+        """Link the imported files of stores from before imported_files had a solution_id to their solutions"""
+        connection = self._connection
+        if 'solution_id' in [row[1] for row in connection.execute('PRAGMA table_info(imported_files)')]:
+            return
+        with connection:
+            connection.execute('ALTER TABLE imported_files ADD COLUMN solution_id INTEGER REFERENCES solutions (id)')
+            paths = [row[0] for row in connection.execute('SELECT path FROM imported_files')]
+            # Imported solutions are named after the stem of their file
+            connection.executemany(
+                'UPDATE imported_files SET solution_id = (SELECT MIN(id) FROM solutions WHERE name = ?) WHERE path = ?',
+                [(Path(path).stem, path) for path in paths])
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def add(self, solution: Solution, name: Optional[str] = None) -> int:
+        solution_dict = solution.to_dict()
+        solution_dict['name'] = name
+        return self.add_dicts([solution_dict])[0]
+
+    def add_dicts(self, solution_dicts: Iterable[Dict[str, Any]]) -> List[int]:
+        """Add solutions in the format of `Solution.to_dict` in a single transaction"""
+        with self._lock, self.connection:
+            return self._insert(solution_dicts)
+
+    def _insert(self, solution_dicts: Iterable[Dict[str, Any]]) -> List[int]:
+        ids = []
+        with self._lock:
+            for solution_dict in solution_dicts:
+                metrics = solution_dict.get('metrics') or {}
+                objective_costs = metrics.get('objective_costs') or {}
+                cursor = self.connection.execute(
+                    'INSERT INTO solutions (name, model_name, run_datetime, num_visits, objective_cost, '
+                    'total_travel_time, total_idle_time, running_time, metrics) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        solution_dict.get('name'),
+                        solution_dict['model_name'],
+                        solution_dict['run_datetime'],
+                        len(solution_dict['route']),
+                        objective_costs.get('total'),
+                    ) + tuple(metrics.get(metric) for metric in INDEXED_METRICS) + (json.dumps(metrics),)
+                )
+                columns = zlib.compress(json.dumps(route_to_columns(solution_dict['route'])).encode())
+                self.connection.execute('INSERT INTO routes (solution_id, columns) VALUES (?, ?)',
+                                        (cursor.lastrowid, columns))
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def query(
+            self,
+            model_name: Optional[str] = None,
+            since: Optional[datetime.datetime] = None,
+            until: Optional[datetime.datetime] = None,
+            max_total_travel_time: Optional[float] = None,
+            order_by: str = 'run_datetime',
+            descending: bool = True,
+            limit: Optional[int] = None,
+    ) -> List[StoredSolution]:
+        """The solutions matching every filter that is given, without their routes"""
+        if order_by not in ORDER_BY_COLUMNS:
+            raise RuntimeError('Cannot order solutions by %s, expected one of %s' % (order_by, sorted(ORDER_BY_COLUMNS)))
+
+        conditions = []
+        params = []
+        if model_name is not None:
+            conditions.append('model_name = ?')
+            params.append(model_name)
+        if since is not None:
+            conditions.append('run_datetime >= ?')
+            params.append(since.strftime(RUN_DATETIME_FORMAT))
+        if until is not None:
+            conditions.append('run_datetime < ?')
+            params.append(until.strftime(RUN_DATETIME_FORMAT))
+        if max_total_travel_time is not None:
+            conditions.append('total_travel_time <= ?')
+            params.append(max_total_travel_time)
+
+        sql = 'SELECT id, name, model_name, run_datetime, metrics FROM solutions'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY %s %s' % (order_by, 'DESC' if descending else 'ASC')
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        with self._lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        return [self._solution_from_row(row) for row in rows]
+
+    def get(self, solution_id: int) -> StoredSolution:
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT id, name, model_name, run_datetime, metrics FROM solutions WHERE id = ?',
+                (solution_id,)).fetchone()
+        if row is None:
+            raise RuntimeError('No solution with id %s' % solution_id)
+        return self._solution_from_row(row)
+
+    def load_route(self, solution_id: int) -> List[Location]:
+        with self._lock:
+            row = self.connection.execute('SELECT columns FROM routes WHERE solution_id = ?',
+                                          (solution_id,)).fetchone()
+        if row is None:
+            raise RuntimeError('No route for solution with id %s' % solution_id)
+        columns = json.loads(zlib.decompress(row[0]).decode())
+        return [Location(**location_dict) for location_dict in columns_to_route(columns)]
+
+    def delete_before(self, run_datetime: datetime.datetime, include_imported: bool = False) -> int:
+        """Delete the solutions that were run before `run_datetime`, returning how many were deleted
+
+        Solutions imported from files are history that is only deleted if `include_imported`, their files are then
+        forgotten so they can be imported again."""
+        conditions = 'run_datetime < ?'
+        if not include_imported:
+            conditions += ' AND id NOT IN (SELECT solution_id FROM imported_files WHERE solution_id IS NOT NULL)'
+        deleted_ids = 'SELECT id FROM solutions WHERE ' + conditions
+        params = (run_datetime.strftime(RUN_DATETIME_FORMAT),)
+        with self._lock, self.connection:
+            self.connection.execute('DELETE FROM routes WHERE solution_id IN (%s)' % deleted_ids, params)
+            self.connection.execute('DELETE FROM imported_files WHERE solution_id IN (%s)' % deleted_ids, params)
+            return self.connection.execute('DELETE FROM solutions WHERE ' + conditions, params).rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute('SELECT COUNT(*) FROM solutions').fetchone()[0]
+
+    def _solution_from_row(self, row) -> StoredSolution:
+        solution_id, name, model_name, run_datetime, metrics = row
+        return StoredSolution(
+            self,
+            solution_id,
+            name,
+            model_name,
+            datetime.datetime.strptime(run_datetime, RUN_DATETIME_FORMAT),
+            json.loads(metrics),
+        )
+
+    def import_files(self, output_dir: Path = SOLUTIONS_PATH) -> int:
+        """Add the solutions of every JSON file saved by `Solution.save` in `output_dir` that has not been imported yet
+
+        Solutions persisted by the default `BackgroundSolutionSink` are already added to the store as they are written.
+        """
+        with self._lock:
+            imported = {row[0] for row in self.connection.execute('SELECT path FROM imported_files')}
+
+        num_imported = 0
+        for path in sorted(Path(output_dir).resolve().iterdir()):
+            if path.suffix != '.json' or str(path) in imported:
+                continue
+
+            self.log.info('Importing solution %s', path)
+            solution_dict = Solution.load(path).to_dict()
+            solution_dict['name'] = path.stem
+            with self._lock, self.connection:
+                solution_id, = self._insert([solution_dict])
+                self.connection.execute('INSERT INTO imported_files (path, solution_id) VALUES (?, ?)',
+                                        (str(path), solution_id))
+            num_imported += 1
+        return num_imported
+
+
+"""SolutionStore Singleton of the default store"""
+solution_store = SolutionStore()
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command('import-files')
+@click.option('--output-dir', type=click.Path(exists=True, file_okay=False), default=None)
+def import_files_command(output_dir):
+    """Import solution files into the solution store"""
+    num_imported = solution_store.import_files(Path(output_dir)) if output_dir else solution_store.import_files()
+    click.echo('Imported %d solutions into %s' % (num_imported, solution_store.path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Predicted travel times for pairs that are not in the travel time cache
+
+`TravelTimePredictor` is a random forest trained on the cached trips. The spread of the predictions of its trees is the
+uncertainty of a prediction, so only the pairs it is unsure about need to be fetched. It needs the optional
+scikit-learn package.
+
+    python -m phocus.traffic.travel_time_predictor train --output travel_time_predictor.pkl
+"""
+import json
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import click
+import numpy as np
+
+from phocus.utils.constants import CACHE_DIR
+from phocus.utils.geo import haversine_meters
+from phocus.utils.mixins import Base
+
+DEFAULT_PREDICTOR_PATH = CACHE_DIR / 'travel_time_predictor.pkl'
+DEFAULT_NUM_TREES = 100
+DEFAULT_TEST_FRACTION = 0.2
+"""Predictions whose standard deviation across trees is larger than this fraction of the prediction are fetched"""
+DEFAULT_MAX_RELATIVE_UNCERTAINTY = 0.1
+MINUTES_PER_DAY = 24 * 60
+
+
+def _random_forest(num_trees: int, random_state: int):
+    try:
+        from sklearn.ensemble import RandomForestRegressor
+    except ImportError:
+        raise RuntimeError('Predicting travel times needs scikit-learn, try `pip install scikit-learn`')
+    return RandomForestRegressor(n_estimators=num_trees, random_state=random_state, n_jobs=-1)
+
+
+def _metadata_path(path: Path) -> Path:
+    return Path(str(path) + '.json')
+
+
+class TravelTimePredictor(Base):
+    """Random forest of travel times from coordinates, great circle distance and departure time
+
+    Departures are the buckets of `TravelTimeCache` that are `bucket_minutes` long slots of the week."""
+    def __init__(self, model=None, bucket_minutes: int = 60, metadata: Optional[Dict] = None):
+        self.model = model
+        self.bucket_minutes = bucket_minutes
+        self.metadata = metadata if metadata is not None else {}
+
+    def features(self, origins: np.ndarray, destinations: np.ndarray, buckets: np.ndarray) -> np.ndarray:
+        """A row of features per trip between (n, 2) origins and destinations"""
+        minute_of_week = np.asarray(buckets, dtype=np.float64) * self.bucket_minutes
+        return np.column_stack([
+            origins,
+            destinations,
+            haversine_meters(origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1]),
+            (minute_of_week % MINUTES_PER_DAY) / 60,
+            minute_of_week // MINUTES_PER_DAY,
+        ])
+
+    def train(
+            self,
+            origins: np.ndarray,
+            destinations: np.ndarray,
+            buckets: np.ndarray,
+            seconds: np.ndarray,
+            num_trees: int = DEFAULT_NUM_TREES,
+            test_fraction: float = DEFAULT_TEST_FRACTION,
+            random_state: int = 0,
+    ) -> Dict:
+        """Fit the model to trips, holding out `test_fraction` of them to measure the error"""
+        features = self.features(origins, destinations, buckets)
+        seconds = np.asarray(seconds, dtype=np.float64)
+        order = np.random.RandomState(random_state).permutation(len(seconds))
+        num_test = int(len(seconds) * test_fraction)
+        test, train = order[:num_test], order[num_test:]
+        if not len(train):
+            raise RuntimeError('Cannot train a travel time predictor without trips')
+
+        self.log.info('Training on %d trips and testing on %d', len(train), len(test))
+        self.model = _random_forest(num_trees, random_state)
+        self.model.fit(features[train], seconds[train])
+
+        self.metadata = {'num_train': len(train), 'num_test': len(test), 'bucket_minutes': self.bucket_minutes}
+        if len(test):
+            predictions, uncertainties = self._predict_features(features[test])
+            errors = predictions - seconds[test]
+            relative_errors = np.abs(errors) / np.maximum(seconds[test], 1)
+            self.metadata.update({
+                'mean_absolute_error': float(np.mean(np.abs(errors))),
+                'root_mean_squared_error': float(np.sqrt(np.mean(errors ** 2))),
+                'relative_error_quantiles': {
+                    str(q): float(np.percentile(relative_errors, 100 * q)) for q in (0.5, 0.9, 0.95, 0.99)},
+                'mean_relative_uncertainty': float(np.mean(uncertainties / np.maximum(predictions, 1))),
+            })
+        self.log.info('Travel time predictor: %s', self.metadata)
+        return self.metadata
+
+    def train_from_cache(self, cache=None, **kwargs) -> Dict:
+        from phocus.utils.travel_time_cache import travel_time_cache
+
+        cache = cache if cache is not None else travel_time_cache
+        self.bucket_minutes = cache.bucket_minutes
+        origins, destinations, buckets, seconds = cache.trips()
+        # Trips to the same place teach nothing
+        is_trip = seconds > 0
+        return self.train(origins[is_trip], destinations[is_trip], buckets[is_trip], seconds[is_trip], **kwargs)
+
+    def predict(self, origins: np.ndarray, destinations: np.ndarray, buckets) -> Tuple[np.ndarray, np.ndarray]:
+        """The predicted seconds of each trip and the standard deviation of the predictions of the trees"""
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        destinations = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+        buckets = np.broadcast_to(np.asarray(buckets), (len(origins),))
+        return self._predict_features(self.features(origins, destinations, buckets))
+
+    def _predict_features(self, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self.model is None:
+            raise RuntimeError('The travel time predictor has not been trained')
+        tree_predictions = np.stack([tree.predict(features) for tree in self.model.estimators_])
+        return tree_predictions.mean(axis=0), tree_predictions.std(axis=0)
+
+    def save(self, path: Path = DEFAULT_PREDICTOR_PATH):
+        import joblib
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        joblib.dump(self.model, str(path))
+        with open(str(_metadata_path(path)), 'w') as f:
+            json.dump(self.metadata, f, indent=2)
+
+    @classmethod
+    def load(cls, path: Path = DEFAULT_PREDICTOR_PATH) -> 'TravelTimePredictor':
+        import joblib
+
+        with open(str(_metadata_path(path))) as f:
+            metadata = json.load(f)
+        return cls(joblib.load(str(path)), metadata.get('bucket_minutes', 60), metadata)
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.option('--output', type=click.Path(dir_okay=False), default=str(DEFAULT_PREDICTOR_PATH))
+@click.option('--num-trees', default=DEFAULT_NUM_TREES)
+def train(output, num_trees):
+    """Train a travel time predictor on the travel time cache"""
+    predictor = TravelTimePredictor()
+    metadata = predictor.train_from_cache(num_trees=num_trees)
+    predictor.save(Path(output))
+    click.echo(json.dumps(metadata, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -28,6 +28,7 @@ import json
 from collections import OrderedDict
 
 import phocus.utils.constants as constants
+from phocus.utils.geocoder import geocoder
 from phocus.utils.maps import lat_lon, AmbiguousAddressError
 
 # constant Excel Spread Sheet name
@@ -68,6 +69,14 @@ class DataExercise:
     def create_dict_and_json(self):
         """Creates a dictionary of data and writes it to a .json file.
         """
+        # geocodes every address at once so lat_lon below only reads the geocode cache
+        addresses = []
+        for row in range(1, self.sh.nrows):
+            rowvalues = self.sh.row_values(row)
+            if rowvalues[2] and rowvalues[4]:
+                addresses.append(', '.join((rowvalues[2], rowvalues[4], 'Maryland')))
+        geocoder.geocode_many(addresses)
+
         # iterates throw each row in worksheet
         for row in range(1, self.sh.nrows):
             self.list_of_availability = []
@@ -15,6 +15,7 @@ import json
 from collections import OrderedDict
 
 import phocus.utils.constants as constants
+from phocus.utils.geocoder import geocoder
 from phocus.utils.maps import lat_lon, AmbiguousAddressError
 
 EXCEL_PATH = constants.DATA_PATH / "Elena Routing 2018 - Optimizer Analysis.xlsx"
@@ -53,6 +54,14 @@ class DataExercise:
     def create_dict_and_json(self):
         """Creates a dictionary of data and writes it to a .json file.
         """
+        # geocodes every address at once so lat_lon below only reads the geocode cache
+        addresses = []
+        for row in range(9, self.sh.nrows):
+            rowvalues = self.sh.row_values(row)
+            if rowvalues[3] and rowvalues[4]:
+                addresses.append(', '.join((rowvalues[3], rowvalues[4], 'NY')))
+        geocoder.geocode_many(addresses)
+
         # iterates throw each row in worksheet
         for row in range(9, self.sh.nrows):
             self.list_of_availability = []
@@ -1,3 +1,4 @@
+import collections.abc
 import logging
 from contextlib import contextmanager
 from timeit import default_timer as timer
@@ -5,9 +6,7 @@ from timeit import default_timer as timer
 from datetime import datetime
 from pathlib import Path
 
-from joblib import Memory
-
-import phocus.utils.files
+from phocus.utils.cache_manager import CacheManager
 from phocus.utils.constants import CACHE_DIR
 
 logger = logging.getLogger(__name__)
@@ -19,6 +18,8 @@ def current_isotime_for_filename():
 
 def bootstrap_project(log_title='phocus'):
     """Setup logging and other required setup for running project"""
+    import phocus.utils.files
+
     output_path = phocus.utils.files.make_output_dir() / 'logs'
     output_path.mkdir(parents=True, exist_ok=True)
     log_filename = f'{log_title}-{current_isotime_for_filename()}.log'
@@ -46,6 +47,28 @@ class HashableDict(dict):
         return self.__key() == other.__key()
 
 
+class LazySequence(collections.abc.Sequence):
+    """A sequence that is loaded on first use, for module level data that should not be loaded on import"""
+    def __init__(self, load):
+        self._load = load
+        self._items = None
+
+    @property
+    def items(self) -> list:
+        if self._items is None:
+            self._items = list(self._load())
+        return self._items
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.items if self._items is not None else '...')
+
+
 @contextmanager
 def log_time_context_manager(name):
     """Context manager that logs the time that it is open"""
@@ -55,5 +78,5 @@ def log_time_context_manager(name):
     logger.info('%s completed after %.0f seconds', name, end - start)
 
 
-"""job.Memory Singleton for use for memoization"""
-memory = Memory(cachedir=str(CACHE_DIR), verbose=0)
+"""CacheManager Singleton for use for memoization, a bounded joblib.Memory that is created on first use"""
+memory = CacheManager(CACHE_DIR)
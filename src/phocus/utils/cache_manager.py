@@ -0,0 +1,517 @@
+"""Bounded joblib memoization
+
+`CacheManager` wraps `joblib.Memory` to keep the cache within a size and age limit, evicting the least recently used
+entries first. Entries can be compacted from a directory with a pickle and metadata.json each into one compressed SQLite
+pack per function, which keeps the metadata so `cached_calls` can still read the arguments of each call. Hits, misses
+and their latency are counted per function, and the argument hashes of recent calls are remembered so repeated calls
+with the same coordinates or locations do not hash them again.
+
+Calls never wait for the cache to be pruned, the size is checked on a background thread every `PRUNE_EVERY_MISSES`
+misses. The access times of packed entries are written in batches rather than on every hit, so processes sharing
+a pack rarely wait on its lock.
+
+    python -m phocus.utils.cache_manager info
+    python -m phocus.utils.cache_manager prune --max-gb 2 --max-age-days 90
+    python -m phocus.utils.cache_manager compact
+"""
+import atexit
+import functools
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict, defaultdict, namedtuple
+from contextlib import closing
+from datetime import date, datetime
+from pathlib import Path
+from timeit import default_timer as timer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import click
+
+from phocus.utils.constants import CACHE_DIR
+from phocus.utils.mixins import Base
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+"""Default age limit of the prune command, the cache manager has no age limit unless given one"""
+DEFAULT_MAX_AGE_DAYS = 90
+"""Argument hashes remembered per function"""
+DEFAULT_MAX_ARGUMENT_HASHES = 1024
+"""Misses between checks of the size of the cache"""
+PRUNE_EVERY_MISSES = 100
+"""Hits of packed entries between writes of their access times"""
+WRITE_ACCESSES_EVERY_HITS = 100
+"""Seconds to wait for a pack locked by another process"""
+PACK_TIMEOUT_SECONDS = 10
+"""Prefix of the first line of the function code joblib stores"""
+FIRST_LINE_TEXT = '# first line:'
+PACK_FILENAME = 'packed.sqlite'
+OUTPUT_FILENAME = 'output.pkl'
+METADATA_FILENAME = 'metadata.json'
+SECONDS_PER_DAY = 24 * 60 * 60
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    output BLOB NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL,
+    metadata TEXT
+);
+'''
+
+"""A cached output, in a joblib directory at `path` or a row of the pack at `path` if `packed`"""
+CacheEntry = namedtuple('CacheEntry', 'function key path size created last_access packed')
+
+_HASHABLE_TYPES = (str, bytes, int, float, bool, type(None), date, datetime)
+
+
+class CacheStats(object):
+    """Hits and misses of a cached function and the seconds they took"""
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.hit_seconds = 0.
+        self.miss_seconds = 0.
+
+    @property
+    def hit_rate(self) -> float:
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.
+
+    def to_dict(self) -> Dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'mean_hit_seconds': self.hit_seconds / self.hits if self.hits else 0.,
+            'mean_miss_seconds': self.miss_seconds / self.misses if self.misses else 0.,
+        }
+
+
+def _fast_key(value):
+    """A key of plain immutable data that is cheap to hash, None for anything else
+
+    Types are part of the key so that 1, 1.0 and True, which hash the same, are different keys. Locations are keyed
+    by the state they are pickled and so joblib hashed with."""
+    if isinstance(value, _HASHABLE_TYPES):
+        return type(value), value
+    if isinstance(value, (tuple, list)):
+        items = tuple(_fast_key(item) for item in value)
+        return None if None in items else (type(value), items)
+    if isinstance(value, dict):
+        if all(type(k) is str for k in value):
+            items = tuple((k, _fast_key(v)) for k, v in sorted(value.items()))
+            return None if any(item[1] is None for item in items) else (dict, items)
+        items = tuple((_fast_key(k), _fast_key(v)) for k, v in sorted(value.items(), key=lambda item: repr(item[0])))
+        return None if any(None in item for item in items) else (dict, items)
+
+    from phocus.model.location import Location  # Avoid circular import
+
+    if isinstance(value, Location):
+        state = _fast_key(value.__reduce_ex__(pickle.HIGHEST_PROTOCOL)[2])
+        return None if state is None else (type(value), state)
+    return None
+
+
+class CachedFunction(object):
+    """A function memoized by a `CacheManager` in the cache layout of joblib, joblib is only imported on the first call
+
+    Outputs cached by `joblib.Memory.cache` are hits and the other way around."""
+    def __init__(self, manager: 'CacheManager', func, max_argument_hashes: int = DEFAULT_MAX_ARGUMENT_HASHES):
+        self.manager = manager
+        self.func = func
+        self.max_argument_hashes = max_argument_hashes
+        self._func_id = None
+        self._argument_hashes = OrderedDict()
+        self._checked_code = False
+        functools.update_wrapper(self, func)
+
+    @property
+    def func_id(self) -> str:
+        """The directory of the function in the cache, like `phocus/utils/maps/gmaps_distance_matrix`"""
+        if self._func_id is None:
+            from joblib.func_inspect import get_func_name
+
+            modules, name = get_func_name(self.func)
+            self._func_id = os.path.join(*(modules + [name]))
+        return self._func_id
+
+    @property
+    def stats(self) -> CacheStats:
+        return self.manager.stats[self.func_id]
+
+    def __call__(self, *args, **kwargs):
+        start = timer()
+        if not self._checked_code:
+            self.check_code()
+
+        key = self.argument_hash(*args, **kwargs)
+        try:
+            output = self.manager.load(self.func_id, key)
+        except KeyError:
+            output = self.func(*args, **kwargs)
+            self.manager.store(self.func_id, key, output, {
+                'duration': timer() - start,
+                'input_args': {name: repr(value) for name, value in self._arguments(args, kwargs).items()},
+            })
+            self.stats.misses += 1
+            self.stats.miss_seconds += timer() - start
+            self.manager.on_miss()
+        else:
+            self.stats.hits += 1
+            self.stats.hit_seconds += timer() - start
+        return output
+
+    def check_code(self):
+        """Like joblib, clear the cache of the function if its code changed, checked on the first call only"""
+        from joblib.func_inspect import get_func_code
+
+        func_code, _, first_line = get_func_code(self.func)
+        try:
+            cached_func_code = self.manager.memory.store_backend.get_cached_func_code([self.func_id])
+        except (IOError, OSError):
+            cached_func_code = None
+        else:
+            if cached_func_code.startswith(FIRST_LINE_TEXT):
+                cached_func_code = cached_func_code.split('\n', 1)[1]
+        if cached_func_code != func_code:
+            if cached_func_code is not None:
+                self.manager.log.info('Clearing the cache of %s since its code changed', self.func_id)
+                self.clear()
+            self.manager.memory.store_backend.store_cached_func_code(
+                [self.func_id], '%s %d\n%s' % (FIRST_LINE_TEXT, first_line, func_code))
+        self._checked_code = True
+
+    def _arguments(self, args, kwargs) -> Dict:
+        from joblib.func_inspect import filter_args
+
+        return filter_args(self.func, [], args, kwargs)
+
+    def argument_hash(self, *args, **kwargs) -> str:
+        """The joblib hash of the arguments, remembered for arguments of plain immutable data"""
+        fast_key = _fast_key((args, kwargs))
+        if fast_key is not None and fast_key in self._argument_hashes:
+            self._argument_hashes.move_to_end(fast_key)
+            return self._argument_hashes[fast_key]
+
+        import joblib
+
+        key = joblib.hash(self._arguments(args, kwargs), coerce_mmap=False)
+        if fast_key is not None:
+            self._argument_hashes[fast_key] = key
+            if len(self._argument_hashes) > self.max_argument_hashes:
+                self._argument_hashes.popitem(last=False)
+        return key
+
+    def clear(self):
+        self.manager.memory.store_backend.clear_path([self.func_id])
+        self._argument_hashes.clear()
+
+
+class CacheManager(Base):
+    """joblib memoization within `max_bytes` and `max_age_days`, see the module docstring"""
+    def __init__(
+            self,
+            location: Path = CACHE_DIR,
+            max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+            max_age_days: Optional[float] = None,
+    ):
+        self.cache_dir = Path(location)
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.stats = defaultdict(CacheStats)
+        self._memory = None
+        self._misses_since_prune = 0
+        self._prune_thread = None
+        # Access times of packed entries by pack and key, written every WRITE_ACCESSES_EVERY_HITS hits
+        self._accesses = defaultdict(dict)
+        self._num_accesses = 0
+        self._accesses_lock = threading.Lock()
+        self._writes_accesses_at_exit = False
+
+    @property
+    def memory(self):
+        """The joblib.Memory, which creates the cache directory"""
+        if self._memory is None:
+            from joblib import Memory
+
+            self._memory = Memory(cachedir=str(self.cache_dir), verbose=0)
+        return self._memory
+
+    @property
+    def location(self) -> Path:
+        """The directory joblib caches in"""
+        return self.cache_dir / 'joblib'
+
+    def cache(self, func) -> CachedFunction:
+        """Decorator like `joblib.Memory.cache`"""
+        return CachedFunction(self, func)
+
+    def load(self, func_id: str, key: str):
+        """The cached output of a call, raising KeyError if it is not cached"""
+        pack_path = self.location / func_id / PACK_FILENAME
+        if pack_path.exists():
+            with closing(sqlite3.connect(str(pack_path), timeout=PACK_TIMEOUT_SECONDS)) as connection:
+                row = connection.execute('SELECT output FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self._record_access(pack_path, key)
+                return pickle.loads(zlib.decompress(row[0]))
+
+        output_path = self.location / func_id / key / OUTPUT_FILENAME
+        if not output_path.exists():
+            raise KeyError(key)
+        try:
+            output = self.memory.store_backend.load_item([func_id, key], verbose=0)
+        except Exception:
+            self.log.warning('Could not load cached %s %s', func_id, key, exc_info=True)
+            raise KeyError(key)
+        # Access times are not updated on filesystems mounted with noatime, so touch the output for LRU eviction
+        try:
+            os.utime(str(output_path), (time.time(), output_path.stat().st_mtime))
+        except OSError:
+            pass
+        return output
+
+    def store(self, func_id: str, key: str, output, metadata: Dict):
+        """Cache the output of a call in a directory like joblib does"""
+        try:
+            self.memory.store_backend.dump_item([func_id, key], output, verbose=0)
+            self.memory.store_backend.store_metadata([func_id, key], metadata)
+        except Exception:
+            # Like joblib, failing to cache only costs computing the output again
+            self.log.warning('Could not cache %s %s', func_id, key, exc_info=True)
+
+    def _record_access(self, pack_path: Path, key: str):
+        with self._accesses_lock:
+            self._accesses[pack_path][key] = time.time()
+            self._num_accesses += 1
+            num_accesses = self._num_accesses
+            if not self._writes_accesses_at_exit:
+                atexit.register(self.write_accesses)
+                self._writes_accesses_at_exit = True
+        if num_accesses >= WRITE_ACCESSES_EVERY_HITS:
+            self.write_accesses()
+
+    def write_accesses(self):
+        """Write the access times of the packed entries hit since the last write, in a transaction per pack"""
+        with self._accesses_lock:
+            accesses, self._accesses = self._accesses, defaultdict(dict)
+            self._num_accesses = 0
+        for pack_path, access_by_key in accesses.items():
+            try:
+                with closing(sqlite3.connect(str(pack_path), timeout=PACK_TIMEOUT_SECONDS)) as connection:
+                    with connection:
+                        connection.executemany('UPDATE entries SET last_access = ? WHERE key = ?',
+                                               [(last_access, key) for key, last_access in access_by_key.items()])
+            except sqlite3.Error:
+                # Access times only order the eviction, losing some is better than failing a call
+                self.log.warning('Could not write %d access times to %s', len(access_by_key), pack_path,
+                                 exc_info=True)
+
+    def on_miss(self):
+        self._misses_since_prune += 1
+        if self._misses_since_prune >= PRUNE_EVERY_MISSES:
+            self._misses_since_prune = 0
+            if self._prune_thread is None or not self._prune_thread.is_alive():
+                self._prune_thread = threading.Thread(target=self._prune_in_background, name='cache-prune',
+                                                      daemon=True)
+                self._prune_thread.start()
+
+    def _prune_in_background(self):
+        try:
+            self.prune()
+        except Exception:
+            self.log.warning('Could not prune the cache', exc_info=True)
+
+    def entries(self) -> List[CacheEntry]:
+        """Every cached output, in directories and packs"""
+        entries = []
+        if not self.location.exists():
+            return entries
+        for dirpath, dirnames, filenames in os.walk(str(self.location)):
+            directory = Path(dirpath)
+            if OUTPUT_FILENAME in filenames:
+                func_id = str(directory.parent.relative_to(self.location))
+                try:
+                    output_stat = (directory / OUTPUT_FILENAME).stat()
+                    size = sum((directory / filename).stat().st_size for filename in filenames)
+                except OSError:
+                    # Deleted by another process
+                    continue
+                entries.append(CacheEntry(func_id, directory.name, directory, size, output_stat.st_mtime,
+                                          output_stat.st_atime, False))
+            if PACK_FILENAME in filenames:
+                func_id = str(directory.relative_to(self.location))
+                pack_path = directory / PACK_FILENAME
+                with closing(sqlite3.connect(str(pack_path), timeout=PACK_TIMEOUT_SECONDS)) as connection:
+                    rows = connection.execute('SELECT key, LENGTH(output), created, last_access FROM entries')
+                    entries.extend(CacheEntry(func_id, key, pack_path, size, created, last_access, True)
+                                   for key, size, created, last_access in rows)
+        return entries
+
+    def prune(
+            self,
+            max_bytes: Optional[int] = None,
+            max_age_days: Optional[float] = None,
+            now: Optional[float] = None,
+    ) -> List[CacheEntry]:
+        """Remove entries older than `max_age_days`, then the least recently used ones until under `max_bytes`
+
+        The limits of the manager are used unless others are given, None is no limit."""
+        max_bytes = max_bytes if max_bytes is not None else self.max_bytes
+        max_age_days = max_age_days if max_age_days is not None else self.max_age_days
+        now = now if now is not None else time.time()
+
+        self.write_accesses()
+        entries = sorted(self.entries(), key=lambda entry: entry.last_access)
+        removed = []
+        if max_age_days is not None:
+            removed = [entry for entry in entries if entry.created < now - max_age_days * SECONDS_PER_DAY]
+            entries = [entry for entry in entries if entry.created >= now - max_age_days * SECONDS_PER_DAY]
+        if max_bytes is not None:
+            total_bytes = sum(entry.size for entry in entries)
+            while entries and total_bytes > max_bytes:
+                total_bytes -= entries[0].size
+                removed.append(entries.pop(0))
+        if removed:
+            self.log.info('Removing %d cache entries of %d bytes', len(removed), sum(entry.size for entry in removed))
+            self._remove(removed)
+        return removed
+
+    def compact(self, func_id: Optional[str] = None) -> int:
+        """Move the entries in directories, of one function or all of them, into packs and return how many moved"""
+        num_packed = 0
+        by_function = defaultdict(list)
+        for entry in self.entries():
+            if not entry.packed and (func_id is None or entry.function == func_id):
+                by_function[entry.function].append(entry)
+
+        import joblib
+
+        for function, entries in by_function.items():
+            with closing(sqlite3.connect(str(self.location / function / PACK_FILENAME))) as connection:
+                _create_pack_schema(connection)
+                for entry in entries:
+                    try:
+                        output = joblib.load(str(entry.path / OUTPUT_FILENAME))
+                    except Exception:
+                        self.log.warning('Could not load %s to compact it', entry.path, exc_info=True)
+                        continue
+                    metadata_path = entry.path / METADATA_FILENAME
+                    metadata = metadata_path.read_text() if metadata_path.exists() else None
+                    with connection:
+                        connection.execute(
+                            'INSERT OR REPLACE INTO entries (key, output, created, last_access, metadata) '
+                            'VALUES (?, ?, ?, ?, ?)',
+                            (entry.key, zlib.compress(pickle.dumps(output, pickle.HIGHEST_PROTOCOL)),
+                             entry.created, entry.last_access, metadata))
+                    shutil.rmtree(str(entry.path), ignore_errors=True)
+                    num_packed += 1
+        self.log.info('Compacted %d cache entries', num_packed)
+        return num_packed
+
+    def _remove(self, entries: List[CacheEntry]):
+        by_pack = defaultdict(list)
+        for entry in entries:
+            if entry.packed:
+                by_pack[entry.path].append(entry.key)
+            else:
+                shutil.rmtree(str(entry.path), ignore_errors=True)
+        for pack_path, keys in by_pack.items():
+            with closing(sqlite3.connect(str(pack_path))) as connection:
+                with connection:
+                    connection.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in keys])
+                # Give the space of the deleted rows back to the filesystem
+                connection.execute('VACUUM')
+
+    def log_stats(self):
+        for func_id, stats in sorted(self.stats.items()):
+            self.log.info('Cache of %s: %s', func_id, stats.to_dict())
+
+
+def _create_pack_schema(connection: sqlite3.Connection):
+    """Create the entries table, adding the metadata column to packs compacted before it was kept"""
+    connection.executescript(_SCHEMA)
+    columns = [row[1] for row in connection.execute('PRAGMA table_info(entries)')]
+    if 'metadata' not in columns:
+        connection.execute('ALTER TABLE entries ADD COLUMN metadata TEXT')
+
+
+def cached_calls(function_dir: Path) -> Iterator[Tuple[Dict, Any]]:
+    """The metadata and output of every call cached in the directory of a function, in directories and its pack
+
+    Calls packed before packs kept their metadata are skipped."""
+    import joblib
+
+    for metadata_path in sorted(Path(function_dir).glob('*/' + METADATA_FILENAME)):
+        output_path = metadata_path.parent / OUTPUT_FILENAME
+        if output_path.exists():
+            with open(str(metadata_path)) as f:
+                metadata = json.load(f)
+            yield metadata, joblib.load(str(output_path))
+
+    pack_path = Path(function_dir) / PACK_FILENAME
+    if pack_path.exists():
+        with closing(sqlite3.connect(str(pack_path), timeout=PACK_TIMEOUT_SECONDS)) as connection:
+            _create_pack_schema(connection)
+            rows = connection.execute('SELECT metadata, output FROM entries WHERE metadata IS NOT NULL').fetchall()
+        for metadata, output in rows:
+            yield json.loads(metadata), pickle.loads(zlib.decompress(output))
+
+
+def _summary(entries: List[CacheEntry]) -> Dict[str, Dict]:
+    summary = OrderedDict()
+    for entry in sorted(entries, key=lambda entry: entry.function):
+        function = summary.setdefault(entry.function, {'entries': 0, 'packed': 0, 'bytes': 0, 'oldest': entry.created})
+        function['entries'] += 1
+        function['packed'] += entry.packed
+        function['bytes'] += entry.size
+        function['oldest'] = min(function['oldest'], entry.created)
+    return summary
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+def info():
+    """Show the number of entries and bytes cached per function"""
+    from phocus.utils import memory
+
+    summary = _summary(memory.entries())
+    for function, counts in summary.items():
+        click.echo('%s: %d entries (%d packed), %.1f MB, oldest from %s' % (
+            function, counts['entries'], counts['packed'], counts['bytes'] / 1024 ** 2,
+            datetime.fromtimestamp(counts['oldest']).date()))
+    click.echo('Total: %.1f MB' % (sum(counts['bytes'] for counts in summary.values()) / 1024 ** 2))
+
+
+@main.command()
+@click.option('--max-gb', type=float, default=DEFAULT_MAX_BYTES / 1024 ** 3)
+@click.option('--max-age-days', type=float, default=DEFAULT_MAX_AGE_DAYS)
+def prune(max_gb, max_age_days):
+    """Remove old and least recently used entries"""
+    from phocus.utils import memory
+
+    removed = memory.prune(int(max_gb * 1024 ** 3), max_age_days)
+    click.echo('Removed %d entries, %.1f MB' % (len(removed), sum(entry.size for entry in removed) / 1024 ** 2))
+
+
+@main.command()
+@click.option('--function', default=None, help='Function identifier like phocus/utils/maps/gmaps_distance_matrix')
+def compact(function):
+    """Pack the entries of each function into one compressed file"""
+    from phocus.utils import memory
+
+    click.echo('Packed %d entries' % memory.compact(function))
+
+
+if __name__ == '__main__':
+    main()
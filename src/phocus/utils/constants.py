@@ -13,7 +13,6 @@ NEW_ELENA_JSON_PATH = OUTPUT_PATH / 'Elena.Routing.2018.json'
 CALIBRATION_DATA_PATH = DATA_PATH / 'Calibration Data Input_Actual Visit.xlsx'
 HCP_DATA_PATH = DATA_PATH / 'HCP Data Full Universe.csv'
 CACHE_DIR: Path = OUTPUT_PATH / 'cache'
-CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
 # API PARAMS
 START_LOCATION = 'startLocation'
@@ -1,11 +1,12 @@
 import datetime
 import operator
-from collections import deque
 from numbers import Number
 
 import pendulum
 from typing import Sequence
 
+from phocus.utils.epoch import interval_to_period, open_times_to_blackout_intervals, period_to_interval
+
 
 def sort_periods(periods: Sequence[pendulum.Period]) -> Sequence[pendulum.Period]:
     """Sort periods first by start time then by end time"""
@@ -79,41 +80,20 @@ def convert_open_times_to_blackout_windows(
         open_times: Sequence[pendulum.Period],
         work_periods: Sequence[pendulum.Period],
 ) -> Sequence[pendulum.Period]:
-    open_times = deque(combine_periods(open_times))
-    work_periods = deque(combine_periods(work_periods))
-    blackout_windows = []
+    """Convert the open times of a location to the periods of the work periods it is closed
 
+    See `open_times_to_blackout_intervals` which this wraps for periods
+    """
+    work_periods = combine_periods(work_periods)
     if not open_times:
         return list(work_periods)
 
-    open_period = open_times.popleft()
-    while work_periods:
-        work_period = work_periods.popleft()
-        current_blackout_start = None
-        for work_minute in work_period.range('minutes'):
-            if work_minute > open_period.end:
-                if current_blackout_start:
-                    blackout_windows.append(current_blackout_end - current_blackout_start)
-                    current_blackout_start = current_blackout_end = None
-                while open_times and work_minute > open_period.end:
-                    open_period = open_times.popleft()
-                if not open_times and work_minute > open_period.end:
-                    blackout_windows.append(work_period.end - work_minute)
-                    break
-            if work_minute < open_period.start:
-                if not current_blackout_start:
-                    current_blackout_start = work_minute
-                current_blackout_end = work_minute
-            elif work_minute in open_period and current_blackout_start:
-                blackout_windows.append(current_blackout_end - current_blackout_start)
-                current_blackout_start = current_blackout_end = None
-        if current_blackout_start and current_blackout_end:
-            blackout_windows.append(current_blackout_end - current_blackout_start)
-
-    if not open_times:
-        blackout_windows.extend(work_periods)
-
-    return combine_periods(blackout_windows)
+    tz = work_periods[0].start.timezone if work_periods else 'UTC'
+    blackout_intervals = open_times_to_blackout_intervals(
+        [period_to_interval(p) for p in open_times],
+        [period_to_interval(p) for p in work_periods],
+    )
+    return [interval_to_period(interval, tz) for interval in blackout_intervals]
 
 
 def time_off_periods(work_periods: Sequence[pendulum.Period]):
@@ -3,15 +3,18 @@ import inspect
 
 
 def auto_assign_arguments(function):
+    # Inspect the signature once instead of on every call
+    argspec = inspect.getfullargspec(function)
+
     @wraps(function)
     def wrapped(self, *args, **kwargs):
-        _assign_args(self, list(args), kwargs, function)
+        _assign_args(self, list(args), kwargs, argspec)
         function(self, *args, **kwargs)
 
     return wrapped
 
 
-def _assign_args(instance, args, kwargs, function):
+def _assign_args(instance, args, kwargs, argspec):
     def set_attribute(instance, parameter, default_arg):
         if not (parameter.startswith("_")):
             setattr(instance, parameter, default_arg)
@@ -35,8 +38,7 @@ def _assign_args(instance, args, kwargs, function):
     def assign_variable_args(parameter, args):
         set_attribute(instance, parameter, args)
 
-    positional_params, variable_param, _, keyword_defaults, _, keyword_only_defaults, _ = inspect.getfullargspec(
-        function)
+    positional_params, variable_param, _, keyword_defaults, _, keyword_only_defaults, _ = argspec
     positional_params = positional_params[1:]  # remove 'self'
 
     if keyword_defaults:
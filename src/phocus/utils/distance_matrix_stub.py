@@ -0,0 +1,137 @@
+"""Local stand in for the Google distance matrix API
+
+`StubDistanceMatrixServer` answers distance matrix requests with travel times estimated from great circle distances.
+It adds latency and rejects requests over its quota like the real API so fetching can be tested and benchmarked
+without an API key.
+"""
+import json
+import threading
+import time
+import urllib.parse
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Optional
+
+import numpy as np
+
+from phocus.utils.fetch_planner import GOOGLE_API_LIMITS, ApiLimits
+from phocus.utils.geo import SpeedProfile, haversine_meters
+from phocus.utils.mixins import Base
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubDistanceMatrixServer(Base):
+    """Distance matrix API on localhost that simulates latency, request limits and an elements per second quota
+
+    Use it as a context manager, requests go to `url`."""
+    def __init__(
+            self,
+            latency_seconds: float = 0.,
+            elements_per_second: Optional[float] = None,
+            limits: ApiLimits = GOOGLE_API_LIMITS,
+            speed_profile: Optional[SpeedProfile] = None,
+    ):
+        self.latency_seconds = latency_seconds
+        self.elements_per_second = elements_per_second
+        self.limits = limits
+        self.speed_profile = speed_profile if speed_profile is not None else SpeedProfile()
+        self.num_requests = 0
+        self.num_elements = 0
+        self.num_rejected = 0
+        self._recent_elements = deque()
+        self._lock = threading.Lock()
+        self._server: Optional[HTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:%d/maps/api/distancematrix/json' % self._server.server_address[1]
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                body = json.dumps(stub.respond(query.get('origins', [''])[0], query.get('destinations', [''])[0]))
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+            def log_message(self, format, *args):
+                stub.log.debug(format, *args)
+
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='distance-matrix-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def respond(self, origins: str, destinations: str) -> dict:
+        origins = _parse_coordinates(origins)
+        destinations = _parse_coordinates(destinations)
+        num_elements = len(origins) * len(destinations)
+        time.sleep(self.latency_seconds)
+
+        if (len(origins) > self.limits.max_origins or len(destinations) > self.limits.max_destinations
+                or num_elements > self.limits.max_elements):
+            return self._reject('MAX_ELEMENTS_EXCEEDED')
+        if not self._within_quota(num_elements):
+            return self._reject('OVER_QUERY_LIMIT')
+
+        with self._lock:
+            self.num_requests += 1
+            self.num_elements += num_elements
+        meters = haversine_meters(origins[:, None, 0], origins[:, None, 1], destinations[None, :, 0],
+                                  destinations[None, :, 1])
+        seconds = self.speed_profile.estimate_seconds(meters)
+        road_meters = meters * self.speed_profile.detour_factors[self.speed_profile.bands(meters)]
+        return {
+            'status': 'OK',
+            'rows': [{'elements': [
+                {
+                    'status': 'OK',
+                    'duration': {'value': int(round(float(seconds[i, j])))},
+                    'distance': {'value': int(round(float(road_meters[i, j])))},
+                } for j in range(len(destinations))
+            ]} for i in range(len(origins))],
+        }
+
+    def _within_quota(self, num_elements: int) -> bool:
+        """Whether the elements of the last second stay within the quota, counting them if they do"""
+        if self.elements_per_second is None:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            while self._recent_elements and self._recent_elements[0][0] <= now - 1:
+                self._recent_elements.popleft()
+            if sum(n for _, n in self._recent_elements) + num_elements > self.elements_per_second:
+                return False
+            self._recent_elements.append((now, num_elements))
+            return True
+
+    def _reject(self, status: str) -> dict:
+        with self._lock:
+            self.num_rejected += 1
+        return {'status': status, 'rows': []}
+
+
+def _parse_coordinates(coordinates: str) -> np.ndarray:
+    return np.array([[float(x) for x in c.split(',')] for c in coordinates.split('|') if c],
+                    dtype=np.float64).reshape(-1, 2)
@@ -0,0 +1,47 @@
+"""Sources of travel time matrices"""
+import abc
+from typing import Optional, Sequence
+
+import numpy as np
+import pendulum
+
+from phocus.utils.mixins import Base
+
+
+def coordinates_array(points: Sequence) -> np.ndarray:
+    """An (n, 2) array of the latitude and longitude of each point
+
+    Points can be `Coordinate`s or (lat, lon) tuples, or anything with `lat` and `lon` like a `Location`."""
+    return np.array([(p[0], p[1]) if isinstance(p, tuple) else (p.lat, p.lon) for p in points],
+                    dtype=np.float64).reshape(-1, 2)
+
+
+class DistanceProvider(Base, abc.ABC):
+    """Travel times in seconds between coordinates"""
+    @abc.abstractmethod
+    def travel_time_matrix(
+            self,
+            origins: Sequence,
+            destinations: Optional[Sequence] = None,
+            departure_time: Optional[pendulum.DateTime] = None,
+    ) -> np.ndarray:
+        """The (origins x destinations) matrix of travel times, between the origins if there are no destinations"""
+
+
+class GoogleDistanceProvider(DistanceProvider):
+    """Travel times from the Google distance matrix API, cached on disk by the distance matrix loader"""
+    def travel_time_matrix(
+            self,
+            origins: Sequence,
+            destinations: Optional[Sequence] = None,
+            departure_time: Optional[pendulum.DateTime] = None,
+    ) -> np.ndarray:
+        # Only import the Google client when it is used
+        from phocus.utils.distance_matrix_loader import load_distance_matrix_data
+
+        if destinations is not None and list(destinations) != list(origins):
+            raise RuntimeError('Google travel times are only supported between the same origins and destinations')
+        if departure_time is not None:
+            raise RuntimeError('Google travel times are only cached for the default departure time')
+        # Origins are passed unchanged so that existing cache entries keep matching
+        return load_distance_matrix_data(origins)
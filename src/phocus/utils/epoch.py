@@ -0,0 +1,123 @@
+"""Integer epoch second intervals
+
+Requests are handled with times as int epoch seconds and intervals as (start, end) tuples of them. pendulum objects are
+only created at the API and output boundaries, see `from_epoch` and `interval_to_period`."""
+import bisect
+import datetime
+from numbers import Number
+from typing import List, Sequence
+
+import pendulum
+
+from phocus.utils.interval_set import Interval, IntervalSet
+
+SECONDS_PER_MINUTE = 60
+SECONDS_PER_HOUR = 60 * 60
+SECONDS_PER_DAY = 24 * 60 * 60
+"""Ordinal of 1970-01-01, the date of epoch second 0"""
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def to_epoch(dt: datetime.datetime) -> int:
+    """Convert a timezone aware datetime to epoch seconds"""
+    return int(dt.timestamp())
+
+
+def from_epoch(epoch: int, tz='UTC') -> pendulum.DateTime:
+    return pendulum.from_timestamp(epoch, tz=tz)
+
+
+def date_to_epoch(date: datetime.date) -> int:
+    """Epoch seconds of midnight UTC at the start of `date`"""
+    return (date.toordinal() - _EPOCH_ORDINAL) * SECONDS_PER_DAY
+
+
+def epoch_millis_to_epoch(millis: Number) -> int:
+    return int(millis // 1000)
+
+
+def period_to_interval(period: pendulum.Period) -> Interval:
+    return to_epoch(period.start), to_epoch(period.end)
+
+
+def interval_to_period(interval: Interval, tz='UTC') -> pendulum.Period:
+    return from_epoch(interval[1], tz) - from_epoch(interval[0], tz)
+
+
+def combine_intervals(intervals: Sequence[Interval]) -> List[Interval]:
+    """Combine overlapping or touching intervals like `combine_periods`
+
+    The intervals are returned in sorted order
+    """
+    return IntervalSet.from_intervals(intervals).to_list()
+
+
+def time_off_intervals(work_intervals: Sequence[Interval]) -> List[Interval]:
+    """Convert work intervals to the intervals between them like `time_off_periods`
+
+    As with `time_off_periods` time off starts a second after the end of work"""
+    time_off = IntervalSet.from_intervals(work_intervals).complement()
+    return list(zip((time_off.starts + 1).tolist(), time_off.ends.tolist()))
+
+
+def _ceil_to_grid(t: int, grid_start: int, step: int) -> int:
+    """The first point of the grid `grid_start + step * i` that is at or after `t`"""
+    return grid_start + step * -((grid_start - t) // step)
+
+
+def _floor_to_grid(t: int, grid_start: int, step: int) -> int:
+    """The last point of the grid `grid_start + step * i` that is at or before `t`"""
+    return grid_start + step * ((t - grid_start) // step)
+
+
+def open_times_to_blackout_intervals(
+        open_intervals: Sequence[Interval],
+        work_intervals: Sequence[Interval],
+) -> List[Interval]:
+    """Convert the open times of a location to the intervals of the work intervals it is closed
+
+    Each work interval is sampled every minute from its start. Consecutive samples that fall in the same gap between
+    open times form a blackout interval from the first to the last sample. Once a sample is past the last open time
+    the rest of the work intervals are blacked out.
+
+    The gaps between open times are swept so this is O((open + work) log open) rather than linear in the number of
+    minutes worked.
+    """
+    open_intervals = combine_intervals(open_intervals)
+    work_intervals = combine_intervals(work_intervals)
+
+    if not open_intervals:
+        return work_intervals
+
+    open_starts = [start for start, _ in open_intervals]
+    open_ends = [end for _, end in open_intervals]
+    last_open_end = open_ends[-1]
+    step = SECONDS_PER_MINUTE
+
+    blackout_intervals = []
+    is_past_open_times = False
+    for work_start, work_end in work_intervals:
+        if is_past_open_times:
+            blackout_intervals.append((work_start, work_end))
+            continue
+
+        last_sample = _floor_to_grid(work_end, work_start, step)
+
+        # The gap before open time k is (open_ends[k - 1], open_starts[k])
+        k = bisect.bisect_right(open_starts, work_start)
+        while k < len(open_starts):
+            gap_start = open_ends[k - 1] + 1 if k else work_start
+            if gap_start > last_sample:
+                break
+            first_blocked = _ceil_to_grid(max(work_start, gap_start), work_start, step)
+            last_blocked = _floor_to_grid(min(last_sample, open_starts[k] - 1), work_start, step)
+            if first_blocked <= last_blocked:
+                blackout_intervals.append((first_blocked, last_blocked))
+            k += 1
+
+        past_open_time = _ceil_to_grid(max(work_start, last_open_end + 1), work_start, step)
+        if past_open_time <= last_sample:
+            blackout_intervals.append((past_open_time, work_end))
+            is_past_open_times = True
+
+    return blackout_intervals
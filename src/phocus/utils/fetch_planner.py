@@ -0,0 +1,329 @@
+"""Planning and rate limited fetching of distance matrix requests
+
+`plan_requests` packs the missing pairs of a travel time matrix into as few requests as the API limits allow.
+`AsyncFetcher` sends them concurrently from an asyncio event loop with a token bucket on the elements per second.
+Requests that fail after every attempt are reported instead of raised, since whatever was fetched is already cached a
+later call resumes from the pairs that are still missing.
+
+Fetch throughput can be measured against a local stub of the API:
+
+    python -m phocus.utils.fetch_planner benchmark --num-locations 300 --latency 0.2
+"""
+import asyncio
+import json
+import random
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from timeit import default_timer as timer
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+import click
+import numpy as np
+
+from phocus.utils.mixins import Base
+
+GOOGLE_DISTANCE_MATRIX_URL = 'https://maps.googleapis.com/maps/api/distancematrix/json'
+"""Client side limit of the Google distance matrix API"""
+DEFAULT_ELEMENTS_PER_SECOND = 1000
+DEFAULT_MAX_CONCURRENCY = 10
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF_SECONDS = 1.
+
+
+class ApiLimits(namedtuple('ApiLimits', 'max_origins max_destinations max_elements')):
+    """Maximum origins, destinations and origins x destinations of a single request"""
+
+
+"""Limits of the Google distance matrix API on the standard plan"""
+GOOGLE_API_LIMITS = ApiLimits(max_origins=25, max_destinations=25, max_elements=100)
+"""Largest fraction of the elements of tiled requests that may be known pairs, none since each element is billed"""
+DEFAULT_MAX_KNOWN_FRACTION = 0.
+
+
+class FetchRequest(namedtuple('FetchRequest', 'origin_indices destination_indices')):
+    """The rows and columns of a matrix to fetch in one request"""
+    @property
+    def num_elements(self) -> int:
+        return len(self.origin_indices) * len(self.destination_indices)
+
+
+FetchReport = namedtuple('FetchReport', 'num_requests num_elements failed seconds')
+
+
+class DistanceMatrixError(RuntimeError):
+    """A distance matrix request that was rejected by the API"""
+    def __init__(self, status: str, message: Optional[str] = None):
+        super().__init__('Distance matrix request failed with %s%s' % (status, ': ' + message if message else ''))
+        self.status = status
+
+
+def _exact_requests(is_missing: np.ndarray, limits: ApiLimits) -> List[FetchRequest]:
+    """Requests of exactly the missing pairs, origins that miss the same destinations are requested together"""
+    origins_by_missing = OrderedDict()
+    for i, row in enumerate(is_missing):
+        missing = tuple(int(j) for j in np.flatnonzero(row))
+        if missing:
+            origins_by_missing.setdefault(missing, []).append(i)
+
+    requests = []
+    for missing, origin_indices in origins_by_missing.items():
+        destinations_per_request = min(len(missing), limits.max_destinations, limits.max_elements)
+        origins_per_request = max(1, min(limits.max_origins, limits.max_elements // destinations_per_request))
+        for origin_start in range(0, len(origin_indices), origins_per_request):
+            for destination_start in range(0, len(missing), destinations_per_request):
+                requests.append(FetchRequest(
+                    origin_indices[origin_start:origin_start + origins_per_request],
+                    list(missing[destination_start:destination_start + destinations_per_request]),
+                ))
+    return requests
+
+
+def _tiled_requests(
+        is_missing: np.ndarray,
+        origins: np.ndarray,
+        destinations: np.ndarray,
+        destinations_per_request: int,
+        origins_per_request: int,
+) -> Tuple[List[FetchRequest], List[int]]:
+    """Requests of the tiles of `origins` by `destinations` that have any missing pair and their number of them"""
+    origin_starts = np.arange(0, len(origins), origins_per_request)
+    destination_starts = np.arange(0, len(destinations), destinations_per_request)
+    missing = is_missing[np.ix_(origins, destinations)].astype(np.int32)
+    missing_per_tile = np.add.reduceat(np.add.reduceat(missing, origin_starts, axis=0), destination_starts, axis=1)
+    tile_origins, tile_destinations = np.nonzero(missing_per_tile)
+    requests = [
+        FetchRequest(origins[origin_start:origin_start + origins_per_request].tolist(),
+                     destinations[destination_start:destination_start + destinations_per_request].tolist())
+        for origin_start, destination_start in zip(origin_starts[tile_origins], destination_starts[tile_destinations])
+    ]
+    return requests, missing_per_tile[tile_origins, tile_destinations].tolist()
+
+
+def _split_tiles(
+        is_missing: np.ndarray,
+        tiles: List[FetchRequest],
+        num_missing_per_tile: List[int],
+        limits: ApiLimits,
+) -> List[FetchRequest]:
+    """The tiles that only have missing pairs and the exact requests of the missing pairs of the others"""
+    requests = []
+    for tile, num_missing in zip(tiles, num_missing_per_tile):
+        if num_missing == tile.num_elements:
+            requests.append(tile)
+            continue
+        tile_missing = is_missing[np.ix_(tile.origin_indices, tile.destination_indices)]
+        requests.extend(
+            FetchRequest([tile.origin_indices[i] for i in request.origin_indices],
+                         [tile.destination_indices[j] for j in request.destination_indices])
+            for request in _exact_requests(tile_missing, limits))
+    return requests
+
+
+def plan_requests(
+        is_missing: np.ndarray,
+        limits: ApiLimits = GOOGLE_API_LIMITS,
+        max_known_fraction: float = DEFAULT_MAX_KNOWN_FRACTION,
+) -> List[FetchRequest]:
+    """Non-overlapping requests within `limits` that cover every missing pair, in as few requests as possible
+
+    Requests of exactly the missing pairs suit matrices that only miss the rows and columns of a few new locations.
+    A fresh matrix misses every pair but the diagonal, so it is tiled instead of taking a request per origin. Tiles
+    with known pairs, like the ones on the diagonal, are split into exact requests unless at most `max_known_fraction`
+    of the elements of all tiles are known pairs, which fills every request but pays for the known elements."""
+    is_missing = np.asarray(is_missing, dtype=bool)
+    if not is_missing.any():
+        return []
+    best = _exact_requests(is_missing, limits)
+    num_missing = int(is_missing.sum())
+
+    # Tiles of the origins and destinations with missing pairs
+    origins = np.flatnonzero(is_missing.any(axis=1))
+    destinations = np.flatnonzero(is_missing.any(axis=0))
+    for destinations_per_request in range(1, min(len(destinations), limits.max_destinations, limits.max_elements) + 1):
+        origins_per_request = min(limits.max_origins, limits.max_elements // destinations_per_request)
+        tiled, num_missing_per_tile = _tiled_requests(
+            is_missing, origins, destinations, destinations_per_request, origins_per_request)
+        # Splitting only adds requests
+        if len(tiled) >= len(best):
+            continue
+        num_elements = sum(request.num_elements for request in tiled)
+        if num_elements - num_missing > max_known_fraction * num_elements:
+            tiled = _split_tiles(is_missing, tiled, num_missing_per_tile, limits)
+        if len(tiled) < len(best):
+            best = tiled
+    return best
+
+
+class TokenBucket(object):
+    """Allows `rate` tokens per second on average with bursts of up to `capacity` tokens"""
+    def __init__(self, rate: float, capacity: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """Take `tokens` if they are available and return 0, otherwise the seconds until they will be"""
+        tokens = min(tokens, self.capacity)
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0.
+        return (tokens - self._tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1):
+        while True:
+            wait_seconds = self.try_acquire(tokens)
+            if not wait_seconds:
+                return
+            await asyncio.sleep(wait_seconds)
+
+
+class AsyncFetcher(Base):
+    """Runs blocking fetches of `FetchRequest`s concurrently, rate limited on their number of elements
+
+    Other requests can be fetched by giving the number of elements that each one `costs`. Failed fetches are retried
+    with exponential backoff up to `max_attempts` times."""
+    def __init__(
+            self,
+            fetch: Callable[[Any], Any],
+            elements_per_second: float = DEFAULT_ELEMENTS_PER_SECOND,
+            max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+            max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+            backoff_seconds: float = DEFAULT_BACKOFF_SECONDS,
+            cost: Callable[[Any], float] = lambda request: request.num_elements,
+    ):
+        self.fetch = fetch
+        self.elements_per_second = elements_per_second
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.cost = cost
+
+    def fetch_all(
+            self,
+            requests: Sequence[FetchRequest],
+            on_result: Callable[[FetchRequest, Any], None] = lambda request, result: None,
+    ) -> FetchReport:
+        """Fetch every request, calling `on_result` from the event loop as each one completes"""
+        start = timer()
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            failed = loop.run_until_complete(self._fetch_all(loop, executor, requests, on_result))
+        finally:
+            executor.shutdown(wait=True)
+            loop.close()
+        report = FetchReport(len(requests), sum(self.cost(r) for r in requests), failed, timer() - start)
+        self.log.info('Fetched %d elements in %d requests in %.1f seconds, %d requests failed',
+                      report.num_elements, report.num_requests, report.seconds, len(failed))
+        return report
+
+    async def _fetch_all(self, loop, executor, requests, on_result) -> List[FetchRequest]:
+        bucket = TokenBucket(self.elements_per_second)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        succeeded = await asyncio.gather(*(
+            self._fetch_with_retries(loop, executor, bucket, semaphore, request, on_result) for request in requests))
+        return [request for request, is_success in zip(requests, succeeded) if not is_success]
+
+    async def _fetch_with_retries(self, loop, executor, bucket, semaphore, request, on_result) -> bool:
+        for attempt in range(1, self.max_attempts + 1):
+            await bucket.acquire(self.cost(request))
+            async with semaphore:
+                try:
+                    result = await loop.run_in_executor(executor, self.fetch, request)
+                except Exception as e:
+                    self.log.warning('Attempt %d of %d for %s failed: %s', attempt, self.max_attempts, request, e)
+                else:
+                    on_result(request, result)
+                    return True
+            if attempt < self.max_attempts:
+                await asyncio.sleep(self.backoff_seconds * 2 ** (attempt - 1) * random.uniform(0.5, 1.))
+        return False
+
+
+class HttpDistanceMatrixClient(Base):
+    """Fetches travel times from an endpoint that speaks the Google distance matrix JSON API
+
+    Pairs without a route are nan. Requests rejected by the API raise `DistanceMatrixError`."""
+    def __init__(self, base_url: str = GOOGLE_DISTANCE_MATRIX_URL, key: Optional[str] = None, timeout: float = 30.):
+        self.base_url = base_url
+        self.key = key
+        self.timeout = timeout
+
+    def __call__(self, origins, destinations, departure_time=None) -> Tuple[np.ndarray, np.ndarray]:
+        params = {
+            'origins': '|'.join('%.6f,%.6f' % (lat, lon) for lat, lon in origins),
+            'destinations': '|'.join('%.6f,%.6f' % (lat, lon) for lat, lon in destinations),
+        }
+        if departure_time is not None:
+            params['departure_time'] = str(int(departure_time.timestamp()))
+        if self.key:
+            params['key'] = self.key
+        url = self.base_url + '?' + urllib.parse.urlencode(params)
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            result = json.loads(response.read().decode())
+        if result.get('status') != 'OK':
+            raise DistanceMatrixError(result.get('status', 'UNKNOWN_ERROR'), result.get('error_message'))
+        return parse_distance_matrix_result(result, len(origins), len(destinations))
+
+
+def parse_distance_matrix_result(result, num_origins: int, num_destinations: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Travel times in seconds and distances in meters of a distance matrix response, nan without a route"""
+    seconds = np.full((num_origins, num_destinations), np.nan)
+    meters = np.full((num_origins, num_destinations), np.nan)
+    for i, row in enumerate(result['rows']):
+        for j, element in enumerate(row['elements']):
+            if element.get('status') == 'OK':
+                seconds[i, j] = element['duration']['value']
+                meters[i, j] = element['distance']['value']
+    return seconds, meters
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.option('--num-locations', default=200)
+@click.option('--latency', default=0.1, help='Seconds the stub takes to answer a request')
+@click.option('--quota', default=DEFAULT_ELEMENTS_PER_SECOND, help='Elements per second the stub allows')
+@click.option('--elements-per-second', default=DEFAULT_ELEMENTS_PER_SECOND, help='Client side rate limit')
+@click.option('--max-concurrency', default=DEFAULT_MAX_CONCURRENCY)
+@click.option('--max-known-fraction', default=DEFAULT_MAX_KNOWN_FRACTION,
+              help='Fraction of the requested elements that may be known pairs')
+def benchmark(num_locations, latency, quota, elements_per_second, max_concurrency, max_known_fraction):
+    """Measure the throughput of fetching a travel time matrix from a local stub server"""
+    from phocus.utils.distance_matrix_stub import StubDistanceMatrixServer
+    from phocus.utils.travel_time_cache import TravelTimeCache
+    from phocus.utils.maps import next_monday_8_am_eastern
+
+    points = np.random.RandomState(0).uniform([40.6, -73.9], [40.9, -73.2], size=(num_locations, 2))
+    with StubDistanceMatrixServer(latency_seconds=latency, elements_per_second=quota) as server, \
+            tempfile.TemporaryDirectory() as cache_dir:
+        cache = TravelTimeCache(Path(cache_dir) / 'travel_times.sqlite')
+        start = timer()
+        cache.travel_time_matrix(
+            [tuple(p) for p in points], None, next_monday_8_am_eastern(), HttpDistanceMatrixClient(server.url),
+            elements_per_second=elements_per_second, max_concurrency=max_concurrency,
+            max_known_fraction=max_known_fraction)
+        seconds = timer() - start
+        cache.close()
+    click.echo('Fetched %d elements in %d requests in %.1f seconds, %.0f elements per second, %d rejected' % (
+        server.num_elements, server.num_requests, seconds, server.num_elements / seconds, server.num_rejected))
+
+
+if __name__ == '__main__':
+    main()
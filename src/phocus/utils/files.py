@@ -5,7 +5,6 @@ import logging
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
 
 import phocus.model.location
 import phocus.utils
@@ -16,6 +15,8 @@ logger = logging.getLogger(__name__)
 
 
 def long_island_data():
+    import pandas as pd
+
     return pd.read_csv(LONG_ISLAND_LOCATIONS_CSV_PATH).values
 
 
@@ -32,14 +33,17 @@ def raw_elena_data():
 
 
 def save_formatted_elena_data(city='Long Island', state='NY'):
-    import phocus.utils.maps  # Avoid circular import
-    raw_data = raw_elena_data()
+    from phocus.utils.geocoder import geocoder  # Avoid circular import
+    raw_data = list(raw_elena_data())
     logger.info('Requesting lat and long for raw data')
     locations = set()
-    maps_utils = phocus.utils.maps.MapsUtils()
-    for row in raw_data:
-        coord = maps_utils.get_lat_long(row['address'], components={'administrative_area': state, 'country': 'US',
-                                                                    'locality': row['town']})
+    results = geocoder.geocode_many(
+        [row['address'] for row in raw_data],
+        [{'administrative_area': state, 'country': 'US', 'locality': row['town']} for row in raw_data])
+    for row, result in zip(raw_data, results):
+        if result.coordinate is None:
+            raise RuntimeError(result.message)
+        coord = result.coordinate
         locations.add(phocus.model.location.Location(
             doctor_name=row['name'],
             address=row['address'],
@@ -50,7 +54,8 @@ def save_formatted_elena_data(city='Long Island', state='NY'):
             is_repeat=row['repeat'].lower() == 'yes'
         ))
 
-    location_dicts = [vars(location) for location in locations]
+    location_dicts = [location.to_dict() for location in locations]
+    make_output_dir()
     with REAL_LONG_ISLAND_JSON_PATH.open(mode='w') as f:
         json.dump(location_dicts, f, indent=2)
 
@@ -60,8 +65,8 @@ def make_output_dir(path: Path = OUTPUT_PATH):
     return path
 
 
-REAL_LONG_ISLAND_JSON_PATH = make_output_dir() / 'formatted_elena.json'
-DISTANCE_MATRIX_PATH = make_output_dir() / 'distance.json'
+REAL_LONG_ISLAND_JSON_PATH = OUTPUT_PATH / 'formatted_elena.json'
+DISTANCE_MATRIX_PATH = OUTPUT_PATH / 'distance.json'
 
 
 def real_long_island_data():
@@ -69,6 +74,7 @@ def real_long_island_data():
 
 
 def save_distance_matrix_data(distance_matrix: np.ndarray):
+    make_output_dir()
     with open(DISTANCE_MATRIX_PATH, "w") as f:
         distance_matrix_json = distance_matrix.tolist()
         json.dump(distance_matrix_json, f, indent=2)
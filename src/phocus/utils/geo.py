@@ -0,0 +1,250 @@
+"""Vectorized distance matrices and travel time estimates from straight line distances
+
+`haversine_matrix` and `manhattan_matrix` build float32 matrices a block of rows at a time so that n x m matrices of
+many locations can be written to a memory mapped .npy file instead of memory.
+
+A `SpeedProfile` estimates travel times from great circle distances with a detour factor and a speed per distance band.
+`SpeedProfile.calibrate_from_cache` fits them to the Google distance matrix results in the travel time cache:
+
+    python -m phocus.utils.geo calibrate --output speed_profile.json
+"""
+import json
+import re
+from pathlib import Path
+from typing import Callable, Optional, Sequence, Tuple
+
+import click
+import numpy as np
+import pendulum
+
+from phocus.utils.constants import CACHE_DIR
+from phocus.utils.distance_provider import DistanceProvider, coordinates_array
+
+EARTH_RADIUS_METERS = 6371000.
+DEFAULT_CHUNK_ROWS = 1024
+"""Upper bounds in meters of the distance bands of a `SpeedProfile`, the last band has no upper bound"""
+DEFAULT_BAND_EDGES_METERS = (1000., 2000., 5000., 10000., 20000., 50000.)
+"""Detour factor and speed used before calibration, about 30 km/h through town"""
+DEFAULT_DETOUR_FACTOR = 1.3
+DEFAULT_SPEED_METERS_PER_SECOND = 8.3
+GMAPS_CACHE_DIR = CACHE_DIR / 'joblib' / 'phocus' / 'utils' / 'maps' / 'gmaps_distance_matrix'
+
+_COORDINATE_REPR = re.compile(r'Coordinate\(lat=([-+0-9.e]+), long=([-+0-9.e]+)\)')
+
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    """Great circle distance in meters between arrays of coordinates in degrees, broadcasting like numpy"""
+    lat1, lon1, lat2, lon2 = (np.radians(x) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(a, 1.)))
+
+
+def _pairwise_matrix(
+        distance: Callable[[np.ndarray, np.ndarray], np.ndarray],
+        origins: np.ndarray,
+        destinations: np.ndarray,
+        chunk_rows: int,
+        path: Optional[Path],
+        dtype,
+) -> np.ndarray:
+    """Fill the (origins x destinations) matrix of `distance` between blocks of `chunk_rows` origins"""
+    shape = (len(origins), len(destinations))
+    if path is not None:
+        matrix = np.lib.format.open_memmap(str(path), mode='w+', dtype=dtype, shape=shape)
+    else:
+        matrix = np.empty(shape, dtype=dtype)
+    for start in range(0, len(origins), chunk_rows):
+        matrix[start:start + chunk_rows] = distance(origins[start:start + chunk_rows, None], destinations[None, :])
+    if path is not None:
+        matrix.flush()
+    return matrix
+
+
+def haversine_matrix(
+        origins: Sequence,
+        destinations: Optional[Sequence] = None,
+        chunk_rows: int = DEFAULT_CHUNK_ROWS,
+        path: Optional[Path] = None,
+        dtype=np.float32,
+) -> np.ndarray:
+    """Great circle distances in meters between locations, coordinates or an (n, 2) array of (lat, lon)
+
+    Between the origins if there are no destinations. With a `path` the matrix is a memory mapped .npy file."""
+    origins = _as_coordinates(origins)
+    destinations = origins if destinations is None else _as_coordinates(destinations)
+    return _pairwise_matrix(
+        lambda a, b: haversine_meters(a[..., 0], a[..., 1], b[..., 0], b[..., 1]),
+        origins, destinations, chunk_rows, path, dtype,
+    )
+
+
+def manhattan_matrix(
+        origins: np.ndarray,
+        destinations: Optional[np.ndarray] = None,
+        chunk_rows: int = DEFAULT_CHUNK_ROWS,
+        path: Optional[Path] = None,
+        dtype=np.float32,
+) -> np.ndarray:
+    """Sum of absolute differences between points with any number of dimensions"""
+    origins = np.asarray(origins, dtype=np.float64)
+    origins = origins.reshape(len(origins), -1)
+    destinations = origins if destinations is None else np.asarray(destinations, dtype=np.float64)
+    destinations = destinations.reshape(len(destinations), -1)
+    return _pairwise_matrix(lambda a, b: np.abs(a - b).sum(axis=-1), origins, destinations, chunk_rows, path, dtype)
+
+
+def _as_coordinates(points) -> np.ndarray:
+    if isinstance(points, np.ndarray):
+        return points.astype(np.float64).reshape(-1, 2)
+    return coordinates_array(points)
+
+
+class SpeedProfile(DistanceProvider):
+    """Travel time estimates from great circle distances
+
+    Each distance band has a detour factor, the ratio of road distance to great circle distance, and an average speed
+    on the road. `band_edges` are the upper bounds of every band but the last."""
+    def __init__(
+            self,
+            band_edges: Sequence[float] = DEFAULT_BAND_EDGES_METERS,
+            detour_factors: Optional[Sequence[float]] = None,
+            speeds: Optional[Sequence[float]] = None,
+    ):
+        self.band_edges = np.asarray(band_edges, dtype=np.float64)
+        num_bands = len(self.band_edges) + 1
+        self.detour_factors = np.asarray(
+            detour_factors if detour_factors is not None else [DEFAULT_DETOUR_FACTOR] * num_bands, dtype=np.float64)
+        self.speeds = np.asarray(
+            speeds if speeds is not None else [DEFAULT_SPEED_METERS_PER_SECOND] * num_bands, dtype=np.float64)
+        if len(self.detour_factors) != num_bands or len(self.speeds) != num_bands:
+            raise RuntimeError('Expected a detour factor and speed for each of %d distance bands' % num_bands)
+
+    def bands(self, meters: np.ndarray) -> np.ndarray:
+        return np.searchsorted(self.band_edges, meters, side='right')
+
+    def estimate_seconds(self, meters: np.ndarray) -> np.ndarray:
+        """Travel times in seconds for great circle distances in meters"""
+        meters = np.asarray(meters)
+        bands = self.bands(meters)
+        return (meters * (self.detour_factors[bands] / self.speeds[bands])).astype(np.float32)
+
+    def travel_time_matrix(
+            self,
+            origins: Sequence,
+            destinations: Optional[Sequence] = None,
+            departure_time: Optional[pendulum.DateTime] = None,
+    ) -> np.ndarray:
+        return np.rint(self.estimate_seconds(haversine_matrix(origins, destinations))).astype(np.int64)
+
+    @classmethod
+    def calibrate(
+            cls,
+            straight_meters: np.ndarray,
+            road_meters: np.ndarray,
+            durations: np.ndarray,
+            band_edges: Sequence[float] = DEFAULT_BAND_EDGES_METERS,
+    ) -> 'SpeedProfile':
+        """Fit the median detour factor and the average speed of each band to observed trips
+
+        Bands without trips use the fit of all trips."""
+        straight_meters, road_meters, durations = (np.asarray(a, dtype=np.float64).ravel()
+                                                   for a in (straight_meters, road_meters, durations))
+        has_trip = (straight_meters > 0) & (road_meters > 0) & (durations > 0)
+        straight_meters, road_meters, durations = straight_meters[has_trip], road_meters[has_trip], durations[has_trip]
+        if not len(straight_meters):
+            raise RuntimeError('Cannot calibrate a speed profile without trips')
+
+        profile = cls(band_edges)
+        bands = profile.bands(straight_meters)
+        overall_detour = np.median(road_meters / straight_meters)
+        overall_speed = road_meters.sum() / durations.sum()
+        for band in range(len(profile.speeds)):
+            in_band = bands == band
+            if np.any(in_band):
+                profile.detour_factors[band] = np.median(road_meters[in_band] / straight_meters[in_band])
+                profile.speeds[band] = road_meters[in_band].sum() / durations[in_band].sum()
+            else:
+                profile.detour_factors[band] = overall_detour
+                profile.speeds[band] = overall_speed
+        return profile
+
+    @classmethod
+    def calibrate_from_cache(cls, cache=None, **kwargs) -> 'SpeedProfile':
+        """Calibrate to the trips with a known distance in a `TravelTimeCache`, the shared one by default"""
+        if cache is None:
+            from phocus.utils.travel_time_cache import travel_time_cache as cache  # Avoid circular import
+
+        origins, destinations, road_meters, durations = cache.trips_with_meters()
+        straight_meters = haversine_meters(origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1])
+        return cls.calibrate(straight_meters, road_meters, durations, **kwargs)
+
+    def to_dict(self):
+        return {
+            'band_edges': self.band_edges.tolist(),
+            'detour_factors': self.detour_factors.tolist(),
+            'speeds': self.speeds.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, profile_dict):
+        return cls(**profile_dict)
+
+    def save(self, path: Path):
+        with open(str(path), 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path: Path) -> 'SpeedProfile':
+        with open(str(path)) as f:
+            return cls.from_dict(json.load(f))
+
+
+def load_cached_google_trips(cache_dir: Path = GMAPS_CACHE_DIR) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Origins, destinations, road meters and seconds of every trip in the joblib cache of the Google distance matrix
+
+    Only used to import the legacy cache into the travel time cache, blocks are read from directories and packs."""
+    from phocus.utils.cache_manager import cached_calls
+
+    origins, destinations, road_meters, durations = [], [], [], []
+    for metadata, output in cached_calls(cache_dir):
+        input_args = metadata['input_args']
+        block_origins = [tuple(map(float, c)) for c in _COORDINATE_REPR.findall(input_args.get('origins', ''))]
+        block_destinations = [tuple(map(float, c)) for c in _COORDINATE_REPR.findall(input_args.get('destinations', ''))]
+        result = output[0]
+        if len(result['rows']) != len(block_origins):
+            continue
+        for origin, row in zip(block_origins, result['rows']):
+            if len(row['elements']) != len(block_destinations):
+                continue
+            for destination, element in zip(block_destinations, row['elements']):
+                if element.get('status') == 'OK':
+                    origins.append(origin)
+                    destinations.append(destination)
+                    road_meters.append(element['distance']['value'])
+                    durations.append(element['duration']['value'])
+    return (np.array(origins, dtype=np.float64).reshape(-1, 2), np.array(destinations, dtype=np.float64).reshape(-1, 2),
+            np.array(road_meters, dtype=np.float64), np.array(durations, dtype=np.float64))
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.option('--output', type=click.Path(dir_okay=False), required=True)
+@click.option('--cache-path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Travel time cache, the shared one by default')
+def calibrate(output, cache_path):
+    """Fit a speed profile to the cached Google distance matrix results"""
+    from phocus.utils.travel_time_cache import TravelTimeCache
+
+    profile = SpeedProfile.calibrate_from_cache(TravelTimeCache(Path(cache_path)) if cache_path else None)
+    profile.save(Path(output))
+    lower_edges = [0.] + profile.band_edges.tolist()
+    for lower, detour, speed in zip(lower_edges, profile.detour_factors, profile.speeds):
+        click.echo('From %6.0f m: detour %.2f, %.1f km/h' % (lower, detour, speed * 3.6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""Bulk geocoding with a persistent cache
+
+Addresses are normalized before they are looked up so that spelling differences like 'Street' and 'St.' share a cache
+entry. Addresses that are not found or are ambiguous are cached too so they are not requested again. Uncached addresses
+are geocoded concurrently within the rate limit of the geocoding API.
+
+    coordinates = geocoder.geocode_many(addresses)
+"""
+import datetime
+import json
+import re
+import sqlite3
+import threading
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+from phocus.utils.constants import CACHE_DIR
+from phocus.utils.fetch_planner import DEFAULT_MAX_ATTEMPTS, AsyncFetcher
+from phocus.utils.maps import AddressNotFoundError, AmbiguousAddressError, Coordinate, get_client
+from phocus.utils.mixins import Base
+
+DEFAULT_CACHE_PATH = CACHE_DIR / 'geocodes.sqlite'
+"""The Google geocoding API allows 50 requests per second"""
+DEFAULT_REQUESTS_PER_SECOND = 50
+DEFAULT_MAX_CONCURRENCY = 10
+
+OK = 'OK'
+NOT_FOUND = 'NOT_FOUND'
+AMBIGUOUS = 'AMBIGUOUS'
+
+_ABBREVIATIONS = {
+    'street': 'st',
+    'avenue': 'ave',
+    'road': 'rd',
+    'boulevard': 'blvd',
+    'drive': 'dr',
+    'lane': 'ln',
+    'court': 'ct',
+    'place': 'pl',
+    'parkway': 'pkwy',
+    'highway': 'hwy',
+    'turnpike': 'tpke',
+    'suite': 'ste',
+    'north': 'n',
+    'south': 's',
+    'east': 'e',
+    'west': 'w',
+}
+_PUNCTUATION = re.compile(r'[^\w\s,#-]')
+_SPACES = re.compile(r'\s+')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS geocodes (
+    key TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    lat REAL,
+    lon REAL,
+    message TEXT,
+    geocoded_at TEXT NOT NULL
+);
+'''
+
+"""The outcome of geocoding an address, `coordinate` is None unless the status is OK"""
+GeocodeResult = namedtuple('GeocodeResult', 'status coordinate message')
+
+
+def normalize_address(address: str) -> str:
+    """Lower case the address, drop punctuation and abbreviate common street words"""
+    parts = []
+    for part in _PUNCTUATION.sub('', address.lower()).split(','):
+        words = [_ABBREVIATIONS.get(word, word) for word in _SPACES.split(part.strip()) if word]
+        if words:
+            parts.append(' '.join(words))
+    return ', '.join(parts)
+
+
+def _cache_key(address: str, components: Optional[Dict[str, str]]) -> str:
+    key = normalize_address(address)
+    if components:
+        key += ' | ' + json.dumps({k: normalize_address(v) for k, v in components.items()}, sort_keys=True)
+    return key
+
+
+def google_geocode(address: str, components: Optional[Dict[str, str]] = None) -> GeocodeResult:
+    """Geocode with the Google API, raising on errors that are worth retrying"""
+    results = get_client().geocode(address, components=components)
+    if not results:
+        return GeocodeResult(NOT_FOUND, None, 'Address Not Found: %s' % address)
+    addresses = set(result['formatted_address'] for result in results)
+    if len(addresses) > 1:
+        return GeocodeResult(AMBIGUOUS, None, 'Expected length of result to be 1 but was %d. Address: %s' % (
+            len(results), address))
+    location = results[0]['geometry']['location']
+    return GeocodeResult(OK, Coordinate(lat=location['lat'], long=location['lng']), None)
+
+
+class Geocoder(Base):
+    """Geocodes addresses through a SQLite cache of normalized addresses
+
+    Like the other caches the database is opened on first use and shared between threads behind a lock."""
+    def __init__(
+            self,
+            path: Path = DEFAULT_CACHE_PATH,
+            geocode_uncached: Callable[[str, Optional[Dict[str, str]]], GeocodeResult] = google_geocode,
+            requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+            max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+            max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ):
+        self.path = path
+        self.geocode_uncached = geocode_uncached
+        self.requests_per_second = requests_per_second
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.num_hits = 0
+        self.num_misses = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._connection is None:
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+                self._connection.executescript(_SCHEMA)
+            return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def geocode(self, address: str, components: Optional[Dict[str, str]] = None) -> Coordinate:
+        """The coordinate of an address, raising `AddressNotFoundError` or `AmbiguousAddressError`"""
+        result = self.geocode_many([address], components)[0]
+        if result.status == NOT_FOUND:
+            raise AddressNotFoundError(result.message)
+        if result.status == AMBIGUOUS:
+            raise AmbiguousAddressError(result.message)
+        if result.status != OK:
+            raise RuntimeError(result.message)
+        return result.coordinate
+
+    def geocode_many(
+            self,
+            addresses: Sequence[str],
+            components: Union[None, Dict[str, str], Sequence[Optional[Dict[str, str]]]] = None,
+    ) -> List[GeocodeResult]:
+        """The result for each address, with the same `components` for every address or one per address
+
+        Addresses that could not be geocoded because of errors have a result with a None status and are not cached."""
+        if components is None or isinstance(components, dict):
+            components = [components] * len(addresses)
+        keys = [_cache_key(address, address_components) for address, address_components in zip(addresses, components)]
+        results = self._cached(set(keys))
+        self.num_hits += sum(key in results for key in keys)
+        self.num_misses += sum(key not in results for key in keys)
+
+        uncached = OrderedDict()
+        for key, address, address_components in zip(keys, addresses, components):
+            if key not in results:
+                uncached.setdefault(key, (address, address_components))
+        if uncached:
+            self.log.info('Geocoding %d of %d addresses that are not cached', len(uncached), len(addresses))
+
+            def geocode(key):
+                return self.geocode_uncached(*uncached[key])
+
+            def on_result(key, result: GeocodeResult):
+                results[key] = result
+                self._store(key, result)
+
+            fetcher = AsyncFetcher(geocode, elements_per_second=self.requests_per_second,
+                                   max_concurrency=self.max_concurrency, max_attempts=self.max_attempts,
+                                   cost=lambda key: 1)
+            report = fetcher.fetch_all(list(uncached), on_result)
+            for key in report.failed:
+                results[key] = GeocodeResult(None, None, 'Geocoding failed for %s' % uncached[key][0])
+
+        return [results[key] for key in keys]
+
+    def _cached(self, keys) -> Dict[str, GeocodeResult]:
+        keys = list(keys)
+        results = {}
+        with self._lock:
+            # Stay below the SQLite limit on query parameters
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self.connection.execute(
+                    'SELECT key, status, lat, lon, message FROM geocodes WHERE key IN (%s)' % ', '.join('?' * len(chunk)),
+                    chunk).fetchall()
+                for key, status, lat, lon, message in rows:
+                    coordinate = Coordinate(lat=lat, long=lon) if status == OK else None
+                    results[key] = GeocodeResult(status, coordinate, message)
+        return results
+
+    def _store(self, key: str, result: GeocodeResult):
+        lat, lon = result.coordinate if result.coordinate is not None else (None, None)
+        with self._lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO geocodes (key, status, lat, lon, message, geocoded_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, result.status, lat, lon, result.message, datetime.datetime.utcnow().isoformat()))
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute('SELECT COUNT(*) FROM geocodes').fetchone()[0]
+
+
+"""Geocoder Singleton used by lat_lon and the ingest scripts"""
+geocoder = Geocoder()
@@ -0,0 +1,121 @@
+"""Import time of the modules that API workers, pool processes and the command line import
+
+Every process pays for what its imports do at import time, so modules should only define things and leave loading data,
+creating directories and importing heavy optional packages to first use. `check` fails when a module cannot be imported
+or takes longer to import than its budget:
+
+    python -m phocus.utils.import_time check
+    python -m phocus.utils.import_time show phocus.cp.cp_app --top 20
+"""
+import subprocess
+import sys
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple
+
+import click
+
+"""Budgets in milliseconds of the cumulative import time of each module in a fresh interpreter"""
+IMPORT_BUDGETS_MS = OrderedDict([
+    ('phocus.utils', 250),
+    ('phocus.utils.maps', 350),
+    ('phocus.utils.travel_time_cache', 500),
+    ('phocus.model.solution_store', 400),
+    ('phocus.cp.cp_app', 1500),
+])
+"""Packages that should only be imported when they are used"""
+LAZY_PACKAGES = ('pandas', 'joblib', 'googlemaps', 'tenacity', 'sklearn')
+DEFAULT_REPEAT = 5
+"""Whether `python -X importtime` can break down import times, older versions only time the whole import"""
+IMPORTTIME_AVAILABLE = sys.version_info >= (3, 7)
+
+
+def parse_import_times(output: str) -> Dict[str, Tuple[int, int]]:
+    """The self and cumulative microseconds of each module in the output of `python -X importtime`"""
+    times = OrderedDict()
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if self_us.strip().isdigit():
+            times.setdefault(name.strip(), (int(self_us), int(cumulative_us)))
+    return times
+
+
+def _run_python(module: str, *args: str) -> str:
+    """Run a fresh interpreter with `args` and return its output, failing if it could not import `module`"""
+    process = subprocess.run([sys.executable] + list(args),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode:
+        raise RuntimeError('Could not import %s: %s' % (module, process.stderr.strip().splitlines()[-1]))
+    return process.stdout + process.stderr
+
+
+def import_times(module: str) -> Dict[str, Tuple[int, int]]:
+    """Import `module` in a fresh interpreter and return the import times of everything it imported"""
+    if not IMPORTTIME_AVAILABLE:
+        raise RuntimeError('No import times for %s, python -X importtime needs Python 3.7 or later' % module)
+    times = parse_import_times(_run_python(module, '-X', 'importtime', '-c', 'import %s' % module))
+    if module not in times:
+        raise RuntimeError('No import times for %s in the output of python -X importtime' % module)
+    return times
+
+
+def import_time(module: str) -> float:
+    """The cumulative import time of `module` in a fresh interpreter in milliseconds"""
+    if IMPORTTIME_AVAILABLE:
+        return import_times(module)[module][1] / 1000
+    output = _run_python(
+        module, '-c', 'import time; t = time.perf_counter(); import %s; print(time.perf_counter() - t)' % module)
+    return float(output.split()[-1]) * 1000
+
+
+def measure(module: str, repeat: int = DEFAULT_REPEAT) -> float:
+    """The fastest of `repeat` cumulative import times of `module` in milliseconds"""
+    return min(import_time(module) for _ in range(repeat))
+
+
+def lazy_packages_imported(module: str, packages: Sequence[str] = LAZY_PACKAGES) -> List[str]:
+    """Which of `packages` importing `module` imports"""
+    imported = _run_python(module, '-c', 'import sys; import %s; print(*sys.modules)' % module).split()
+    return [package for package in packages if package in imported]
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.option('--repeat', default=DEFAULT_REPEAT)
+def check(repeat):
+    """Fail if a module takes longer to import than its budget"""
+    over_budget = []
+    failed = []
+    for module, budget_ms in IMPORT_BUDGETS_MS.items():
+        try:
+            milliseconds = measure(module, repeat)
+        except RuntimeError as e:
+            click.echo('%s: %s' % (module, e))
+            failed.append(module)
+            continue
+        click.echo('%s: %.0f ms of %d ms' % (module, milliseconds, budget_ms))
+        if milliseconds > budget_ms:
+            over_budget.append(module)
+    if failed:
+        raise click.ClickException('Could not measure the import time of: %s' % ', '.join(failed))
+    if over_budget:
+        raise click.ClickException('Over the import time budget: %s' % ', '.join(over_budget))
+
+
+@main.command()
+@click.argument('module')
+@click.option('--top', default=20)
+def show(module, top):
+    """Show the imports of a module that take the longest"""
+    times = import_times(module)
+    for name, (self_us, cumulative_us) in sorted(times.items(), key=lambda item: -item[1][1])[:top]:
+        click.echo('%8.1f ms %8.1f ms  %s' % (cumulative_us / 1000, self_us / 1000, name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Sets of closed integer intervals backed by numpy arrays"""
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from phocus.utils.mixins import Base
+
+Interval = Tuple[int, int]
+
+
+class IntervalSet(Base):
+    """A set of closed [start, end] intervals stored as sorted int64 start and end arrays
+
+    Overlapping or touching intervals are combined on construction, like `combine_periods`, so the stored intervals
+    are disjoint with a gap between each of them. Set operations are on the real line: `complement` and `subtract`
+    return the closures of the remaining gaps, so boundaries are shared the same way touching pendulum periods share
+    them.
+
+    >>> IntervalSet.from_intervals([(10, 20), (0, 5), (5, 8)]).to_list()
+    [(0, 8), (10, 20)]
+    >>> IntervalSet.from_intervals([(0, 8), (10, 20)]).complement(-5, 30).to_list()
+    [(-5, 0), (8, 10), (20, 30)]
+    """
+    def __init__(self, starts=(), ends=()):
+        starts = np.asarray(starts, dtype=np.int64).ravel()
+        ends = np.asarray(ends, dtype=np.int64).ravel()
+        if starts.shape != ends.shape:
+            raise RuntimeError('Expected as many starts as ends but got %d and %d' % (len(starts), len(ends)))
+        if np.any(ends < starts):
+            raise RuntimeError('Intervals should not end before they start')
+        self.starts, self.ends = _combine(starts, ends)
+
+    @classmethod
+    def from_intervals(cls, intervals: Iterable[Interval]) -> 'IntervalSet':
+        intervals = list(intervals)
+        if not intervals:
+            return cls()
+        starts, ends = zip(*intervals)
+        return cls(starts, ends)
+
+    @classmethod
+    def _from_combined(cls, starts: np.ndarray, ends: np.ndarray) -> 'IntervalSet':
+        """Create a set from arrays that are already sorted, disjoint and not touching"""
+        interval_set = cls.__new__(cls)
+        interval_set.starts = starts
+        interval_set.ends = ends
+        return interval_set
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self) -> Iterator[Interval]:
+        return iter(self.to_list())
+
+    def __eq__(self, other):
+        return (isinstance(other, IntervalSet)
+                and np.array_equal(self.starts, other.starts)
+                and np.array_equal(self.ends, other.ends))
+
+    def __or__(self, other: 'IntervalSet') -> 'IntervalSet':
+        return self.union(other)
+
+    def __and__(self, other: 'IntervalSet') -> 'IntervalSet':
+        return self.intersection(other)
+
+    def __sub__(self, other: 'IntervalSet') -> 'IntervalSet':
+        return self.subtract(other)
+
+    def to_list(self) -> List[Interval]:
+        return list(zip(self.starts.tolist(), self.ends.tolist()))
+
+    def total_length(self) -> int:
+        return int((self.ends - self.starts).sum())
+
+    def shift(self, start_offset: int = 0, end_offset: int = 0) -> 'IntervalSet':
+        """Move the starts and the ends of every interval, combining any that end up overlapping"""
+        return IntervalSet(self.starts + start_offset, np.maximum(self.starts + start_offset, self.ends + end_offset))
+
+    def union(self, other: 'IntervalSet') -> 'IntervalSet':
+        return IntervalSet(np.concatenate([self.starts, other.starts]), np.concatenate([self.ends, other.ends]))
+
+    def intersection(self, other: 'IntervalSet') -> 'IntervalSet':
+        # For every interval of self, the intervals of other that overlap it are other[first:last]
+        first = np.searchsorted(other.ends, self.starts, side='left')
+        last = np.searchsorted(other.starts, self.ends, side='right')
+        counts = np.maximum(last - first, 0)
+        self_idx = np.repeat(np.arange(len(self)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        other_idx = np.repeat(first, counts) + offsets
+        return IntervalSet._from_combined(
+            np.maximum(self.starts[self_idx], other.starts[other_idx]),
+            np.minimum(self.ends[self_idx], other.ends[other_idx]),
+        )
+
+    def complement(self, horizon_start: Optional[int] = None, horizon_end: Optional[int] = None) -> 'IntervalSet':
+        """The gaps between the intervals, including the gaps to the horizon if it is given"""
+        if not len(self):
+            if horizon_start is None or horizon_end is None:
+                raise RuntimeError('The complement of an empty set needs both ends of the horizon')
+            return IntervalSet([horizon_start], [horizon_end]) if horizon_end > horizon_start else IntervalSet()
+
+        starts = self.ends[:-1]
+        ends = self.starts[1:]
+        if horizon_start is not None:
+            starts = np.concatenate([[horizon_start], starts])
+            ends = np.concatenate([self.starts[:1], ends])
+        if horizon_end is not None:
+            starts = np.concatenate([starts, self.ends[-1:]])
+            ends = np.concatenate([ends, [horizon_end]])
+
+        if horizon_start is not None:
+            starts = np.maximum(starts, horizon_start)
+        if horizon_end is not None:
+            ends = np.minimum(ends, horizon_end)
+        is_gap = ends > starts
+        return IntervalSet._from_combined(starts[is_gap].astype(np.int64), ends[is_gap].astype(np.int64))
+
+    def subtract(self, other: 'IntervalSet') -> 'IntervalSet':
+        if not len(self) or not len(other):
+            return self
+        # Widen the horizon so that zero length intervals at its ends are kept
+        return self.intersection(other.complement(int(self.starts[0]) - 1, int(self.ends[-1]) + 1))
+
+    def contains(self, points) -> np.ndarray:
+        """Whether each of the points is in one of the intervals"""
+        points = np.asarray(points, dtype=np.int64)
+        if not len(self):
+            return np.zeros(points.shape, bool)
+        idx = np.searchsorted(self.starts, points, side='right') - 1
+        return (idx >= 0) & (points <= self.ends[np.maximum(idx, 0)])
+
+    def overlaps(self, starts, ends) -> np.ndarray:
+        """Whether each of the closed [start, end] intervals overlaps one of the intervals"""
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if not len(self):
+            return np.zeros(starts.shape, bool)
+        # The last interval starting at or before the end is the only candidate since the intervals are disjoint
+        idx = np.searchsorted(self.starts, ends, side='right') - 1
+        return (idx >= 0) & (self.ends[np.maximum(idx, 0)] >= starts)
+
+    def overlapping(self, start: int, end: int) -> 'IntervalSet':
+        """The intervals that overlap the closed [start, end] interval"""
+        first = np.searchsorted(self.ends, start, side='left')
+        last = np.searchsorted(self.starts, end, side='right')
+        return IntervalSet._from_combined(self.starts[first:last], self.ends[first:last])
+
+
+def _combine(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sort and combine overlapping or touching intervals"""
+    if not len(starts):
+        return starts, ends
+    order = np.lexsort((ends, starts))
+    starts = starts[order]
+    running_ends = np.maximum.accumulate(ends[order])
+    is_new = np.empty(len(starts), dtype=bool)
+    is_new[0] = True
+    is_new[1:] = starts[1:] > running_ends[:-1]
+    is_last = np.empty(len(starts), dtype=bool)
+    is_last[:-1] = is_new[1:]
+    is_last[-1] = True
+    return starts[is_new], running_ends[is_last]
@@ -5,6 +5,8 @@ import logging
 
 class ReprMixin(object):
     """Mixin that provides a sane __repr__ from an object's vars"""
+    __slots__ = ()
+
     def __repr__(self):
         attributes = []
         for key in vars(self):
@@ -17,6 +19,8 @@ class LoggingMixin(object):
     """Mixin that provides a logger property
 
     Note: does not call logs.setup_logging as that should generally only be called from __main__"""
+    __slots__ = ()
+
     @property
     def log(self) -> logging.Logger:
         try:
@@ -31,4 +35,4 @@ class Base(LoggingMixin, ReprMixin):
 
     Currently extends LoggingMixing and ReprMixin
     """
-    pass
+    __slots__ = ()
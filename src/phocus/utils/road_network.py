@@ -0,0 +1,331 @@
+"""Offline travel times on a local road network
+
+A `RoadNetwork` is a directed graph of road segments stored as CSR arrays. It can be loaded from a CSV edge list or,
+with the optional `osmium` package, from an OSM PBF extract. `RoadNetworkDistanceProvider` snaps coordinates to the
+nearest road node with a KD-tree and runs the multi-source Dijkstra of `scipy.sparse.csgraph` from blocks of origins,
+split across a pool of worker processes that is kept between calls, caching the rows it has computed:
+
+    with RoadNetworkDistanceProvider(RoadNetwork.from_osm_pbf('new-york-latest.osm.pbf'), max_workers=4) as provider:
+        matrix = provider.travel_time_matrix(locations)
+
+Travel times need scipy, install the `roads` extra.
+"""
+import csv
+import hashlib
+import multiprocessing
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pendulum
+
+from phocus.utils.distance_provider import DistanceProvider, coordinates_array
+from phocus.utils.geo import haversine_meters
+from phocus.utils.mixins import Base
+
+"""Walking speed used for the distance between a coordinate and its nearest road node"""
+ACCESS_SPEED_METERS_PER_SECOND = 1.4
+"""Travel time reported between points that aren't connected by the road network"""
+UNREACHABLE_SECONDS = 10 * 24 * 60 * 60
+"""Speeds of OSM highway types in km/h when a way has no usable maxspeed"""
+DEFAULT_HIGHWAY_SPEEDS_KPH = {
+    'motorway': 100,
+    'motorway_link': 60,
+    'trunk': 80,
+    'trunk_link': 50,
+    'primary': 65,
+    'primary_link': 45,
+    'secondary': 55,
+    'secondary_link': 40,
+    'tertiary': 45,
+    'tertiary_link': 35,
+    'unclassified': 40,
+    'residential': 30,
+    'living_street': 10,
+    'service': 20,
+}
+# Limit the memory of shortest paths to about SHORTEST_PATH_CHUNK_ELEMENTS floats per process at a time
+SHORTEST_PATH_CHUNK_ELEMENTS = 10 ** 7
+DEFAULT_MAX_CACHED_ROWS = 100000
+
+"""The network of a worker process, set by `_start_worker`"""
+_worker_network = None
+
+
+def _scipy():
+    """The scipy modules the road network uses"""
+    try:
+        import scipy.sparse
+        import scipy.sparse.csgraph
+        import scipy.spatial
+    except ImportError:
+        raise RuntimeError('Travel times on a road network need scipy, try `pip install scipy`')
+    return scipy
+
+
+def _unit_vectors(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Points on the unit sphere, the straight line between two of them grows with their great circle distance"""
+    lats, lons = np.radians(lats), np.radians(lons)
+    return np.column_stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)])
+
+
+class RoadNetwork(Base):
+    """A directed road graph with travel time weights in seconds"""
+    def __init__(self, node_lats, node_lons, edge_sources, edge_targets, edge_seconds):
+        self.node_lats = np.asarray(node_lats, dtype=np.float64)
+        self.node_lons = np.asarray(node_lons, dtype=np.float64)
+        edge_sources = np.asarray(edge_sources, dtype=np.int64)
+        edge_targets = np.asarray(edge_targets, dtype=np.int64)
+        edge_seconds = np.asarray(edge_seconds, dtype=np.float64)
+        if np.any(edge_seconds < 0):
+            raise RuntimeError('Travel times of road segments should not be negative')
+
+        # Compressed sparse rows: the edges leaving node i are indptr[i]:indptr[i + 1]
+        order = np.argsort(edge_sources, kind='mergesort')
+        self.indptr = np.searchsorted(edge_sources[order], np.arange(self.num_nodes + 1))
+        self.targets = edge_targets[order]
+        self.seconds = edge_seconds[order]
+        self._graph = None
+        self._node_tree = None
+
+    def __getstate__(self):
+        # The graph and tree are built again where they are used
+        state = {k: v for k, v in vars(self).items() if k != '_logger'}
+        state.update(_graph=None, _node_tree=None)
+        return state
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_lats)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.targets)
+
+    def fingerprint(self) -> str:
+        digest = hashlib.sha1()
+        for array in (self.node_lats, self.node_lons, self.indptr, self.targets, self.seconds):
+            digest.update(np.ascontiguousarray(array).view(np.uint8))
+        return digest.hexdigest()
+
+    @classmethod
+    def from_edges(cls, edges: Sequence[Tuple[float, float, float, float, float]], oneway: Sequence[bool] = None):
+        """Build a network from (from_lat, from_lon, to_lat, to_lon, seconds) edges
+
+        Nodes are identified by their coordinates. Edges are traversable both ways unless they are `oneway`."""
+        node_ids: Dict[Tuple[float, float], int] = {}
+
+        def node_id(lat, lon):
+            return node_ids.setdefault((lat, lon), len(node_ids))
+
+        sources, targets, seconds = [], [], []
+        for i, (from_lat, from_lon, to_lat, to_lon, edge_seconds) in enumerate(edges):
+            source = node_id(from_lat, from_lon)
+            target = node_id(to_lat, to_lon)
+            sources.append(source)
+            targets.append(target)
+            seconds.append(edge_seconds)
+            if not (oneway and oneway[i]):
+                sources.append(target)
+                targets.append(source)
+                seconds.append(edge_seconds)
+
+        coordinates = np.array(list(node_ids), dtype=np.float64).reshape(-1, 2)
+        return cls(coordinates[:, 0], coordinates[:, 1], sources, targets, seconds)
+
+    @classmethod
+    def from_edge_list_csv(cls, path: Path) -> 'RoadNetwork':
+        """Load a CSV with from_lat, from_lon, to_lat, to_lon and seconds columns and an optional oneway column"""
+        edges = []
+        oneway = []
+        with open(str(path), newline='') as f:
+            for row in csv.DictReader(f):
+                edges.append((float(row['from_lat']), float(row['from_lon']), float(row['to_lat']),
+                              float(row['to_lon']), float(row['seconds'])))
+                oneway.append(row.get('oneway', '').strip().lower() in ('1', 'true', 'yes'))
+        return cls.from_edges(edges, oneway)
+
+    @classmethod
+    def from_osm_pbf(cls, path: Path, highway_speeds_kph: Dict[str, float] = None) -> 'RoadNetwork':
+        """Load the drivable ways of an OSM PBF extract, this needs the `osmium` package"""
+        try:
+            import osmium
+        except ImportError:
+            raise RuntimeError('Loading OSM extracts needs the osmium package, try `pip install osmium`')
+
+        speeds = highway_speeds_kph if highway_speeds_kph is not None else DEFAULT_HIGHWAY_SPEEDS_KPH
+        edges = []
+        oneway = []
+
+        class WayHandler(osmium.SimpleHandler):
+            def way(self, way):
+                highway = way.tags.get('highway')
+                if highway not in speeds:
+                    return
+                speed_kph = _parse_maxspeed(way.tags.get('maxspeed')) or speeds[highway]
+                is_oneway = way.tags.get('oneway') in ('yes', 'true', '1') or highway == 'motorway'
+                nodes = [n for n in way.nodes if n.location.valid()]
+                for a, b in zip(nodes, nodes[1:]):
+                    meters = float(haversine_meters(a.location.lat, a.location.lon, b.location.lat, b.location.lon))
+                    edges.append((a.location.lat, a.location.lon, b.location.lat, b.location.lon,
+                                  meters / (speed_kph / 3.6)))
+                    oneway.append(is_oneway)
+
+        WayHandler().apply_file(str(path), locations=True)
+        return cls.from_edges(edges, oneway)
+
+    @property
+    def graph(self):
+        """The scipy CSR matrix of the network, keeping the fastest of parallel segments"""
+        if self._graph is None:
+            scipy = _scipy()
+            sources = np.repeat(np.arange(self.num_nodes), np.diff(self.indptr))
+            # Sort by seconds so the first of each (source, target) pair is the fastest
+            order = np.lexsort((self.seconds, self.targets, sources))
+            sources, targets, seconds = sources[order], self.targets[order], self.seconds[order]
+            is_first = np.ones(len(order), dtype=bool)
+            is_first[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+            sources, targets, seconds = sources[is_first], targets[is_first], seconds[is_first]
+            indptr = np.searchsorted(sources, np.arange(self.num_nodes + 1))
+            # Explicit zeros are segments that take no time
+            self._graph = scipy.sparse.csr_matrix((seconds, targets, indptr), shape=(self.num_nodes, self.num_nodes))
+        return self._graph
+
+    def nearest_nodes(self, coordinates: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """The nearest node to each (lat, lon) and the distance to it in meters"""
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        if self._node_tree is None:
+            self._node_tree = _scipy().spatial.cKDTree(_unit_vectors(self.node_lats, self.node_lons))
+        _, nodes = self._node_tree.query(_unit_vectors(coordinates[:, 0], coordinates[:, 1]))
+        nodes = np.asarray(nodes, dtype=np.int64).reshape(-1)
+        meters = haversine_meters(coordinates[:, 0], coordinates[:, 1], self.node_lats[nodes], self.node_lons[nodes])
+        return nodes, np.asarray(meters, dtype=np.float64).reshape(-1)
+
+    def shortest_times(self, sources: Sequence[int], targets: Sequence[int]) -> np.ndarray:
+        """The (sources x targets) seconds of the fastest routes, infinite between nodes that are not connected
+
+        Blocks of sources are searched by one call to scipy's Dijkstra."""
+        scipy = _scipy()
+        sources = np.asarray(sources, dtype=np.int64).reshape(-1)
+        targets = np.asarray(targets, dtype=np.int64).reshape(-1)
+        times = np.empty((len(sources), len(targets)), dtype=np.float64)
+        chunk_size = max(1, SHORTEST_PATH_CHUNK_ELEMENTS // max(1, self.num_nodes))
+        for start in range(0, len(sources), chunk_size):
+            chunk = sources[start:start + chunk_size]
+            seconds = scipy.sparse.csgraph.dijkstra(self.graph, directed=True, indices=chunk)
+            times[start:start + chunk_size] = seconds.reshape(len(chunk), -1)[:, targets]
+        return times
+
+
+def _parse_maxspeed(maxspeed: Optional[str]) -> Optional[float]:
+    """The km/h of an OSM maxspeed tag like '50' or '30 mph'"""
+    if not maxspeed:
+        return None
+    parts = maxspeed.split()
+    try:
+        speed = float(parts[0])
+    except ValueError:
+        return None
+    return speed * 1.609344 if len(parts) > 1 and parts[1] == 'mph' else speed
+
+
+def _start_worker(network: RoadNetwork):
+    global _worker_network
+    _worker_network = network
+
+
+def _worker_shortest_times(args) -> np.ndarray:
+    return _worker_network.shortest_times(*args)
+
+
+class RoadNetworkDistanceProvider(DistanceProvider):
+    """Travel times on a local `RoadNetwork`
+
+    Each point is snapped to its nearest road node, the walk to the node is added at `access_speed`. Rows of the
+    matrix are computed across `max_workers` processes, all the cores by default, and cached per (origin node,
+    destination nodes) so repeated requests only compute the origins they haven't seen. The workers get the network
+    once when they start and are kept until the provider is closed, use it as a context manager or `close` it.
+    """
+    def __init__(
+            self,
+            network: RoadNetwork,
+            max_workers: Optional[int] = None,
+            access_speed: float = ACCESS_SPEED_METERS_PER_SECOND,
+            max_cached_rows: int = DEFAULT_MAX_CACHED_ROWS,
+    ):
+        self.network = network
+        self.max_workers = max_workers
+        self.access_speed = access_speed
+        self.max_cached_rows = max_cached_rows
+        self._rows: 'OrderedDict[Tuple[int, str], np.ndarray]' = OrderedDict()
+        self._pool = None
+
+    @property
+    def num_workers(self) -> int:
+        return self.max_workers or multiprocessing.cpu_count()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self) -> 'RoadNetworkDistanceProvider':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def travel_time_matrix(
+            self,
+            origins: Sequence,
+            destinations: Optional[Sequence] = None,
+            departure_time: Optional[pendulum.DateTime] = None,
+    ) -> np.ndarray:
+        origin_coordinates = coordinates_array(origins)
+        destination_coordinates = (coordinates_array(destinations) if destinations is not None
+                                   else origin_coordinates)
+        origin_nodes, origin_meters = self.network.nearest_nodes(origin_coordinates)
+        destination_nodes, destination_meters = self.network.nearest_nodes(destination_coordinates)
+
+        source_nodes = np.unique(origin_nodes)
+        target_nodes = np.unique(destination_nodes)
+        road_seconds = self._road_seconds(source_nodes, target_nodes)
+        matrix = road_seconds[np.ix_(np.searchsorted(source_nodes, origin_nodes),
+                                     np.searchsorted(target_nodes, destination_nodes))]
+
+        matrix = matrix + (origin_meters / self.access_speed)[:, None] + (destination_meters / self.access_speed)[None, :]
+        is_same_point = np.all(origin_coordinates[:, None, :] == destination_coordinates[None, :, :], axis=2)
+        matrix[is_same_point] = 0
+        if not np.all(np.isfinite(matrix)):
+            self.log.warning('%d pairs are not connected by the road network', np.sum(~np.isfinite(matrix)))
+            matrix[~np.isfinite(matrix)] = UNREACHABLE_SECONDS
+        return np.rint(matrix).astype(np.int64)
+
+    def _road_seconds(self, source_nodes: np.ndarray, target_nodes: np.ndarray) -> np.ndarray:
+        """The (sources x targets) road seconds between nodes"""
+        targets_key = hashlib.sha1(np.ascontiguousarray(target_nodes, dtype=np.int64).view(np.uint8)).hexdigest()
+        missing = [int(source) for source in source_nodes if (int(source), targets_key) not in self._rows]
+        targets = target_nodes.tolist()
+        self.log.info('Computing travel times from %d of %d origins to %d destinations on the road network',
+                      len(missing), len(source_nodes), len(targets))
+
+        if missing:
+            rows = self._shortest_times(missing, targets)
+            for source, row in zip(missing, rows):
+                self._rows[(source, targets_key)] = row
+                while len(self._rows) > self.max_cached_rows:
+                    self._rows.popitem(last=False)
+
+        return np.array([self._rows[(int(source), targets_key)] for source in source_nodes],
+                        dtype=np.float64).reshape(len(source_nodes), len(target_nodes))
+
+    def _shortest_times(self, sources: List[int], targets: List[int]) -> np.ndarray:
+        num_chunks = min(len(sources), self.num_workers)
+        if num_chunks == 1:
+            return self.network.shortest_times(sources, targets)
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.num_workers, initializer=_start_worker, initargs=(self.network,))
+        chunks = np.array_split(np.asarray(sources), num_chunks)
+        return np.concatenate(self._pool.map(_worker_shortest_times, [(chunk, targets) for chunk in chunks]))
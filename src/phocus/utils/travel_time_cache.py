@@ -0,0 +1,330 @@
+"""Persistent cache of travel times between pairs of coordinates
+
+Travel times are keyed on the coordinates of the origin and destination, rounded to `COORDINATE_DECIMALS`, and the
+hour of the week of the departure. Matrices are looked up with a single query and only the missing pairs are fetched,
+so adding, removing or reordering locations only fetches the pairs that were never seen.
+
+Trips already in the joblib cache of `gmaps_distance_matrix` can be imported with
+`python -m phocus.utils.travel_time_cache import-joblib`.
+"""
+import sqlite3
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import click
+import numpy as np
+import pendulum
+
+from phocus.traffic.travel_time_predictor import DEFAULT_MAX_RELATIVE_UNCERTAINTY
+from phocus.utils.constants import CACHE_DIR
+from phocus.utils.distance_provider import coordinates_array
+from phocus.utils.fetch_planner import (
+    ApiLimits,
+    AsyncFetcher,
+    DEFAULT_ELEMENTS_PER_SECOND,
+    DEFAULT_MAX_ATTEMPTS,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_MAX_KNOWN_FRACTION,
+    FetchReport,
+    FetchRequest,
+    GOOGLE_API_LIMITS,
+    plan_requests,
+)
+from phocus.utils.mixins import Base
+
+DEFAULT_CACHE_PATH = CACHE_DIR / 'travel_times.sqlite'
+"""Coordinates are rounded to about a meter"""
+COORDINATE_DECIMALS = 5
+DEFAULT_BUCKET_MINUTES = 60
+
+"""Fetch travel times and distances between (lat, lon) origins and destinations as (seconds, meters) matrices
+
+Pairs without a route should be nan."""
+Fetcher = Callable[[List[Tuple[float, float]], List[Tuple[float, float]], pendulum.DateTime],
+                   Tuple[np.ndarray, np.ndarray]]
+Key = Tuple[int, int]
+
+
+class IncompleteFetchError(RuntimeError):
+    """Some travel times could not be fetched, the ones that were are cached"""
+    def __init__(self, report: FetchReport):
+        super().__init__('%d of %d distance matrix requests failed' % (len(report.failed), report.num_requests))
+        self.report = report
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS travel_times (
+    origin_lat INTEGER NOT NULL,
+    origin_lon INTEGER NOT NULL,
+    destination_lat INTEGER NOT NULL,
+    destination_lon INTEGER NOT NULL,
+    departure_bucket INTEGER NOT NULL,
+    seconds INTEGER NOT NULL,
+    meters INTEGER,
+    PRIMARY KEY (origin_lat, origin_lon, destination_lat, destination_lon, departure_bucket)
+) WITHOUT ROWID;
+'''
+
+
+class TravelTimeCache(Base):
+    """SQLite cache of travel times between coordinate pairs
+
+    Like `SolutionStore` the database is opened on first use and shared between threads behind a lock."""
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH, bucket_minutes: int = DEFAULT_BUCKET_MINUTES):
+        self.path = path
+        self.bucket_minutes = bucket_minutes
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_predicted = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._connection is None:
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+                self._connection.executescript(_SCHEMA)
+            return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    @property
+    def hit_rate(self) -> float:
+        num_lookups = self.num_hits + self.num_misses
+        return self.num_hits / num_lookups if num_lookups else 0.
+
+    def departure_bucket(self, departure_time: pendulum.DateTime) -> int:
+        """The index of the `bucket_minutes` long slot of the week of the departure, in its own timezone"""
+        minute_of_week = (departure_time.weekday() * 24 + departure_time.hour) * 60 + departure_time.minute
+        return minute_of_week // self.bucket_minutes
+
+    def lookup(self, origins: Sequence, destinations: Sequence, departure_time: pendulum.DateTime) -> np.ndarray:
+        """The (origins x destinations) cached travel times in seconds, nan where a pair is not cached"""
+        origin_keys = _keys(origins)
+        destination_keys = _keys(destinations)
+        matrix = np.full((len(origin_keys), len(destination_keys)), np.nan)
+        origin_positions = _positions(origin_keys)
+        destination_positions = _positions(destination_keys)
+
+        with self._lock:
+            connection = self.connection
+            connection.execute('CREATE TEMP TABLE IF NOT EXISTS lookup_origins (lat INTEGER, lon INTEGER)')
+            connection.execute('CREATE TEMP TABLE IF NOT EXISTS lookup_destinations (lat INTEGER, lon INTEGER)')
+            connection.execute('DELETE FROM lookup_origins')
+            connection.execute('DELETE FROM lookup_destinations')
+            connection.executemany('INSERT INTO lookup_origins VALUES (?, ?)', origin_positions.keys())
+            connection.executemany('INSERT INTO lookup_destinations VALUES (?, ?)', destination_positions.keys())
+            rows = connection.execute(
+                'SELECT t.origin_lat, t.origin_lon, t.destination_lat, t.destination_lon, t.seconds '
+                'FROM lookup_origins o CROSS JOIN lookup_destinations d JOIN travel_times t '
+                'ON t.origin_lat = o.lat AND t.origin_lon = o.lon '
+                'AND t.destination_lat = d.lat AND t.destination_lon = d.lon AND t.departure_bucket = ?',
+                (self.departure_bucket(departure_time),)).fetchall()
+
+        for origin_lat, origin_lon, destination_lat, destination_lon, seconds in rows:
+            matrix[np.ix_(origin_positions[(origin_lat, origin_lon)],
+                          destination_positions[(destination_lat, destination_lon)])] = seconds
+        return matrix
+
+    def put(
+            self,
+            origins: Sequence,
+            destinations: Sequence,
+            departure_time: pendulum.DateTime,
+            seconds: np.ndarray,
+            meters: Optional[np.ndarray] = None,
+    ) -> int:
+        """Cache the (origins x destinations) travel times that are not nan, returning how many were cached"""
+        bucket = self.departure_bucket(departure_time)
+        seconds = np.asarray(seconds, dtype=np.float64)
+        meters = np.full(seconds.shape, np.nan) if meters is None else np.asarray(meters, dtype=np.float64)
+        rows = []
+        for (origin_lat, origin_lon), seconds_row, meters_row in zip(_keys(origins), seconds, meters):
+            for (destination_lat, destination_lon), pair_seconds, pair_meters in zip(
+                    _keys(destinations), seconds_row, meters_row):
+                if not np.isnan(pair_seconds):
+                    rows.append((origin_lat, origin_lon, destination_lat, destination_lon, bucket, int(pair_seconds),
+                                 None if np.isnan(pair_meters) else int(pair_meters)))
+        with self._lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO travel_times VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def travel_time_matrix(
+            self,
+            origins: Sequence,
+            destinations: Optional[Sequence],
+            departure_time: pendulum.DateTime,
+            fetch: Fetcher,
+            limits: ApiLimits = GOOGLE_API_LIMITS,
+            elements_per_second: float = DEFAULT_ELEMENTS_PER_SECOND,
+            max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+            max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+            max_known_fraction: float = DEFAULT_MAX_KNOWN_FRACTION,
+            predictor=None,
+            max_relative_uncertainty: float = DEFAULT_MAX_RELATIVE_UNCERTAINTY,
+    ) -> np.ndarray:
+        """The travel times in seconds between points, fetching and caching only the pairs that are not cached yet
+
+        Points at the same coordinates are 0 seconds apart without fetching. Raises `IncompleteFetchError` when
+        requests still fail after retrying, calling again fetches only the pairs that are still missing.
+
+        With a `TravelTimePredictor` missing pairs are predicted and only the predictions with a standard deviation
+        over `max_relative_uncertainty` of the prediction are fetched. Predictions are not cached."""
+        origin_coordinates, origin_inverse = _unique_coordinates(origins)
+        if destinations is None:
+            destination_coordinates, destination_inverse = origin_coordinates, origin_inverse
+        else:
+            destination_coordinates, destination_inverse = _unique_coordinates(destinations)
+
+        matrix = self.lookup(origin_coordinates, destination_coordinates, departure_time)
+        key_ids: Dict[Key, int] = {}
+        origin_ids = [key_ids.setdefault(key, len(key_ids)) for key in _keys(origin_coordinates)]
+        destination_ids = [key_ids.setdefault(key, len(key_ids)) for key in _keys(destination_coordinates)]
+        is_same_point = np.equal.outer(origin_ids, destination_ids)
+        matrix[is_same_point] = 0
+        is_missing = np.isnan(matrix)
+        num_missing = int(is_missing.sum())
+        num_pairs = matrix.size - int(is_same_point.sum())
+        self.num_hits += num_pairs - num_missing
+        self.num_misses += num_missing
+        self.log.info('%d of %d travel times are cached, the hit rate is %.1f%%',
+                      num_pairs - num_missing, num_pairs, 100 * self.hit_rate)
+
+        if num_missing and predictor is not None:
+            missing_origins, missing_destinations = np.nonzero(is_missing)
+            predictions, uncertainties = predictor.predict(
+                np.array(origin_coordinates)[missing_origins],
+                np.array(destination_coordinates)[missing_destinations],
+                self.departure_bucket(departure_time),
+            )
+            is_certain = uncertainties <= max_relative_uncertainty * np.maximum(predictions, 1)
+            matrix[missing_origins[is_certain], missing_destinations[is_certain]] = np.rint(predictions[is_certain])
+            is_missing = np.isnan(matrix)
+            num_missing = int(is_missing.sum())
+            self.num_predicted += int(is_certain.sum())
+            self.log.info('Predicted %d travel times, %d are too uncertain', is_certain.sum(), num_missing)
+
+        if num_missing:
+            requests = plan_requests(is_missing, limits, max_known_fraction)
+            self.log.info('Fetching %d travel times in %d requests', num_missing, len(requests))
+
+            def fetch_request(request: FetchRequest):
+                request_origins = [origin_coordinates[i] for i in request.origin_indices]
+                request_destinations = [destination_coordinates[i] for i in request.destination_indices]
+                seconds, meters = fetch(request_origins, request_destinations, departure_time)
+                self.put(request_origins, request_destinations, departure_time, seconds, meters)
+                return seconds
+
+            def on_result(request: FetchRequest, seconds: np.ndarray):
+                matrix[np.ix_(request.origin_indices, request.destination_indices)] = seconds
+
+            fetcher = AsyncFetcher(fetch_request, elements_per_second=elements_per_second,
+                                   max_concurrency=max_concurrency, max_attempts=max_attempts)
+            report = fetcher.fetch_all(requests, on_result)
+            if report.failed:
+                raise IncompleteFetchError(report)
+            if np.any(np.isnan(matrix)):
+                raise RuntimeError('No route was found for %d pairs of locations' % np.isnan(matrix).sum())
+
+        return matrix[np.ix_(origin_inverse, destination_inverse)].astype(np.int64)
+
+    def import_trips(
+            self,
+            origins: np.ndarray,
+            destinations: np.ndarray,
+            seconds: np.ndarray,
+            meters: np.ndarray,
+            departure_time: pendulum.DateTime,
+    ) -> int:
+        """Cache individual trips from (n, 2) arrays of coordinates"""
+        bucket = self.departure_bucket(departure_time)
+        rows = [tuple(origin) + tuple(destination) + (bucket, int(trip_seconds), int(trip_meters))
+                for origin, destination, trip_seconds, trip_meters in zip(
+                    _keys(origins), _keys(destinations), seconds, meters)]
+        with self._lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO travel_times VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def trips(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """The origins, destinations, departure buckets and seconds of every cached trip"""
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT origin_lat, origin_lon, destination_lat, destination_lon, departure_bucket, seconds '
+                'FROM travel_times').fetchall()
+        values = np.array(rows, dtype=np.float64).reshape(-1, 6)
+        scale = 10. ** COORDINATE_DECIMALS
+        return values[:, 0:2] / scale, values[:, 2:4] / scale, values[:, 4].astype(np.int64), values[:, 5]
+
+    def trips_with_meters(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """The origins, destinations, road meters and seconds of every cached trip whose distance is known"""
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT origin_lat, origin_lon, destination_lat, destination_lon, meters, seconds '
+                'FROM travel_times WHERE meters IS NOT NULL').fetchall()
+        values = np.array(rows, dtype=np.float64).reshape(-1, 6)
+        scale = 10. ** COORDINATE_DECIMALS
+        return values[:, 0:2] / scale, values[:, 2:4] / scale, values[:, 4], values[:, 5]
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute('SELECT COUNT(*) FROM travel_times').fetchone()[0]
+
+
+def _keys(points) -> List[Key]:
+    """Rounded integer coordinates of points"""
+    coordinates = np.asarray(points, dtype=np.float64) if isinstance(points, np.ndarray) else coordinates_array(points)
+    rounded = np.rint(coordinates.reshape(-1, 2) * 10 ** COORDINATE_DECIMALS).astype(np.int64)
+    return [(int(lat), int(lon)) for lat, lon in rounded]
+
+
+def _positions(keys: List[Key]) -> Dict[Key, List[int]]:
+    positions = defaultdict(list)
+    for i, key in enumerate(keys):
+        positions[key].append(i)
+    return positions
+
+
+def _unique_coordinates(points: Sequence) -> Tuple[List[Tuple[float, float]], np.ndarray]:
+    """The (lat, lon) of points with distinct keys and the index of each point in them"""
+    coordinates = coordinates_array(points)
+    first_positions: Dict[Key, int] = {}
+    inverse = np.array([first_positions.setdefault(key, len(first_positions)) for key in _keys(coordinates)],
+                       dtype=np.int64)
+    unique_coordinates = [None] * len(first_positions)
+    for coordinate, position in zip(coordinates, inverse):
+        if unique_coordinates[position] is None:
+            unique_coordinates[position] = (float(coordinate[0]), float(coordinate[1]))
+    return unique_coordinates, inverse
+
+
+"""TravelTimeCache Singleton used by MapsUtils"""
+travel_time_cache = TravelTimeCache()
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command('import-joblib')
+def import_joblib_command():
+    """Import the trips in the joblib cache of the Google distance matrix blocks, in directories and packs"""
+    from phocus.utils.geo import load_cached_google_trips
+    from phocus.utils.maps import next_monday_8_am_eastern
+
+    origins, destinations, meters, seconds = load_cached_google_trips()
+    # The blocks were all fetched for a Monday 8 AM departure
+    num_imported = travel_time_cache.import_trips(origins, destinations, seconds, meters, next_monday_8_am_eastern())
+    click.echo('Imported %d travel times into %s' % (num_imported, travel_time_cache.path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Travel times between locations for several departure times of the day
+
+A `TravelTimeTensor` is a (time bucket x n x n) array of travel times quantized to uint16 in units of `unit_seconds`
+and memory mapped from a .npy file, with the buckets and unit in a JSON file next to it. A 1000 location territory takes
+2 MB per bucket and a lookup only reads the rows it needs.
+
+Tensors are filled from the travel time cache:
+
+    tensor = build_travel_time_tensor(path, locations, fetch=gmaps_travel_times)
+    distance_matrix = tensor.matrix(work_period.start)
+"""
+import json
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+import pendulum
+
+from phocus.utils.mixins import Base
+
+"""Start hours of the buckets sampled by the traffic scripts: the morning, midday and evening"""
+DEFAULT_BUCKET_HOURS = (8, 12, 16)
+"""The bucket used for matrices without a departure time, like the fixed Monday 8 AM departure used before"""
+DEFAULT_HOUR = 8
+DEFAULT_TIMEZONE = 'US/Eastern'
+"""Quantized value of pairs without a travel time"""
+MISSING = np.iinfo(np.uint16).max
+MAX_QUANTIZED = MISSING - 1
+
+
+def _metadata_path(path: Path) -> Path:
+    return Path(str(path) + '.json')
+
+
+class TravelTimeTensor(Base):
+    """Quantized travel time matrices for departures at each of `bucket_hours` local time
+
+    A departure uses the latest bucket that starts at or before its hour, departures before the first bucket use the
+    first bucket."""
+    def __init__(
+            self,
+            data: np.ndarray,
+            bucket_hours: Sequence[int] = DEFAULT_BUCKET_HOURS,
+            unit_seconds: int = 1,
+            timezone: str = DEFAULT_TIMEZONE,
+            path: Optional[Path] = None,
+    ):
+        if data.ndim != 3 or data.shape[1] != data.shape[2] or data.shape[0] != len(bucket_hours):
+            raise RuntimeError('Expected a (%d x n x n) tensor but got %s' % (len(bucket_hours), data.shape))
+        if list(bucket_hours) != sorted(bucket_hours):
+            raise RuntimeError('Bucket hours should be sorted: %s' % list(bucket_hours))
+        self.data = data
+        self.bucket_hours = list(bucket_hours)
+        self.unit_seconds = unit_seconds
+        self.timezone = timezone
+        self.path = path
+
+    @property
+    def num_nodes(self) -> int:
+        return self.data.shape[1]
+
+    @classmethod
+    def create(
+            cls,
+            path: Path,
+            num_nodes: int,
+            bucket_hours: Sequence[int] = DEFAULT_BUCKET_HOURS,
+            unit_seconds: int = 1,
+            timezone: str = DEFAULT_TIMEZONE,
+    ) -> 'TravelTimeTensor':
+        """A writable tensor at `path` with every travel time missing"""
+        data = np.lib.format.open_memmap(str(path), mode='w+', dtype=np.uint16,
+                                         shape=(len(bucket_hours), num_nodes, num_nodes))
+        data[:] = MISSING
+        with open(str(_metadata_path(path)), 'w') as f:
+            json.dump({'bucket_hours': list(bucket_hours), 'unit_seconds': unit_seconds, 'timezone': timezone}, f)
+        return cls(data, bucket_hours, unit_seconds, timezone, path)
+
+    @classmethod
+    def load(cls, path: Path, mode: str = 'r') -> 'TravelTimeTensor':
+        with open(str(_metadata_path(path))) as f:
+            metadata = json.load(f)
+        return cls(np.load(str(path), mmap_mode=mode), path=path, **metadata)
+
+    def flush(self):
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+
+    def bucket(self, departure_time: Optional[pendulum.DateTime] = None, time_dependent: bool = True) -> int:
+        """The bucket of `departure_time`, or of DEFAULT_HOUR without a departure or if not `time_dependent`"""
+        if departure_time is None or not time_dependent:
+            hour = DEFAULT_HOUR
+        else:
+            hour = pendulum.instance(departure_time).in_timezone(self.timezone).hour
+        return max(0, int(np.searchsorted(self.bucket_hours, hour, side='right')) - 1)
+
+    def set_matrix(self, bucket: int, seconds: np.ndarray):
+        """Quantize the travel times of a bucket, nan for pairs without a travel time"""
+        seconds = np.asarray(seconds, dtype=np.float64)
+        quantized = np.clip(np.rint(seconds / self.unit_seconds), 0, MAX_QUANTIZED)
+        quantized[np.isnan(seconds)] = MISSING
+        self.data[bucket] = quantized.astype(np.uint16)
+
+    def matrix(
+            self,
+            departure_time: Optional[pendulum.DateTime] = None,
+            nodes: Optional[Sequence[int]] = None,
+            time_dependent: bool = True,
+    ) -> np.ndarray:
+        """Travel times in seconds between `nodes`, or all nodes, for departures at `departure_time`"""
+        data = self.data[self.bucket(departure_time, time_dependent)]
+        quantized = data[np.ix_(nodes, nodes)] if nodes is not None else np.asarray(data)
+        if np.any(quantized == MISSING):
+            raise RuntimeError('%d travel times are missing from the tensor' % np.sum(quantized == MISSING))
+        return quantized.astype(np.int64) * self.unit_seconds
+
+
+def build_travel_time_tensor(
+        path: Path,
+        points: Sequence,
+        fetch,
+        bucket_hours: Sequence[int] = DEFAULT_BUCKET_HOURS,
+        unit_seconds: int = 1,
+        timezone: str = DEFAULT_TIMEZONE,
+        day: Optional[pendulum.DateTime] = None,
+        cache=None,
+) -> TravelTimeTensor:
+    """Fill a tensor from the travel time cache for departures on `day`, next Monday by default
+
+    Travel times that are not cached are fetched with `fetch` like `TravelTimeCache.travel_time_matrix`."""
+    from phocus.utils.travel_time_cache import travel_time_cache
+
+    cache = cache if cache is not None else travel_time_cache
+    day = day if day is not None else pendulum.now(timezone).next(pendulum.MONDAY)
+    tensor = TravelTimeTensor.create(path, len(points), bucket_hours, unit_seconds, timezone)
+    for bucket, hour in enumerate(bucket_hours):
+        departure_time = pendulum.instance(day).in_timezone(timezone).set(hour=hour, minute=0, second=0)
+        tensor.set_matrix(bucket, cache.travel_time_matrix(points, None, departure_time, fetch))
+    tensor.flush()
+    return tensor
@@ -12,13 +12,14 @@ import dash_table_experiments as dt
 import pandas as pd
 from dash.dependencies import Output, Input, State
 
-from phocus.model.solution import load_all_solutions
+from phocus.model.solution_store import solution_store
 from phocus.utils import bootstrap_project
 from phocus.viz.maps import plot_locations
 
 
 USER_PASS = ('phocus', 'optimal-path')
 PASSWORDS = [USER_PASS]
+MAX_DROPDOWN_SOLUTIONS = 1000
 
 logger = logging.getLogger(__name__)
 
@@ -75,7 +76,7 @@ class ResultRenderer:
 
     @property
     def container(self):
-        locations_df = pd.DataFrame([vars(loc) for loc in self.solution.route])
+        locations_df = pd.DataFrame([loc.to_dict() for loc in self.solution.route])
         table_id = self.id + '-table'
         locations_table = generate_table(locations_df, numbered=True, id=table_id)
         table_div = html.Div([locations_table],
@@ -135,20 +136,19 @@ def solution_name(solution):
     return '%s %s' % (solution.model_name, solution.run_datetime)
 
 
-def solution_from_name(name):
-    for sol in load_all_solutions():
-        if solution_name(sol) == name:
-            return sol
+def solution_options():
+    """Dropdown options of the newest stored solutions. Routes are not loaded."""
+    return [{'label': solution_name(solution), 'value': solution.solution_id}
+            for solution in solution_store.query(limit=MAX_DROPDOWN_SOLUTIONS)]
 
 
-solutions = load_all_solutions()
-solution_names = [solution_name(solution) for solution in solutions]
+options = solution_options()
 
 header = html.Div(
             dcc.Dropdown(
                 id='solution-dropdown',
-                options=[{'label': name, 'value': name} for name in solution_names],
-                value=solution_names[0],
+                options=options,
+                value=options[0]['value'] if options else None,
             )
         ),
 
@@ -266,8 +266,8 @@ app.layout = html.Div(className='container-fluid', children=[
         header=html.Div([
             dcc.Dropdown(
                 id='solution-dropdown',
-                options=[{'label': name, 'value': name} for name in solution_names],
-                value=solution_names[0],
+                options=options,
+                value=options[0]['value'] if options else None,
             )]
         ),
         id='solution-card',
@@ -335,9 +335,7 @@ def display_new_run_card(value, classes):
     [State('solution-dropdown', 'options')]
 )
 def update_dropdown_live(n, options):
-    current_solutions = load_all_solutions()
-    current_solution_names = {solution_name(solution) for solution in current_solutions}
-    return [{'label': name, 'value': name} for name in sorted(current_solution_names)]
+    return solution_options()
 
 
 @app.callback(
@@ -345,8 +343,12 @@ def update_dropdown_live(n, options):
     [Input('solution-dropdown', 'value')]
 )
 def update_output_live(value):
-    solution = solution_from_name(value)
-    result = ResultRenderer(value, 'cp-result', solution, value)
+    if value is None:
+        # The store has no solutions yet
+        return []
+    solution = solution_store.get(value)
+    name = solution_name(solution)
+    result = ResultRenderer(name, 'cp-result', solution, name)
     return [result.container]
 
 
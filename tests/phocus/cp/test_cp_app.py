@@ -1,3 +1,4 @@
+from pathlib import Path
 from typing import List
 from unittest.mock import MagicMock
 
@@ -5,10 +6,13 @@ import numpy as np
 import pendulum
 import pytest
 
-from phocus.cp.cp_app import run_model, CP, EXAMPLE_START_DATETIME, EXAMPLE_APPOINTMENTS
-from phocus.model.location import convert_date_str
+from phocus.cp.cp_app import run_model, CP, EXAMPLE_START_DATETIME, EXAMPLE_APPOINTMENTS, LunchModel, \
+    WorkPeriodVehiclesCP, breaks_supported
+from phocus.model.location import Location, convert_date_str
 from phocus.utils.date_utils import is_weekday, is_weekend
+from phocus.utils.epoch import period_to_interval
 from phocus.utils.files import real_long_island_data
+from phocus.utils.travel_time_tensor import TravelTimeTensor
 
 
 @pytest.fixture(autouse=True)
@@ -21,9 +25,9 @@ def mock_distance_matrix(monkeypatch):
 
 @pytest.fixture
 def mock_save(monkeypatch):
-    mock_save_instance = MagicMock()
-    monkeypatch.setattr('phocus.cp.cp_app.Solution.save', mock_save_instance)
-    return mock_save_instance
+    mock_sink = MagicMock()
+    monkeypatch.setattr('phocus.model.solution_sink.solution_sink', mock_sink)
+    return mock_sink.submit
 
 
 def test_simple_one_day_solution(mock_save):
@@ -75,6 +79,86 @@ def test_weekend_travel_time_solution(mock_save):
         assert is_weekday(arrival_time - pendulum.duration(seconds=travel_to_time))
 
 
+@pytest.mark.skipif(not breaks_supported(), reason='ortools is too old for break intervals')
+def test_lunch_breaks_do_not_overlap_visits(mock_save):
+    days = 2
+    num_locations = 10
+    locations = [Location('origin', 'origin address', 40.7, -73.6, id='origin')] + [
+        Location('doctor %d' % i, 'address %d' % i, 40.7 + i / 100, -73.6, id=str(i)) for i in range(1, num_locations)]
+    distance_matrix = np.random.RandomState(0).randint(5 * 60, 30 * 60, size=(num_locations, num_locations))
+    np.fill_diagonal(distance_matrix, 0)
+    work_periods = [
+        EXAMPLE_START_DATETIME.add(days=day, hours=8) - EXAMPLE_START_DATETIME.add(days=day) for day in range(days)]
+    solution = run_model(
+        work_periods=work_periods,
+        solution_name='Lunch Break Solution',
+        time_limit_ms=1000,
+        locations=locations,
+        distance_matrix=distance_matrix,
+        lunch_hour_start=12,
+        lunch_minutes=60,
+        lunch_model=LunchModel.BREAK,
+    )
+
+    assert solution.metrics['num_breaks'] == days
+    assert len(solution.route) > days
+    for lunch in solution.metrics['breaks']:
+        lunch_start = convert_date_str(lunch['start_time'])
+        lunch_end = lunch_start + pendulum.duration(seconds=lunch['duration_seconds'])
+        assert 12 <= lunch_start.hour <= 13
+        for location in solution.route:
+            arrival_time = convert_date_str(location.arrival_time)
+            end_time = convert_date_str(location.end_time)
+            assert end_time <= lunch_start or arrival_time >= lunch_end
+
+
+def test_vehicle_per_work_period_solution(mock_save):
+    days = 3
+    work_periods = example_work_periods_skipping_weekends(days)
+    solution = run_model(
+        work_periods=work_periods,
+        solution_name='Vehicle Per Work Period Solution',
+        time_limit_ms=1000,
+        vehicle_per_work_period=True,
+    )
+
+    assert solution.metrics['num_vehicles'] == days
+    # The route starts and ends at the origin without the depots between the work periods
+    assert [location.is_same_doctor(solution.route[0]) for location in solution.route].count(True) == 2
+    for location in solution.route:
+        arrival_time = convert_date_str(location.arrival_time)
+        end_time = convert_date_str(location.end_time)
+        assert any(arrival_time in p and end_time in p for p in work_periods)
+
+
+def test_vehicles_use_the_travel_times_of_their_departure(mock_save, tmpdir):
+    days = 2
+    work_periods = example_work_periods_skipping_weekends(days)
+    num_locations = len(real_long_island_data())
+    tensor = TravelTimeTensor.create(Path(str(tmpdir)) / 'tensor.npy', num_locations, bucket_hours=[8, 12])
+    for bucket in range(2):
+        tensor.set_matrix(bucket, np.random.randint(1, 50 * 60, size=(num_locations, num_locations)))
+    solution = run_model(
+        work_periods=work_periods,
+        solution_name='Time Dependent Solution',
+        time_limit_ms=1000,
+        vehicle_per_work_period=True,
+        travel_time_tensor=tensor,
+    )
+
+    assert solution.metrics['travel_time_bucket_hours'] == [tensor.bucket_hours[tensor.bucket(p.start)]
+                                                            for p in work_periods]
+
+
+def test_vehicle_per_work_period_has_no_duplicate_origins():
+    locations = real_long_island_data()
+    locations_with_duplicates, _, fake_origin_idx = WorkPeriodVehiclesCP._locations_with_duplicates_and_origin(
+        locations, [])
+
+    assert fake_origin_idx is None
+    assert not any(getattr(loc, 'is_duplicate_origin', False) for loc in locations_with_duplicates)
+
+
 def example_work_periods_skipping_weekends(days: int) -> List[pendulum.Period]:
     current_period = (EXAMPLE_START_DATETIME + pendulum.duration(hours=8)) - EXAMPLE_START_DATETIME
     work_periods = []
@@ -91,7 +175,8 @@ def test_locations_with_duplicate_origins_with_no_weekend():
     locations = real_long_island_data()
     days = 3
     work_periods = example_work_periods_skipping_weekends(days)
-    locations_with_duplicates, repeat_locations = CP._locations_with_duplicates_and_origin(locations, work_periods)
+    locations_with_duplicates, repeat_locations, _ = CP._locations_with_duplicates_and_origin(
+        locations, [period_to_interval(p) for p in work_periods])
 
     origin = locations_with_duplicates[0]
 
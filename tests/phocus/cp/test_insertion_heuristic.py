@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from phocus.cp.insertion_heuristic import InsertionHeuristic, merge_intervals
+
+DAY = 8 * 60 * 60
+
+
+def make_heuristic(num_nodes=12, seed=0, **kwargs):
+    # Euclidean travel times so the triangle inequality holds
+    points = np.random.RandomState(seed).rand(num_nodes, 2) * 30 * 60
+    travel_times = np.sqrt(((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)).astype(np.int64)
+    args = dict(
+        travel_times=travel_times,
+        service_times=[0] + [20 * 60] * (num_nodes - 1),
+        blackouts=[([], [])] * num_nodes,
+        horizon=DAY,
+        skeleton=[],
+    )
+    args.update(kwargs)
+    return InsertionHeuristic(**args)
+
+
+def assert_feasible(heuristic, route):
+    times = heuristic.schedule(route)
+    assert times is not None
+    for node, time in zip(route, times):
+        if node in heuristic.fixed_times:
+            assert time == heuristic.fixed_times[node]
+        for start, end in zip(heuristic._starts[node], heuristic._ends[node]):
+            assert not start <= time <= end
+    return dict(zip(route, times))
+
+
+def test_merge_intervals():
+    assert merge_intervals([10, 0, 21], [20, 5, 30]) == ([0, 10], [5, 30])
+    assert merge_intervals([], []) == ([], [])
+
+
+def test_all_nodes_inserted_when_there_is_capacity():
+    heuristic = make_heuristic()
+    route = heuristic.build()
+    assert sorted(route) == list(range(1, 12))
+    assert_feasible(heuristic, route)
+
+
+def test_route_respects_capacity_and_blackouts():
+    num_nodes = 30
+    blackouts = [([], [])] + [([0], [2 * 60 * 60])] * 10 + [([4 * 60 * 60], [DAY])] * (num_nodes - 11)
+    heuristic = make_heuristic(num_nodes, blackouts=blackouts)
+    route = heuristic.build()
+    assert 0 < len(route) < num_nodes - 1
+    assert_feasible(heuristic, route)
+
+
+def test_appointments_and_required_nodes_are_placed_first():
+    num_nodes = 40
+    penalties = [0] * num_nodes
+    heuristic = make_heuristic(
+        num_nodes,
+        fixed_times={5: 3 * 60 * 60, 6: 6 * 60 * 60},
+        priority_nodes=[7, 8],
+        penalties=penalties,
+    )
+    route = heuristic.build()
+    # Zero penalty nodes are never worth inserting
+    assert sorted(route) == [5, 6, 7, 8]
+    times = assert_feasible(heuristic, route)
+    assert times[5] == 3 * 60 * 60
+    assert times[6] == 6 * 60 * 60
+
+
+def test_repeat_visits_respect_gap():
+    num_nodes = 10
+    blackouts = [([], [])] * num_nodes
+    skeleton = [num_nodes - 1]
+    heuristic = make_heuristic(
+        num_nodes,
+        horizon=3 * DAY,
+        blackouts=blackouts,
+        skeleton=skeleton,
+        fixed_times={num_nodes - 1: DAY},
+        repeat_groups=[([1, 2, 3], DAY // 2)],
+        priority_nodes=[1, 2, 3],
+    )
+    route = heuristic.build()
+    times = assert_feasible(heuristic, route)
+    repeat_times = sorted(times[node] for node in (1, 2, 3))
+    assert np.all(np.diff(repeat_times) >= DAY // 2)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_vectorized_costs_match_exact_schedule(seed):
+    num_nodes = 15
+    random_state = np.random.RandomState(seed)
+    blackouts = [([], [])] + [
+        ([int(s)], [int(s) + 60 * 60]) for s in random_state.randint(0, DAY, size=num_nodes - 1)
+    ]
+    heuristic = make_heuristic(num_nodes, seed=seed, blackouts=blackouts, fixed_times={1: DAY // 2},
+                               skeleton=[1], repeat_groups=[([2, 3], 60 * 60)])
+    route = [1, 2]
+    times = heuristic.schedule(route)
+    nodes = np.arange(3, num_nodes)
+    costs = heuristic.insertion_costs(nodes, route, times, heuristic._latest_times(route))
+    for row, node in enumerate(nodes):
+        for pos in range(len(route) + 1):
+            exact = heuristic.schedule(route[:pos] + [int(node)] + route[pos:])
+            assert (costs[row, pos] < 1e15) == (exact is not None)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from phocus.cp.model_cache import CacheStats, ModelInputCache, fingerprint_array, size_of
+
+
+def test_hits_report_time_saved():
+    cache = ModelInputCache()
+    stats = CacheStats()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return sum(range(100000))
+
+    assert cache.get('a', compute, stats) == cache.get('a', compute, stats)
+    assert len(calls) == 1
+    assert (stats.hits, stats.misses) == (1, 1)
+
+    metrics = {}
+    stats.add_to(metrics)
+    assert metrics['model_cache']['hits'] == 1
+    assert metrics['model_cache']['preprocessing_time_saved'] >= 0
+
+
+def test_values_are_read_only():
+    cache = ModelInputCache()
+    matrix = cache.get('matrix', lambda: np.zeros((3, 3)))
+    with pytest.raises(ValueError):
+        matrix[0, 0] = 1
+    assert cache.get('intervals', lambda: ([(0, 1)], [2, 3])) == (((0, 1),), (2, 3))
+
+
+def test_least_recently_used_entries_are_evicted_within_max_bytes():
+    cache = ModelInputCache(max_bytes=2 * size_of(np.zeros(1000)))
+    cache.get('a', lambda: np.zeros(1000))
+    cache.get('b', lambda: np.ones(1000))
+    cache.get('a', lambda: None)
+    cache.get('c', lambda: np.full(1000, 2.))
+
+    stats = CacheStats()
+    cache.get('a', lambda: None, stats)
+    cache.get('c', lambda: None, stats)
+    cache.get('b', lambda: np.ones(1000), stats)
+    assert (stats.hits, stats.misses) == (2, 1)
+    assert cache.num_bytes <= cache.max_bytes
+    # Values larger than the cache are not cached
+    assert cache.get('d', lambda: np.zeros(10000)).shape == (10000,)
+    assert len(cache) == 2
+
+
+def test_fingerprint_array_depends_on_contents():
+    matrix = np.arange(9).reshape(3, 3)
+    assert fingerprint_array(matrix) == fingerprint_array(matrix.copy())
+    assert fingerprint_array(matrix) != fingerprint_array(matrix.T)
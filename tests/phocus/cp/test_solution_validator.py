@@ -1,12 +1,16 @@
 from unittest.mock import MagicMock
 
+import numpy as np
 import pendulum
 import pytest
 
+from phocus.cp.cp_app import RepeatLocation
 from phocus.cp.solution_validator import SolutionValidator
 from phocus.model.appointment import Appointment
+from phocus.model.problem_instance import NO_NODE, ProblemInstance
 from phocus.model.solution import Solution
 from phocus.utils.constants import TEST_DATA_PATH
+from phocus.utils.epoch import to_epoch
 
 
 @pytest.fixture
@@ -146,3 +150,76 @@ class TestValidateAppointments:
             solution=solution,
         )
         assert [] == validator._validate_appointments()
+
+
+class TestValidateBlackoutWindows:
+    def test_only_overlapping_blackouts_are_reported(self, solution):
+        doctor = solution.route[1].copy()
+        doctor.blackout_intervals = [
+            (to_epoch(pendulum.parse('2018-06-18T13:00:00+00:00')), to_epoch(pendulum.parse('2018-06-18T13:59:01+00:00'))),
+            (to_epoch(pendulum.parse('2018-06-18T14:00:00+00:00')), to_epoch(pendulum.parse('2018-06-18T14:05:00+00:00'))),
+            (to_epoch(pendulum.parse('2018-06-18T14:09:02+00:00')), to_epoch(pendulum.parse('2018-06-18T15:00:00+00:00'))),
+        ]
+        validator = SolutionValidator(
+            appointments=[],
+            locations=[doctor],
+            repeat_locations=[],
+            solution=solution,
+        )
+        error_messages = validator._validate_location_blackout_windows()
+        assert 1 == len(error_messages)
+        assert '14:04:59' in error_messages[0]
+
+
+class TestValidateRepeatVisits:
+    def test_missing_repeat_visit(self, solution):
+        locations = [solution.route[0], solution.route[1], solution.route[1].copy()]
+        validator = SolutionValidator(
+            appointments=[],
+            locations=locations,
+            repeat_locations=[RepeatLocation(1, 1, 2)],
+            solution=solution,
+        )
+        assert ['Expected 2 instances of Juan Goez-10 in solution, but got 1'] == validator._validate_repeat_visits()
+
+
+class TestValidateProblemInstance:
+    @pytest.fixture
+    def problem(self, solution):
+        origin, doctor = solution.route[0].copy(), solution.route[1].copy()
+        doctor.num_total_visits = 2
+        doctor.min_visit_gap_days = 1
+        doctor.blackout_intervals = [
+            (to_epoch(pendulum.parse('2018-06-18T14:00:00+00:00')), to_epoch(pendulum.parse('2018-06-18T14:05:00+00:00'))),
+        ]
+        work_period = pendulum.parse('2018-06-18T13:00:00+00:00') - pendulum.parse('2018-06-19T13:00:00+00:00')
+        return ProblemInstance.compile([origin, doctor], np.zeros((2, 2)), [work_period])
+
+    def test_messages_match_the_ones_of_locations(self, solution):
+        origin, doctor = solution.route[0].copy(), solution.route[1].copy()
+        doctor.blackout_intervals = [
+            (to_epoch(pendulum.parse('2018-06-18T14:00:00+00:00')), to_epoch(pendulum.parse('2018-06-18T14:05:00+00:00'))),
+        ]
+        appointment = Appointment(doctor, pendulum.parse('2018-06-18T14:17:24+00:00'),
+                                  pendulum.parse('2018-06-18T14:47:24+00:00'))
+        work_period = pendulum.parse('2018-06-18T13:00:00+00:00') - pendulum.parse('2018-06-19T13:00:00+00:00')
+        problem = ProblemInstance.compile([origin, doctor], np.zeros((2, 2)), [work_period], [appointment])
+        problem_validator = SolutionValidator.from_problem_instance(problem, solution)
+        locations_validator = SolutionValidator([appointment], [doctor], [], solution)
+
+        blackout_messages = problem_validator._validate_location_blackout_windows()
+        assert 1 == len(blackout_messages)
+        assert 'for doctor (%s)' % doctor in blackout_messages[0]
+        assert blackout_messages == locations_validator._validate_location_blackout_windows()
+        assert problem_validator._validate_appointments() == locations_validator._validate_appointments()
+
+    def test_model_nodes_are_checked_against_the_visits(self, problem, solution):
+        solution_message = 'Expected 2 instances of Juan Goez-10 in solution, but got 1'
+        assert [solution_message] == SolutionValidator.from_problem_instance(problem, solution)._validate_repeat_visits()
+        assert [solution_message] == SolutionValidator.from_problem_instance(
+            problem, solution, node_sources=np.array([0, 1, 1, NO_NODE]))._validate_repeat_visits()
+        assert [
+            'Expected 2 instances of Juan Goez-10 in input locations, but got 1',
+            solution_message,
+        ] == SolutionValidator.from_problem_instance(
+            problem, solution, node_sources=np.array([0, 1, NO_NODE]))._validate_repeat_visits()
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from phocus.mdp import Segment
+from phocus.mdp.env import Environment, VectorEnvironment
+
+NUM_NODES = 50
+NUM_EPISODES = 8
+SEGMENTS_WITH_END_NODE = [
+    Segment(hours=3, start_node=0, end_node=None),
+    Segment(hours=5, start_node=None, end_node=7),
+    Segment(hours=3, start_node=0, end_node=None),
+]
+
+
+@pytest.mark.parametrize('segments', [
+    [Segment(hours=3, start_node=0, end_node=None), Segment(hours=5, start_node=None, end_node=None)],
+    SEGMENTS_WITH_END_NODE,
+])
+def test_vector_environment_steps_like_environment(segments):
+    rng = np.random.RandomState(0)
+    node_locations = rng.rand(NUM_NODES, 2) * 7
+    node_rewards = rng.rand(NUM_NODES)
+    scores = rng.rand(NUM_EPISODES, NUM_NODES)
+    env = Environment(node_locations, node_rewards, 15, 0.5, segments)
+    vector_env = VectorEnvironment(node_locations, node_rewards, 15, 0.5, segments, NUM_EPISODES)
+
+    expected_routes, expected_rewards, expected_states = [], [], []
+    for episode_scores in scores:
+        env.reset()
+        total_reward, states = 0, []
+        while not env.is_terminal():
+            reward, state = env.step((episode_scores * env.valid_actions).argmax())
+            total_reward += reward
+            states.append(state.copy())
+        expected_routes.append(env.visited_nodes[:env.num_visited + 1].tolist())
+        expected_rewards.append(total_reward)
+        expected_states.append(states)
+
+    total_rewards = np.zeros(NUM_EPISODES)
+    states = [[] for _ in range(NUM_EPISODES)]
+    while not vector_env.done.all():
+        active = np.flatnonzero(~vector_env.done)
+        rewards, state = vector_env.step((scores * vector_env.valid_actions).argmax(axis=1))
+        total_rewards += rewards
+        for episode in active:
+            states[episode].append(state[episode].copy())
+
+    assert [route.tolist() for route in vector_env.routes()] == expected_routes
+    np.testing.assert_allclose(total_rewards, expected_rewards)
+    for episode_states, episode_expected_states in zip(states, expected_states):
+        np.testing.assert_allclose(episode_states, episode_expected_states)
+
+
+def test_done_episodes_ignore_actions():
+    rng = np.random.RandomState(0)
+    vector_env = VectorEnvironment(rng.rand(NUM_NODES, 2) * 7, np.ones(NUM_NODES), 15, 0.5, SEGMENTS_WITH_END_NODE, 2)
+    while not vector_env.done[0]:
+        vector_env.step((rng.rand(2, NUM_NODES) * vector_env.valid_actions).argmax(axis=1))
+    route = vector_env.routes()[0].tolist()
+
+    rewards, _ = vector_env.step(np.array([1, 2]))
+    assert vector_env.routes()[0].tolist() == route
+    assert rewards[0] == 0
+
+    vector_env.reset()
+    assert not vector_env.done.any()
+    assert [route.tolist() for route in vector_env.routes()] == [[0], [0]]
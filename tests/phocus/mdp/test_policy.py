@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from phocus.mdp.env import Environment, VectorEnvironment
+from phocus.mdp.po.main import EPISODE_SEGMENTS, SALES_TIME, TRAVEL_SPEED
+from phocus.mdp.po.policy import Policy, PolicyBatch
+from phocus.mdp.po.population import PolicyShape, batch_rewards, sample_trajectory
+
+SHAPE = PolicyShape(state_size=12, action_size=5, hidden_dim=4)
+
+
+def test_policy_batch_acts_like_each_policy():
+    rng = np.random.RandomState(0)
+    thetas = rng.randn(6, SHAPE.dim_theta)
+    states = rng.rand(6, SHAPE.state_size)
+    valid_actions = rng.rand(6, SHAPE.action_size) < 0.5
+    policies = PolicyBatch(*SHAPE, thetas=thetas)
+
+    expected_scores = [Policy(*SHAPE, theta=theta).score_actions(state)[0] for theta, state in zip(thetas, states)]
+    np.testing.assert_allclose(policies.score_actions(states), expected_scores)
+    assert policies.sample_actions(states, valid_actions).tolist() == [
+        Policy(*SHAPE, theta=theta).sample_action(state, valid)
+        for theta, state, valid in zip(thetas, states, valid_actions)]
+
+
+def test_batch_rewards_match_sample_trajectory():
+    rng = np.random.RandomState(0)
+    env = Environment(rng.rand(50, 2) * 7, np.ones(50), TRAVEL_SPEED, SALES_TIME, EPISODE_SEGMENTS)
+    shape = PolicyShape.for_nodes(50)
+    thetas = rng.randn(8, shape.dim_theta)
+
+    rewards = batch_rewards(shape.policy_batch(thetas), VectorEnvironment.from_environment(env, 8))
+    assert rewards.tolist() == [sample_trajectory(shape.policy(theta), env)[1] for theta in thetas]
+    with pytest.raises(RuntimeError):
+        batch_rewards(shape.policy_batch(thetas), VectorEnvironment.from_environment(env, 4))
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from phocus.mdp.env import Environment
+from phocus.mdp.po.main import EPISODE_SEGMENTS, SALES_TIME, TRAVEL_SPEED, train_cross_entropy, \
+    train_evolution_strategies, train_simulated_annealing
+from phocus.mdp.po.population import PolicyShape, PopulationEvaluator, noise_table, sample_trajectory
+
+NUM_NODES = 50
+NOISE_SIZE = 2 ** 16
+NODE_LOCATIONS = np.random.RandomState(0).rand(NUM_NODES, 2) * 7
+
+
+@pytest.fixture
+def env():
+    return Environment(NODE_LOCATIONS, np.ones(NUM_NODES), TRAVEL_SPEED, SALES_TIME, EPISODE_SEGMENTS)
+
+
+def test_noise_table_is_the_same_for_a_seed():
+    table = noise_table(1, NOISE_SIZE)
+    assert noise_table(1, NOISE_SIZE) is table
+    assert np.array_equal(table, np.random.RandomState(1).randn(NOISE_SIZE))
+    with pytest.raises(ValueError):
+        table[0] = 0
+
+
+def test_workers_return_the_serial_rewards(env):
+    shape = PolicyShape.for_nodes(NUM_NODES)
+    rng = np.random.RandomState(0)
+    thetas = rng.randn(5, shape.dim_theta)
+    theta = rng.randn(shape.dim_theta)
+    expected = [sample_trajectory(shape.policy(t), env)[1] for t in thetas]
+
+    with PopulationEvaluator(env, shape, noise_size=NOISE_SIZE) as serial, \
+            PopulationEvaluator(env, shape, num_workers=2, noise_size=NOISE_SIZE) as parallel:
+        offsets = serial.noise_offsets(rng, 5)
+        perturbed = [sample_trajectory(shape.policy(t), env)[1] for t in theta + 0.2 * serial.perturbations(offsets)]
+        assert serial.rewards(thetas).tolist() == expected
+        assert parallel.rewards(thetas).tolist() == expected
+        assert serial.perturbed_rewards(theta, 0.2, offsets).tolist() == perturbed
+        assert parallel.perturbed_rewards(theta, 0.2, offsets).tolist() == perturbed
+
+
+@pytest.mark.parametrize('train', [train_cross_entropy, train_evolution_strategies])
+def test_training_does_not_depend_on_the_number_of_workers(train, env):
+    serial = train(env, NODE_LOCATIONS, num_workers=1, seed=3, max_generations=2)
+    parallel = train(env, NODE_LOCATIONS, num_workers=2, seed=3, max_generations=2)
+    assert np.array_equal(serial.theta, parallel.theta)
+    assert serial.reward == parallel.reward
+    assert len(serial.generation_seconds) == len(parallel.generation_seconds) == 2
+
+
+def test_simulated_annealing_is_seeded(env):
+    first = train_simulated_annealing(env, NODE_LOCATIONS, num_workers=2, seed=3, k_max=20)
+    second = train_simulated_annealing(env, NODE_LOCATIONS, num_workers=2, seed=3, k_max=20)
+    assert np.array_equal(first.theta, second.theta)
+    assert 10 <= len(first.generation_seconds) <= 20
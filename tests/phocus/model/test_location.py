@@ -0,0 +1,50 @@
+import copy
+import pickle
+
+import joblib
+import pytest
+
+from phocus.model.location import Location, locations_dicts
+
+
+def test_extras_read_and_write_like_attributes():
+    location = Location('doctor', 'address', 40.6, -73.7, id='1', visit_time_seconds=600)
+    location.arrival_time = '2018-01-01 09:00:00'
+    assert location.id == '1' and location.arrival_time == '2018-01-01 09:00:00'
+    assert location.to_dict() == {
+        'doctor_name': 'doctor', 'address': 'address', 'lat': 40.6, 'lon': -73.7, 'city': None, 'state': None,
+        'is_repeat': False, 'is_duplicate_origin': False, 'id': '1', 'visit_time_seconds': 600,
+        'arrival_time': '2018-01-01 09:00:00',
+    }
+    assert locations_dicts([location])[0]['id'] == '1'
+    assert not hasattr(location, '__dict__')
+    with pytest.raises(AttributeError):
+        location.travel_to_time
+    del location.arrival_time
+    assert not hasattr(location, 'arrival_time')
+
+
+def test_copies_share_extras_until_written():
+    location = Location('doctor', 'address', 40.6, -73.7, id='1')
+    duplicate = copy.copy(location)
+    assert duplicate.extras is location.extras
+
+    duplicate.is_duplicate_origin = True
+    duplicate.time_off_seconds = 60
+    location.visit_time_seconds = 600
+    assert not location.is_duplicate_origin and not hasattr(location, 'time_off_seconds')
+    assert not hasattr(duplicate, 'visit_time_seconds')
+    assert duplicate == location
+
+
+def test_pickle_and_deepcopy_round_trip():
+    location = Location('doctor', 'address', 40.6, -73.7, id='1', blackout_intervals=[(0, 3600)])
+    for restored in (pickle.loads(pickle.dumps(location)), copy.deepcopy(location)):
+        assert restored.to_dict() == location.to_dict()
+        assert restored.blackout_intervals is not location.blackout_intervals
+
+
+def test_joblib_hash_is_the_same_as_before_slots():
+    # The hash of this location when Location had a __dict__, distance matrices cached by joblib are keyed by it
+    location = Location('doctor', 'address', 40.6, -73.7, id='1', visit_time_seconds=600)
+    assert joblib.hash([location]) == 'fbf7fb36876a0342f0b4929ab5654774'
@@ -0,0 +1,86 @@
+from collections import namedtuple
+
+import numpy as np
+import pendulum
+import pytest
+
+from phocus.model.appointment import Appointment
+from phocus.model.location import Location
+from phocus.model.problem_instance import DEFAULT_SERVICE_SECONDS, NO_NODE, ProblemInstance
+from phocus.model.work_period import WorkPeriod
+
+START = pendulum.datetime(2018, 6, 18, 8, tz='America/New_York')
+EPOCH = int(START.timestamp())
+Break = namedtuple('Break', 'earliest_start latest_start duration_seconds')
+
+
+@pytest.fixture
+def problem():
+    locations = [
+        Location('origin', 'address', 40.6, -73.7, id='origin'),
+        Location('doctor', 'address', 40.7, -73.6, city='city', id='1', visit_time_seconds=900, is_required=True,
+                 blackout_intervals=[(EPOCH, EPOCH + 600), (EPOCH + 3600, EPOCH + 4200)]),
+        Location('repeat', None, 40.8, -73.5, id='2', num_total_visits=3, min_visit_gap_days=2,
+                 skip_cost_multiplier=1.5),
+    ]
+    work_periods = [
+        WorkPeriod(START.add(days=1), START.add(days=1, hours=8), 'origin', '1'),
+        START.add(hours=8) - START,
+    ]
+    appointments = [Appointment(locations[2], START.add(hours=1), START.add(hours=1, minutes=30))]
+    return ProblemInstance.compile(locations, np.arange(9).reshape(3, 3), work_periods, appointments,
+                                   [(EPOCH + 14400, EPOCH + 18000)], [Break(EPOCH, EPOCH + 900, 1800)])
+
+
+def test_compile_reads_location_attributes(problem):
+    assert problem.num_locations == 3
+    assert problem.service_seconds.tolist() == [DEFAULT_SERVICE_SECONDS, 900, DEFAULT_SERVICE_SECONDS]
+    assert problem.is_required.tolist() == [False, True, False]
+    assert problem.skip_cost_multipliers.tolist() == [1, 1, 1.5]
+    assert problem.num_visits.tolist() == [1, 1, 3]
+    assert problem.min_visit_gap_days.tolist() == [0, 0, 2]
+    assert problem.appointment_intervals() == {2: (EPOCH + 3600, EPOCH + 5400)}
+    assert problem.work_start_nodes.tolist() == [0, NO_NODE]
+    assert problem.work_end_nodes.tolist() == [1, NO_NODE]
+    assert problem.blackout_intervals() == [(EPOCH + 14400, EPOCH + 18000)]
+    assert problem.break_windows() == [(EPOCH, EPOCH + 900, 1800)]
+    assert problem.timezone == 'America/New_York'
+
+
+def test_windows_are_csr(problem):
+    assert problem.window_offsets.tolist() == [0, 0, 2, 2]
+    assert problem.windows(0) == []
+    assert problem.windows(1) == [(EPOCH, EPOCH + 600), (EPOCH + 3600, EPOCH + 4200)]
+    assert problem.windows(2) == []
+
+
+def test_arrays_are_read_only(problem):
+    with pytest.raises(ValueError):
+        problem.service_seconds[0] = 0
+    with pytest.raises(ValueError):
+        problem.travel_times[0, 1] = 0
+
+
+def test_save_and_load_round_trip(problem, tmpdir):
+    path = str(tmpdir.join('problem.npz'))
+    problem.save(path)
+    loaded = ProblemInstance.load(path)
+    assert loaded.equals(problem)
+    assert loaded.tzinfo.name == 'America/New_York'
+
+    locations = loaded.to_locations()
+    assert [location.id for location in locations] == ['origin', '1', '2']
+    assert locations[1].city == 'city' and locations[2].address is None and locations[2].lat == 40.8
+
+
+def test_travel_times_must_match_the_locations():
+    locations = [Location('origin', 'address', 40.6, -73.7, id='origin')]
+    with pytest.raises(RuntimeError):
+        ProblemInstance.compile(locations, np.zeros((2, 2)), [START.add(hours=8) - START])
+
+
+def test_appointments_must_be_at_one_of_the_locations():
+    locations = [Location('origin', 'address', 40.6, -73.7, id='origin')]
+    appointment = Appointment(Location('doctor', 'address', 40.7, -73.6, id='1'), START, START.add(minutes=30))
+    with pytest.raises(RuntimeError, match='location 1 of the appointment with doctor'):
+        ProblemInstance.compile(locations, np.zeros((1, 1)), [START.add(hours=8) - START], [appointment])
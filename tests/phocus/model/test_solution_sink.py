@@ -0,0 +1,81 @@
+import datetime
+import gzip
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from phocus.model.location import Location
+from phocus.model.solution import Solution, load_all_solutions
+from phocus.model.solution_sink import BackgroundSolutionSink, solutions_filename
+
+
+def make_solution(name):
+    route = [Location('doctor', 'address', 40.6, -73.7, id='1')]
+    return Solution(name, datetime.datetime(2018, 6, 18, 13), route, metrics={'total_travel_time': 10})
+
+
+def test_submitted_solutions_are_written_in_the_background(tmpdir):
+    output_dir = Path(str(tmpdir))
+    sink = BackgroundSolutionSink(output_dir=output_dir, flush_interval=0.01)
+    solution = make_solution('first')
+    sink.submit(solution, 'first')
+    # Changes after submit are not persisted
+    solution.metrics['total_travel_time'] = 20
+    sink.submit(make_solution('second'), 'second')
+
+    assert sink.flush(timeout=5)
+    assert sink.num_written == 2
+    solutions = load_all_solutions(output_dir)
+    assert [s.model_name for s in solutions] == ['first', 'second']
+    assert solutions[0].metrics['total_travel_time'] == 10
+    assert solutions[0].route[0].doctor_name == 'doctor'
+
+
+def test_full_queue_drops_solutions_instead_of_blocking(tmpdir):
+    sink = BackgroundSolutionSink(output_dir=Path(str(tmpdir)), max_queue_size=1)
+    # Without a writer thread nothing leaves the queue
+    sink._ensure_started = lambda: None
+    sink.submit(make_solution('kept'), 'kept')
+    sink.submit(make_solution('dropped'), 'dropped')
+    assert sink.num_dropped == 1
+
+
+def test_old_solution_files_are_removed(tmpdir):
+    output_dir = Path(str(tmpdir))
+    old_path = output_dir / solutions_filename(datetime.date.today() - datetime.timedelta(days=31))
+    with gzip.open(str(old_path), mode='wt') as f:
+        f.write('')
+    sink = BackgroundSolutionSink(output_dir=output_dir, retention_days=30)
+    sink.submit(make_solution('new'), 'new')
+
+    assert sink.flush(timeout=5)
+    assert not old_path.exists()
+    assert (output_dir / solutions_filename(datetime.date.today(), os.getpid())).exists()
+
+
+def test_close_writes_queued_solutions(tmpdir):
+    output_dir = Path(str(tmpdir))
+    sink = BackgroundSolutionSink(output_dir=output_dir, flush_interval=10)
+    sink.submit(make_solution('queued'), 'queued')
+    sink.close(timeout=5)
+    assert [s.model_name for s in load_all_solutions(output_dir)] == ['queued']
+
+    # Solutions submitted after closing are written right away
+    sink.submit(make_solution('late'), 'late')
+    assert [s.model_name for s in load_all_solutions(output_dir)] == ['queued', 'late']
+
+
+def submit_in_worker(output_dir: str, name: str) -> int:
+    BackgroundSolutionSink(output_dir=Path(output_dir), flush_interval=10).submit(make_solution(name), name)
+    return os.getpid()
+
+
+def test_worker_processes_write_their_own_files(tmpdir):
+    output_dir = Path(str(tmpdir))
+    names = ['solution-%d' % i for i in range(6)]
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        pids = set(executor.map(submit_in_worker, [str(output_dir)] * len(names), names))
+
+    assert sorted(path.name for path in output_dir.iterdir()) == sorted(
+        solutions_filename(datetime.date.today(), pid) for pid in pids)
+    assert sorted(s.model_name for s in load_all_solutions(output_dir)) == names
@@ -0,0 +1,84 @@
+import datetime
+from pathlib import Path
+
+import pytest
+
+from phocus.model.location import Location
+from phocus.model.solution import Solution
+from phocus.model.solution_store import INDEXED_METRICS, SolutionStore, columns_to_route, route_to_columns
+
+
+def make_solution(model_name, day, total_travel_time):
+    route = [
+        Location('origin', 'address', 40.6, -73.7, id='origin'),
+        Location('doctor', 'address', 40.7, -73.6, id='1', travel_to_time=total_travel_time),
+    ]
+    return Solution(model_name, datetime.datetime(2018, 6, day, 13), route,
+                    metrics={'total_travel_time': total_travel_time, 'objective_costs': {'total': 5}})
+
+
+@pytest.fixture
+def store(tmpdir):
+    store = SolutionStore(Path(str(tmpdir)) / 'solutions.sqlite')
+    yield store
+    store.close()
+
+
+def test_query_filters_and_orders_without_loading_routes(store, monkeypatch):
+    store.add(make_solution('MIP', 18, 100))
+    store.add(make_solution('MIP', 19, 50))
+    store.add(make_solution('Other', 20, 10))
+
+    load_route_calls = []
+    monkeypatch.setattr(store, 'load_route', lambda solution_id: load_route_calls.append(solution_id))
+    solutions = store.query(model_name='MIP', order_by='total_travel_time', descending=False)
+
+    assert [s.run_datetime.day for s in solutions] == [19, 18]
+    assert solutions[0].metrics['total_travel_time'] == 50
+    assert load_route_calls == []
+    assert [s.model_name for s in store.query(since=datetime.datetime(2018, 6, 19), limit=1)] == ['Other']
+
+
+def test_route_is_loaded_on_use(store):
+    solution_id = store.add(make_solution('MIP', 18, 100), name='mip-1')
+
+    solution = store.get(solution_id)
+    assert solution.name == 'mip-1'
+    assert [loc.id for loc in solution.route] == ['origin', '1']
+    assert solution.route[1].travel_to_time == 100
+    assert not hasattr(solution.route[0], 'travel_to_time')
+
+
+def test_delete_before(store):
+    store.add(make_solution('MIP', 18, 100))
+    store.add(make_solution('MIP', 19, 50))
+
+    assert store.delete_before(datetime.datetime(2018, 6, 19)) == 1
+    assert len(store) == 1
+
+
+def test_columns_round_trip():
+    route_dicts = [{'id': 'a', 'lat': 1.}, {'id': 'b', 'travel_to_time': None}]
+    assert columns_to_route(route_to_columns(route_dicts)) == route_dicts
+
+
+def test_every_indexed_metric_has_an_index(store):
+    index_columns = {
+        row[0] for row in store.connection.execute(
+            "SELECT ii.name FROM sqlite_master m, pragma_index_info(m.name) ii WHERE m.type = 'index'")}
+    assert set(INDEXED_METRICS) <= index_columns
+
+
+def test_retention_keeps_imported_solutions(store, tmpdir):
+    output_dir = Path(str(tmpdir)) / 'solutions'
+    make_solution('MIP', 18, 100).save('mip-1.json', output_dir)
+    assert store.import_files(output_dir) == 1
+    store.add(make_solution('MIP', 18, 50))
+
+    assert store.delete_before(datetime.datetime(2018, 6, 19)) == 1
+    assert [s.name for s in store.query()] == ['mip-1']
+    assert store.import_files(output_dir) == 0
+
+    assert store.delete_before(datetime.datetime(2018, 6, 19), include_imported=True) == 1
+    assert len(store) == 0
+    assert store.import_files(output_dir) == 1
@@ -1,5 +1,6 @@
 import copy
 import json
+import time
 from collections import Counter
 
 import pendulum
@@ -8,8 +9,9 @@ from typing import List
 
 from joblib import Parallel, delayed
 
-from phocus.app import plan_route
-from phocus.errors import SolutionError
+from phocus.app import _plan_route, plan_route, plan_routes as plan_route_batch, fair_time_allotment_ms, \
+    route_executor
+from phocus.errors import SolutionError, TimeBudgetExhaustedError
 from phocus.utils.constants import TEST_DATA_PATH
 from phocus.utils.date_utils import convert_epoch_millis_to_date_time
 
@@ -227,6 +229,44 @@ def plan_routes(input_data: List, parallel=True):
         return [plan_route(d) for d in input_data]
 
 
+def test_fair_time_allotment_ms():
+    assert fair_time_allotment_ms(60000, 4, 2) == 30000
+    assert fair_time_allotment_ms(60000, 3, 2) == 30000
+    assert fair_time_allotment_ms(60000, 1, 2) == 60000
+
+
+def test_plan_routes_returns_results_and_errors_in_order(params, full_freq):
+    too_many_frequencies = copy.deepcopy(full_freq)
+    for location in too_many_frequencies['locations']:
+        location['numTotalVisits'] = 2
+        location['minVisitGapDays'] = 1
+
+    response = plan_route_batch({
+        'routeParams': [params, too_many_frequencies, params],
+        'maxTotalMillis': 60000,
+        'maxWorkers': 2,
+    })
+
+    results = response['results']
+    assert (response['numSucceeded'], response['numFailed']) == (2, 1)
+    assert results[0]['result']['metrics']['doctors_visited'] == 1
+    assert 'error' in results[1]
+    assert results[2]['result']['unroutedLocationIDs'] == []
+    assert all(r['allottedMillis'] <= 60000 for r in results)
+
+
+def test_plan_routes_reuses_its_process_pool(params):
+    assert plan_route_batch({'routeParams': [params]})['numSucceeded'] == 1
+    executor = route_executor()
+    assert plan_route_batch({'routeParams': [params]})['numSucceeded'] == 1
+    assert route_executor() is executor
+
+
+def test_preparing_a_route_counts_against_its_deadline(params):
+    with pytest.raises(TimeBudgetExhaustedError):
+        _plan_route(params, deadline=time.time())
+
+
 def load_json(filename):
     with open(TEST_DATA_PATH / filename) as f:
         return json.load(f)
@@ -0,0 +1,35 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from phocus.traffic.travel_time_predictor import TravelTimePredictor
+
+pytest.importorskip('sklearn')
+
+
+def make_trips(num_trips, random_state=0):
+    random = np.random.RandomState(random_state)
+    origins = random.uniform([40.6, -73.9], [40.9, -73.2], size=(num_trips, 2))
+    destinations = random.uniform([40.6, -73.9], [40.9, -73.2], size=(num_trips, 2))
+    buckets = random.choice([8, 12, 16], size=num_trips)
+    meters = np.abs(origins - destinations).sum(axis=1) * 100000
+    seconds = meters / np.where(buckets == 16, 6., 10.)
+    return origins, destinations, buckets, seconds
+
+
+def test_predictions_and_error_bounds(tmpdir):
+    predictor = TravelTimePredictor()
+    metadata = predictor.train(*make_trips(2000), num_trees=20)
+    assert metadata['num_test'] == 400
+    assert metadata['relative_error_quantiles']['0.5'] < 0.2
+
+    path = Path(str(tmpdir)) / 'predictor.pkl'
+    predictor.save(path)
+    predictor = TravelTimePredictor.load(path)
+    assert predictor.metadata == metadata
+
+    origins, destinations, buckets, seconds = make_trips(50, random_state=1)
+    predictions, uncertainties = predictor.predict(origins, destinations, buckets)
+    assert predictions.shape == uncertainties.shape == (50,)
+    assert np.median(np.abs(predictions - seconds) / seconds) < 0.2
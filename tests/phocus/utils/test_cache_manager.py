@@ -0,0 +1,116 @@
+import time
+from pathlib import Path
+
+import joblib
+
+from phocus.model.location import Location
+from phocus.utils.cache_manager import CacheManager, cached_calls
+
+CALLS = []
+
+
+def travel_times(points):
+    CALLS.append(points)
+    return [[60.] * len(points) for _ in points]
+
+
+def test_hits_and_misses_are_counted(tmpdir):
+    manager = CacheManager(Path(str(tmpdir)))
+    cached = manager.cache(travel_times)
+    del CALLS[:]
+    points = [(40.6, -73.5), (40.7, -73.4)]
+    for _ in range(3):
+        assert cached(points) == [[60., 60.], [60., 60.]]
+    assert len(CALLS) == 1
+    assert cached.stats.hits == 2 and cached.stats.misses == 1
+    assert manager.stats[cached.func_id].hit_rate == 2 / 3
+    # Equal values of other types are different calls
+    assert cached.argument_hash([1, 2]) != cached.argument_hash([1., 2.])
+
+
+def test_least_recently_used_entries_are_pruned_first(tmpdir):
+    manager = CacheManager(Path(str(tmpdir)), max_bytes=None, max_age_days=None)
+    cached = manager.cache(travel_times)
+    for num_points in range(1, 5):
+        cached([(40.6, -73.5)] * num_points)
+    time.sleep(0.01)
+    cached([(40.6, -73.5)])
+    entries = manager.entries()
+    assert len(entries) == 4
+
+    # The single point call was used again so the two point call is the least recently used
+    removed = manager.prune(max_bytes=sum(entry.size for entry in entries) - 1)
+    assert [entry.key for entry in removed] == [cached.argument_hash([(40.6, -73.5)] * 2)]
+    assert len(manager.prune(max_age_days=1, now=time.time() + 2 * 24 * 60 * 60)) == 3
+    assert manager.entries() == []
+
+
+def test_compacted_entries_are_hits(tmpdir):
+    manager = CacheManager(Path(str(tmpdir)))
+    cached = manager.cache(travel_times)
+    del CALLS[:]
+    for num_points in range(1, 4):
+        cached([(40.6, -73.5)] * num_points)
+
+    assert manager.compact() == 3
+    assert all(entry.packed for entry in manager.entries())
+    assert cached([(40.6, -73.5)] * 3) == [[60.] * 3] * 3
+    assert len(CALLS) == 3
+
+    assert len(manager.prune(max_bytes=0)) == 3
+    cached([(40.6, -73.5)])
+    assert len(CALLS) == 4
+
+
+def test_joblib_memory_shares_the_entries(tmpdir):
+    manager = CacheManager(Path(str(tmpdir)))
+    cached = manager.cache(travel_times)
+    joblib_cached = manager.memory.cache(travel_times)
+    del CALLS[:]
+
+    joblib_cached([(40.6, -73.5)])
+    cached([(40.6, -73.5)])
+    cached([(40.7, -73.4)])
+    joblib_cached([(40.7, -73.4)])
+    assert len(CALLS) == 2
+
+
+def test_equal_locations_are_hashed_once(tmpdir, monkeypatch):
+    cached = CacheManager(Path(str(tmpdir))).cache(travel_times)
+    locations = [Location('doctor %d' % i, 'address', 40.6, -73.5 + i / 100, id=str(i)) for i in range(3)]
+    key = cached.argument_hash(locations)
+    assert key == joblib.hash({'points': locations})
+
+    hashed = []
+    monkeypatch.setattr(joblib, 'hash', lambda *args, **kwargs: hashed.append(args) or 'hash')
+    assert cached.argument_hash([location.copy() for location in locations]) == key
+    assert not hashed
+    locations[0].visit_time_seconds = 600
+    assert cached.argument_hash(locations) == 'hash'
+
+
+def test_access_times_of_packed_entries_are_written_in_batches(tmpdir):
+    manager = CacheManager(Path(str(tmpdir)))
+    cached = manager.cache(travel_times)
+    cached([(40.6, -73.5)])
+    manager.compact()
+    last_access = manager.entries()[0].last_access
+
+    time.sleep(0.01)
+    cached([(40.6, -73.5)])
+    assert manager.entries()[0].last_access == last_access
+    manager.write_accesses()
+    assert manager.entries()[0].last_access > last_access
+
+
+def test_cached_calls_are_read_from_directories_and_packs(tmpdir):
+    manager = CacheManager(Path(str(tmpdir)))
+    cached = manager.cache(travel_times)
+    cached([(40.6, -73.5)])
+    cached([(40.6, -73.5)] * 2)
+    manager.compact()
+    cached([(40.6, -73.5)] * 3)
+
+    calls = list(cached_calls(manager.location / cached.func_id))
+    assert sorted(len(output) for _, output in calls) == [1, 2, 3]
+    assert all(metadata['input_args']['points'].startswith('[(40.6, -73.5)') for metadata, _ in calls)
@@ -1,4 +1,7 @@
+from collections import deque
+
 import pendulum
+from hypothesis import given, settings, strategies as st
 
 from phocus.utils.date_utils import sort_periods, combine_periods, convert_open_times_to_blackout_windows, next_weekday
 
@@ -104,3 +107,65 @@ def test_different_timezone():
         pendulum.datetime(2018, 6, 21, 21) - pendulum.datetime(2018, 6, 21, 13),
         pendulum.datetime(2018, 6, 22, 21) - pendulum.datetime(2018, 6, 22, 13),
     ], 'Different starting time'
+
+
+def legacy_convert_open_times_to_blackout_windows(open_times, work_periods):
+    """The original minute by minute conversion that convert_open_times_to_blackout_windows has to match"""
+    open_times = deque(combine_periods(open_times))
+    work_periods = deque(combine_periods(work_periods))
+    blackout_windows = []
+
+    if not open_times:
+        return list(work_periods)
+
+    open_period = open_times.popleft()
+    while work_periods:
+        work_period = work_periods.popleft()
+        current_blackout_start = current_blackout_end = None
+        for work_minute in work_period.range('minutes'):
+            if work_minute > open_period.end:
+                if current_blackout_start:
+                    blackout_windows.append(current_blackout_end - current_blackout_start)
+                    current_blackout_start = current_blackout_end = None
+                while open_times and work_minute > open_period.end:
+                    open_period = open_times.popleft()
+                if not open_times and work_minute > open_period.end:
+                    blackout_windows.append(work_period.end - work_minute)
+                    break
+            if work_minute < open_period.start:
+                if not current_blackout_start:
+                    current_blackout_start = work_minute
+                current_blackout_end = work_minute
+            elif work_minute in open_period and current_blackout_start:
+                blackout_windows.append(current_blackout_end - current_blackout_start)
+                current_blackout_start = current_blackout_end = None
+        if current_blackout_start and current_blackout_end:
+            blackout_windows.append(current_blackout_end - current_blackout_start)
+
+    return combine_periods(blackout_windows)
+
+
+def periods_strategy(max_size, max_length):
+    """Periods within a week of DAY1 at second resolution"""
+    def to_period(start_and_length):
+        start, length = start_and_length
+        return DAY1.add(seconds=start + length) - DAY1.add(seconds=start)
+
+    return st.lists(
+        st.tuples(st.integers(0, 7 * 24 * 60 * 60), st.integers(1, max_length)).map(to_period),
+        max_size=max_size,
+    )
+
+
+def as_tuples(periods):
+    return [(p.start, p.end) for p in periods]
+
+
+@settings(max_examples=200, deadline=None)
+@given(
+    open_times=periods_strategy(max_size=8, max_length=12 * 60 * 60),
+    work_periods=periods_strategy(max_size=4, max_length=10 * 60 * 60).filter(bool),
+)
+def test_convert_open_times_to_blackout_windows_matches_minute_by_minute(open_times, work_periods):
+    assert as_tuples(convert_open_times_to_blackout_windows(open_times, work_periods)) == as_tuples(
+        legacy_convert_open_times_to_blackout_windows(open_times, work_periods))
@@ -0,0 +1,54 @@
+import pendulum
+from hypothesis import given, strategies as st
+
+from phocus.cp.time_dimension_converter import Granularity, TimeDimensionConverter
+from phocus.utils.date_utils import combine_periods, time_off_periods
+from phocus.utils.epoch import combine_intervals, date_to_epoch, from_epoch, interval_to_period, \
+    period_to_interval, time_off_intervals, to_epoch
+
+START = pendulum.datetime(2018, 1, 1, 9)
+
+intervals_strategy = st.lists(
+    st.tuples(st.integers(0, 10000), st.integers(1, 1000)).map(lambda x: (x[0], x[0] + x[1])),
+    min_size=1,
+    max_size=10,
+)
+
+
+def to_periods(intervals):
+    return [interval_to_period((START.int_timestamp + s, START.int_timestamp + e)) for s, e in intervals]
+
+
+def test_epoch_round_trip():
+    assert from_epoch(to_epoch(START)) == START
+    period = START.add(hours=8) - START
+    assert interval_to_period(period_to_interval(period)) == period
+
+
+def test_date_to_epoch_is_midnight_utc():
+    assert date_to_epoch(START.date()) == to_epoch(pendulum.datetime(2018, 1, 1))
+    assert date_to_epoch(pendulum.date(1969, 12, 31)) == -86400
+
+
+@given(intervals_strategy)
+def test_combine_intervals_matches_combine_periods(intervals):
+    periods = to_periods(intervals)
+    assert combine_intervals(period_to_interval(p) for p in periods) == [
+        period_to_interval(p) for p in combine_periods(periods)]
+
+
+@given(intervals_strategy)
+def test_time_off_intervals_matches_time_off_periods(intervals):
+    periods = to_periods(intervals)
+    assert time_off_intervals([period_to_interval(p) for p in periods]) == [
+        period_to_interval(p) for p in time_off_periods(periods)]
+
+
+@given(st.integers(-100000, 100000), st.sampled_from([Granularity.SECOND, Granularity.MINUTE]))
+def test_time_dimension_converter_epochs_match_datetimes(seconds, granularity):
+    converter = TimeDimensionConverter(granularity, START)
+    dt = START.add(seconds=seconds)
+    assert converter.epoch_to_time_dimension(to_epoch(dt)) == converter.datetime_to_time_dimension(dt)
+    time_dimension = converter.datetime_to_time_dimension(dt)
+    assert from_epoch(converter.time_dimension_to_epoch(time_dimension)) == converter.time_dimension_to_datetime(
+        time_dimension)
@@ -0,0 +1,107 @@
+from pathlib import Path
+
+import numpy as np
+import pendulum
+import pytest
+
+from phocus.utils.distance_matrix_stub import StubDistanceMatrixServer
+from phocus.utils.fetch_planner import ApiLimits, HttpDistanceMatrixClient, TokenBucket, plan_requests
+from phocus.utils.travel_time_cache import IncompleteFetchError, TravelTimeCache
+
+DEPARTURE = pendulum.datetime(2018, 7, 2, 8, tz='US/Eastern')
+
+
+def _covered(requests, shape):
+    covered = np.zeros(shape, dtype=bool)
+    for request in requests:
+        assert len(request.origin_indices) <= 25 and len(request.destination_indices) <= 25
+        assert request.num_elements <= 100
+        assert not np.any(covered[np.ix_(request.origin_indices, request.destination_indices)])
+        covered[np.ix_(request.origin_indices, request.destination_indices)] = True
+    return covered
+
+
+def test_plan_covers_missing_pairs_within_limits():
+    is_missing = np.ones((40, 40), dtype=bool)
+    np.fill_diagonal(is_missing, False)
+    is_missing[:30, :30] = False
+
+    requests = plan_requests(is_missing, ApiLimits(max_origins=25, max_destinations=25, max_elements=100))
+    np.testing.assert_array_equal(_covered(requests, is_missing.shape), is_missing)
+    # Six tiles of 10 x 10 between the old and new locations and a request per new origin for the diagonal tile
+    assert len(requests) == 6 + 10
+
+
+@pytest.mark.parametrize('num_locations', [50, 200])
+def test_plan_only_requests_the_missing_pairs_of_a_new_matrix(num_locations):
+    is_missing = np.ones((num_locations, num_locations), dtype=bool)
+    np.fill_diagonal(is_missing, False)
+
+    requests = plan_requests(is_missing)
+    np.testing.assert_array_equal(_covered(requests, is_missing.shape), is_missing)
+    # Fewer than requesting 25 destinations at a time per origin
+    assert len(requests) < num_locations * num_locations // 25
+
+
+@pytest.mark.parametrize('num_locations', [50, 200])
+def test_plan_can_fill_requests_with_known_pairs(num_locations):
+    is_missing = np.ones((num_locations, num_locations), dtype=bool)
+    np.fill_diagonal(is_missing, False)
+
+    requests = plan_requests(is_missing, max_known_fraction=0.05)
+    assert np.all(_covered(requests, is_missing.shape)[is_missing])
+    assert len(requests) == num_locations ** 2 // 100
+
+
+def test_plan_requests_only_the_pairs_of_a_new_location():
+    is_missing = np.zeros((200, 200), dtype=bool)
+    is_missing[:, -1] = is_missing[-1, :] = True
+    is_missing[-1, -1] = False
+
+    requests = plan_requests(is_missing)
+    np.testing.assert_array_equal(_covered(requests, is_missing.shape), is_missing)
+    assert len(requests) == 16
+
+
+def test_token_bucket_waits_for_refill():
+    now = [0.]
+    bucket = TokenBucket(rate=100, clock=lambda: now[0])
+    assert bucket.try_acquire(100) == 0
+    assert bucket.try_acquire(50) == pytest.approx(0.5)
+    now[0] = 0.5
+    assert bucket.try_acquire(50) == 0
+
+
+def test_failed_requests_resume_from_the_cache(tmpdir):
+    points = [(40.6 + i / 100, -73.5) for i in range(15)]
+    cache = TravelTimeCache(Path(str(tmpdir)) / 'travel_times.sqlite')
+    with StubDistanceMatrixServer() as server:
+        client = HttpDistanceMatrixClient(server.url)
+
+        def failing_fetch(origins, destinations, departure_time):
+            if origins[0] in points[:5]:
+                raise RuntimeError('Connection reset')
+            return client(origins, destinations, departure_time)
+
+        with pytest.raises(IncompleteFetchError):
+            cache.travel_time_matrix(points, None, DEPARTURE, failing_fetch, max_attempts=1)
+        num_cached = len(cache)
+        assert 0 < num_cached < 15 * 14
+
+        num_elements = server.num_elements
+        matrix = cache.travel_time_matrix(points, None, DEPARTURE, client)
+        assert server.num_elements - num_elements == 15 * 14 - num_cached
+    assert matrix.shape == (15, 15)
+    assert np.all(matrix[~np.eye(15, dtype=bool)] > 0)
+
+
+def test_requests_over_the_quota_are_retried(tmpdir):
+    points = [(40.6 + i / 100, -73.5 - i / 100) for i in range(20)]
+    cache = TravelTimeCache(Path(str(tmpdir)) / 'travel_times.sqlite')
+    with StubDistanceMatrixServer(latency_seconds=0.01, elements_per_second=200) as server:
+        matrix = cache.travel_time_matrix(points, None, DEPARTURE, HttpDistanceMatrixClient(server.url),
+                                          elements_per_second=1000)
+    # Only the pairs off the diagonal are billed
+    assert server.num_elements == 20 * 19
+    assert server.num_rejected > 0
+    np.testing.assert_array_equal(matrix, matrix.T)
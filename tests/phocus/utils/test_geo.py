@@ -0,0 +1,66 @@
+from pathlib import Path
+
+import numpy as np
+import pendulum
+
+from phocus.model.location import Location, haversine_distance
+from phocus.utils.geo import SpeedProfile, haversine_matrix, haversine_meters, manhattan_matrix
+from phocus.utils.travel_time_cache import TravelTimeCache
+
+LOCATIONS = [
+    Location('a', 'address', 40.68, -73.54, id='a'),
+    Location('b', 'address', 40.71, -73.46, id='b'),
+    Location('c', 'address', 40.84, -73.28, id='c'),
+]
+
+
+def test_haversine_matrix_matches_haversine_distance():
+    matrix = haversine_matrix(LOCATIONS)
+    assert matrix.dtype == np.float32
+    for i, l1 in enumerate(LOCATIONS):
+        for j, l2 in enumerate(LOCATIONS):
+            assert np.isclose(matrix[i, j], haversine_distance(l1, l2), rtol=1e-5)
+
+
+def test_chunked_memory_mapped_matrix_matches_in_memory(tmpdir):
+    origins = np.random.RandomState(0).uniform([40.5, -74.], [41., -73.], size=(50, 2))
+    destinations = origins[:7]
+    path = Path(str(tmpdir)) / 'matrix.npy'
+
+    matrix = haversine_matrix(origins, destinations, chunk_rows=8, path=path)
+    assert matrix.shape == (50, 7)
+    np.testing.assert_array_equal(np.load(str(path)), haversine_matrix(origins, destinations))
+
+
+def test_manhattan_matrix():
+    points = np.array([[0., 0.], [1., 2.], [-1., 1.]])
+    np.testing.assert_array_equal(manhattan_matrix(points, chunk_rows=2), [[0, 3, 2], [3, 0, 3], [2, 3, 0]])
+
+
+def test_calibration_recovers_detour_and_speed_per_band():
+    straight_meters = np.array([500., 800., 3000., 4000.])
+    road_meters = straight_meters * np.array([1.5, 1.5, 1.2, 1.2])
+    durations = road_meters / np.array([5., 5., 10., 10.])
+    profile = SpeedProfile.calibrate(straight_meters, road_meters, durations, band_edges=[1000., 2000.])
+
+    np.testing.assert_allclose(profile.detour_factors, [1.5, 1.35, 1.2])
+    np.testing.assert_allclose(profile.speeds, [5., 10350. / 1230, 10.])
+    np.testing.assert_allclose(profile.estimate_seconds([600., 3500.]), [180., 420.], rtol=1e-6)
+    assert SpeedProfile.from_dict(profile.to_dict()).to_dict() == profile.to_dict()
+
+
+def test_calibration_from_the_travel_time_cache(tmpdir):
+    cache = TravelTimeCache(Path(str(tmpdir)) / 'travel_times.sqlite')
+    origins = [(40.68, -73.54)]
+    destinations = [(40.681, -73.54), (40.75, -73.54)]
+    straight_meters = haversine_meters(40.68, -73.54, np.array([40.681, 40.75]), -73.54)
+    road_meters = straight_meters * np.array([1.5, 1.2])
+    departure_time = pendulum.datetime(2018, 6, 18, 8)
+    cache.put(origins, destinations, departure_time, [road_meters / [5., 10.]], [road_meters])
+    # Trips without a distance are not used
+    cache.put(origins, [(40.7, -73.54)], departure_time, [[1.]])
+
+    profile = SpeedProfile.calibrate_from_cache(cache, band_edges=[1000.])
+    cache.close()
+    np.testing.assert_allclose(profile.detour_factors, [1.5, 1.2], rtol=1e-2)
+    np.testing.assert_allclose(profile.speeds, [5., 10.], rtol=1e-2)
@@ -0,0 +1,62 @@
+from pathlib import Path
+
+import pytest
+
+from phocus.utils.geocoder import AMBIGUOUS, NOT_FOUND, OK, GeocodeResult, Geocoder, normalize_address
+from phocus.utils.maps import AddressNotFoundError, AmbiguousAddressError, Coordinate
+
+
+class FakeGeocoder:
+    def __init__(self):
+        self.addresses = []
+
+    def __call__(self, address, components=None):
+        self.addresses.append(address)
+        if 'nowhere' in address.lower():
+            return GeocodeResult(NOT_FOUND, None, 'Address Not Found: %s' % address)
+        if 'main' in address.lower():
+            return GeocodeResult(AMBIGUOUS, None, 'Ambiguous: %s' % address)
+        return GeocodeResult(OK, Coordinate(lat=40.7, long=-73.4), None)
+
+
+def test_normalize_address():
+    assert normalize_address('  123 North Main Street., Huntington,  NY ') == '123 n main st, huntington, ny'
+    assert normalize_address('123 N. Main St, Huntington, NY') == '123 n main st, huntington, ny'
+
+
+def test_spellings_of_an_address_are_geocoded_once(tmpdir):
+    fake = FakeGeocoder()
+    geocoder = Geocoder(Path(str(tmpdir)) / 'geocodes.sqlite', fake)
+    results = geocoder.geocode_many(['1 Park Avenue, Huntington, NY', '1 Park Ave., Huntington, NY', '2 Park Ave'])
+    assert [result.status for result in results] == [OK, OK, OK]
+    assert len(fake.addresses) == 2
+    assert geocoder.geocode('1 PARK AVE, HUNTINGTON, NY') == Coordinate(lat=40.7, long=-73.4)
+    assert len(fake.addresses) == 2
+    assert geocoder.num_hits == 1
+
+
+def test_failures_are_cached(tmpdir):
+    fake = FakeGeocoder()
+    path = Path(str(tmpdir)) / 'geocodes.sqlite'
+    geocoder = Geocoder(path, fake)
+    with pytest.raises(AddressNotFoundError):
+        geocoder.geocode('1 Nowhere Road')
+    with pytest.raises(AmbiguousAddressError):
+        geocoder.geocode('1 Main Street')
+
+    geocoder = Geocoder(path, fake)
+    with pytest.raises(AddressNotFoundError):
+        geocoder.geocode('1 Nowhere Rd')
+    assert len(fake.addresses) == 2
+    assert len(geocoder) == 2
+
+
+def test_errors_are_not_cached(tmpdir):
+    def failing_geocode(address, components=None):
+        raise RuntimeError('Connection reset')
+
+    path = Path(str(tmpdir)) / 'geocodes.sqlite'
+    geocoder = Geocoder(path, failing_geocode, max_attempts=1)
+    result, = geocoder.geocode_many(['1 Park Ave'])
+    assert result.status is None
+    assert len(geocoder) == 0
@@ -0,0 +1,48 @@
+from collections import OrderedDict
+
+from click.testing import CliRunner
+
+from phocus.utils import LazySequence
+from phocus.utils.import_time import check, lazy_packages_imported, measure, parse_import_times
+
+OUTPUT = '''import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _json
+import time:       300 |        420 | json
+import time:        50 |         50 | json
+'''
+
+
+def test_parse_import_times():
+    assert parse_import_times(OUTPUT) == {'_json': (120, 120), 'json': (300, 420)}
+
+
+def test_lazy_sequence_loads_on_first_use():
+    loads = []
+
+    def load():
+        loads.append(1)
+        return range(3)
+
+    sequence = LazySequence(load)
+    assert not loads
+    assert len(sequence) == 3 and list(sequence) == [0, 1, 2] and sequence[-1] == 2
+    assert len(loads) == 1
+
+
+def test_importing_utils_does_not_import_heavy_packages():
+    assert lazy_packages_imported('phocus.utils.maps') == []
+    assert lazy_packages_imported('phocus.utils.travel_time_cache') == []
+
+
+def test_measure_without_importtime(monkeypatch):
+    monkeypatch.setattr('phocus.utils.import_time.IMPORTTIME_AVAILABLE', False)
+    assert 0 < measure('phocus.utils', repeat=1) < 60 * 1000
+
+
+def test_check_fails_when_a_module_cannot_be_imported(monkeypatch):
+    monkeypatch.setattr('phocus.utils.import_time.IMPORT_BUDGETS_MS',
+                        OrderedDict([('phocus.utils', 60 * 1000), ('phocus.no_such_module', 60 * 1000)]))
+    result = CliRunner().invoke(check, ['--repeat', '1'])
+    assert result.exit_code != 0
+    assert 'phocus.no_such_module' in result.output
+    assert 'phocus.utils:' in result.output
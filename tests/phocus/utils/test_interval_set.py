@@ -0,0 +1,71 @@
+import numpy as np
+from hypothesis import given, strategies as st
+
+from phocus.utils.epoch import combine_intervals
+from phocus.utils.interval_set import IntervalSet
+
+intervals_strategy = st.lists(
+    st.tuples(st.integers(0, 200), st.integers(0, 30)).map(lambda x: (x[0], x[0] + x[1])),
+    max_size=10,
+)
+
+
+def brute_force_contains(intervals, point):
+    return any(start <= point <= end for start, end in intervals)
+
+
+def test_empty_set():
+    empty = IntervalSet()
+    assert len(empty) == 0
+    assert empty.to_list() == []
+    assert empty.complement(0, 10).to_list() == [(0, 10)]
+    assert not empty.contains([1, 2]).any()
+
+
+@given(intervals_strategy)
+def test_intervals_are_combined_like_combine_periods(intervals):
+    interval_set = IntervalSet.from_intervals(intervals)
+    assert np.all(interval_set.starts[1:] > interval_set.ends[:-1])
+    for point in range(-1, 232):
+        assert interval_set.contains([point])[0] == brute_force_contains(intervals, point)
+
+
+@given(intervals_strategy, intervals_strategy)
+def test_union_and_intersection(a, b):
+    set_a, set_b = IntervalSet.from_intervals(a), IntervalSet.from_intervals(b)
+    assert (set_a | set_b).to_list() == combine_intervals(a + b)
+
+    intersection = set_a & set_b
+    points = np.arange(-1, 232)
+    assert np.array_equal(intersection.contains(points), set_a.contains(points) & set_b.contains(points))
+
+
+@given(intervals_strategy, intervals_strategy)
+def test_subtract_keeps_the_boundaries(a, b):
+    set_a, set_b = IntervalSet.from_intervals(a), IntervalSet.from_intervals(b)
+    difference = set_a - set_b
+    points = np.arange(-1, 232)
+    in_difference = difference.contains(points)
+    # Boundaries of b are shared, every other point is in exactly one of them
+    boundaries = np.isin(points, np.concatenate([set_b.starts, set_b.ends]))
+    expected = set_a.contains(points) & ~set_b.contains(points)
+    assert np.array_equal(in_difference[~boundaries], expected[~boundaries])
+
+
+@given(intervals_strategy)
+def test_complement_covers_the_horizon(intervals):
+    interval_set = IntervalSet.from_intervals(intervals)
+    complement = interval_set.complement(-10, 250)
+    assert (interval_set | complement).to_list() == [(-10, 250)]
+    assert (interval_set & complement).total_length() == 0
+
+
+@given(intervals_strategy, st.lists(st.tuples(st.integers(-5, 240), st.integers(0, 20)), max_size=10))
+def test_overlaps(intervals, queries):
+    interval_set = IntervalSet.from_intervals(intervals)
+    starts = [start for start, _ in queries]
+    ends = [start + length for start, length in queries]
+    expected = [any(s <= end and e >= start for s, e in intervals) for start, end in zip(starts, ends)]
+    assert interval_set.overlaps(starts, ends).tolist() == expected
+    for start, end, overlaps in zip(starts, ends, expected):
+        assert bool(len(interval_set.overlapping(start, end))) == overlaps
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from phocus.utils.road_network import RoadNetwork, RoadNetworkDistanceProvider, UNREACHABLE_SECONDS
+
+pytest.importorskip('scipy')
+
+
+def write_grid_csv(path):
+    """A 3x3 grid of 0.01 degree blocks that take 60 seconds each, with a one way street in the top row"""
+    lines = ['from_lat,from_lon,to_lat,to_lon,seconds,oneway']
+    for i in range(3):
+        for j in range(3):
+            if j < 2:
+                lines.append('%s,%s,%s,%s,60,%s' % (i / 100, j / 100, i / 100, (j + 1) / 100, int(i == 2)))
+            if i < 2:
+                lines.append('%s,%s,%s,%s,60,0' % (i / 100, j / 100, (i + 1) / 100, j / 100))
+    path.write('\n'.join(lines) + '\n')
+
+
+def test_travel_times_follow_the_road_network(tmpdir):
+    path = tmpdir.join('edges.csv')
+    write_grid_csv(path)
+    network = RoadNetwork.from_edge_list_csv(str(path))
+    assert network.num_nodes == 9
+
+    provider = RoadNetworkDistanceProvider(network, max_workers=1)
+    points = [(0., 0.), (0.02, 0.01), (0.02, 0.02)]
+    matrix = provider.travel_time_matrix(points)
+
+    assert matrix[0, 0] == 0
+    assert matrix[0, 2] == 240
+    # The one way top row can only be driven west to east, going back is a detour through the row below
+    assert matrix[1, 2] == 60
+    assert matrix[2, 1] == 180
+
+
+def test_parallel_travel_times_match_serial(tmpdir):
+    path = tmpdir.join('edges.csv')
+    write_grid_csv(path)
+    network = RoadNetwork.from_edge_list_csv(str(path))
+    origins = [(i / 100, j / 100) for i in range(3) for j in range(3)]
+    destinations = [(0.001, 0.), (0.02, 0.02)]
+
+    serial = RoadNetworkDistanceProvider(network, max_workers=1).travel_time_matrix(origins, destinations)
+    with RoadNetworkDistanceProvider(network, max_workers=2) as provider:
+        parallel = provider.travel_time_matrix(origins, destinations)
+        # The workers are kept for the next call
+        pool = provider._pool
+        np.testing.assert_array_equal(provider.travel_time_matrix(origins[::-1], destinations), serial[::-1])
+        assert provider._pool is pool
+    np.testing.assert_array_equal(serial, parallel)
+    assert serial.shape == (9, 2)
+    # Walking 0.001 degrees from the nearest node is added to the road time
+    assert serial[0, 0] == round(111.19 / 1.4)
+
+
+def test_disconnected_points_are_unreachable():
+    network = RoadNetwork.from_edges([(0., 0., 0., 0.01, 60.), (1., 1., 1., 1.01, 60.)])
+    matrix = RoadNetworkDistanceProvider(network, max_workers=1).travel_time_matrix([(0., 0.), (1., 1.)])
+    assert matrix[0, 1] == UNREACHABLE_SECONDS
+
+
+def test_the_fastest_of_parallel_segments_is_taken():
+    network = RoadNetwork([0., 0., 0.], [0., 0.01, 0.02], [0, 0, 1], [1, 1, 2], [50., 0., 30.])
+    np.testing.assert_array_equal(network.shortest_times([0, 2], [0, 1, 2]), [[0, 0, 30], [np.inf, np.inf, 0]])
+    nodes, meters = network.nearest_nodes([(0., 0.019), (0., -1.)])
+    assert nodes.tolist() == [2, 0]
+    assert meters[0] == pytest.approx(111.19, rel=1e-3)
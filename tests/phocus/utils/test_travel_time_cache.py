@@ -0,0 +1,81 @@
+from pathlib import Path
+
+import numpy as np
+import pendulum
+
+from phocus.utils.travel_time_cache import TravelTimeCache
+
+DEPARTURE = pendulum.datetime(2018, 7, 2, 8, tz='US/Eastern')
+POINTS = [(40.6 + i / 100, -73.5 - i / 100) for i in range(12)]
+
+
+class CountingFetcher(object):
+    """Travel times of 1000 times the sum of the indices of the points"""
+    def __init__(self):
+        self.num_pairs = 0
+        self.num_requests = 0
+
+    def __call__(self, origins, destinations, departure_time):
+        self.num_pairs += len(origins) * len(destinations)
+        self.num_requests += 1
+        assert len(origins) * len(destinations) <= 100
+        seconds = np.array([[1000 * (POINTS.index(o) + POINTS.index(d)) for d in destinations] for o in origins],
+                           dtype=np.float64)
+        return seconds, seconds * 10
+
+
+def expected_matrix(points):
+    indices = np.array([POINTS.index(p) for p in points])
+    return 1000 * (indices[:, None] + indices[None, :])
+
+
+def test_only_missing_pairs_are_fetched(tmpdir):
+    cache = TravelTimeCache(Path(str(tmpdir)) / 'travel_times.sqlite')
+    fetch = CountingFetcher()
+
+    first = POINTS[:11]
+    matrix = cache.travel_time_matrix(first, None, DEPARTURE, fetch)
+    # The diagonal is not fetched
+    np.testing.assert_array_equal(matrix, expected_matrix(first) * (1 - np.eye(11)))
+    assert fetch.num_pairs == 11 * 10
+    assert len(cache) == 11 * 10
+
+    # Reordering and adding a location only fetches the new row and column
+    second = list(reversed(POINTS))
+    matrix = cache.travel_time_matrix(second, None, DEPARTURE, fetch)
+    np.testing.assert_array_equal(matrix, expected_matrix(second) * (1 - np.eye(12)))
+    assert fetch.num_pairs == 11 * 10 + 2 * 11
+    assert cache.num_hits == 11 * 10
+    assert cache.hit_rate == 110 / (110 + 110 + 22)
+
+    # Another hour of the week is fetched separately
+    cache.travel_time_matrix(POINTS[:2], None, DEPARTURE.add(hours=2), fetch)
+    assert fetch.num_pairs == 11 * 10 + 2 * 11 + 2
+
+
+def test_repeated_points_are_fetched_once(tmpdir):
+    cache = TravelTimeCache(Path(str(tmpdir)) / 'travel_times.sqlite')
+    fetch = CountingFetcher()
+    points = [POINTS[0], POINTS[1], POINTS[0]]
+
+    np.testing.assert_array_equal(cache.travel_time_matrix(points, None, DEPARTURE, fetch),
+                                  [[0, 1000, 0], [1000, 0, 1000], [0, 1000, 0]])
+    assert fetch.num_pairs == 2
+
+
+class ConfidentForOnePair(object):
+    """Predicts 500 seconds, only confidently from the first point to the second"""
+    def predict(self, origins, destinations, buckets):
+        is_confident = np.all(origins == POINTS[0], axis=1) & np.all(destinations == POINTS[1], axis=1)
+        return np.full(len(origins), 500.), np.where(is_confident, 1., 500.)
+
+
+def test_only_uncertain_predictions_are_fetched(tmpdir):
+    cache = TravelTimeCache(Path(str(tmpdir)) / 'travel_times.sqlite')
+    fetch = CountingFetcher()
+
+    matrix = cache.travel_time_matrix(POINTS[:3], None, DEPARTURE, fetch, predictor=ConfidentForOnePair())
+    assert matrix[0, 1] == 500
+    assert matrix[1, 0] == 1000
+    assert fetch.num_pairs == 5
+    assert cache.num_predicted == 1
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+import numpy as np
+import pendulum
+import pytest
+
+from phocus.utils.travel_time_cache import TravelTimeCache
+from phocus.utils.travel_time_tensor import TravelTimeTensor, build_travel_time_tensor
+
+
+def test_departures_use_the_bucket_of_their_hour(tmpdir):
+    path = Path(str(tmpdir)) / 'tensor.npy'
+    tensor = TravelTimeTensor.create(path, 3, bucket_hours=[8, 12, 16], unit_seconds=60)
+    for bucket in range(3):
+        tensor.set_matrix(bucket, np.full((3, 3), 600. * (bucket + 1)))
+    tensor.flush()
+
+    tensor = TravelTimeTensor.load(path)
+    assert tensor.data.dtype == np.uint16
+    day = pendulum.datetime(2018, 7, 2, tz='US/Eastern')
+    assert tensor.matrix(day.set(hour=13))[0, 1] == 1200
+    assert tensor.matrix(day.set(hour=6))[0, 1] == 600
+    assert tensor.matrix(day.set(hour=20), nodes=[2, 0]).shape == (2, 2)
+    # Without time dependence the 8 AM travel times are used
+    assert tensor.matrix(day.set(hour=17), time_dependent=False)[0, 1] == 600
+    assert tensor.matrix(day.set(hour=17).in_timezone('UTC'))[0, 1] == 1800
+
+
+def test_missing_travel_times_raise(tmpdir):
+    tensor = TravelTimeTensor.create(Path(str(tmpdir)) / 'tensor.npy', 2, bucket_hours=[8])
+    tensor.set_matrix(0, [[0, np.nan], [10, 0]])
+    assert tensor.matrix(nodes=[1])[0, 0] == 0
+    with pytest.raises(RuntimeError):
+        tensor.matrix()
+
+
+def test_build_from_the_travel_time_cache(tmpdir):
+    points = [(40.6, -73.5), (40.7, -73.4)]
+
+    def fetch(origins, destinations, departure_time):
+        seconds = np.full((len(origins), len(destinations)), departure_time.hour * 100.)
+        return seconds, seconds
+
+    cache = TravelTimeCache(Path(str(tmpdir)) / 'travel_times.sqlite')
+    tensor = build_travel_time_tensor(Path(str(tmpdir)) / 'tensor.npy', points, fetch, bucket_hours=[8, 16],
+                                      cache=cache)
+    np.testing.assert_array_equal(tensor.data[:, 0, 1], [800, 1600])
+    np.testing.assert_array_equal(tensor.data[:, 0, 0], [0, 0])